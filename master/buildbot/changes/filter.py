@@ -60,10 +60,68 @@ class ChangeFilter(ComparableMixin):
                 (mklist(category), mkre(category_re), category_fn, "category"),
             ]
 
+        # the checks used by filter_change, with the lists compiled into sets
+        # where the values allow it, and omitting checks that do nothing
+        def mkset(l):
+            if l is None:
+                return None
+            try:
+                return frozenset(l)
+            except TypeError: # unhashable values
+                return l
+        self._compiled_checks = [
+                (mkset(filt_list), filt_re, filt_fn, chg_attr)
+                for (filt_list, filt_re, filt_fn, chg_attr) in self.checks
+                if filt_list is not None or filt_re is not None
+                   or filt_fn is not None ]
+
+        # the change attributes that filter_change looks at, if it only looks
+        # at attributes (see getChangeKey)
+        self._key_attrs = None
+        if filter_fn is None and not [ c for c in self.checks if c[2] ]:
+            self._key_attrs = [ c[3] for c in self._compiled_checks ]
+
+    def _overridesFilterChange(self):
+        # a subclass that overrides filter_change may look at anything
+        return (self.__class__.filter_change.im_func
+                is not ChangeFilter.filter_change.im_func)
+
+    def getChangeKey(self, change):
+        """
+        Return a key for C{change} such that changes with equal keys are
+        certain to be filtered the same way, or None if there is no such key
+        (because C{filter_fn} or one of the C{*_fn} arguments is used, or a
+        subclass overrides L{filter_change}).  This allows callers to reuse
+        the results of L{filter_change} for similar changes.
+        """
+        if self._key_attrs is None or self._overridesFilterChange():
+            return None
+        return tuple([ getattr(change, attr, '') for attr in self._key_attrs ])
+
+    def getIndexableCheck(self):
+        """
+        Return a tuple (attribute, values) such that no change passes this
+        filter unless the named attribute of the change is in the set of
+        values, or None if there is no such check (because only regular
+        expressions and functions are used, the values are unhashable, or a
+        subclass overrides L{filter_change}).  When more than one check
+        qualifies, the one with the fewest values is returned.  This allows
+        callers to index filters by attribute value.
+        """
+        if self._overridesFilterChange():
+            return None
+        best = None
+        for (filt_list, filt_re, filt_fn, chg_attr) in self._compiled_checks:
+            if not isinstance(filt_list, frozenset):
+                continue
+            if best is None or len(filt_list) < len(best[1]):
+                best = (chg_attr, filt_list)
+        return best
+
     def filter_change(self, change):
         if self.filter_fn is not None and not self.filter_fn(change):
             return False
-        for (filt_list, filt_re, filt_fn, chg_attr) in self.checks:
+        for (filt_list, filt_re, filt_fn, chg_attr) in self._compiled_checks:
             chg_val = getattr(change, chg_attr, '')
             if filt_list is not None and chg_val not in filt_list:
                 return False
@@ -16,6 +16,7 @@
 import time
 import tempfile
 import os
+import fnmatch
 from twisted.python import log
 from twisted.internet import defer, utils
 
@@ -26,7 +27,7 @@ class GitPoller(base.PollingChangeSource):
     """This source will poll a remote git repo for changes and submit
     them to the change master."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branch", "branches", "bare", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
                      "category", "project"]
                      
@@ -35,14 +36,26 @@ class GitPoller(base.PollingChangeSource):
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8'):
+                 encoding='utf-8', branches=None, bare=False):
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
             pollInterval = pollinterval
         if project is None: project = ''
 
         self.repourl = repourl
-        self.branch = branch
+        # all of the branches are fetched at once; the first is the one
+        # checked out in the workdir, and the others are tracked with
+        # local branches of the same name
+        self.branches = branches or [ branch ]
+        self.branch = self.branches[0]
+        # in bare mode, the workdir is a bare mirror of the repository, and
+        # branches may be glob patterns
+        self.bare = bare
+        if not bare:
+            for b in self.branches:
+                if self._isPattern(b):
+                    raise ValueError("GitPoller branch patterns like '%s' "
+                                     "require bare=True" % b)
         self.pollInterval = pollInterval
         self.fetch_refspec = fetch_refspec
         self.encoding = encoding
@@ -54,7 +67,8 @@ class GitPoller(base.PollingChangeSource):
         self.category = category
         self.project = project
         self.changeCount = 0
-        self.commitInfo  = {}
+        self.branchesToCatchUp = []
+        self.tipsToRecord = {}
         self.initLock = defer.DeferredLock()
         
         if self.workdir == None:
@@ -71,7 +85,11 @@ class GitPoller(base.PollingChangeSource):
         # initialize the repository we'll use to get changes; note that
         # startService is not an event-driven method, so this method will
         # instead acquire self.initLock immediately when it is called.
-        if not os.path.exists(self.workdir + r'/.git'):
+        if self.bare:
+            exists = os.path.exists(os.path.join(self.workdir, 'objects'))
+        else:
+            exists = os.path.exists(self.workdir + r'/.git')
+        if not exists:
             d = self.initRepository()
             d.addErrback(log.err, 'while initializing GitPoller repository')
         else:
@@ -82,6 +100,8 @@ class GitPoller(base.PollingChangeSource):
 
     @deferredLocked('initLock')
     def initRepository(self):
+        if self.bare:
+            return self._initMirror()
         d = defer.succeed(None)
         def make_dir(_):
             dirpath = os.path.dirname(self.workdir.rstrip(os.sep))
@@ -132,6 +152,14 @@ class GitPoller(base.PollingChangeSource):
             d.addErrback(self._stop_on_failure)
             return d
         d.addCallback(set_master)
+        def track_branches(_):
+            d = defer.succeed(None)
+            for branch in self.branches[1:]:
+                d.addCallback(lambda _, branch=branch :
+                        self._update_branch(branch))
+            d.addErrback(self._stop_on_failure)
+            return d
+        d.addCallback(track_branches)
         def get_rev(_):
             d = utils.getProcessOutputAndValue(self.gitbin,
                     ['rev-parse', self.branch],
@@ -147,72 +175,68 @@ class GitPoller(base.PollingChangeSource):
         d.addCallback(print_rev)
         return d
 
+    def _initMirror(self):
+        dirpath = os.path.dirname(self.workdir.rstrip(os.sep))
+        if not os.path.exists(dirpath):
+            log.msg('gitpoller: creating parent directories for workdir')
+            os.makedirs(dirpath)
+
+        log.msg('gitpoller: initializing mirror of %s' % self.repourl)
+        d = defer.succeed(None)
+        for args, path in [ (['init', '--bare', self.workdir], None),
+                            (['remote', 'add', 'origin', self.repourl],
+                                                            self.workdir) ]:
+            d.addCallback(lambda _, args=args, path=path :
+                    utils.getProcessOutputAndValue(self.gitbin, args,
+                                path=path, env=dict(PATH=os.environ['PATH'])))
+            d.addCallback(self._convert_nonzero_to_failure)
+        def fetch(_):
+            args = ['fetch', 'origin']
+            self._extend_with_fetch_refspec(args)
+            d = utils.getProcessOutputAndValue(self.gitbin, args,
+                    path=self.workdir, env=dict(PATH=os.environ['PATH']))
+            d.addCallback(self._convert_nonzero_to_failure)
+            return d
+        d.addCallback(fetch)
+
+        # start watching each branch from its current tip
+        d.addCallback(lambda _ : self._get_tips())
+        def record(tips):
+            current, seen = tips
+            self.tipsToRecord = current
+            return self._catch_up(None)
+        d.addCallback(record)
+        d.addErrback(self._stop_on_failure)
+        def done(_):
+            log.msg("gitpoller: finished initializing mirror of %s"
+                    % self.repourl)
+        d.addCallback(done)
+        return d
+
     def describe(self):
         status = ""
         if not self.master:
             status = "[STOPPED - check log]"
-        str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+        if len(self.branches) == 1:
+            str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
+                    % (self.repourl, self.branch, status)
+        else:
+            str = 'GitPoller watching the remote git repository %s, branches: %s %s' \
+                    % (self.repourl, ', '.join(self.branches), status)
         return str
 
     @deferredLocked('initLock')
     def poll(self):
         d = self._get_changes()
-        d.addCallback(self._process_changes)
+        if self.bare:
+            d.addCallback(self._process_mirror_changes)
+        else:
+            d.addCallback(self._process_changes)
         d.addErrback(self._process_changes_failure)
         d.addCallback(self._catch_up)
         d.addErrback(self._catch_up_failure)
         return d
 
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=dict(PATH=os.environ['PATH']), errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit comment for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=dict(PATH=os.environ['PATH']), errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip()
-            if self.usetimestamps:
-                try:
-                    stamp = float(stripped_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % stripped_output)
-                        raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
-        return d
-
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=dict(PATH=os.environ['PATH']), errortoo=False )
-        def process(git_output):
-            fileList = git_output.split()
-            return fileList
-        d.addCallback(process)
-        return d
-            
-    def _get_commit_name(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%aE']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=dict(PATH=os.environ['PATH']), errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit name for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
     def _get_changes(self):
         log.msg('gitpoller: polling git repo at %s' % self.repourl)
 
@@ -220,6 +244,9 @@ class GitPoller(base.PollingChangeSource):
         
         # get a deferred object that performs the fetch
         args = ['fetch', 'origin']
+        if self.bare:
+            # so that deleted branches are noticed
+            args.append('--prune')
         self._extend_with_fetch_refspec(args)
 
         # This command always produces data on stderr, but we actually do not care
@@ -232,60 +259,246 @@ class GitPoller(base.PollingChangeSource):
 
         return d
 
+    # each commit's record starts with this marker, followed by the fields
+    # below, one per line; git then adds a NUL and the NUL-terminated list of
+    # files that the commit touched
+    LOG_MARKER = '\x01'
+    LOG_FORMAT = r'--format=%x01%H%n%P%n%ct%n%aE%n%s%n%b'
+
+    def _parse_log(self, git_output):
+        """Parse the output of 'git log -z --name-only' with LOG_FORMAT into
+        a list of dictionaries with keys 'revision', 'parents', 'timestamp',
+        'name', 'files' and 'comments', in the order git listed them."""
+        commits = []
+        commit = None
+        first_file = False
+        for token in git_output.split('\0'):
+            if token.startswith(self.LOG_MARKER):
+                fields = token[len(self.LOG_MARKER):].split('\n', 4)
+                if len(fields) < 5:
+                    raise EnvironmentError('could not parse git log output')
+                rev, parents, timestamp, name, comments = fields
+                if self.usetimestamps:
+                    try:
+                        timestamp = float(timestamp)
+                    except ValueError:
+                        log.msg('gitpoller: caught exception converting output '
+                                '\'%s\' to timestamp' % timestamp)
+                        raise
+                else:
+                    timestamp = None
+                comments = comments.strip().decode(self.encoding)
+                name = name.strip().decode(self.encoding)
+                if not comments:
+                    raise EnvironmentError('could not get commit comment for rev')
+                if not name:
+                    raise EnvironmentError('could not get commit name for rev')
+                commit = dict(revision=rev, parents=parents.split(),
+                              timestamp=timestamp, name=name,
+                              files=[], comments=comments)
+                commits.append(commit)
+                first_file = True
+            elif commit is not None:
+                # git separates the file list from the record with a newline
+                if first_file and token.startswith('\n'):
+                    token = token[1:]
+                first_file = False
+                if token:
+                    commit['files'].append(token)
+        return commits
+
+    def _get_branch_log(self, branch):
+        args = ['log', '-z', '--name-only', self.LOG_FORMAT,
+                '%s..origin/%s' % (branch, branch)]
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
+                                   env=dict(PATH=os.environ['PATH']), errortoo=False )
+        d.addCallback(self._parse_log)
+        return d
+
     @defer.deferredGenerator
     def _process_changes(self, unused_output):
-        # get the change list
-        revListArgs = ['log', '%s..origin/%s' % (self.branch, self.branch), r'--format=%H']
+        # all of the branches were fetched at once; get the new commits on
+        # each of them with a single 'git log' apiece
+        self.changeCount = 0
+        self.branchesToCatchUp = []
+        changes = []
+        for branch in self.branches:
+            d = self._get_branch_log(branch)
+            wfd = defer.waitForDeferred(d)
+            yield wfd
+            try:
+                commits = wfd.getResult()
+            except Exception, e:
+                if branch == self.branch:
+                    raise
+                # probably a branch that was added to the configuration
+                # since the workdir was initialized; start tracking it from
+                # its current tip
+                log.msg('gitpoller: could not get log for branch %s (%s); '
+                        'starting to track it' % (branch, e))
+                self.branchesToCatchUp.append(branch)
+                continue
+
+            if not commits:
+                continue
+
+            # process oldest change first
+            commits.reverse()
+            self.branchesToCatchUp.append(branch)
+            log.msg('gitpoller: processing %d changes on branch %s: %s in "%s"'
+                    % (len(commits), branch,
+                       [ c['revision'] for c in commits ], self.workdir) )
+
+            for commit in commits:
+                changes.append(dict(
+                       who=commit['name'],
+                       revision=commit['revision'],
+                       files=commit['files'],
+                       comments=commit['comments'],
+                       when=commit['timestamp'],
+                       branch=branch,
+                       category=self.category,
+                       project=self.project,
+                       repository=self.repourl))
+
+        self.changeCount = len(changes)
+        if not changes:
+            return
+
+        # and add them all to the database at once
+        wfd = defer.waitForDeferred(self.master.addChanges(changes))
+        yield wfd
+        wfd.getResult()
+
+    # state for bare mode: the tip of each watched branch, as of the last
+    # poll, is kept in a ref of its own in the mirror
+    SEEN_REFS = 'refs/buildbot/heads/'
+    REMOTE_REFS = 'refs/remotes/origin/'
+
+    def _isPattern(self, branch):
+        for c in '*?[':
+            if c in branch:
+                return True
+        return False
+
+    def _matchBranch(self, branch):
+        for pattern in self.branches:
+            if fnmatch.fnmatchcase(branch, pattern):
+                return True
+        return False
+
+    def _get_tips(self):
+        """Return (current, seen) via Deferred: dictionaries mapping the
+        name of each watched branch to its tip in the mirror and to its tip
+        as of the last poll, respectively"""
+        args = ['for-each-ref', '--format=%(objectname) %(refname)',
+                self.REMOTE_REFS.rstrip('/'), self.SEEN_REFS.rstrip('/')]
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
+                                   env=dict(PATH=os.environ['PATH']), errortoo=False )
+        def parse(git_output):
+            current, seen = {}, {}
+            for line in git_output.splitlines():
+                if not line.strip():
+                    continue
+                sha, ref = line.split(' ', 1)
+                if ref.startswith(self.REMOTE_REFS):
+                    branch = ref[len(self.REMOTE_REFS):]
+                    if branch != 'HEAD' and self._matchBranch(branch):
+                        current[branch] = sha
+                elif ref.startswith(self.SEEN_REFS):
+                    seen[ref[len(self.SEEN_REFS):]] = sha
+            return current, seen
+        d.addCallback(parse)
+        return d
+
+    def _branchOrder(self, branch):
+        # branches are considered in the order they (or the patterns that
+        # match them) were configured, and then by name
+        for i in range(len(self.branches)):
+            if fnmatch.fnmatchcase(branch, self.branches[i]):
+                return (i, branch)
+        return (len(self.branches), branch)
+
+    def _assign_branches(self, commits, tips):
+        """Assign each of C{commits} (as returned by L{_parse_log}) to the
+        first branch, in L{_branchOrder}, from whose new tip it is reachable
+        through other new commits.  C{tips} maps branch names to new tips.
+        Returns a dictionary mapping revisions to branch names."""
+        bysha = {}
+        for commit in commits:
+            bysha[commit['revision']] = commit
+        assigned = {}
+        branches = tips.keys()
+        branches.sort(key=self._branchOrder)
+        for branch in branches:
+            stack = [ tips[branch] ]
+            while stack:
+                rev = stack.pop()
+                if rev in assigned or rev not in bysha:
+                    continue
+                assigned[rev] = branch
+                stack.extend(bysha[rev]['parents'])
+        return assigned
+
+    @defer.deferredGenerator
+    def _process_mirror_changes(self, unused_output):
         self.changeCount = 0
-        d = utils.getProcessOutput(self.gitbin, revListArgs, path=self.workdir,
+        self.tipsToRecord = {}
+
+        wfd = defer.waitForDeferred(self._get_tips())
+        yield wfd
+        current, seen = wfd.getResult()
+
+        changed = {}
+        for branch, sha in current.iteritems():
+            if seen.get(branch) != sha:
+                changed[branch] = sha
+        # branches that went away, or are no longer watched
+        for branch in seen:
+            if branch not in current:
+                self.tipsToRecord[branch] = None
+        if not changed:
+            return
+
+        # get all of the new commits, on all branches, from a single 'git
+        # log'; excluding everything that was already seen on any branch
+        # means that commits shared between branches are only reported once
+        args = ['log', '-z', '--name-only', '--topo-order', self.LOG_FORMAT]
+        args.extend(sorted(changed.values()))
+        args.extend([ '^' + sha for sha in sorted(seen.values()) ])
+        args.append('--')
+        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir,
                                    env=dict(PATH=os.environ['PATH']), errortoo=False )
+        d.addCallback(self._parse_log)
         wfd = defer.waitForDeferred(d)
         yield wfd
-        results = wfd.getResult()
+        commits = wfd.getResult()
 
-        # process oldest change first
-        revList = results.split()
-        if not revList:
-            return
+        assigned = self._assign_branches(commits, changed)
 
-        revList.reverse()
-        self.changeCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes: %s in "%s"'
-                % (self.changeCount, revList, self.workdir) )
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_name(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            wfd = defer.waitForDeferred(dl)
-            yield wfd
-            results = wfd.getResult()
-
-            # check for failures
-            failures = [ r[1] for r in results if not r[0] ]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, name, files, comments = [ r[1] for r in results ]
-            d = self.master.addChange(
-                   who=name,
-                   revision=rev,
-                   files=files,
-                   comments=comments,
-                   when=timestamp,
-                   branch=self.branch,
+        # process oldest change first
+        commits.reverse()
+        log.msg('gitpoller: processing %d changes on %d branches in "%s"'
+                % (len(commits), len(changed), self.workdir))
+        changes = []
+        for commit in commits:
+            changes.append(dict(
+                   who=commit['name'],
+                   revision=commit['revision'],
+                   files=commit['files'],
+                   comments=commit['comments'],
+                   when=commit['timestamp'],
+                   branch=assigned.get(commit['revision']),
                    category=self.category,
                    project=self.project,
-                   repository=self.repourl)
-            wfd = defer.waitForDeferred(d)
+                   repository=self.repourl))
+        self.changeCount = len(changes)
+        self.tipsToRecord.update(changed)
+
+        if changes:
+            wfd = defer.waitForDeferred(self.master.addChanges(changes))
             yield wfd
-            results = wfd.getResult()
+            wfd.getResult()
 
     def _process_changes_failure(self, f):
         log.msg('gitpoller: repo poll failed')
@@ -294,11 +507,43 @@ class GitPoller(base.PollingChangeSource):
         return None
         
     def _catch_up(self, res):
-        if self.changeCount == 0:
+        if self.bare:
+            return self._record_tips()
+        if not self.branchesToCatchUp:
+            log.msg('gitpoller: no changes, no catch_up')
+            return
+        log.msg('gitpoller: catching up tracking branches')
+        d = defer.succeed(None)
+        for branch in self.branchesToCatchUp:
+            d.addCallback(lambda _, branch=branch : self._update_branch(branch))
+        return d
+
+    def _record_tips(self):
+        if not self.tipsToRecord:
             log.msg('gitpoller: no changes, no catch_up')
             return
-        log.msg('gitpoller: catching up tracking branch')
-        args = ['reset', '--hard', 'origin/%s' % (self.branch,)]
+        d = defer.succeed(None)
+        for branch, sha in sorted(self.tipsToRecord.items()):
+            if sha is None:
+                args = ['update-ref', '-d', self.SEEN_REFS + branch]
+            else:
+                args = ['update-ref', self.SEEN_REFS + branch, sha]
+            d.addCallback(lambda _, args=args :
+                    utils.getProcessOutputAndValue(self.gitbin, args,
+                        path=self.workdir, env=dict(PATH=os.environ['PATH'])))
+            d.addCallback(self._convert_nonzero_to_failure)
+        def done(res):
+            self.tipsToRecord = {}
+            return res
+        d.addCallback(done)
+        return d
+
+    def _update_branch(self, branch):
+        if branch == self.branch:
+            # this one is checked out
+            args = ['reset', '--hard', 'origin/%s' % (branch,)]
+        else:
+            args = ['branch', '-f', branch, 'origin/%s' % (branch,)]
         d = utils.getProcessOutputAndValue(self.gitbin, args, path=self.workdir, env=dict(PATH=os.environ['PATH']))
         d.addCallback(self._convert_nonzero_to_failure)
         return d
@@ -25,7 +25,7 @@ from email.Iterators import body_line_iterator
 
 from zope.interface import implements
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from buildbot import util
 from buildbot.interfaces import IChangeSource
 from buildbot.util.maildir import MaildirService
@@ -36,6 +36,9 @@ class MaildirSource(MaildirService, util.ComparableMixin):
 
     compare_attrs = ["basedir", "pollinterval", "prefix"]
 
+    # the number of messages parsed, and whose changes are added, together
+    batchSize = 100
+
     def __init__(self, maildir, prefix=None, category='', repository=''):
         MaildirService.__init__(self, maildir)
         self.prefix = prefix
@@ -45,28 +48,89 @@ class MaildirSource(MaildirService, util.ComparableMixin):
             log.msg("%s: you probably want your prefix=('%s') to end with "
                     "a slash")
 
+        # throughput counters
+        self.messagesProcessed = 0
+        self.changesAdded = 0
+        self.processingTime = 0.0
+
     def describe(self):
-        return "%s watching maildir '%s'" % (self.__class__.__name__, self.basedir)
+        desc = "%s watching maildir '%s'" % (self.__class__.__name__, self.basedir)
+        if self.messagesProcessed:
+            desc += (" (%d messages, %d changes, %.1f messages/s)"
+                     % (self.messagesProcessed, self.changesAdded,
+                        self.getThroughput()))
+        return desc
+
+    def getThroughput(self):
+        """Return the number of messages processed per second of processing
+        time, or None if nothing has been processed yet."""
+        if not self.processingTime:
+            return None
+        return self.messagesProcessed / self.processingTime
 
     def messageReceived(self, filename):
-        path = os.path.join(self.basedir, "new", filename)
-        d = defer.succeed(None)
-        def parse_file(_):
-            return self.parse_file(open(path, "r"), self.prefix)
-        d.addCallback(parse_file)
-
-        def add_change(chdict):
-            if chdict:
-                return self.master.addChange(**chdict)
+        return self.processMessages([ filename ])
+
+    @defer.deferredGenerator
+    def messagesReceived(self, filenames):
+        for i in range(0, len(filenames), self.batchSize):
+            batch = filenames[i:i+self.batchSize]
+            wfd = defer.waitForDeferred(self.processMessages(batch))
+            yield wfd
+            try:
+                wfd.getResult()
+            except:
+                log.msg("while processing %d messages from maildir '%s':"
+                        % (len(batch), self.basedir))
+                log.err()
+
+    @defer.deferredGenerator
+    def processMessages(self, filenames):
+        """Parse the given messages in the reactor's thread pool, add the
+        resulting changes to the master in one transaction, and then move the
+        messages to cur/.  Messages that cannot be parsed are logged and left
+        in new/."""
+        start = util.now()
+
+        def parse(filename):
+            f = open(os.path.join(self.basedir, "new", filename), "r")
+            try:
+                return self.parse_file(f, self.prefix)
+            finally:
+                f.close()
+        wfd = defer.waitForDeferred(defer.DeferredList(
+                [ threads.deferToThread(parse, filename)
+                  for filename in filenames ],
+                consumeErrors=True))
+        yield wfd
+        results = wfd.getResult()
+
+        chdicts = []
+        parsed = []
+        for filename, (success, result) in zip(filenames, results):
+            if not success:
+                log.msg("while reading '%s' from maildir '%s':"
+                        % (filename, self.basedir))
+                log.err(result)
+                continue
+            parsed.append(filename)
+            if result:
+                chdicts.append(result)
             else:
                 log.msg("no change found in maildir file '%s'" % filename)
-        d.addCallback(add_change)
 
-        def move_file(_):
-            os.rename(path, os.path.join(self.basedir, "cur", filename))
-        d.addCallback(move_file)
+        if chdicts:
+            wfd = defer.waitForDeferred(self.master.addChanges(chdicts))
+            yield wfd
+            wfd.getResult()
+
+        for filename in parsed:
+            os.rename(os.path.join(self.basedir, "new", filename),
+                      os.path.join(self.basedir, "cur", filename))
 
-        return d
+        self.messagesProcessed += len(parsed)
+        self.changesAdded += len(chdicts)
+        self.processingTime += util.now() - start
 
     def parse_file(self, fd, prefix=None):
         m = message_from_file(fd)
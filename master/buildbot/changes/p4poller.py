@@ -171,15 +171,16 @@ class P4Source(base.PollingChangeSource, util.ComparableMixin):
                     else:
                         branch_files[branch] = [file]
 
-            for branch in branch_files:
-                d = self.master.addChange(
-                       who=who,
-                       files=branch_files[branch],
-                       comments=comments,
-                       revision=str(num),
-                       when=when,
-                       branch=branch)
-                wfd = defer.waitForDeferred(d)
+            # add the changes for each branch in a single transaction
+            chdicts = [ dict(who=who,
+                             files=branch_files[branch],
+                             comments=comments,
+                             revision=str(num),
+                             when=when,
+                             branch=branch)
+                        for branch in branch_files ]
+            if chdicts:
+                wfd = defer.waitForDeferred(self.master.addChanges(chdicts))
                 yield wfd
                 wfd.getResult()
 
@@ -25,6 +25,7 @@ from buildbot import util
 from buildbot.changes import base
 
 import xml.dom.minidom
+import xml.parsers.expat
 import os, urllib
 
 # these split_file_* functions are available for use as values to the
@@ -44,6 +45,74 @@ def split_file_branches(path):
         return None
 
 
+class LogParser:
+    """
+    A streaming parser for the output of 'svn log --xml --verbose'.  Feed it
+    the output, in as many pieces as convenient, then call L{close} to get
+    the log entries.  Each entry is a dictionary with keys 'revision' (an
+    integer), 'author' and 'msg' (unicode strings), and 'paths' (a list of
+    (action, path) tuples, or None if the entry had no paths element).
+
+    Unlike a DOM, this only keeps the parts of the output that the poller
+    uses, so the cost of parsing is proportional to the size of the output,
+    and not to the size of the tree built from it.
+    """
+
+    def __init__(self):
+        self.logentries = []
+        self._entry = None
+        self._action = None
+        self._text = None
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+        self._parser.buffer_text = True
+
+    def feed(self, data):
+        self._parser.Parse(data, False)
+
+    def close(self):
+        self._parser.Parse('', True)
+        return self.logentries
+
+    def _start(self, name, attrs):
+        if name == 'logentry':
+            self._entry = dict(revision=int(attrs['revision']),
+                               author=None, msg=None, paths=None)
+        elif self._entry is None:
+            return
+        elif name == 'paths':
+            self._entry['paths'] = []
+        elif name == 'path':
+            self._action = attrs.get('action')
+            self._text = []
+        elif name in ('author', 'msg'):
+            self._text = []
+
+    def _data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _end(self, name):
+        entry = self._entry
+        if entry is None:
+            return
+        if name == 'logentry':
+            for field in ('author', 'msg'):
+                if entry[field] is None:
+                    entry[field] = u"<unknown>"
+            self.logentries.append(entry)
+            self._entry = None
+        elif name == 'path' and self._text is not None:
+            if entry['paths'] is not None:
+                entry['paths'].append((self._action, u"".join(self._text)))
+            self._text = None
+        elif name in ('author', 'msg') and self._text is not None:
+            entry[name] = u"".join(self._text)
+            self._text = None
+
+
 class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
     """
     Poll a Subversion repository for changes and submit them to the change
@@ -151,11 +220,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
                 self._prefix = prefix
             d.addCallback(set_prefix)
 
-        d.addCallback(self.get_logs)
-        d.addCallback(self.parse_logs)
-        d.addCallback(self.get_new_logentries)
-        d.addCallback(self.create_changes)
-        d.addCallback(self.submit_changes)
+        d.addCallback(self.poll_logs)
         d.addCallback(self.finished_ok)
         d.addErrback(log.err, 'error in SVNPoller while polling') # eat errors
         return d
@@ -200,6 +265,26 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         d.addCallback(determine_prefix)
         return d
 
+    @defer.deferredGenerator
+    def poll_logs(self, _):
+        # fetch the new log entries in batches of at most histmax, oldest
+        # first, submitting the changes from each revision as we go
+        while True:
+            wfd = defer.waitForDeferred(self.get_logs(None))
+            yield wfd
+            logentries = self.parse_logs(wfd.getResult())
+
+            new_logentries = self.get_new_logentries(logentries)
+            wfd = defer.waitForDeferred(
+                    self.submit_logentries(new_logentries))
+            yield wfd
+            wfd.getResult()
+
+            # a full batch (histmax new entries, plus last_change) means that
+            # there may be more to come
+            if not new_logentries or len(logentries) <= self.histmax:
+                break
+
     def get_logs(self, _):
         args = []
         args.extend(["log", "--xml", "--verbose", "--non-interactive"])
@@ -207,62 +292,59 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
             args.extend(["--username=%s" % self.svnuser])
         if self.svnpasswd:
             args.extend(["--password=%s" % self.svnpasswd])
-        args.extend(["--limit=%d" % (self.histmax), self.svnurl])
+        if self.last_change is None:
+            # we only need the latest revision, to start from
+            args.extend(["--limit=1"])
+        else:
+            # ask for everything since the last change, oldest first.  The
+            # range starts at last_change itself, which is known to exist;
+            # asking for a range starting after HEAD would be an error.  So
+            # that each batch has up to histmax new entries (and at least
+            # one), ask for one more entry than that.
+            args.extend(["--revision=%d:HEAD" % self.last_change,
+                         "--limit=%d" % (self.histmax + 1)])
+        args.append(self.svnurl)
         d = self.getProcessOutput(args)
         return d
 
     def parse_logs(self, output):
-        # parse the XML output, return a list of <logentry> nodes
+        # parse the XML output, return a list of log entries as returned by
+        # LogParser
+        parser = LogParser()
         try:
-            doc = xml.dom.minidom.parseString(output)
+            parser.feed(output)
+            return parser.close()
         except xml.parsers.expat.ExpatError:
             log.msg("SVNPoller.parse_logs: ExpatError in '%s'" % output)
             raise
-        logentries = doc.getElementsByTagName("logentry")
-        return logentries
-
 
     def get_new_logentries(self, logentries):
-        last_change = old_last_change = self.last_change
-
-        # given a list of logentries, calculate new_last_change, and
-        # new_logentries, where new_logentries contains only the ones after
-        # last_change
-
-        new_last_change = None
-        new_logentries = []
-        if logentries:
-            new_last_change = int(logentries[0].getAttribute("revision"))
-
-            if last_change is None:
-                # if this is the first time we've been run, ignore any changes
-                # that occurred before now. This prevents a build at every
-                # startup.
-                log.msg('svnPoller: starting at change %s' % new_last_change)
-            elif last_change == new_last_change:
-                # an unmodified repository will hit this case
-                log.msg('svnPoller: no changes')
-            else:
-                for el in logentries:
-                    if last_change == int(el.getAttribute("revision")):
-                        break
-                    new_logentries.append(el)
-                new_logentries.reverse() # return oldest first
-
-        self.last_change = new_last_change
-        log.msg('svnPoller: _process_changes %s .. %s' %
-                (old_last_change, new_last_change))
+        # given a list of log entries, return those after last_change, oldest
+        # first
+        revisions = [ e['revision'] for e in logentries ]
+        if not revisions:
+            log.msg('svnPoller: no changes')
+            return []
+
+        if self.last_change is None:
+            # if this is the first time we've been run, ignore any changes
+            # that occurred before now. This prevents a build at every
+            # startup.
+            self.last_change = max(revisions)
+            log.msg('svnPoller: starting at change %s' % self.last_change)
+            return []
+
+        new_logentries = [ e for e in logentries
+                           if e['revision'] > self.last_change ]
+        new_logentries.sort(key=lambda e : e['revision'])
+        if new_logentries:
+            log.msg('svnPoller: _process_changes %s .. %s' %
+                    (self.last_change, new_logentries[-1]['revision']))
+        else:
+            # an unmodified repository will hit this case
+            log.msg('svnPoller: no changes')
         return new_logentries
 
-
-    def _get_text(self, element, tag_name):
-        try:
-            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
-            text = "".join([t.data for t in child_nodes])
-        except:
-            text = "<unknown>"
-        return text
-
     def _transform_path(self, path):
         assert path.startswith(self._prefix), \
                 ("filepath '%s' should start with prefix '%s'" %
@@ -278,7 +360,7 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
         changes = []
 
         for el in new_logentries:
-            revision = str(el.getAttribute("revision"))
+            revision = str(el['revision'])
 
             revlink=''
 
@@ -287,23 +369,19 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
                     revlink = self.revlinktmpl % urllib.quote_plus(revision)
 
             log.msg("Adding change revision %s" % (revision,))
-            author   = self._get_text(el, "author")
-            comments = self._get_text(el, "msg")
+            author   = el['author']
+            comments = el['msg']
             # there is a "date" field, but it provides localtime in the
             # repository's timezone, whereas we care about buildmaster's
             # localtime (since this will get used to position the boxes on
             # the Waterfall display, etc). So ignore the date field, and
             # addChange will fill in with the current time
             branches = {}
-            try:
-                pathlist = el.getElementsByTagName("paths")[0]
-            except IndexError: # weird, we got an empty revision
+            if el['paths'] is None: # weird, we got an empty revision
                 log.msg("ignoring commit with no paths")
                 continue
 
-            for p in pathlist.getElementsByTagName("path"):
-                action = p.getAttribute("action")
-                path = "".join([t.data for t in p.childNodes])
+            for action, path in el['paths']:
                 # the rest of buildbot is certaily not yet ready to handle
                 # unicode filenames, because they get put in RemoteCommands
                 # which get sent via PB to the buildslave, and PB doesn't
@@ -346,18 +424,33 @@ class SVNPoller(base.PollingChangeSource, util.ComparableMixin):
 
         return changes
 
-    @defer.deferredGenerator
     def submit_changes(self, changes):
-        for chdict in changes:
-            wfd = defer.waitForDeferred(self.master.addChange(**chdict))
+        if not changes:
+            return defer.succeed(None)
+        # all of the changes for a revision are added in one transaction
+        return self.master.addChanges(changes)
+
+    @defer.deferredGenerator
+    def submit_logentries(self, new_logentries):
+        # submit one revision at a time, recording our progress after each,
+        # so that a failure part-way through neither loses nor repeats
+        # changes
+        for el in new_logentries:
+            wfd = defer.waitForDeferred(
+                    self.submit_changes(self.create_changes([ el ])))
             yield wfd
             wfd.getResult()
+            self.last_change = el['revision']
+            self.write_cache()
 
-    def finished_ok(self, res):
+    def write_cache(self):
         if self.cachepath:
             f = open(self.cachepath, "w")
             f.write(str(self.last_change))
             f.close()
 
+    def finished_ok(self, res):
+        self.write_cache()
+
         log.msg("SVNPoller finished polling %s" % res)
         return res
@@ -15,7 +15,9 @@
 
 
 import sys, os, re, time, random
+from cStringIO import StringIO
 from twisted.internet import utils, protocol, defer, reactor, task
+from twisted.protocols import basic
 from twisted.spread import pb
 from twisted.cred import credentials
 from twisted.python import log
@@ -25,11 +27,27 @@ from buildbot.sourcestamp import SourceStamp
 from buildbot.util import now
 from buildbot.status import builder
 
-class SourceStampExtractor:
+def gatherResults(deferreds):
+    """Like L{defer.gatherResults}, but fails with the first failure of any
+    of C{deferreds}, rather than a L{defer.FirstError}."""
+    d = defer.DeferredList(deferreds, fireOnOneErrback=True,
+                           consumeErrors=True)
+    d.addCallback(lambda results : [ result for success, result in results ])
+    d.addErrback(lambda why : why.value.subFailure)
+    return d
 
-    def __init__(self, treetop, branch):
+class SourceStampExtractor:
+    # set to false in subclasses whose getPatch does not need the base
+    # revision found by getBaseRevision, so that the two can run concurrently
+    patchNeedsBaseRevision = True
+    # set to false in subclasses which cannot make a patch against a base
+    # revision given with --diff-from
+    supportsDiffFrom = True
+
+    def __init__(self, treetop, branch, diffFrom=None):
         self.treetop = treetop # also is repository
         self.branch = branch
+        self.diffFrom = diffFrom
         self.exe = which(self.vcexe)[0]
 
     def dovc(self, cmd):
@@ -49,8 +67,18 @@ class SourceStampExtractor:
 
     def get(self):
         """Return a Deferred that fires with a SourceStamp instance."""
-        d = self.getBaseRevision()
-        d.addCallback(self.getPatch)
+        if self.diffFrom is not None:
+            # the base revision was given, so only the patch is needed
+            if not self.supportsDiffFrom:
+                return defer.fail(RuntimeError(
+                    "--diff-from is not supported for %s" % self.vcexe))
+            self.baserev = self.diffFrom
+            d = self.getPatch(None)
+        elif self.patchNeedsBaseRevision:
+            d = self.getBaseRevision()
+            d.addCallback(self.getPatch)
+        else:
+            d = gatherResults([ self.getBaseRevision(), self.getPatch(None) ])
         d.addCallback(self.done)
         return d
     def readPatch(self, diff, patchlevel):
@@ -125,7 +153,7 @@ class SVNExtractor(SourceStampExtractor):
         raise IndexError("Could not find 'Status against revision' in "
                          "SVN output: %s" % res)
     def getPatch(self, res):
-        d = self.dovc(["diff", "-r%d" % self.baserev])
+        d = self.dovc(["diff", "-r%s" % self.baserev])
         d.addCallback(self.readPatch, self.patchlevel)
         return d
 
@@ -150,6 +178,7 @@ class BzrExtractor(SourceStampExtractor):
 class MercurialExtractor(SourceStampExtractor):
     patchlevel = 1
     vcexe = "hg"
+    patchNeedsBaseRevision = False
     def getBaseRevision(self):
         d = self.dovc(["identify", "--id", "--debug"])
         d.addCallback(self.parseStatus)
@@ -158,7 +187,12 @@ class MercurialExtractor(SourceStampExtractor):
         m = re.search(r'^(\w+)', output)
         self.baserev = m.group(0)
     def getPatch(self, res):
-        d = self.dovc(["diff"])
+        # 'hg diff' is relative to the working directory's parent, which is
+        # the base revision unless one was given
+        if self.diffFrom is not None:
+            d = self.dovc(["diff", "-r", self.baserev])
+        else:
+            d = self.dovc(["diff"])
         d.addCallback(self.readPatch, self.patchlevel)
         return d
 
@@ -166,6 +200,8 @@ class MercurialExtractor(SourceStampExtractor):
 class PerforceExtractor(SourceStampExtractor):
     patchlevel = 0
     vcexe = "p4"
+    patchNeedsBaseRevision = False
+    supportsDiffFrom = False
     def getBaseRevision(self):
         d = self.dovc(["changes", "-m1", "..."])
         d.addCallback(self.parseStatus)
@@ -209,6 +245,8 @@ class PerforceExtractor(SourceStampExtractor):
 class DarcsExtractor(SourceStampExtractor):
     patchlevel = 1
     vcexe = "darcs"
+    patchNeedsBaseRevision = False
+    supportsDiffFrom = False
     def getBaseRevision(self):
         d = self.dovc(["changes", "--context"])
         d.addCallback(self.parseStatus)
@@ -236,13 +274,16 @@ class GitExtractor(SourceStampExtractor):
                 self.branch = self.branch.split('/', 1)[1]
             d.addCallback(self.override_baserev)
             return d
-        d = self.dovc(["branch", "--no-color", "-v", "--no-abbrev"])
-        d.addCallback(self.parseStatus)
-        return d
-
-    def readConfig(self):
-        d = self.dovc(["config", "-l"])
-        d.addCallback(self.parseConfig)
+        # the config is read at the same time as the current branch, since
+        # it is needed to find the branch's remote
+        d = gatherResults([
+            self.dovc(["branch", "--no-color", "-v", "--no-abbrev"]),
+            self.dovc(["config", "-l"]) ])
+        def parse(results):
+            status, config = results
+            self.parseStatus(status)
+            return self.parseConfig(config)
+        d.addCallback(parse)
         return d
 
     def parseConfig(self, res):
@@ -273,7 +314,7 @@ class GitExtractor(SourceStampExtractor):
         if m:
             self.baserev = m.group(2)
             self.branch = m.group(1)
-            return self.readConfig()
+            return
         raise IndexError("Could not find current GIT branch: %s" % res)
 
     def getPatch(self, res):
@@ -281,21 +322,21 @@ class GitExtractor(SourceStampExtractor):
         d.addCallback(self.readPatch, self.patchlevel)
         return d
 
-def getSourceStamp(vctype, treetop, branch=None):
+def getSourceStamp(vctype, treetop, branch=None, diffFrom=None):
     if vctype == "cvs":
-        e = CVSExtractor(treetop, branch)
+        e = CVSExtractor(treetop, branch, diffFrom)
     elif vctype == "svn":
-        e = SVNExtractor(treetop, branch)
+        e = SVNExtractor(treetop, branch, diffFrom)
     elif vctype == "bzr":
-        e = BzrExtractor(treetop, branch)
+        e = BzrExtractor(treetop, branch, diffFrom)
     elif vctype == "hg":
-        e = MercurialExtractor(treetop, branch)
+        e = MercurialExtractor(treetop, branch, diffFrom)
     elif vctype == "p4":
-        e = PerforceExtractor(treetop, branch)
+        e = PerforceExtractor(treetop, branch, diffFrom)
     elif vctype == "darcs":
-        e = DarcsExtractor(treetop, branch)
+        e = DarcsExtractor(treetop, branch, diffFrom)
     elif vctype == "git":
-        e = GitExtractor(treetop, branch)
+        e = GitExtractor(treetop, branch, diffFrom)
     else:
         raise KeyError("unknown vctype '%s'" % vctype)
     return e.get()
@@ -305,19 +346,21 @@ def ns(s):
     return "%d:%s," % (len(s), s)
 
 def createJobfile(bsid, branch, baserev, patchlevel, diff, repository, 
-                  project, builderNames):
-    job = ""
-    job += ns("2")
-    job += ns(bsid)
-    job += ns(branch)
-    job += ns(str(baserev))
-    job += ns("%d" % patchlevel)
-    job += ns(diff)
-    job += ns(repository)
-    job += ns(project)
+                  project, builderNames, priority=None):
+    # (joined at the end, to avoid copying a large diff repeatedly)
+    # version 3 adds the priority, so only use it when one is given, for the
+    # sake of older masters
+    if priority is None:
+        version = "2"
+    else:
+        version = "3"
+    job = [ ns(version), ns(bsid), ns(branch), ns(str(baserev)),
+            ns("%d" % patchlevel), ns(diff), ns(repository), ns(project) ]
+    if priority is not None:
+        job.append(ns(str(priority)))
     for bn in builderNames:
-        job += ns(bn)
-    return job
+        job.append(ns(bn))
+    return "".join(job)
 
 def getTopdir(topfile, start=None):
     """walk upwards from the current directory until we find this topfile"""
@@ -337,12 +380,23 @@ def getTopdir(topfile, start=None):
                      % (topfile, start))
 
 class RemoteTryPP(protocol.ProcessProtocol):
-    def __init__(self, job):
+    def __init__(self, job, progress=None):
         self.job = job
+        self.progress = progress
+        self.sent = 0
         self.d = defer.Deferred()
     def connectionMade(self):
-        self.transport.write(self.job)
-        self.transport.closeStdin()
+        # send the job in chunks, as the process is ready for them, rather
+        # than buffering all of it at once
+        sender = basic.FileSender()
+        d = sender.beginFileTransfer(StringIO(self.job), self.transport,
+                                     self._sentChunk)
+        d.addCallback(lambda _ : self.transport.closeStdin())
+    def _sentChunk(self, data):
+        self.sent += len(data)
+        if self.progress:
+            self.progress(self.sent, len(self.job))
+        return data
     def outReceived(self, data):
         sys.stdout.write(data)
     def errReceived(self, data):
@@ -396,12 +450,21 @@ class Try(pb.Referenceable):
     quiet = False
     printloop = False
 
+    # patches larger than this are sent to a PB master in chunks of this size,
+    # since a single PB call cannot carry more than 640k
+    patchChunkSize = 256*1024
+    # progress is reported in steps of this percentage, for jobs and patches
+    # larger than patchChunkSize
+    progressStep = 10
+    _lastProgress = None
+
     def __init__(self, config):
         self.config = config
         self.connect = self.getopt('connect')
         assert self.connect, "you must specify a connect style: ssh or pb"
         self.builderNames = self.getopt('builders')
         self.project = self.getopt('project', '')
+        self.priority = self.getopt('priority')
 
     def getopt(self, config_name, default=None):
         value = self.config.get(config_name)
@@ -445,7 +508,8 @@ class Try(pb.Referenceable):
                     treedir = getTopdir(topfile)
             else:
                 treedir = os.getcwd()
-            d = getSourceStamp(vc, treedir, branch)
+            d = getSourceStamp(vc, treedir, branch,
+                               self.getopt("diff-from"))
         d.addCallback(self._createJob_1)
         return d
 
@@ -459,7 +523,8 @@ class Try(pb.Referenceable):
             self.jobfile = createJobfile(self.bsid,
                                          ss.branch or "", revspec,
                                          patchlevel, diff, ss.repository,
-                                         self.project, self.builderNames)
+                                         self.project, self.builderNames,
+                                         self.priority)
 
     def fakeDeliverJob(self):
         # Display the job to be delivered, but don't perform delivery.
@@ -486,7 +551,7 @@ class Try(pb.Referenceable):
                     "buildbot", "tryserver", "--jobdir", trydir]
             # now run this command and feed the contents of 'job' into stdin
 
-            pp = RemoteTryPP(self.jobfile)
+            pp = RemoteTryPP(self.jobfile, self.reportProgress)
             reactor.spawnProcess(pp, argv[0], argv, os.environ)
             d = pp.d
             return d
@@ -507,16 +572,40 @@ class Try(pb.Referenceable):
     def _deliverJob_pb(self, remote):
         ss = self.sourcestamp
 
-        d = remote.callRemote("try",
+        # send a large patch ahead of the request, in chunks
+        patch = ss.patch
+        patchlevel, diff = patch
+        if diff and len(diff) > self.patchChunkSize:
+            d = self._sendPatch_pb(remote, diff)
+            patch = (patchlevel, None)
+        else:
+            d = defer.succeed(None)
+
+        # (the priority is only sent when given, for the sake of older masters)
+        kwargs = {}
+        if self.priority is not None:
+            kwargs['priority'] = self.priority
+        d.addCallback(lambda _ : remote.callRemote("try",
                               ss.branch,
                               ss.revision,
-                              ss.patch,
+                              patch,
                               ss.repository,
                               self.project,
                               self.builderNames,
-                              self.config.get('properties', {}))
+                              self.config.get('properties', {}),
+                              **kwargs))
         d.addCallback(self._deliverJob_pb2)
         return d
+
+    @defer.deferredGenerator
+    def _sendPatch_pb(self, remote, diff):
+        for start in range(0, len(diff), self.patchChunkSize):
+            chunk = diff[start:start+self.patchChunkSize]
+            wfd = defer.waitForDeferred(
+                    remote.callRemote("addPatchChunk", chunk))
+            yield wfd
+            wfd.getResult()
+            self.reportProgress(start + len(chunk), len(diff))
     def _deliverJob_pb2(self, status):
         self.buildsetStatus = status
         return status
@@ -719,6 +808,15 @@ class Try(pb.Referenceable):
         for buildername in buildernames:
             print buildername
 
+    def reportProgress(self, sent, total):
+        if total <= self.patchChunkSize:
+            return
+        percent = sent * 100 / total
+        percent -= percent % self.progressStep
+        if percent != self._lastProgress:
+            self._lastProgress = percent
+            self.announce("sent %d%% of %d bytes" % (percent, total))
+
     def announce(self, message):
         if not self.quiet:
             print message
@@ -126,6 +126,49 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             return [ self._brdictFromRow(row) for row in res.fetchall() ]
         return self.db.pool.do(thd)
 
+    def getUnclaimedBuildRequests(self, buildername, limit=None,
+                                  agingInterval=None):
+        """
+        Get the unclaimed build requests for a builder, in the order in which
+        they should be built: highest priority first, and then oldest first.
+
+        If C{agingInterval} is given, a request's priority is increased by one
+        for every C{agingInterval} seconds that it has been waiting, so that
+        low-priority requests are not starved by a steady stream of
+        high-priority requests.
+
+        @param buildername: builder to get requests for
+        @type buildername: string
+
+        @param limit: if not None, return at most this many requests
+        @type limit: integer
+
+        @param agingInterval: seconds per priority point, or None
+        @type agingInterval: number
+
+        @returns: List of build request dictionaries, via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.buildrequests
+            q = tbl.select(whereclause=(
+                    ((tbl.c.claimed_at == None) | (tbl.c.claimed_at == 0)) &
+                    (tbl.c.claimed_by_name == None) &
+                    (tbl.c.claimed_by_incarnation == None) &
+                    (tbl.c.buildername == buildername)))
+            if agingInterval:
+                # priority + (now - submitted_at) / agingInterval, scaled by
+                # agingInterval and without the constant term
+                q = q.order_by(
+                    (tbl.c.priority * agingInterval - tbl.c.submitted_at).desc())
+            else:
+                q = q.order_by(tbl.c.priority.desc())
+            q = q.order_by(tbl.c.submitted_at, tbl.c.id)
+            if limit is not None:
+                q = q.limit(limit)
+            res = conn.execute(q)
+            return [ self._brdictFromRow(row) for row in res.fetchall() ]
+        return self.db.pool.do(thd)
+
     def claimBuildRequests(self, brids, _reactor=reactor, _race_hook=None):
         """
         Try to "claim" the indicated build requests for this buildmaster
@@ -30,7 +30,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
     """
 
     def addBuildset(self, ssid, reason, properties, builderNames,
-                   external_idstring=None, _reactor=reactor):
+                   external_idstring=None, priority=0, _reactor=reactor):
         """
         Add a new Buildset to the database, along with the buildrequests for
         each named builder, returning the resulting bsid via a Deferred.
@@ -53,43 +53,146 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
         defaults to None
         @type external_idstring: unicode string
 
+        @param priority: priority of the buildrequests; higher priorities are
+        built first.  Defaults to 0.
+        @type priority: integer
+
         @param _reactor: for testing
 
         @returns: buildset ID via a Deferred
         """
+        def thd(conn):
+            transaction = conn.begin()
+            bsid = self._addBuildsetThd(conn, ssid=ssid, reason=reason,
+                    properties=properties, builderNames=builderNames,
+                    external_idstring=external_idstring, priority=priority,
+                    submitted_at=_reactor.seconds())
+            transaction.commit()
+            return bsid
+        return self.db.pool.do(thd)
+
+    def addBuildsets(self, buildsets, _reactor=reactor):
+        """
+        Add several buildsets, with their buildrequests, in a single
+        transaction.
+
+        @param buildsets: the buildsets to add, each a dictionary with the
+        arguments to L{addBuildset} (except C{_reactor})
+
+        @param _reactor: for testing
+
+        @returns: list of buildset IDs, in the same order as C{buildsets}, via
+        a Deferred
+        """
         def thd(conn):
             submitted_at = _reactor.seconds()
+            transaction = conn.begin()
+            bsids = []
+            for buildset in buildsets:
+                bsids.append(self._addBuildsetThd(conn, ssid=buildset['ssid'],
+                        reason=buildset['reason'],
+                        properties=buildset['properties'],
+                        builderNames=buildset['builderNames'],
+                        external_idstring=buildset.get('external_idstring'),
+                        priority=buildset.get('priority', 0),
+                        submitted_at=submitted_at))
+            transaction.commit()
+            return bsids
+        return self.db.pool.do(thd)
+
+    def addBuildsetsForChanges(self, buildsets, flushSchedulerid=None,
+                               _reactor=reactor):
+        """
+        Add several buildsets, each for a new SourceStamp referencing a list
+        of changes, in a single transaction.  Each SourceStamp takes its
+        branch, revision, repository and project from the newest of its
+        changes, as in
+        L{buildbot.schedulers.base.BaseScheduler.addBuildsetForChanges}.
+
+        @param buildsets: the buildsets to add, each a dictionary with key
+        C{changeids} (a nonempty list of change IDs), and the other arguments
+        to L{addBuildset} except C{ssid}
+
+        @param flushSchedulerid: if not None, the classifications of all of
+        the changes for this scheduler are deleted in the same transaction,
+        so that the changes cannot be built twice
+
+        @param _reactor: for testing
 
+        @returns: list of (bsid, ssid) tuples, in the same order as
+        C{buildsets}, via a Deferred
+        """
+        def thd(conn):
+            submitted_at = _reactor.seconds()
+            changes_tbl = self.db.model.changes
             transaction = conn.begin()
 
-            # insert the buildset itself
-            r = conn.execute(self.db.model.buildsets.insert(), dict(
-                sourcestampid=ssid, submitted_at=submitted_at,
-                reason=reason, complete=0, complete_at=None, results=-1,
-                external_idstring=external_idstring))
-            bsid = r.inserted_primary_key[0]
-
-            # add any properties
-            if properties:
-                conn.execute(self.db.model.buildset_properties.insert(), [
-                    dict(buildsetid=bsid, property_name=k,
-                         property_value=json.dumps([v,s]))
-                    for k,(v,s) in properties.iteritems() ])
-
-            # and finish with a build request for each builder
-            conn.execute(self.db.model.buildrequests.insert(), [
-                dict(buildsetid=bsid, buildername=buildername,
-                     priority=0, claimed_at=0, claimed_by_name=None,
-                     claimed_by_incarnation=None, complete=0,
-                     results=-1, submitted_at=submitted_at,
-                     complete_at=None)
-                for buildername in builderNames ])
+            ids = []
+            all_changeids = []
+            for buildset in buildsets:
+                changeids = buildset['changeids']
+                all_changeids.extend(changeids)
+
+                # the sourcestamp takes its attributes from the newest change
+                q = changes_tbl.select(
+                        whereclause=(changes_tbl.c.changeid == max(changeids)))
+                res = conn.execute(q)
+                row = res.fetchone()
+                res.close()
+                ssid = self.db.sourcestamps._createSourceStampThd(conn,
+                        branch=row.branch, revision=row.revision,
+                        repository=row.repository, project=row.project,
+                        changeids=changeids)
+
+                bsid = self._addBuildsetThd(conn, ssid=ssid,
+                        reason=buildset['reason'],
+                        properties=buildset['properties'],
+                        builderNames=buildset['builderNames'],
+                        external_idstring=buildset.get('external_idstring'),
+                        priority=buildset.get('priority', 0),
+                        submitted_at=submitted_at)
+                ids.append((bsid, ssid))
+
+            if flushSchedulerid is not None:
+                tbl = self.db.model.scheduler_changes
+                while all_changeids:
+                    chunk, all_changeids = \
+                            all_changeids[:100], all_changeids[100:]
+                    conn.execute(tbl.delete(
+                        (tbl.c.schedulerid == flushSchedulerid)
+                        & (tbl.c.changeid.in_(chunk))))
 
             transaction.commit()
-
-            return bsid
+            return ids
         return self.db.pool.do(thd)
 
+    def _addBuildsetThd(self, conn, ssid, reason, properties, builderNames,
+                        external_idstring, submitted_at, priority=0):
+        # insert the buildset itself
+        r = conn.execute(self.db.model.buildsets.insert(), dict(
+            sourcestampid=ssid, submitted_at=submitted_at,
+            reason=reason, complete=0, complete_at=None, results=-1,
+            external_idstring=external_idstring))
+        bsid = r.inserted_primary_key[0]
+
+        # add any properties
+        if properties:
+            conn.execute(self.db.model.buildset_properties.insert(), [
+                dict(buildsetid=bsid, property_name=k,
+                     property_value=json.dumps([v,s]))
+                for k,(v,s) in properties.iteritems() ])
+
+        # and finish with a build request for each builder
+        conn.execute(self.db.model.buildrequests.insert(), [
+            dict(buildsetid=bsid, buildername=buildername,
+                 priority=priority, claimed_at=0, claimed_by_name=None,
+                 claimed_by_incarnation=None, complete=0,
+                 results=-1, submitted_at=submitted_at,
+                 complete_at=None)
+            for buildername in builderNames ])
+
+        return bsid
+
     def getBuildset(self, bsid):
         """
         Get a dictionary representing the given buildset, or None
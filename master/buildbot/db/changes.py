@@ -19,6 +19,7 @@ Support for changes in the database
 
 from buildbot.util import json
 import sqlalchemy as sa
+from twisted.internet import defer
 from buildbot.changes.changes import Change
 from buildbot.db import base
 
@@ -88,19 +89,38 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 repository=repository, project=project)
 
         # then add it to the database and update its '.number'
-        def thd(conn):
-            assert change.number is None
+        d = self.db.pool.do(self._addChangesThd, [ change ])
+        d.addCallback(lambda changes : changes[0])
+        return d
 
-            # note that in a read-uncommitted database like SQLite this
-            # transaction does not buy atomicitiy - other database users may
-            # still come across a change without its links, files, properties,
-            # etc.  That's OK, since we don't announce the change until it's
-            # all in the database, but beware.
+    def addChanges(self, changes):
+        """Add several changes to the database at once, in a single
+        transaction.
 
-            transaction = conn.begin()
+        @param changes: the changes to add, each given as a dictionary of
+        keyword arguments to L{addChange}
+        @type changes: list of dictionaries
 
-            ins = self.db.model.changes.insert()
-            r = conn.execute(ins, dict(
+        @returns: list of L{buildbot.changes.changes.Change} instances, in the
+        same order, via Deferred
+        """
+        changes = [ Change(**kwargs) for kwargs in changes ]
+        if not changes:
+            return defer.succeed([])
+        return self.db.pool.do(self._addChangesThd, changes)
+
+    def _addChangesThd(self, conn, changes):
+        # note that in a read-uncommitted database like SQLite this
+        # transaction does not buy atomicitiy - other database users may
+        # still come across a change without its links, files, properties,
+        # etc.  That's OK, since we don't announce the change until it's
+        # all in the database, but beware.
+
+        transaction = conn.begin()
+
+        changes_tbl = self.db.model.changes
+        ins = changes_tbl.insert()
+        rows = [ dict(
                 author=change.who,
                 comments=change.comments,
                 is_dir=change.isdir,
@@ -110,34 +130,51 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 when_timestamp=change.when,
                 category=change.category,
                 repository=change.repository,
-                project=change.project))
-            change.number = r.inserted_primary_key[0]
-            if change.links:
-                ins = self.db.model.change_links.insert()
-                conn.execute(ins, [
-                    dict(changeid=change.number, link=l)
-                        for l in change.links
-                    ])
-            if change.files:
-                ins = self.db.model.change_files.insert()
-                conn.execute(ins, [
-                    dict(changeid=change.number, filename=f)
-                        for f in change.files
-                    ])
-            if change.properties:
-                ins = self.db.model.change_properties.insert()
-                conn.execute(ins, [
-                    dict(changeid=change.number,
-                        property_name=k,
-                        property_value=json.dumps(v))
-                    for k,v,s in change.properties.asList()
-                ])
-
-            transaction.commit()
-
-            return change
-        d = self.db.pool.do(thd)
-        return d
+                project=change.project)
+            for change in changes ]
+        for change in changes:
+            assert change.number is None
+
+        if len(changes) > 1 and conn.dialect.name == 'sqlite':
+            # SQLite holds the database's write lock from the first insert
+            # until the commit, so the newest len(changes) changeids are
+            # ours, in order, and the rows can all go in one statement
+            conn.execute(ins, rows)
+            q = sa.select([changes_tbl.c.changeid],
+                    order_by=[sa.desc(changes_tbl.c.changeid)],
+                    limit=len(changes))
+            changeids = [ r.changeid for r in conn.execute(q).fetchall() ]
+            changeids.reverse()
+            for change, changeid in zip(changes, changeids):
+                change.number = changeid
+        else:
+            # other databases give no such guarantee, so each change row is
+            # inserted separately, to get its changeid
+            for change, row in zip(changes, rows):
+                r = conn.execute(ins, row)
+                change.number = r.inserted_primary_key[0]
+
+        # the ancillary rows for all of the changes go in one statement each
+        links, files, properties = [], [], []
+        for change in changes:
+            links.extend([ dict(changeid=change.number, link=l)
+                           for l in change.links ])
+            files.extend([ dict(changeid=change.number, filename=f)
+                           for f in change.files ])
+            properties.extend([ dict(changeid=change.number,
+                                     property_name=k,
+                                     property_value=json.dumps(v))
+                                for k,v,s in change.properties.asList() ])
+        if links:
+            conn.execute(self.db.model.change_links.insert(), links)
+        if files:
+            conn.execute(self.db.model.change_files.insert(), files)
+        if properties:
+            conn.execute(self.db.model.change_properties.insert(), properties)
+
+        transaction.commit()
+
+        return changes
 
     def getChangeInstance(self, changeid):
         """
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import base64
+import zlib
 
 from twisted.python import threadable, log
 from twisted.application import internet, service
@@ -291,13 +292,15 @@ class DBConnector(service.MultiService):
 
         patch = None
         if patchid is not None:
-            t.execute(self.quoteq("SELECT patchlevel,patch_base64,subdir"
-                                  " FROM patches WHERE id=?"),
+            t.execute(self.quoteq("SELECT patchlevel,patch_base64,compressed,"
+                                  "subdir FROM patches WHERE id=?"),
                       (patchid,))
             r = t.fetchall()
             assert len(r) == 1
-            (patch_level, patch_text_base64, subdir_u) = r[0]
+            (patch_level, patch_text_base64, compressed, subdir_u) = r[0]
             patch_text = base64.b64decode(patch_text_base64)
+            if compressed:
+                patch_text = zlib.decompress(patch_text)
             if subdir_u:
                 patch = (patch_level, patch_text, str(subdir_u))
             else:
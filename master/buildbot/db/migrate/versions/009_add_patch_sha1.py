@@ -0,0 +1,32 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import sqlalchemy as sa
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    # add a hash of each patch, by which identical patches can be found, and a
+    # flag for patches that are stored compressed
+    patches = sa.Table('patches', metadata, autoload=True)
+    patch_sha1 = sa.Column('patch_sha1', sa.String(40))
+    patch_sha1.create(patches)
+    compressed = sa.Column('compressed', sa.SmallInteger, nullable=False,
+                           server_default=sa.DefaultClause("0"))
+    compressed.create(patches, populate_default=True)
+
+    idx = sa.Index('patches_patch_sha1', patches.c.patch_sha1)
+    idx.create(migrate_engine)
@@ -219,9 +219,17 @@ class Model(base.DBConnectorComponent):
         # number of directory levels to strip off (patch -pN)
         sa.Column('patchlevel', sa.Integer, nullable=False),
 
-        # base64-encoded version of the patch file
+        # base64-encoded version of the patch file, compressed with zlib first
+        # if 'compressed' is set
         sa.Column('patch_base64', sa.Text, nullable=False),
 
+        # nonzero if the patch is compressed
+        sa.Column('compressed', sa.SmallInteger, nullable=False, server_default=sa.DefaultClause("0")),
+
+        # hex SHA1 of the (uncompressed) patch, used to share identical
+        # patches; NULL for patches added before this was recorded
+        sa.Column('patch_sha1', sa.String(40)),
+
         # subdirectory in which the patch should be applied; NULL for top-level
         sa.Column('subdir', sa.Text),
     )
@@ -348,6 +356,7 @@ class Model(base.DBConnectorComponent):
     sa.Index('change_files_changeid', change_files.c.changeid)
     sa.Index('change_links_changeid', change_links.c.changeid)
     sa.Index('change_properties_changeid', change_properties.c.changeid)
+    sa.Index('patches_patch_sha1', patches.c.patch_sha1)
     sa.Index('scheduler_changes_schedulerid', scheduler_changes.c.schedulerid)
     sa.Index('scheduler_changes_changeid', scheduler_changes.c.changeid)
     sa.Index('scheduler_changes_unique', scheduler_changes.c.schedulerid,
@@ -19,7 +19,6 @@ Support for schedulers in the database
 
 from buildbot.util import json
 import sqlalchemy as sa
-import sqlalchemy.exc
 from twisted.python import log
 from buildbot.db import base
 
@@ -60,27 +59,41 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
         """Record a collection of classifications in the scheduler_changes
         table. CLASSIFICATIONS is a dictionary mapping CHANGEID to IMPORTANT
         (boolean).  Returns a Deferred."""
+        return self.classifyChangesForSchedulers(
+                { schedulerid : classifications })
+
+    def classifyChangesForSchedulers(self, classifications):
+        """Record classifications for several schedulers in the
+        scheduler_changes table, in a single transaction.  CLASSIFICATIONS is
+        a dictionary mapping SCHEDULERID to a dictionary mapping CHANGEID to
+        IMPORTANT (boolean), as for L{classifyChanges}.  Returns a
+        Deferred."""
         def thd(conn):
             tbl = self.db.model.scheduler_changes
-            ins_q = tbl.insert()
-            upd_q = tbl.update(
-                    ((tbl.c.schedulerid == schedulerid)
-                    & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
-            for changeid, important in classifications.items():
-                # convert the 'important' value into an integer, since that
-                # is the column type
-                imp_int = important and 1 or 0
-                try:
-                    conn.execute(ins_q,
-                            schedulerid=schedulerid,
-                            changeid=changeid,
-                            important=imp_int)
-                except (sqlalchemy.exc.ProgrammingError,
-                        sqlalchemy.exc.IntegrityError):
-                    # insert failed, so try an update
-                    conn.execute(upd_q,
-                            wc_changeid=changeid,
-                            important=imp_int)
+            transaction = conn.begin()
+
+            # replace any existing classifications: delete them, then insert
+            # all of the new rows at once
+            rows = []
+            for schedulerid, sched_classifications in classifications.items():
+                changeids = sched_classifications.keys()
+                # (the changeids are chunked to keep the IN clause within
+                # the databases' limits on bound parameters)
+                while changeids:
+                    chunk, changeids = changeids[:100], changeids[100:]
+                    conn.execute(tbl.delete(
+                        (tbl.c.schedulerid == schedulerid)
+                        & (tbl.c.changeid.in_(chunk))))
+                for changeid, important in sched_classifications.items():
+                    # convert the 'important' value into an integer, since
+                    # that is the column type
+                    rows.append(dict(schedulerid=schedulerid,
+                                     changeid=changeid,
+                                     important=important and 1 or 0))
+            if rows:
+                conn.execute(tbl.insert(), rows)
+
+            transaction.commit()
 
         return self.db.pool.do(thd)
 
@@ -128,6 +141,48 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
             return dict([ (r.changeid, [False,True][r.important]) for r in conn.execute(q) ])
         return self.db.pool.do(thd)
 
+    def getChangeClassificationsForBranches(self, schedulerid, branches):
+        """
+        Like L{getChangeClassifications}, but for several branches at once.
+
+        @param schedulerid: scheduler to look up changes for
+        @type schedulerid: integer
+
+        @param branches: the branches to look up
+        @type branches: list of strings or None (for default branch)
+
+        @returns: dictionary mapping each branch to a dictionary like that
+        returned by L{getChangeClassifications}, via Deferred
+        """
+        def thd(conn):
+            scheduler_changes_tbl = self.db.model.scheduler_changes
+            changes_tbl = self.db.model.changes
+
+            result = dict([ (branch, {}) for branch in branches ])
+            named = [ b for b in branches if b is not None ]
+            # (the branches are chunked to keep the IN clause within the
+            # databases' limits on bound parameters)
+            conditions = []
+            while named:
+                chunk, named = named[:100], named[100:]
+                conditions.append(changes_tbl.c.branch.in_(chunk))
+            if None in result:
+                conditions.append(changes_tbl.c.branch == None)
+            for branch_wc in conditions:
+                q = sa.select(
+                    [ scheduler_changes_tbl.c.changeid,
+                      scheduler_changes_tbl.c.important,
+                      changes_tbl.c.branch ],
+                    whereclause=(
+                        (scheduler_changes_tbl.c.schedulerid == schedulerid) &
+                        (scheduler_changes_tbl.c.changeid ==
+                                                changes_tbl.c.changeid) &
+                        branch_wc))
+                for r in conn.execute(q):
+                    result[r.branch][r.changeid] = [False,True][r.important]
+            return result
+        return self.db.pool.do(thd)
+
     def getSchedulerId(self, sched_name, sched_class):
         """
         Get the schedulerid for the given scheduler, creating a new schedulerid
@@ -18,14 +18,29 @@ Support for creating and reading source stamps
 """
 
 import base64
+import zlib
+import sqlalchemy as sa
 from twisted.python import log
 from buildbot.db import base
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
 class SourceStampsConnectorComponent(base.DBConnectorComponent):
     """
     A DBConnectorComponent to handle source stamps in the database
+
+    Patches are shared between source stamps: a patch identical to one
+    already in the database, with the same patch level and subdirectory, is
+    found by its SHA1 and used again, rather than stored once more.  Patches
+    of at least C{patchCompressMinimum} bytes are compressed with zlib before
+    they are base64-encoded, if that makes them smaller.
     """
 
+    patchCompressMinimum = 1024
+
     def createSourceStamp(self, branch, revision, repository, project,
                           patch_body=None, patch_level=0, patch_subdir=None,
                           changeids=[]):
@@ -33,37 +48,74 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
         Create a new SourceStamp instance with the given attributes, and return
         its sourcestamp ID, via a Deferred.
         """
-        def thd(conn):
-            # handle inserting a patch
-            patchid = None
-            if patch_body is not None:
-                ins = self.db.model.patches.insert()
-                r = conn.execute(ins, dict(
-                    patchlevel=patch_level,
-                    patch_base64=base64.b64encode(patch_body),
-                    subdir=patch_subdir))
-                patchid = r.inserted_primary_key[0]
-
-            # insert the sourcestamp itself
-            ins = self.db.model.sourcestamps.insert()
-            r = conn.execute(ins, dict(
-                branch=branch,
-                revision=revision,
-                patchid=patchid,
-                repository=repository,
-                project=project))
-            ssid = r.inserted_primary_key[0]
-
-            # handle inserting change ids
-            if changeids:
-                ins = self.db.model.sourcestamp_changes.insert()
-                conn.execute(ins, [
-                    dict(sourcestampid=ssid, changeid=changeid)
-                    for changeid in changeids ])
-
-            # and return the new ssid
-            return ssid
-        return self.db.pool.do(thd)
+        return self.db.pool.do(self._createSourceStampThd, branch=branch,
+                revision=revision, repository=repository, project=project,
+                patch_body=patch_body, patch_level=patch_level,
+                patch_subdir=patch_subdir, changeids=changeids)
+
+    def _createSourceStampThd(self, conn, branch, revision, repository,
+                              project, patch_body=None, patch_level=0,
+                              patch_subdir=None, changeids=[]):
+        # handle inserting a patch
+        patchid = None
+        if patch_body is not None:
+            patchid = self._findOrAddPatchThd(conn, patch_body, patch_level,
+                                              patch_subdir)
+
+        # insert the sourcestamp itself
+        ins = self.db.model.sourcestamps.insert()
+        r = conn.execute(ins, dict(
+            branch=branch,
+            revision=revision,
+            patchid=patchid,
+            repository=repository,
+            project=project))
+        ssid = r.inserted_primary_key[0]
+
+        # handle inserting change ids
+        if changeids:
+            ins = self.db.model.sourcestamp_changes.insert()
+            conn.execute(ins, [
+                dict(sourcestampid=ssid, changeid=changeid)
+                for changeid in changeids ])
+
+        # and return the new ssid
+        return ssid
+
+    def _findOrAddPatchThd(self, conn, patch_body, patch_level, patch_subdir):
+        tbl = self.db.model.patches
+        patch_sha1 = sha1(patch_body).hexdigest()
+
+        # look for an identical patch
+        if patch_subdir is None:
+            subdir_clause = (tbl.c.subdir == None)
+        else:
+            subdir_clause = (tbl.c.subdir == patch_subdir)
+        q = sa.select([ tbl.c.id ],
+                whereclause=((tbl.c.patch_sha1 == patch_sha1)
+                             & (tbl.c.patchlevel == patch_level)
+                             & subdir_clause))
+        res = conn.execute(q)
+        row = res.fetchone()
+        res.close()
+        if row:
+            return row.id
+
+        # compress large patches, if it helps
+        compressed = 0
+        if len(patch_body) >= self.patchCompressMinimum:
+            compressed_body = zlib.compress(patch_body)
+            if len(compressed_body) < len(patch_body):
+                patch_body = compressed_body
+                compressed = 1
+
+        r = conn.execute(tbl.insert(), dict(
+            patchlevel=patch_level,
+            patch_base64=base64.b64encode(patch_body),
+            compressed=compressed,
+            patch_sha1=patch_sha1,
+            subdir=patch_subdir))
+        return r.inserted_primary_key[0]
 
     def getSourceStamp(self, ssid):
         """
@@ -106,6 +158,8 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
                     ssdict['patch_level'] = row.patchlevel
                     ssdict['patch_subdir'] = row.subdir
                     body = base64.b64decode(row.patch_base64)
+                    if row.compressed:
+                        body = zlib.decompress(body)
                     ssdict['patch_body'] = body
                 else:
                     log.msg('patchid %d, referenced from ssid %d, not found'
@@ -1067,6 +1067,9 @@ class ILogFile(Interface):
         pass
     def addHeader(data):
         pass
+    def getPendingLength():
+        """Return the number of bytes added but not yet written out. This
+        is optional, and is used for flow control of slave updates."""
     def finish():
         """The process that is feeding the log file has finished, and no
         further data will be added. This closes the logfile."""
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 
+from collections import deque
 from twisted.python import log
 from twisted.internet import reactor, defer
 from buildbot import util
@@ -23,25 +24,56 @@ if False: # for debugging
 else:
     debuglog = lambda m: None
 
+class _Waiter:
+    """An entry in a lock's queue of waiters."""
+
+    def __init__(self, owner, access, d, started):
+        self.owner = owner
+        self.access = access
+        self.d = d
+        self.started = started
+        self.cancelled = False
+        # the delayed call that will fire d, once the lock has been granted
+        self.wakeup = None
+
 class BaseLock:
     """
     Class handling claiming and releasing of L{self}, and keeping track of
     current and waiting owners.
 
-    @note: Ideally, we'd like to maintain FIFO order. The place to do that
-           would be the L{isAvailable()} function. However, this function is
-           called by builds/steps both for the first time, and after waking
-           them up by L{self} from the L{self.waiting} queue. There is
-           currently no way of distinguishing between them.
+    The numbers of exclusive and counting owners are kept as counters, and
+    waiters in a FIFO queue.  As the lock becomes available, it is claimed on
+    behalf of the waiters at the head of the queue before they are woken, so
+    that only those that can hold the lock are woken, in order.  While anyone
+    is waiting, the lock is not available to newcomers.
+
+    The number of waits that ended with the lock being granted, and the
+    total and longest time spent in them, are kept in memory and available
+    from L{getStatus}.
     """
     description = "<BaseLock>"
 
+    _reactor = reactor # for tests
+
     def __init__(self, name, maxCount=1):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (LockAccess, deferred)
-        self.owners = []          # Current owners, tuples (owner, LockAccess)
+        self.waiting = deque()    # Current queue of _Waiter instances
+        self.owners = {}          # Current owners, (owner, LockAccess) -> count
         self.maxCount = maxCount  # maximal number of counting owners
 
+        self._numExclusive = 0
+        self._numCounting = 0
+        # number of waiters in self.waiting that have not been cancelled
+        self._numWaiting = 0
+        # (owner, LockAccess) -> _Waiter, for waiters whose Deferreds have not
+        # yet fired
+        self._waiters = {}
+
+        # contention statistics
+        self.waits = 0
+        self.totalWaitTime = 0
+        self.maxWaitTime = 0
+
     def __repr__(self):
         return self.description
 
@@ -50,29 +82,25 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else: # mode == 'counting'
-                num_counting = num_counting + 1
-
-        assert (num_excl == 1 and num_counting == 0) \
-                or (num_excl == 0 and num_counting <= self.maxCount)
-        return num_excl, num_counting
+        assert (self._numExclusive == 1 and self._numCounting == 0) \
+                or (self._numExclusive == 0
+                    and self._numCounting <= self.maxCount)
+        return self._numExclusive, self._numCounting
 
+    def _canClaim(self, access):
+        if access.mode == 'counting':
+            # Wants counting access
+            return (self._numExclusive == 0
+                    and self._numCounting < self.maxCount)
+        else:
+            # Wants exclusive access
+            return self._numExclusive == 0 and self._numCounting == 0
 
     def isAvailable(self, access):
         """ Return a boolean whether the lock is available for claiming """
         debuglog("%s isAvailable(%s): self.owners=%r"
                                             % (self, access, self.owners))
-        num_excl, num_counting = self._getOwnersCount()
-        if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting < self.maxCount
-        else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0
+        return self._numWaiting == 0 and self._canClaim(access)
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
@@ -82,9 +110,18 @@ class BaseLock:
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.owners.append((owner, access))
+        self._claim(owner, access)
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
+    def _claim(self, owner, access):
+        entry = (owner, access)
+        self.owners[entry] = self.owners.get(entry, 0) + 1
+        if access.mode == 'exclusive':
+            self._numExclusive += 1
+        else:
+            self._numCounting += 1
+        self._getOwnersCount() # check the counts
+
     def release(self, owner, access):
         """ Release the lock """
         assert isinstance(access, LockAccess)
@@ -92,52 +129,120 @@ class BaseLock:
         debuglog("%s release(%s, %s)" % (self, owner, access.mode))
         entry = (owner, access)
         assert entry in self.owners
-        self.owners.remove(entry)
-        # who can we wake up?
-        # After an exclusive access, we may need to wake up several waiting.
-        # Break out of the loop when the first waiting client should not be awakened.
-        num_excl, num_counting = self._getOwnersCount()
-        while len(self.waiting) > 0:
-            access, d = self.waiting[0]
-            if access.mode == 'counting':
-                if num_excl > 0 or num_counting == self.maxCount:
-                    break
-                else:
-                    num_counting = num_counting + 1
-            else:
-                # access.mode == 'exclusive'
-                if num_excl > 0 or num_counting > 0:
-                    break
-                else:
-                    num_excl = num_excl + 1
-
-            del self.waiting[0]
-            reactor.callLater(0, d.callback, self)
-
-    def waitUntilMaybeAvailable(self, owner, access):
-        """Fire when the lock *might* be available. The caller will need to
-        check with isAvailable() when the deferred fires. This loose form is
-        used to avoid deadlocks. If we were interested in a stronger form,
-        this would be named 'waitUntilAvailable', and the deferred would fire
-        after the lock had been claimed.
+        if self.owners[entry] == 1:
+            del self.owners[entry]
+        else:
+            self.owners[entry] -= 1
+        if access.mode == 'exclusive':
+            self._numExclusive -= 1
+        else:
+            self._numCounting -= 1
+        self._wakeWaiters()
+
+    def _wakeWaiters(self):
+        # grant the lock to as many waiters as can hold it, in order.  After
+        # an exclusive access, we may wake up several waiting; stop at the
+        # first that cannot be granted the lock.
+        while self.waiting:
+            waiter = self.waiting[0]
+            if waiter.cancelled:
+                self.waiting.popleft()
+                continue
+            if not self._canClaim(waiter.access):
+                break
+            self.waiting.popleft()
+            self._numWaiting -= 1
+            self._claim(waiter.owner, waiter.access)
+            self._waited(self._reactor.seconds() - waiter.started)
+            waiter.wakeup = self._reactor.callLater(0, self._fireWaiter,
+                                                    waiter)
+
+    def _waited(self, seconds):
+        self.waits += 1
+        self.totalWaitTime += seconds
+        if seconds > self.maxWaitTime:
+            self.maxWaitTime = seconds
+
+    def _fireWaiter(self, waiter):
+        del self._waiters[(waiter.owner, waiter.access)]
+        waiter.d.callback(self)
+
+    def waitUntilAvailable(self, owner, access):
+        """Wait until the lock is available, claim it on behalf of
+        C{owner}, and then fire the returned Deferred with the lock.  The
+        caller must not already be waiting for the lock.  The wait can be
+        cancelled with L{stopWaitingUntilAvailable}.
         """
         debuglog("%s waitUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
+        assert (owner, access) not in self._waiters
         if self.isAvailable(access):
+            self._claim(owner, access)
             return defer.succeed(self)
         d = defer.Deferred()
-        self.waiting.append((access, d))
+        waiter = _Waiter(owner, access, d, self._reactor.seconds())
+        self.waiting.append(waiter)
+        self._waiters[(owner, access)] = waiter
+        self._numWaiting += 1
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
+        """Stop waiting for the lock; C{d} will not fire.  If the lock has
+        already been claimed on behalf of C{owner}, but C{d} has not yet
+        fired, the claim is released."""
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (access, d) in self.waiting
-        self.waiting.remove( (access, d) )
+        waiter = self._waiters.pop((owner, access))
+        assert waiter.d is d
+        if waiter.wakeup:
+            # the lock was granted, but the waiter has not been woken
+            waiter.wakeup.cancel()
+            self.release(owner, access)
+        else:
+            # (left in the queue, and skipped when it reaches the head)
+            waiter.cancelled = True
+            self._numWaiting -= 1
+            self._wakeWaiters()
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
 
+    def _describeOwner(self, owner):
+        # builds and steps say which build they are; anything else is just
+        # converted to a string
+        describe = getattr(owner, 'describeLockOwner', None)
+        if describe is not None:
+            return describe()
+        return str(owner)
+
+    def getStatus(self):
+        """Return a dictionary describing this lock: its name and
+        description, its maxCount, the numbers of its current exclusive and
+        counting owners and of its waiters, its current owners, and the
+        number of waits that ended with the lock being granted, with the
+        total and longest time spent in them, in seconds.
+
+        Each owner is a dictionary with keys 'owner' (a description of the
+        build or step that holds the lock), 'mode' ('exclusive' or
+        'counting') and 'count' (the number of times it holds the lock)."""
+        owners = [ { 'owner' : self._describeOwner(owner),
+                     'mode' : access.mode,
+                     'count' : count }
+                   for ((owner, access), count) in self.owners.items() ]
+        owners.sort(key=lambda o : o['owner'])
+        return {
+            'name' : self.name,
+            'description' : self.description,
+            'max_count' : self.maxCount,
+            'exclusive_owners' : self._numExclusive,
+            'counting_owners' : self._numCounting,
+            'waiting' : self._numWaiting,
+            'owners' : owners,
+            'waits' : self.waits,
+            'total_wait_time' : self.totalWaitTime,
+            'max_wait_time' : self.maxWaitTime,
+        }
+
 
 class RealMasterLock(BaseLock):
     def __init__(self, lockid):
@@ -147,6 +252,11 @@ class RealMasterLock(BaseLock):
     def getLock(self, slave):
         return self
 
+    def getLocks(self):
+        """Return the real locks behind this lock, as (slavename, lock)
+        tuples; slavename is None for a master lock."""
+        return [ (None, self) ]
+
 class RealSlaveLock:
     def __init__(self, lockid):
         self.name = lockid.name
@@ -172,6 +282,13 @@ class RealSlaveLock:
             self.locks[slavename] = lock
         return self.locks[slavename]
 
+    def getLocks(self):
+        """Return the real locks behind this lock, one for each slave that
+        has used it, as (slavename, lock) tuples."""
+        locks = self.locks.items()
+        locks.sort()
+        return locks
+
 
 class LockAccess(util.ComparableMixin):
     """ I am an object representing a way to access a lock.
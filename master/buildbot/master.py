@@ -37,6 +37,7 @@ from buildbot.config import BuilderConfig
 from buildbot.process.builder import BuilderControl
 from buildbot.db import connector, exceptions
 from buildbot.schedulers.manager import SchedulerManager
+from buildbot.schedulers.classifier import ChangeClassifier
 from buildbot.schedulers.base import isScheduler
 from buildbot.process.botmaster import BotMaster
 from buildbot.process import debug
@@ -74,6 +75,9 @@ class BuildMaster(service.MultiService):
         self.slavePortnum = None
         self.slavePort = None
 
+        self.priorityAgingInterval = None
+        "seconds after which a waiting build request gains a priority point"
+
         self.change_svc = ChangeManager()
         self.change_svc.setServiceParent(self)
 
@@ -93,6 +97,8 @@ class BuildMaster(service.MultiService):
         self.scheduler_manager.setName('scheduler_manager')
         self.scheduler_manager.setServiceParent(self)
 
+        self.change_classifier = ChangeClassifier(self)
+
         self.debugClientRegistration = None
 
         self.status = Status(self.botmaster, self.basedir)
@@ -113,10 +119,14 @@ class BuildMaster(service.MultiService):
         # subscription points
         self._change_subs = \
                 subscription.SubscriptionPoint("changes")
+        self._change_batch_subs = \
+                subscription.SubscriptionPoint("change_batches")
         self._new_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_additions")
         self._complete_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_completion")
+        self._complete_buildset_index = \
+                subscription.IndexedSubscriptionPoint("buildset_completion")
 
     def startService(self):
         service.MultiService.startService(self)
@@ -209,6 +219,7 @@ class BuildMaster(service.MultiService):
                           "logHorizon", "buildHorizon", "changeHorizon",
                           "logMaxSize", "logMaxTailSize", "logCompressionMethod",
                           "db_url", "multiMaster", "db_poll_interval",
+                          "priorityAgingInterval",
                           )
             for k in config.keys():
                 if k not in known_keys:
@@ -260,6 +271,12 @@ class BuildMaster(service.MultiService):
                 prioritizeBuilders = config.get('prioritizeBuilders')
                 if prioritizeBuilders is not None and not callable(prioritizeBuilders):
                     raise ValueError("prioritizeBuilders must be callable")
+                priorityAgingInterval = config.get('priorityAgingInterval')
+                if priorityAgingInterval is not None and not (
+                        isinstance(priorityAgingInterval, (int, float))
+                        and priorityAgingInterval > 0):
+                    raise ValueError("priorityAgingInterval must be None or "
+                                     "a positive number")
                 changeHorizon = config.get("changeHorizon")
                 if changeHorizon is not None and not isinstance(changeHorizon, int):
                     raise ValueError("changeHorizon needs to be an int")
@@ -454,6 +471,7 @@ class BuildMaster(service.MultiService):
                 self.botmaster.mergeRequests = mergeRequests
             if prioritizeBuilders is not None:
                 self.botmaster.prioritizeBuilders = prioritizeBuilders
+            self.priorityAgingInterval = priorityAgingInterval
 
             self.buildCacheSize = buildCacheSize
             self.changeCacheSize = changeCacheSize
@@ -723,11 +741,30 @@ class BuildMaster(service.MultiService):
             log.msg(msg.encode('utf-8', 'replace'))
             # only deliver messages immediately if we're not polling
             if not self.db_poll_interval:
-                self._change_subs.deliver(change)
+                self._deliverChanges([ change ])
             return change
         d.addCallback(notify)
         return d
 
+    def addChanges(self, changes):
+        """Add several changes to the buildmaster at once, and act on them.
+        Each element of C{changes} is a dictionary of keyword arguments to
+        L{addChange}.  The changes are added to the database in a single
+        transaction (see
+        L{buildbot.db.changes.ChangesConnectorComponent.addChanges}) and
+        delivered to subscribers as one batch, and the resulting Change
+        objects are returned in order via Deferred."""
+        d = self.db.changes.addChanges(changes)
+        def notify(changes):
+            for change in changes:
+                msg = u"added change %s to database" % change
+                log.msg(msg.encode('utf-8', 'replace'))
+            if changes and not self.db_poll_interval:
+                self._deliverChanges(changes)
+            return changes
+        d.addCallback(notify)
+        return d
+
     def subscribeToChanges(self, callback):
         """
         Request that C{callback} be called with each Change object added to the
@@ -737,6 +774,41 @@ class BuildMaster(service.MultiService):
         """
         return self._change_subs.subscribe(callback)
 
+    def subscribeToChangeBatches(self, callback):
+        """
+        Request that C{callback} be called with lists of Change objects added
+        to the cluster.  Changes added together (see L{addChanges}) are
+        delivered in a single call, in order.  Each change is delivered both
+        to these subscribers and to those of L{subscribeToChanges}.
+
+        Note: this method will go away in 0.9.x
+        """
+        return self._change_batch_subs.subscribe(callback)
+
+    def subscribeToClassifiedChanges(self, callback, change_filter=None,
+                                     fileIsImportant=None, schedulerid=None,
+                                     name=None):
+        """
+        Request that C{callback} be called with lists of (change, important)
+        tuples for the new changes that pass C{change_filter}, as classified
+        by C{fileIsImportant}.  If C{schedulerid} is given, the
+        classifications are recorded for that scheduler before the callback
+        is called.  C{name} identifies the subscriber in the classifier's
+        routing counts.  The changes are filtered and classified in batches,
+        for all subscribers at once; see
+        L{buildbot.schedulers.classifier.ChangeClassifier}.
+
+        Note: this method will go away in 0.9.x
+        """
+        return self.change_classifier.subscribe(callback,
+                change_filter=change_filter, fileIsImportant=fileIsImportant,
+                schedulerid=schedulerid, name=name)
+
+    def _deliverChanges(self, changes):
+        for change in changes:
+            self._change_subs.deliver(change)
+        self._change_batch_subs.deliver(changes)
+
     def addBuildset(self, **kwargs):
         """
         Add a buildset to the buildmaster and act on it.  Interface is
@@ -754,6 +826,47 @@ class BuildMaster(service.MultiService):
         d.addCallback(notify)
         return d
 
+    def addBuildsets(self, buildsets):
+        """
+        Add several buildsets to the buildmaster, in a single database
+        transaction, and act on them.  Interface is identical to
+        L{buildbot.db.buildsets.BuildsetConnectorComponent.addBuildsets}.
+        """
+        d = self.db.buildsets.addBuildsets(buildsets)
+        def notify(bsids):
+            for buildset, bsid in zip(buildsets, bsids):
+                log.msg("added buildset %d to database" % bsid)
+                kwargs = buildset.copy()
+                kwargs.setdefault('external_idstring', None)
+                self._new_buildset_subs.deliver(bsid=bsid, **kwargs)
+            return bsids
+        d.addCallback(notify)
+        return d
+
+    def addBuildsetsForChanges(self, buildsets, flushSchedulerid=None):
+        """
+        Add several buildsets for lists of changes to the buildmaster, in a
+        single database transaction, and act on them.  Interface is identical
+        to C{addBuildsetsForChanges} in
+        L{buildbot.db.buildsets.BuildsetConnectorComponent}, except that the
+        Deferred fires with a list of bsids.
+        """
+        d = self.db.buildsets.addBuildsetsForChanges(buildsets,
+                                        flushSchedulerid=flushSchedulerid)
+        def notify(ids):
+            bsids = []
+            for buildset, (bsid, ssid) in zip(buildsets, ids):
+                log.msg("added buildset %d to database" % bsid)
+                kwargs = buildset.copy()
+                del kwargs['changeids']
+                kwargs.setdefault('external_idstring', None)
+                self._new_buildset_subs.deliver(bsid=bsid, ssid=ssid,
+                                                **kwargs)
+                bsids.append(bsid)
+            return bsids
+        d.addCallback(notify)
+        return d
+
     def subscribeToBuildsets(self, callback):
         """
         Request that C{callback(bsid=bsid, ssid=ssid, reason=reason,
@@ -772,6 +885,7 @@ class BuildMaster(service.MultiService):
         """
         # note that buildset completions are only reported on this master
         self._complete_buildset_subs.deliver(bsid, result)
+        self._complete_buildset_index.deliver(bsid, bsid, result)
 
     def subscribeToBuildsetCompletions(self, callback):
         """
@@ -782,6 +896,17 @@ class BuildMaster(service.MultiService):
         """
         return self._complete_buildset_subs.subscribe(callback)
 
+    def subscribeToBuildsetCompletion(self, bsid, callback):
+        """
+        Request that C{callback(bsid, result)} be called when the buildset
+        with ID C{bsid} is complete.  Unlike
+        L{subscribeToBuildsetCompletions}, this costs nothing when other
+        buildsets complete.  The subscription is not removed automatically.
+
+        Note: this method will go away in 0.9.x
+        """
+        return self._complete_buildset_index.subscribe(bsid, callback)
+
     ## database polling
 
     def pollDatabase(self):
@@ -826,6 +951,8 @@ class BuildMaster(service.MultiService):
         if self._last_processed_change is None:
             return
 
+        # the new changes are delivered as a single batch
+        changes = []
         while True:
             changeid = self._last_processed_change + 1
             wfd = defer.waitForDeferred(
@@ -838,11 +965,14 @@ class BuildMaster(service.MultiService):
             if not change:
                 break
 
-            self._change_subs.deliver(change)
+            changes.append(change)
 
             self._last_processed_change = changeid
             need_setState = True
 
+        if changes:
+            self._deliverChanges(changes)
+
         # write back the updated state, if it's changed
         if need_setState:
             wfd = defer.waitForDeferred(
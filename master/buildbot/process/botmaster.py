@@ -321,6 +321,20 @@ class BotMaster(service.MultiService):
         # be hashable and that they should compare properly.
         return self.locks[lockid]
 
+    def getLockStatus(self):
+        """Return a list of dictionaries describing the current state of
+        each real lock and its contention statistics (see
+        L{locks.BaseLock.getStatus}), with the slave to which it belongs, if
+        it is a SlaveLock."""
+        status = []
+        for reallock in self.locks.values():
+            for slavename, lock in reallock.getLocks():
+                lock_status = lock.getStatus()
+                lock_status['slavename'] = slavename
+                status.append(lock_status)
+        status.sort(key=lambda l : (l['name'], l['slavename']))
+        return status
+
     def triggerNewBuildCheck(self):
         # TODO: old name -- should go
         self.loop.trigger()
@@ -21,7 +21,7 @@ from twisted.python import log
 from twisted.python.failure import Failure
 from twisted.internet import reactor, defer, error
 
-from buildbot import interfaces, locks
+from buildbot import interfaces, locks, util
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, EXCEPTION, \
   RETRY, SKIPPED, worst_status
 from buildbot.status.builder import Results
@@ -59,6 +59,8 @@ class Build:
     finished = False
     results = None
     stopped = False
+    lockWaitTime = 0
+    _lockWaitStarted = None
 
     def __init__(self, requests):
         self.requests = requests
@@ -118,6 +120,13 @@ class Build:
     def __repr__(self):
         return "<Build %s>" % (self.builder.name,)
 
+    def describeLockOwner(self):
+        """Describe this build as the owner of a lock, for the lock's
+        status."""
+        if self.build_status is None:
+            return self.builder.name
+        return "%s #%d" % (self.builder.name, self.build_status.getNumber())
+
     def blamelist(self):
         blamelist = []
         for c in self.allChanges():
@@ -251,22 +260,43 @@ class Build:
         return d
 
     def acquireLocks(self, res=None):
+        # if we were woken by the lock we were waiting for, it has already
+        # been claimed for us
+        granted = None
+        if self._acquiringLock and res is self._acquiringLock[0]:
+            granted = self._acquiringLock[:2]
         self._acquiringLock = None
         if not self.locks:
             return defer.succeed(None)
         if self.stopped:
+            if granted:
+                granted[0].release(self, granted[1])
             return defer.succeed(None)
         log.msg("acquireLocks(build %s, locks %s)" % (self, self.locks))
         for lock, access in self.locks:
+            if (lock, access) == granted:
+                continue
             if not lock.isAvailable(access):
+                # don't hold one lock while waiting for another, to avoid
+                # deadlocks
+                if granted:
+                    granted[0].release(self, granted[1])
+                if self._lockWaitStarted is None:
+                    self._lockWaitStarted = util.now()
                 log.msg("Build %s waiting for lock %s" % (self, lock))
-                d = lock.waitUntilMaybeAvailable(self, access)
+                d = lock.waitUntilAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
                 return d
         # all locks are available, claim them all
         for lock, access in self.locks:
-            lock.claim(self, access)
+            if (lock, access) != granted:
+                lock.claim(self, access)
+        if self._lockWaitStarted is not None:
+            self.lockWaitTime = util.now() - self._lockWaitStarted
+            self._lockWaitStarted = None
+            log.msg("Build %s waited %.1f seconds for locks"
+                    % (self, self.lockWaitTime))
         return defer.succeed(None)
 
     def _startBuild_2(self, res):
@@ -73,6 +73,11 @@ class Builder(pb.Referenceable, service.MultiService):
 
     expectations = None # this is created the first time we get a good build
 
+    # the number of unclaimed build requests fetched at a time when starting
+    # builds; requests beyond these are neither started nor merged until the
+    # ones before them have been claimed
+    unclaimedRequestsWindow = 100
+
     def __init__(self, setup, builder_status):
         """
         @type  setup: dict
@@ -577,6 +582,10 @@ class Builder(pb.Referenceable, service.MultiService):
 
                 return d
 
+            # the slave is ours, so let it start fetching sources while the
+            # build gets going
+            self._startPrefetch(build, sb)
+
             def _ping(ign):
                 # ping the slave to make sure they're still there. If they've
                 # fallen off the map (due to a NAT timeout or something), this
@@ -596,6 +605,27 @@ class Builder(pb.Referenceable, service.MultiService):
         d.addCallback(_prepared)
         return d
 
+    # slaves older than this do not implement remote_prefetch
+    PREFETCH_MIN_VERSION = "2.14"
+
+    def _startPrefetch(self, build, sb):
+        """Ask the slave to start updating the repository mirrors that the
+        build's source steps will use, so that fetching overlaps with pinging
+        the slave, waiting for locks, and any earlier steps.  This is
+        fire-and-forget: failures are logged, and the source steps fetch
+        anything that was missed."""
+        getPrefetchArgs = getattr(self.buildFactory, 'getPrefetchArgs', None)
+        if not sb.remote or not getPrefetchArgs:
+            return
+        for command, cmdargs in getPrefetchArgs(build.getSourceStamp()):
+            version = sb.getSlaveCommandVersion(command)
+            if (not version or map(int, version.split(".")) <
+                    map(int, self.PREFETCH_MIN_VERSION.split("."))):
+                continue
+            log.msg("asking slave %s to prefetch for %s" % (sb, build))
+            d = sb.remote.callRemote("prefetch", command, cmdargs)
+            d.addErrback(log.err, "while prefetching for %s" % build)
+
     def _startBuild_1(self, res, build, sb):
         if not res:
             return self._startBuildFailed("slave ping failed", build, sb)
@@ -711,15 +741,16 @@ class Builder(pb.Referenceable, service.MultiService):
             self.updateBigStatus()
             return
 
-        # now, get the available build requests
+        # now, get the available build requests, in order.  Only the first
+        # unclaimedRequestsWindow of them are fetched at a time, unless
+        # nextBuild needs to see all of them.
+        limit = self.unclaimedRequestsWindow
+        if self.nextBuild:
+            limit = None
         wfd = defer.waitForDeferred(
-                self.master.db.buildrequests.getBuildRequests(
-                        buildername=self.name, claimed=False))
+                self._getUnclaimedRequests(limit))
         yield wfd
-        unclaimed_requests = wfd.getResult()
-
-        # sort by submitted_at, so the first is the oldest
-        unclaimed_requests.sort(key=lambda brd : brd['submitted_at'])
+        unclaimed_requests, more_requests = wfd.getResult()
 
         # get the mergeRequests function for later
         mergeRequests_fn = self._getMergeRequestsFn()
@@ -775,10 +806,9 @@ class Builder(pb.Referenceable, service.MultiService):
                 # trying to match them
                 self._breakBrdictRefloops(unclaimed_requests)
                 wfd = defer.waitForDeferred(
-                        self.master.db.buildrequests.getBuildRequests(
-                                buildername=self.name, claimed=False))
+                        self._getUnclaimedRequests(limit))
                 yield wfd
-                unclaimed_requests = wfd.getResult()
+                unclaimed_requests, more_requests = wfd.getResult()
 
                 # go around the loop again
                 continue
@@ -799,6 +829,14 @@ class Builder(pb.Referenceable, service.MultiService):
                 unclaimed_requests.remove(breq)
             available_slavebuilders.remove(slavebuilder)
 
+            # if the window is used up, fetch the next one
+            if not unclaimed_requests and more_requests \
+                    and available_slavebuilders:
+                wfd = defer.waitForDeferred(
+                        self._getUnclaimedRequests(limit))
+                yield wfd
+                unclaimed_requests, more_requests = wfd.getResult()
+
         self._breakBrdictRefloops(unclaimed_requests)
         self.updateBigStatus()
         return
@@ -806,6 +844,23 @@ class Builder(pb.Referenceable, service.MultiService):
     # a few utility functions to make the maybeStartBuild a bit shorter and
     # easier to read
 
+    def _getUnclaimedRequests(self, limit):
+        """
+        Get up to C{limit} (or all, if None) of this builder's unclaimed build
+        requests, highest priority first, aged according to
+        C{priorityAgingInterval}.
+
+        @returns: (requests, more) via Deferred, where C{more} is true if
+        there may be further requests
+        """
+        d = self.master.db.buildrequests.getUnclaimedBuildRequests(
+                self.name, limit=limit,
+                agingInterval=self.master.priorityAgingInterval)
+        def check_more(brdicts):
+            return (brdicts, limit is not None and len(brdicts) >= limit)
+        d.addCallback(check_more)
+        return d
+
     def _chooseSlave(self, available_slavebuilders):
         """
         Choose the next slave, using the C{nextSlave} configuration if
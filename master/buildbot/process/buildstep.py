@@ -24,7 +24,7 @@ from twisted.python import log
 from twisted.python.failure import Failure
 from twisted.web.util import formatFailure
 
-from buildbot import interfaces, locks
+from buildbot import interfaces, locks, util
 from buildbot.status import progress
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
      EXCEPTION, RETRY, worst_status
@@ -58,9 +58,14 @@ class RemoteCommand(pb.Referenceable):
                            RemoteCommand executed across all slaves
     @type  active:         boolean
     @ivar  active:         whether the command is currently running
+    @type  updateCredit:   int
+    @cvar  updateCredit:   number of bytes of log data a slave may send
+                           without waiting for an acknowledgement
     """
     commandCounter = [0] # we use a list as a poor man's singleton
     active = False
+    updateCredit = 1024*1024
+    minUpdateCredit = 16*1024
 
     def __init__(self, remote_command, args):
         """
@@ -166,9 +171,11 @@ class RemoteCommand(pb.Referenceable):
 
         @type  updates: list of [object, int]
         @param updates: list of updates from the remote command
+
+        @returns: the number of bytes of update credit the slave may use.
+        Older slaves ignore this value.
         """
         self.buildslave.messageReceivedFromSlave()
-        max_updatenum = 0
         for (update, num) in updates:
             #log.msg("update[%d]:" % num)
             try:
@@ -179,9 +186,13 @@ class RemoteCommand(pb.Referenceable):
                 self._finished(Failure())
                 # TODO: what if multiple updates arrive? should
                 # skip the rest but ack them all
-            if num > max_updatenum:
-                max_updatenum = num
-        return max_updatenum
+        return self.getUpdateCredit()
+
+    def getUpdateCredit(self):
+        """Return the number of bytes of unacknowledged log data the slave
+        may have in flight.  Subclasses can reduce this when they are falling
+        behind on writing that data."""
+        return self.updateCredit
 
     def remoteUpdate(self, update):
         raise NotImplementedError("You must implement this in a subclass")
@@ -376,6 +387,16 @@ class LoggedRemoteCommand(RemoteCommand):
                     self.updates[k] = []
                 self.updates[k].append(update[k])
 
+    def getUpdateCredit(self):
+        # reduce the credit by the amount of data the logs have not yet
+        # written to disk
+        pending = 0
+        for loog in self.logs.values():
+            # not all ILogFile implementations buffer
+            if hasattr(loog, 'getPendingLength'):
+                pending += loog.getPendingLength()
+        return max(self.minUpdateCredit, self.updateCredit - pending)
+
     def remoteComplete(self, maybeFailure):
         for name,loog in self.logs.items():
             if self._closeWhenFinished[name]:
@@ -464,7 +485,8 @@ class RemoteShellCommand(LoggedRemoteCommand):
     def __init__(self, workdir, command, env=None,
                  want_stdout=1, want_stderr=1,
                  timeout=20*60, maxTime=None, logfiles={},
-                 usePTY="slave-config", logEnviron=True):
+                 usePTY="slave-config", logEnviron=True,
+                 bufferSize=None, bufferTimeout=None):
         """
         @type  workdir: string
         @param workdir: directory where the command ought to run,
@@ -510,6 +532,16 @@ class RemoteShellCommand(LoggedRemoteCommand):
         @param maxTime: tell the remote that if the command fails to complete
                         in this number of seconds, the command should be
                         killed.  Use None to disable maxTime.
+
+        @type  bufferSize: int or (int, int)
+        @param bufferSize: bytes of output the slave should collect before
+                           sending it; a (min, max) tuple lets the slave
+                           adapt to the output rate.  None uses the slave's
+                           default.
+
+        @type  bufferTimeout: number or (number, number)
+        @param bufferTimeout: the longest the slave should hold output before
+                              sending it, in the same form as bufferSize.
         """
 
         self.command = command # stash .command, set it later
@@ -528,6 +560,12 @@ class RemoteShellCommand(LoggedRemoteCommand):
                 'usePTY': usePTY,
                 'logEnviron': logEnviron,
                 }
+        # only send the buffering parameters when they are set; otherwise the
+        # slave uses its own defaults
+        if bufferSize is not None:
+            args['bufferSize'] = bufferSize
+        if bufferTimeout is not None:
+            args['bufferTimeout'] = bufferTimeout
         LoggedRemoteCommand.__init__(self, "shell", args)
 
     def start(self):
@@ -621,6 +659,9 @@ class BuildStep:
     progress = None
     # doStepIf can be False, True, or a function that returns False or True
     doStepIf = True
+    # seconds spent waiting for locks, once they have been acquired
+    lockWaitTime = 0
+    _lockWaitStarted = None
 
     def __init__(self, **kwargs):
         self.factory = (self.__class__, dict(kwargs))
@@ -640,6 +681,11 @@ class BuildStep:
     def describe(self, done=False):
         return [self.name]
 
+    def describeLockOwner(self):
+        """Describe this step as the owner of a lock, for the lock's
+        status."""
+        return "%s step %s" % (self.build.describeLockOwner(), self.name)
+
     def setBuild(self, build):
         # subclasses which wish to base their behavior upon qualities of the
         # Build (e.g. use the list of changed files to run unit tests only on
@@ -743,26 +789,55 @@ class BuildStep:
         return self.deferred
 
     def acquireLocks(self, res=None):
+        # if we were woken by the lock we were waiting for, it has already
+        # been claimed for us
+        granted = None
+        if self._acquiringLock and res is self._acquiringLock[0]:
+            granted = self._acquiringLock[:2]
         self._acquiringLock = None
         if not self.locks:
             return defer.succeed(None)
         if self.stopped:
+            if granted:
+                granted[0].release(self, granted[1])
             return defer.succeed(None)
         log.msg("acquireLocks(step %s, locks %s)" % (self, self.locks))
         for lock, access in self.locks:
+            if (lock, access) == granted:
+                continue
             if not lock.isAvailable(access):
+                # don't hold one lock while waiting for another, to avoid
+                # deadlocks
+                if granted:
+                    granted[0].release(self, granted[1])
+                if self._lockWaitStarted is None:
+                    self._lockWaitStarted = util.now()
                 self.step_status.setWaitingForLocks(True)
                 log.msg("step %s waiting for lock %s" % (self, lock))
-                d = lock.waitUntilMaybeAvailable(self, access)
+                d = lock.waitUntilAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
                 return d
         # all locks are available, claim them all
         for lock, access in self.locks:
-            lock.claim(self, access)
+            if (lock, access) != granted:
+                lock.claim(self, access)
         self.step_status.setWaitingForLocks(False)
+        if self._lockWaitStarted is not None:
+            self.lockWaited(util.now() - self._lockWaitStarted)
+            self._lockWaitStarted = None
         return defer.succeed(None)
 
+    def lockWaited(self, seconds):
+        """Called once this step has acquired its locks, if it had to wait
+        for them, with the number of seconds that it waited.  This is an
+        instrumentation hook; by default, the time is logged, kept in
+        C{lockWaitTime}, and recorded as the step's C{lock_wait_time}
+        statistic."""
+        self.lockWaitTime = seconds
+        self.step_status.setStatistic('lock_wait_time', seconds)
+        log.msg("step %s waited %.1f seconds for locks" % (self, seconds))
+
     def _startStep_2(self, res):
         if self.stopped:
             self.finished(EXCEPTION)
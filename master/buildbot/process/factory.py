@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 
+from twisted.python import log, failure
 from buildbot import util
 from buildbot.process.build import Build
 from buildbot.process.buildstep import BuildStep
@@ -52,13 +53,40 @@ class BuildFactory(util.ComparableMixin):
     def __init__(self, steps=None):
         if steps is None:
             steps = []
+        # steps that can tell the slave to start fetching sources before the
+        # build starts; see getPrefetchArgs
+        self.prefetchSteps = []
         self.steps = [self._makeStepFactory(s) for s in steps]
 
     def _makeStepFactory(self, step_or_factory):
         if isinstance(step_or_factory, BuildStep):
+            self._addPrefetchStep(step_or_factory)
             return step_or_factory.getStepFactory()
         return step_or_factory
 
+    def _addPrefetchStep(self, step):
+        if getattr(step, 'getPrefetchArgs', None):
+            self.prefetchSteps.append(step)
+
+    def getPrefetchArgs(self, sourcestamp):
+        """Return a list of (command, args) tuples describing how the slave
+        can start fetching the sources that a build of SOURCESTAMP will need,
+        before the build starts.  These come from the C{getPrefetchArgs}
+        methods of the steps (such as L{buildbot.steps.source.Source} steps)
+        that were added to this factory as instances; steps are not created
+        just to ask them.  Errors are logged and ignored."""
+        prefetches = []
+        for step in self.prefetchSteps:
+            try:
+                prefetch = step.getPrefetchArgs(sourcestamp)
+            except:
+                log.err(failure.Failure(),
+                        "while computing prefetch for %s" % (step,))
+                continue
+            if prefetch:
+                prefetches.append(prefetch)
+        return prefetches
+
     def newBuild(self, request):
         """Create a new Build instance.
 
@@ -75,6 +103,7 @@ class BuildFactory(util.ComparableMixin):
         if isinstance(step_or_factory, BuildStep):
             if kwargs:
                 raise ArgumentsInTheWrongPlace()
+            self._addPrefetchStep(step_or_factory)
             s = step_or_factory.getStepFactory()
         elif type(step_or_factory) == type(BuildStep) and \
                 issubclass(step_or_factory, BuildStep):
@@ -34,9 +34,9 @@ class BaseScheduler(service.MultiService, ComparableMixin):
     C{base.Scheduler.compare_attrs}.
     """
 
-    compare_attrs = ('name', 'builderNames', 'properties')
+    compare_attrs = ('name', 'builderNames', 'properties', 'priority')
 
-    def __init__(self, name, builderNames, properties):
+    def __init__(self, name, builderNames, properties, priority=0):
         """
         Initialize a Scheduler.
 
@@ -50,6 +50,11 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         scheduler
         @type properties: dictionary
 
+        @param priority: priority of the build requests this scheduler
+        submits; requests with higher priorities are built first.  Defaults
+        to 0.
+        @type priority: integer
+
         @param consumeChanges: true if this scheduler wishes to be informed
         about the addition of new changes.  Defaults to False.  This should
         be passed explicitly from subclasses to indicate their interest in
@@ -73,6 +78,9 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         self.properties.update(properties, "Scheduler")
         self.properties.setProperty("scheduler", name, "Scheduler")
 
+        self.priority = priority
+        "priority of the build requests in each buildset"
+
         self.schedulerid = None
         """ID of this scheduler; set just before the scheduler starts, and set
         to None after stopService is complete."""
@@ -156,12 +164,14 @@ class BaseScheduler(service.MultiService, ComparableMixin):
 
     ## change handling
 
-    def startConsumingChanges(self, fileIsImportant=None, change_filter=None):
+    def startConsumingChanges(self, fileIsImportant=None, change_filter=None,
+                              recordClassifications=False):
         """
         Subclasses should call this method from startService to register to
-        receive changes.  The BaseScheduler class will take care of filtering
-        the changes (using change_filter) and (if fileIsImportant is not None)
-        classifying them.  See L{gotChange}.  Returns a Deferred.
+        receive changes.  The master will take care of filtering the changes
+        (using change_filter) and (if fileIsImportant is not None) classifying
+        them, in batches for all schedulers at once.  See L{gotChanges} and
+        L{gotChange}.  Returns a Deferred.
 
         @param fileIsImportant: a callable provided by the user to distinguish
         important and unimportant changes
@@ -170,37 +180,37 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         @param change_filter: a filter to determine which changes are even
         considered by this scheduler, or C{None} to consider all changes
         @type change_filter: L{buildbot.changes.filter.ChangeFilter} instance
+
+        @param recordClassifications: if true, the classifications are
+        recorded for this scheduler (see C{db.schedulers.classifyChanges})
+        before L{gotChanges} is called.
+        @type recordClassifications: boolean
         """
         assert fileIsImportant is None or callable(fileIsImportant)
 
         # register for changes with master
         assert not self._change_subscription
-        def changeCallback(change):
+        def changesCallback(classified):
             # ignore changes delivered while we're not running
             if not self._change_subscription:
                 return
 
-            if change_filter and not change_filter.filter_change(change):
-                return
-            if fileIsImportant:
-                try:
-                    important = fileIsImportant(change)
-                except:
-                    log.err(failure.Failure(),
-                            'in fileIsImportant check for %s' % change)
-                    return
-            else:
-                important = True
-
             # use change_consumption_lock to ensure the service does not stop
-            # while this change is being processed
+            # while these changes are being processed
             d = self._change_consumption_lock.acquire()
-            d.addCallback(lambda _ : self.gotChange(change, important))
+            d.addCallback(lambda _ : self.gotChanges(classified))
             def release(x):
                 self._change_consumption_lock.release()
             d.addBoth(release)
-            d.addErrback(log.err, 'while processing change')
-        self._change_subscription = self.master.subscribeToChanges(changeCallback)
+            d.addErrback(log.err, 'while processing changes')
+        schedulerid = None
+        if recordClassifications:
+            schedulerid = self.schedulerid
+        self._change_subscription = \
+                self.master.subscribeToClassifiedChanges(changesCallback,
+                        change_filter=change_filter,
+                        fileIsImportant=fileIsImportant,
+                        schedulerid=schedulerid, name=self.name)
 
         return defer.succeed(None)
 
@@ -233,11 +243,33 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         """
         raise NotImplementedError
 
+    @defer.deferredGenerator
+    def gotChanges(self, changes):
+        """
+        Called when a batch of changes is received; returns a Deferred.  The
+        default implementation calls L{gotChange} for each change in turn;
+        subclasses can override this to handle the batch as a whole.  If the
+        C{recordClassifications} parameter to C{startConsumingChanges} was
+        true, the changes' classifications have already been recorded.
+
+        @param changes: the new changes, in order, with their importance
+        @type changes: list of (change, important) tuples
+        @returns: Deferred
+        """
+        for change, important in changes:
+            wfd = defer.waitForDeferred(
+                defer.maybeDeferred(self.gotChange, change, important))
+            yield wfd
+            try:
+                wfd.getResult()
+            except:
+                log.err(failure.Failure(), 'while processing %s' % change)
+
     ## starting bulids
 
     def addBuildsetForLatest(self, reason='', external_idstring=None,
                         branch=None, repository='', project='',
-                        builderNames=None, properties=None):
+                        builderNames=None, properties=None, priority=None):
         """
         Add a buildset for the 'latest' source in the given branch,
         repository, and project.  This will create a relative sourcestamp for
@@ -258,6 +290,8 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         @param properties: a properties object containing initial properties for
             the buildset
         @type properties: L{buildbot.process.properties.Properties}
+        @param priority: priority of the buildset's build requests (defaults
+            to C{self.priority})
         @returns: buildset ID via Deferred
         """
         d = self.master.db.sourcestamps.createSourceStamp(
@@ -266,11 +300,11 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         d.addCallback(self.addBuildsetForSourceStamp, reason=reason,
                                 external_idstring=external_idstring,
                                 builderNames=builderNames,
-                                properties=properties)
+                                properties=properties, priority=priority)
         return d
 
     def addBuildsetForChanges(self, reason='', external_idstring=None,
-            changeids=[], builderNames=None, properties=None):
+            changeids=[], builderNames=None, properties=None, priority=None):
         """
         Add a buildset for the combination of the given changesets, creating
         a sourcestamp based on those changes.  The sourcestamp for the buildset
@@ -289,6 +323,8 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         @param properties: a properties object containing initial properties for
             the buildset
         @type properties: L{buildbot.process.properties.Properties}
+        @param priority: priority of the buildset's build requests (defaults
+            to C{self.priority})
         @returns: buildset ID via Deferred
         """
         assert changeids is not []
@@ -307,11 +343,57 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         d.addCallback(self.addBuildsetForSourceStamp, reason=reason,
                                 external_idstring=external_idstring,
                                 builderNames=builderNames,
-                                properties=properties)
+                                properties=properties, priority=priority)
         return d
 
+    def addBuildsetsForChanges(self, reason='', changeids_list=[],
+            builderNames=None, properties=None, flushClassifications=False,
+            priority=None):
+        """
+        Add a buildset for each of several lists of changes, as for
+        L{addBuildsetForChanges}, but all in a single database transaction.
+
+        @param reason: reason for these buildsets
+        @type reason: unicode string
+        @param changeids_list: list of nonempty lists of changes
+        @param builderNames: builders to name in the buildsets (defaults to
+            C{self.builderNames})
+        @param properties: a properties object containing initial properties
+            for the buildsets
+        @type properties: L{buildbot.process.properties.Properties}
+        @param flushClassifications: if true, this scheduler's classifications
+            of all of the changes are flushed in the same transaction
+        @param priority: priority of the buildsets' build requests (defaults
+            to C{self.priority})
+        @returns: list of buildset IDs via Deferred
+        """
+        # combine properties
+        if properties:
+            properties.updateFromProperties(self.properties)
+        else:
+            properties = self.properties
+        properties_dict = properties.asDict()
+
+        # apply the default builderNames
+        if not builderNames:
+            builderNames = self.builderNames
+
+        if priority is None:
+            priority = self.priority
+
+        flushSchedulerid = None
+        if flushClassifications:
+            flushSchedulerid = self.schedulerid
+
+        return self.master.addBuildsetsForChanges([
+                dict(changeids=changeids, reason=reason,
+                     properties=properties_dict, builderNames=builderNames,
+                     priority=priority)
+                for changeids in changeids_list ],
+                flushSchedulerid=flushSchedulerid)
+
     def addBuildsetForSourceStamp(self, ssid, reason='', external_idstring=None,
-            properties=None, builderNames=None):
+            properties=None, builderNames=None, priority=None):
         """
         Add a buildset for the given, already-existing sourcestamp.
 
@@ -327,6 +409,8 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         @type properties: L{buildbot.process.properties.Properties}
         @param builderNames: builders to name in the buildset (defaults to
             C{self.builderNames})
+        @param priority: priority of the buildset's build requests (defaults
+            to C{self.priority})
         @returns: buildset ID via Deferred
         """
         # combine properties
@@ -339,6 +423,9 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         if not builderNames:
             builderNames = self.builderNames
 
+        if priority is None:
+            priority = self.priority
+
         # translate properties object into a dict as required by the
         # addBuildset method
         properties_dict = properties.asDict()
@@ -346,4 +433,5 @@ class BaseScheduler(service.MultiService, ComparableMixin):
         # add the buildset
         return self.master.addBuildset(
                 ssid=ssid, reason=reason, properties=properties_dict,
-                builderNames=builderNames, external_idstring=external_idstring)
+                builderNames=builderNames, external_idstring=external_idstring,
+                priority=priority)
@@ -16,7 +16,7 @@
 from twisted.internet import defer, reactor
 from twisted.python import log
 from buildbot import util
-from buildbot.util import collections, NotABranch
+from buildbot.util import NotABranch, timerwheel
 from buildbot.changes import filter
 from buildbot.schedulers import base, dependent
 
@@ -27,18 +27,23 @@ class BaseBasicScheduler(base.BaseScheduler):
 
     _reactor = reactor # for tests
 
+    # the granularity, in seconds, of the treeStableTimers; timers expiring
+    # within the same interval fire together
+    stableTimerResolution = 1
+
     class NotSet: pass
     def __init__(self, name, shouldntBeSet=NotSet, treeStableTimer=None,
                 builderNames=None, branch=NotABranch, branches=NotABranch,
                 fileIsImportant=None, properties={}, categories=None,
-                change_filter=None):
+                change_filter=None, priority=0):
         assert shouldntBeSet is self.NotSet, \
                 "pass arguments to schedulers using keyword arguments"
         if fileIsImportant:
             assert callable(fileIsImportant)
 
         # initialize parent classes
-        base.BaseScheduler.__init__(self, name, builderNames, properties)
+        base.BaseScheduler.__init__(self, name, builderNames, properties,
+                                    priority=priority)
 
         self.treeStableTimer = treeStableTimer
         self.fileIsImportant = fileIsImportant
@@ -46,10 +51,15 @@ class BaseBasicScheduler(base.BaseScheduler):
                 branches=branches, change_filter=change_filter,
                 categories=categories)
 
-        # the IDelayedCall used to wake up when this scheduler's
-        # treeStableTimer expires.
-        self._stable_timers = collections.defaultdict(lambda : None)
+        # the treeStableTimers, by timer name (see getTimerNameForChange),
+        # created in startService
+        self._stable_timers = None
         self._stable_timers_lock = defer.DeferredLock()
+        # the highest changeid that gotChange or gotChanges has seen for each
+        # timer; the classifier records classifications before the changes
+        # are delivered, so a timer that fires in between must not build the
+        # changes it has not yet seen
+        self._stable_timer_changeids = {}
 
     def getChangeFilter(self, branch, branches, change_filter, categories):
         raise NotImplementedError
@@ -57,8 +67,18 @@ class BaseBasicScheduler(base.BaseScheduler):
     def startService(self, _returnDeferred=False):
         base.BaseScheduler.startService(self)
 
+        def timersExpired(timer_names):
+            d = self.stableTimersFired(timer_names)
+            d.addErrback(log.err, "while firing treeStableTimers")
+        self._stable_timers = timerwheel.TimerWheel(timersExpired,
+                resolution=self.stableTimerResolution, _reactor=self._reactor)
+
+        # with a treeStableTimer, the master records the classifications of
+        # new changes for us (see gotChanges)
         d = self.startConsumingChanges(fileIsImportant=self.fileIsImportant,
-                                       change_filter=self.change_filter)
+                                       change_filter=self.change_filter,
+                                       recordClassifications=
+                                                bool(self.treeStableTimer))
 
         # if treeStableTimer is False, then we don't care about classified
         # changes, so get rid of any hanging around from previous
@@ -87,10 +107,9 @@ class BaseBasicScheduler(base.BaseScheduler):
         d.addCallback(lambda _ :
                 self._stable_timers_lock.acquire())
         def cancel_timers(_):
-            for timer in self._stable_timers.values():
-                if timer:
-                    timer.cancel()
-            self._stable_timers = {}
+            if self._stable_timers is not None:
+                self._stable_timers.cancelAll()
+            self._stable_timer_changeids = {}
             self._stable_timers_lock.release()
         d.addCallback(cancel_timers)
         return d
@@ -108,6 +127,7 @@ class BaseBasicScheduler(base.BaseScheduler):
                             changeids=[ change.number ])
 
         timer_name = self.getTimerNameForChange(change)
+        self._sawChange(timer_name, change)
 
         # if we have a treeStableTimer, then record the change's importance
         # and:
@@ -116,15 +136,49 @@ class BaseBasicScheduler(base.BaseScheduler):
         d = self.master.db.schedulers.classifyChanges(
                 self.schedulerid, { change.number : important })
         def fix_timer(_):
-            if not important and not self._stable_timers[timer_name]:
+            if not important and not self._stable_timers.isPending(timer_name):
                 return
-            if self._stable_timers[timer_name]:
-                self._stable_timers[timer_name].cancel()
-            self._stable_timers[timer_name] = self._reactor.callLater(
-                    self.treeStableTimer, self.stableTimerFired, timer_name)
+            self._stable_timers.reset(timer_name, self.treeStableTimer)
         d.addCallback(fix_timer)
         return d
 
+    @util.deferredLocked('_stable_timers_lock')
+    @defer.deferredGenerator
+    def gotChanges(self, changes):
+        if not self.treeStableTimer:
+            # build each important change right away, as in gotChange
+            for change, important in changes:
+                if not important:
+                    continue
+                wfd = defer.waitForDeferred(
+                    self.addBuildsetForChanges(reason='scheduler',
+                                changeids=[ change.number ]))
+                yield wfd
+                wfd.getResult()
+            return
+
+        # the importance of the changes has already been recorded (see
+        # startService), so just fix up the timers, once for each timer the
+        # batch touched
+        timers = {}
+        order = []
+        for change, important in changes:
+            timer_name = self.getTimerNameForChange(change)
+            self._sawChange(timer_name, change)
+            if timer_name not in timers:
+                order.append(timer_name)
+                timers[timer_name] = False
+            timers[timer_name] = timers[timer_name] or important
+        for timer_name in order:
+            if (not timers[timer_name]
+                    and not self._stable_timers.isPending(timer_name)):
+                continue
+            self._stable_timers.reset(timer_name, self.treeStableTimer)
+
+    def _sawChange(self, timer_name, change):
+        if change.number > self._stable_timer_changeids.get(timer_name, -1):
+            self._stable_timer_changeids[timer_name] = change.number
+
     @defer.deferredGenerator
     def scanExistingClassifiedChanges(self):
         # call gotChange for each classified change.  This is called at startup
@@ -162,37 +216,67 @@ class BaseBasicScheduler(base.BaseScheduler):
         name"""
         raise NotImplementedError # see subclasses
 
+    @defer.deferredGenerator
+    def getChangeClassificationsForTimers(self, schedulerid, timer_names):
+        """similar to getChangeClassificationsForTimer, but given a list of
+        timer names, and returning a dictionary mapping each timer name to
+        its classifications.  Subclasses can override this to fetch them
+        all at once."""
+        result = {}
+        for timer_name in timer_names:
+            wfd = defer.waitForDeferred(
+                    self.getChangeClassificationsForTimer(schedulerid,
+                                                          timer_name))
+            yield wfd
+            result[timer_name] = wfd.getResult()
+        yield result
+
+    def getPendingTimerCount(self):
+        """Return the number of treeStableTimers that are running."""
+        if self._stable_timers is None:
+            return 0
+        return len(self._stable_timers)
+
     @util.deferredLocked('_stable_timers_lock')
     @defer.deferredGenerator
-    def stableTimerFired(self, timer_name):
-        # if the service has already been stoppd then just bail out
-        if not self._stable_timers[timer_name]:
-            return
+    def stableTimersFired(self, timer_names):
+        # called with all of the timers that expired at once, which are
+        # handled with one query for their changes, and a single transaction
+        # to add their buildsets and flush those changes' classifications
 
-        # delete this now-fired timer
-        del self._stable_timers[timer_name]
+        # if the service has already been stopped then just bail out
+        if not self.running:
+            return
 
         wfd = defer.waitForDeferred(
-                self.getChangeClassificationsForTimer(self.schedulerid,
-                                                      timer_name))
+                self.getChangeClassificationsForTimers(self.schedulerid,
+                                                       timer_names))
         yield wfd
         classifications = wfd.getResult()
 
-        # just in case: databases do weird things sometimes!
-        if not classifications: # pragma: no cover
+        changeids_list = []
+        for timer_name in timer_names:
+            # (a timer restarted while we waited is no longer stable)
+            if self._stable_timers.isPending(timer_name):
+                continue
+            # only build the changes that have been delivered to us; any
+            # others will restart the timer when they arrive.  The timer is
+            # done with, so forget it, lest we keep every branch ever seen
+            seen = self._stable_timer_changeids.pop(timer_name, -1)
+            changeids = [ changeid
+                          for changeid in classifications.get(timer_name, {})
+                          if changeid <= seen ]
+            # just in case: databases do weird things sometimes!
+            if not changeids: # pragma: no cover
+                continue
+            changeids_list.append(sorted(changeids))
+        if not changeids_list:
             return
 
-        changeids = sorted(classifications.keys())
         wfd = defer.waitForDeferred(
-                self.addBuildsetForChanges(reason='scheduler',
-                                           changeids=changeids))
-        yield wfd
-        wfd.getResult()
-
-        max_changeid = changeids[-1] # (changeids are sorted)
-        wfd = defer.waitForDeferred(
-                self.master.db.schedulers.flushChangeClassifications(
-                            self.schedulerid, less_than=max_changeid+1))
+                self.addBuildsetsForChanges(reason='scheduler',
+                                            changeids_list=changeids_list,
+                                            flushClassifications=True))
         yield wfd
         wfd.getResult()
 
@@ -239,5 +323,10 @@ class AnyBranchScheduler(Scheduler):
         return self.master.db.schedulers.getChangeClassifications(
                 self.schedulerid, branch=branch)
 
+    def getChangeClassificationsForTimers(self, schedulerid, timer_names):
+        branches = timer_names # set in getTimerNameForChange
+        return self.master.db.schedulers.getChangeClassificationsForBranches(
+                self.schedulerid, branches)
+
 # now at buildbot.schedulers.dependent, but keep the old name alive
 Dependent = dependent.Dependent
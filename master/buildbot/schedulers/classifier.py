@@ -0,0 +1,293 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Filtering and classification of new changes for all schedulers at once.
+"""
+
+from twisted.python import failure, log
+from twisted.internet import defer, reactor, task
+
+class ChangeConsumer(object):
+    """A subscription to classified changes; see
+    L{ChangeClassifier.subscribe}."""
+
+    def __init__(self, classifier, callback, change_filter, fileIsImportant,
+                 schedulerid, name):
+        self.classifier = classifier
+        self.callback = callback
+        self.change_filter = change_filter
+        self.fileIsImportant = fileIsImportant
+        self.schedulerid = schedulerid
+        self.name = name
+
+        # routing counts: the changes for which this consumer was a
+        # candidate, and the changes that passed its filter
+        self.candidates = 0
+        self.matched = 0
+
+    def unsubscribe(self):
+        self.classifier._unsubscribe(self)
+
+class ChangeClassifier(object):
+    """
+    I filter and classify new changes on behalf of all of the schedulers
+    that consume them.
+
+    Changes are buffered for C{batchDelay} seconds, so that a burst of
+    changes is handled as a single batch.  Each batch is filtered for all
+    consumers in one pass, reusing the result of each change filter for
+    changes that it cannot tell apart (see
+    L{buildbot.changes.filter.ChangeFilter.getChangeKey}), and returning to
+    the reactor every C{chunkSize} classifications.
+
+    Consumers whose filters require an exact match on some attribute of the
+    change (see L{buildbot.changes.filter.ChangeFilter.getIndexableCheck})
+    are indexed by the values they accept, so that each change is only
+    checked against the consumers that it may pass, plus those whose
+    filters use nothing but regular expressions and functions.  The numbers
+    of changes and filter checks are available from L{getStatus}.  The classifications of
+    all consumers that record them are then written in a single transaction,
+    and finally each consumer's callback is invoked with its share of the
+    batch.
+    """
+
+    batchDelay = 0.1
+    chunkSize = 500
+
+    _reactor = reactor # for tests
+
+    def __init__(self, master):
+        self.master = master
+        self.consumers = []
+        self._subscription = None
+        self._buffer = []
+        self._timer = None
+        self._index = None
+
+        # routing counts
+        self.changesRouted = 0
+        self.indexedCandidates = 0
+        self.unindexedCandidates = 0
+        self.filterChecks = 0
+        self.filterCacheHits = 0
+
+    def subscribe(self, callback, change_filter=None, fileIsImportant=None,
+                  schedulerid=None, name=None):
+        """
+        Request that C{callback} be called with lists of (change, important)
+        tuples for new changes that pass C{change_filter}, classified with
+        C{fileIsImportant} (or as important, if that is None).  If
+        C{schedulerid} is given, the classifications are recorded for that
+        scheduler (see C{db.schedulers.classifyChanges}) before the callback
+        is invoked.  C{name} identifies the consumer in L{getStatus}.
+
+        @returns: an object with an C{unsubscribe} method
+        """
+        consumer = ChangeConsumer(self, callback, change_filter,
+                                  fileIsImportant, schedulerid, name)
+        self.consumers.append(consumer)
+        self._index = None
+        if not self._subscription:
+            self._subscription = \
+                    self.master.subscribeToChangeBatches(self.changesAdded)
+        # changes left over from consumers that have unsubscribed (such as
+        # the scheduler this one replaces, at reconfig) are handed on
+        if self._buffer and not self._timer:
+            self._timer = self._reactor.callLater(self.batchDelay,
+                                                  self._timerFired)
+        return consumer
+
+    def _unsubscribe(self, consumer):
+        # any buffered changes are kept for the remaining consumers, or for
+        # the next one to subscribe
+        if consumer in self.consumers:
+            self.consumers.remove(consumer)
+            self._index = None
+        if not self.consumers:
+            if self._subscription:
+                self._subscription.unsubscribe()
+                self._subscription = None
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def changesAdded(self, changes):
+        """Called with each batch of new changes.  If C{batchDelay} is zero,
+        the batch is processed immediately, and a Deferred is returned that
+        fires when it has been."""
+        self._buffer.extend(changes)
+        if not self.batchDelay:
+            return self._processBuffer()
+        if not self._timer:
+            self._timer = self._reactor.callLater(self.batchDelay,
+                                                  self._timerFired)
+
+    def _timerFired(self):
+        self._timer = None
+        d = self._processBuffer()
+        d.addErrback(log.err, 'while classifying changes')
+
+    def _getIndex(self):
+        # return (consumers, indexes, unindexed), where indexes maps each
+        # indexed attribute to a dictionary mapping values to the positions of
+        # the consumers that accept them, and unindexed lists the positions of
+        # the consumers that must be checked for every change
+        if self._index is None:
+            consumers = self.consumers[:]
+            indexes = {}
+            unindexed = []
+            for i in range(len(consumers)):
+                # filters without getIndexableCheck are not indexed
+                check = None
+                getIndexableCheck = getattr(consumers[i].change_filter,
+                                            'getIndexableCheck', None)
+                if getIndexableCheck:
+                    check = getIndexableCheck()
+                if check is None:
+                    unindexed.append(i)
+                    continue
+                attr, values = check
+                index = indexes.setdefault(attr, {})
+                for value in values:
+                    index.setdefault(value, []).append(i)
+            self._index = (consumers, indexes.items(), unindexed)
+        return self._index
+
+    def _getCandidates(self, change, indexes, unindexed):
+        # return the positions of the consumers that this change may pass, in
+        # order
+        candidates = []
+        for attr, index in indexes:
+            try:
+                candidates.extend(index.get(getattr(change, attr, ''), ()))
+            except TypeError: # unhashable value
+                continue
+        self.indexedCandidates += len(candidates)
+        self.unindexedCandidates += len(unindexed)
+        candidates.extend(unindexed)
+        candidates.sort()
+        return candidates
+
+    def getStatus(self):
+        """Return a dictionary of routing counts: the numbers of changes
+        routed, of candidate consumers found for them through the indexes
+        and otherwise, of filter checks made and of results reused, and for
+        each consumer, the attribute it is indexed by and the numbers of
+        changes for which it was a candidate and which passed its filter."""
+        consumers, indexes, unindexed = self._getIndex()
+        indexed_by = {}
+        for attr, index in indexes:
+            for positions in index.values():
+                for i in positions:
+                    indexed_by[i] = attr
+        return {
+            'changes_routed' : self.changesRouted,
+            'indexed_candidates' : self.indexedCandidates,
+            'unindexed_candidates' : self.unindexedCandidates,
+            'filter_checks' : self.filterChecks,
+            'filter_cache_hits' : self.filterCacheHits,
+            'consumers' : [
+                dict(name=consumers[i].name,
+                     indexed_by=indexed_by.get(i),
+                     candidates=consumers[i].candidates,
+                     matched=consumers[i].matched)
+                for i in range(len(consumers)) ],
+        }
+
+    @defer.deferredGenerator
+    def _processBuffer(self):
+        consumers, indexes, unindexed = self._getIndex()
+        if not consumers:
+            return
+        changes, self._buffer = self._buffer, []
+        if not changes:
+            return
+
+        # results of each filter for each change key
+        filter_results = {}
+        classified = [ [] for consumer in consumers ]
+        count = 0
+        for change in changes:
+            self.changesRouted += 1
+            for i in self._getCandidates(change, indexes, unindexed):
+                consumer = consumers[i]
+                consumer.candidates += 1
+                change_filter = consumer.change_filter
+                if change_filter:
+                    # change_filter need only have a filter_change method
+                    key = None
+                    getChangeKey = getattr(change_filter, 'getChangeKey', None)
+                    if getChangeKey:
+                        key = getChangeKey(change)
+                    if key is not None:
+                        key = (id(change_filter), key)
+                    if key is not None and key in filter_results:
+                        self.filterCacheHits += 1
+                        passed = filter_results[key]
+                    else:
+                        self.filterChecks += 1
+                        # a broken filter only affects its own consumer
+                        try:
+                            passed = change_filter.filter_change(change)
+                        except:
+                            log.err(failure.Failure(),
+                                    'in change filter for %s' % change)
+                            continue
+                        if key is not None:
+                            filter_results[key] = passed
+                    if not passed:
+                        continue
+                consumer.matched += 1
+
+                if consumer.fileIsImportant:
+                    try:
+                        important = consumer.fileIsImportant(change)
+                    except:
+                        log.err(failure.Failure(),
+                                'in fileIsImportant check for %s' % change)
+                        continue
+                else:
+                    important = True
+                classified[i].append((change, important))
+
+                # give the reactor a chance to run during large batches
+                count += 1
+                if count % self.chunkSize == 0:
+                    wfd = defer.waitForDeferred(
+                        task.deferLater(self._reactor, 0, lambda : None))
+                    yield wfd
+                    wfd.getResult()
+
+        # record the classifications for all schedulers at once
+        to_record = {}
+        for consumer, consumer_classified in zip(consumers, classified):
+            if consumer.schedulerid is not None and consumer_classified:
+                to_record.setdefault(consumer.schedulerid, {}).update(
+                    dict([ (change.number, important)
+                           for change, important in consumer_classified ]))
+        if to_record:
+            wfd = defer.waitForDeferred(
+                self.master.db.schedulers.classifyChangesForSchedulers(
+                                                                to_record))
+            yield wfd
+            wfd.getResult()
+
+        for consumer, consumer_classified in zip(consumers, classified):
+            # (skipping any consumers that unsubscribed in the meantime)
+            if not consumer_classified or consumer not in self.consumers:
+                continue
+            d = defer.maybeDeferred(consumer.callback, consumer_classified)
+            d.addErrback(log.err, 'while processing changes')
@@ -20,81 +20,131 @@ from buildbot.status.builder import SUCCESS, WARNINGS
 from buildbot.schedulers import base
 
 class Dependent(base.BaseScheduler):
+    """
+    I add a buildset for the sourcestamp of each buildset submitted by my
+    upstream scheduler that completes with SUCCESS or WARNINGS.
+
+    My subscriptions to upstream buildsets are recorded in the database, so
+    that they survive a restart, and also kept in memory, where each one is
+    subscribed to the completion of its buildset alone (see
+    L{buildbot.master.BuildMaster.subscribeToBuildsetCompletion}).  The
+    completion of any other buildset costs me nothing.
+    """
 
     compare_attrs = base.BaseScheduler.compare_attrs + ('upstream_name',)
 
-    def __init__(self, name, upstream, builderNames, properties={}):
-        base.BaseScheduler.__init__(self, name, builderNames, properties)
+    def __init__(self, name, upstream, builderNames, properties={},
+                 priority=0):
+        base.BaseScheduler.__init__(self, name, builderNames, properties,
+                                    priority=priority)
         assert base.isScheduler(upstream), \
                 "upstream must be another Scheduler instance"
         self.upstream_name = upstream.name
         self._buildset_addition_subscr = None
-        self._buildset_completion_subscr = None
+
+        # bsid -> (ssid, completion subscription) for each upstream buildset
+        # that we are waiting for
+        self._upstream_buildsets = {}
 
         # the subscription lock makes sure that we're done inserting a
-        # subcription into the DB before registering that the buildset is
-        # complete.
+        # subcription into the DB before acting on the completion of its
+        # buildset.
         self._subscription_lock = defer.DeferredLock()
 
     def startService(self):
         self._buildset_addition_subscr = \
                 self.master.subscribeToBuildsets(self._buildsetAdded)
-        self._buildset_completion_subscr = \
-                self.master.subscribeToBuildsetCompletions(self._buildsetCompleted)
-        # check for any buildsets completed before we started
-        d = self._checkCompletedBuildsets(None, None)
-        d.addErrback(log.err, 'while checking for completed buildsets in start')
+
+        # load the subscriptions from the database, acting on any buildsets
+        # completed before we started; completions that occur while this is
+        # in progress are noted, so that they are not missed
+        completed = {}
+        def noteCompletion(bsid, result):
+            completed[bsid] = result
+        startup_subscr = \
+                self.master.subscribeToBuildsetCompletions(noteCompletion)
+        d = self._loadSubscriptions(completed)
+        def unsubscribe(x):
+            startup_subscr.unsubscribe()
+            return x
+        d.addBoth(unsubscribe)
+        d.addErrback(log.err, 'while loading buildset subscriptions in start')
 
     def stopService(self):
         if self._buildset_addition_subscr:
             self._buildset_addition_subscr.unsubscribe()
-        if self._buildset_completion_subscr:
-            self._buildset_completion_subscr.unsubscribe()
+            self._buildset_addition_subscr = None
+        for ssid, subscr in self._upstream_buildsets.values():
+            subscr.unsubscribe()
+        self._upstream_buildsets = {}
         return defer.succeed(None)
 
-    @util.deferredLocked('_subscription_lock')
-    def _buildsetAdded(self, bsid=None, properties=None, **kwargs):
+    def _buildsetAdded(self, bsid=None, ssid=None, properties=None, **kwargs):
         # check if this was submitetted by our upstream by checking the
         # scheduler property
         submitter = properties.getProperty('scheduler', None)
         if submitter != self.upstream_name:
             return
 
-        # record our interest in this buildset, both locally and in the
-        # database
-        d = self.master.db.buildsets.subscribeToBuildset(
-                                        self.schedulerid, bsid)
+        # record our interest in this buildset, both locally (immediately, so
+        # that its completion is not missed) and in the database
+        self._watchBuildset(bsid, ssid)
+        d = self._subscription_lock.run(
+                self.master.db.buildsets.subscribeToBuildset,
+                self.schedulerid, bsid)
         d.addErrback(log.err, 'while subscribing to buildset %d' % bsid)
 
+    def _watchBuildset(self, bsid, ssid):
+        subscr = self.master.subscribeToBuildsetCompletion(bsid,
+                                                self._buildsetCompleted)
+        self._upstream_buildsets[bsid] = (ssid, subscr)
+
     def _buildsetCompleted(self, bsid, result):
-        d = self._checkCompletedBuildsets(bsid, result)
-        d.addErrback(log.err, 'while checking for completed buildsets')
+        if bsid not in self._upstream_buildsets:
+            return
+        ssid, subscr = self._upstream_buildsets.pop(bsid)
+        subscr.unsubscribe()
+        d = self._subscription_lock.run(self._upstreamBuildsetCompleted,
+                                        bsid, ssid, result)
+        d.addErrback(log.err,
+                'while handling completion of buildset %d' % bsid)
 
     @util.deferredLocked('_subscription_lock')
     @defer.deferredGenerator
-    def _checkCompletedBuildsets(self, bsid, result):
+    def _loadSubscriptions(self, completed):
         wfd = defer.waitForDeferred(
             self.master.db.buildsets.getSubscribedBuildsets(self.schedulerid))
         yield wfd
         subs = wfd.getResult()
 
         for (sub_bsid, sub_ssid, sub_complete, sub_results) in subs:
-            # skip incomplete builds, handling the case where the 'complete'
-            # column has not been updated yet
-            if not sub_complete and sub_bsid != bsid:
+            if sub_bsid in self._upstream_buildsets:
+                continue
+            if not sub_complete and sub_bsid in completed:
+                sub_complete, sub_results = True, completed[sub_bsid]
+            if not sub_complete:
+                self._watchBuildset(sub_bsid, sub_ssid)
                 continue
 
-            # build a dependent build if the status is appropriate
-            if sub_results in (SUCCESS, WARNINGS):
-                wfd = defer.waitForDeferred(
-                    self.addBuildsetForSourceStamp(ssid=sub_ssid,
-                                               reason='downstream'))
-                yield wfd
-                wfd.getResult()
+            wfd = defer.waitForDeferred(
+                self._upstreamBuildsetCompleted(sub_bsid, sub_ssid,
+                                                sub_results))
+            yield wfd
+            wfd.getResult()
 
-            # and regardless of status, remove the subscription
+    @defer.deferredGenerator
+    def _upstreamBuildsetCompleted(self, bsid, ssid, result):
+        # build a dependent build if the status is appropriate
+        if result in (SUCCESS, WARNINGS):
             wfd = defer.waitForDeferred(
-                self.master.db.buildsets.unsubscribeFromBuildset(
-                                          self.schedulerid, sub_bsid))
+                self.addBuildsetForSourceStamp(ssid=ssid,
+                                               reason='downstream'))
             yield wfd
             wfd.getResult()
+
+        # and regardless of status, remove the subscription
+        wfd = defer.waitForDeferred(
+            self.master.db.buildsets.unsubscribeFromBuildset(
+                                      self.schedulerid, bsid))
+        yield wfd
+        wfd.getResult()
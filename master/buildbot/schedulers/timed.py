@@ -14,6 +14,8 @@
 # Copyright Buildbot Team Members
 
 import time
+import datetime
+import calendar
 from buildbot import util
 from buildbot.schedulers import base
 from twisted.internet import defer, reactor
@@ -29,8 +31,9 @@ class Timed(base.BaseScheduler):
 
     compare_attrs = base.BaseScheduler.compare_attrs
 
-    def __init__(self, name, builderNames, properties={}):
-        base.BaseScheduler.__init__(self, name, builderNames, properties)
+    def __init__(self, name, builderNames, properties={}, priority=0):
+        base.BaseScheduler.__init__(self, name, builderNames, properties,
+                                    priority=priority)
 
         # tracking for when to start the next build
         self.lastActuated = None
@@ -150,8 +153,9 @@ class Timed(base.BaseScheduler):
         # set up the new timer
         def set_timer(actuateAt):
             now = self.now()
-            self.actuateAt = max(actuateAt, now)
+            self.actuateAt = None
             if actuateAt is not None:
+                self.actuateAt = max(actuateAt, now)
                 untilNext = self.actuateAt - now
                 if untilNext == 0:
                     log.msg(("%s: missed scheduled build time, so building "
@@ -207,9 +211,9 @@ class Periodic(Timed):
     compare_attrs = Timed.compare_attrs + ('periodicBuildTimer', 'branch',)
 
     def __init__(self, name, builderNames, periodicBuildTimer,
-            branch=None, properties={}):
+            branch=None, properties={}, priority=0):
         Timed.__init__(self, name=name, builderNames=builderNames,
-                    properties=properties)
+                    properties=properties, priority=priority)
         assert periodicBuildTimer > 0, "periodicBuildTimer must be positive"
         self.periodicBuildTimer = periodicBuildTimer
         self.branch = branch
@@ -224,18 +228,51 @@ class Periodic(Timed):
     def startBuild(self):
         return self.addBuildsetForLatest(reason=self.reason, branch=self.branch)
 
+def _fieldValues(value, allowed):
+    # return the sorted values matched by a Nightly time field
+    if value == '*':
+        return allowed
+    if isinstance(value, int):
+        value = [ value ]
+    return [ v for v in allowed if v in value ]
+
+def _utcOffset(when):
+    when = int(when)
+    return calendar.timegm(time.localtime(when)) - when
+
+def _epochsForLocalTime(wallclock):
+    # return the epoch times, in order, at which the local time is the given
+    # naive datetime: none if it is skipped by a DST change, and two if it is
+    # repeated by one
+    epochs = []
+    for isdst in (0, 1):
+        timetuple = wallclock.timetuple()[:8] + (isdst,)
+        try:
+            epoch = time.mktime(timetuple)
+        except (OverflowError, ValueError):
+            continue
+        if (time.localtime(epoch)[:5] == timetuple[:5]
+                and epoch not in epochs):
+            epochs.append(epoch)
+    epochs.sort()
+    return epochs
+
 class Nightly(Timed):
     compare_attrs = (Timed.compare_attrs
             + ('minute', 'hour', 'dayOfMonth', 'month',
                'dayOfWeek', 'onlyIfChanged', 'fileIsImportant',
                'change_filter',))
 
+    # how many years ahead to look for a matching time
+    yearLimit = 10
+
     class NoBranch: pass
     def __init__(self, name, builderNames, minute=0, hour='*',
                  dayOfMonth='*', month='*', dayOfWeek='*',
                  branch=NoBranch, fileIsImportant=None, onlyIfChanged=False,
-                 properties={}, change_filter=None):
-        Timed.__init__(self, name=name, builderNames=builderNames, properties=properties)
+                 properties={}, change_filter=None, priority=0):
+        Timed.__init__(self, name=name, builderNames=builderNames,
+                       properties=properties, priority=priority)
 
         if fileIsImportant:
             assert callable(fileIsImportant), \
@@ -272,55 +309,94 @@ class Nightly(Timed):
         return self.master.db.schedulers.classifyChanges(
                 self.schedulerid, { change.number : important })
 
-    def getNextBuildTime(self, lastActuated):
-        def addTime(timetuple, secs):
-            return time.localtime(time.mktime(timetuple)+secs)
-
-        def check(ourvalue, value):
-            if ourvalue == '*': return True
-            if isinstance(ourvalue, int): return value == ourvalue
-            return (value in ourvalue)
-
-        dateTime = time.localtime(lastActuated or self.now())
-
-        # Remove seconds by advancing to at least the next minute
-        dateTime = addTime(dateTime, 60-dateTime[5])
-
-        # Now we just keep adding minutes until we find something that matches
-        # TODO: use a smarter algorithm, now that we have thorough tests
-
-        yearLimit = dateTime[0]+2 # only check 2 years (a lot of minutes!)
-        def isRunTime(timetuple):
-
-            if not check(self.minute, timetuple[4]):
-                return False
-
-            if not check(self.hour, timetuple[3]):
-                return False
-
-            if not check(self.month, timetuple[1]):
-                return False
+    def gotChanges(self, changes):
+        # as for gotChange, but recording the whole batch at once
+        classifications = dict([ (change.number, important)
+                                 for change, important in changes
+                                 if change.branch == self.branch ])
+        if not classifications:
+            return defer.succeed(None)
+        return self.master.db.schedulers.classifyChanges(
+                self.schedulerid, classifications)
 
-            if self.dayOfMonth != '*' and self.dayOfWeek != '*':
-                # They specified both day(s) of month AND day(s) of week.
-                # This means that we only have to match one of the two. If
-                # neither one matches, this time is not the right time.
-                if not (check(self.dayOfMonth, timetuple[2]) or
-                        check(self.dayOfWeek, timetuple[6])):
-                    return False
+    def getNextBuildTime(self, lastActuated):
+        # This finds the first minute after lastActuated (or now) whose local
+        # time matches the spec, without stepping through every minute in
+        # between: matching wall-clock times are generated field by field, and
+        # each is converted to the epoch time(s) at which it occurs.  A time
+        # skipped by a DST change does not occur at all, and a time repeated
+        # by one occurs twice.
+        after = lastActuated or self.now()
+
+        # start from the local time of 'after' -- or, if the UTC offset changes
+        # nearby, a few hours before it, since a DST change may mean that a
+        # slightly earlier wall-clock time occurs later
+        start = datetime.datetime(*time.localtime(after)[:5])
+        if _utcOffset(after - 3*3600) != _utcOffset(after + 3*3600):
+            start -= datetime.timedelta(hours=3)
+
+        best = None
+        limit = None
+        for wallclock in self._iterMatchingTimes(start):
+            if limit is not None and wallclock > limit:
+                break
+            epochs = _epochsForLocalTime(wallclock)
+            later = [ e for e in epochs if e > after ]
+            if not later:
+                continue
+            if best is None or later[0] < best:
+                best = later[0]
+            if limit is not None:
+                continue
+            earlier = epochs[0]
+            if earlier < best:
+                # this is the second occurrence of a time repeated by a DST
+                # change, so the first occurrences of the times following it
+                # may still come first
+                limit = wallclock + datetime.timedelta(seconds=best - earlier)
             else:
-                if not check(self.dayOfMonth, timetuple[2]):
-                    return False
-
-                if not check(self.dayOfWeek, timetuple[6]):
-                    return False
-
-            return True
-
-        while not isRunTime(dateTime):
-            dateTime = addTime(dateTime, 60)
-            assert dateTime[0] < yearLimit, 'Something is wrong with this code'
-        return defer.succeed(time.mktime(dateTime))
+                break
+        return defer.succeed(best)
+
+    def _iterMatchingTimes(self, start):
+        """Generate the local times, as naive datetimes, at or after C{start}
+        that match this scheduler's spec, in order.  This gives up after
+        C{yearLimit} years, as some specs (e.g., February 30th) never
+        match."""
+        minutes = _fieldValues(self.minute, range(60))
+        hours = _fieldValues(self.hour, range(24))
+        days = _fieldValues(self.dayOfMonth, range(1, 32))
+        months = _fieldValues(self.month, range(1, 13))
+        weekdays = _fieldValues(self.dayOfWeek, range(7))
+        if self.dayOfMonth != '*' and self.dayOfWeek != '*':
+            # either one may match
+            def dayMatches(year, month, day):
+                return (day in days or
+                        calendar.weekday(year, month, day) in weekdays)
+        else:
+            def dayMatches(year, month, day):
+                return (day in days and
+                        calendar.weekday(year, month, day) in weekdays)
+
+        first = (start.year, start.month, start.day, start.hour)
+        for year in range(start.year, start.year + self.yearLimit):
+            for month in months:
+                if (year, month) < first[:2]:
+                    continue
+                lastday = calendar.monthrange(year, month)[1]
+                for day in range(1, lastday + 1):
+                    if (year, month, day) < first[:3]:
+                        continue
+                    if not dayMatches(year, month, day):
+                        continue
+                    for hour in hours:
+                        if (year, month, day, hour) < first:
+                            continue
+                        for minute in minutes:
+                            when = datetime.datetime(year, month, day,
+                                                     hour, minute)
+                            if when >= start:
+                                yield when
 
     @defer.deferredGenerator
     def startBuild(self):
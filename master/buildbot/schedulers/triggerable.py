@@ -18,73 +18,93 @@ from twisted.internet import defer
 from buildbot.schedulers import base
 from buildbot.process.properties import Properties
 
+def triggerSchedulers(master, schedulers, ssid, set_props=None):
+    """
+    Trigger each of the given L{Triggerable} schedulers with the given
+    sourcestamp ID, or with a new sourcestamp for the latest source if it is
+    None.  All of the buildsets and their buildrequests are added in a
+    single database transaction.
+
+    @returns: a list of Deferreds, one for each scheduler in order, each of
+    which fires with the result of that scheduler's buildset when it is
+    finished, via a Deferred
+    """
+    if ssid:
+        d = defer.succeed(ssid)
+    else:
+        d = master.db.sourcestamps.createSourceStamp(branch=None,
+                revision=None, repository='', project='')
+    def add_buildsets(ssid):
+        return master.addBuildsets([ sch._getBuildset(ssid, set_props)
+                                     for sch in schedulers ])
+    d.addCallback(add_buildsets)
+    def setup_waiters(bsids):
+        return [ sch._waitForBuildset(bsid)
+                 for sch, bsid in zip(schedulers, bsids) ]
+    d.addCallback(setup_waiters)
+    return d
+
 class Triggerable(base.BaseScheduler):
 
     compare_attrs = base.BaseScheduler.compare_attrs
 
-    def __init__(self, name, builderNames, properties={}):
-        base.BaseScheduler.__init__(self, name, builderNames, properties)
+    def __init__(self, name, builderNames, properties={}, priority=0):
+        base.BaseScheduler.__init__(self, name, builderNames, properties,
+                                    priority=priority)
+        # bsid -> (Deferred, completion subscription)
         self._waiters = {}
-        self._bsc_subscription = None
         self.reason = "Triggerable(%s)" % name
 
     def trigger(self, ssid, set_props=None):
         """Trigger this scheduler with the given sourcestamp ID. Returns a
-        deferred that will fire when the buildset is finished."""
-        # properties for this buildset are composed of our own properties,
-        # potentially overridden by anything from the triggering build
-        props = Properties()
-        props.updateFromProperties(self.properties)
-        if set_props:
-            props.updateFromProperties(set_props)
-
-        # note that this does not use the buildset subscriptions mechanism, as
-        # the duration of interest to the caller is bounded by the lifetime of
-        # this process.
-        if ssid:
-            d = self.addBuildsetForSourceStamp(reason=self.reason, ssid=ssid,
-                    properties=props)
-        else:
-            d = self.addBuildsetForLatest(reason=self.reason, properties=props)
-        def setup_waiter(bsid):
-            self._waiters[bsid] = d = defer.Deferred()
-            self._updateWaiters()
-            return d
-        d.addCallback(setup_waiter)
+        deferred that will fire when the buildset is finished.  To trigger
+        several schedulers at once, use L{triggerSchedulers}."""
+        d = triggerSchedulers(self.master, [ self ], ssid, set_props)
+        d.addCallback(lambda waiters : waiters[0])
         return d
 
     def stopService(self):
-        # cancel any outstanding subscription
-        if self._bsc_subscription:
-            self._bsc_subscription.unsubscribe()
-            self._bsc_subscription = None
-
-        # and errback any outstanding deferreds
+        # cancel any outstanding subscriptions, and errback any outstanding
+        # deferreds
         if self._waiters:
             msg = 'Triggerable scheduler stopped before build was complete'
-            for d in self.waiters:
+            waiters, self._waiters = self._waiters, {}
+            for d, subscription in waiters.values():
+                subscription.unsubscribe()
                 d.errback(failure.Failure(RuntimeError(msg)))
-            self._waiters = {}
 
         return base.BaseScheduler.stopService(self)
 
-    def _updateWaiters(self):
-        if self._waiters and not self._bsc_subscription:
-            self._bsc_subscription = \
-                    self.master.subscribeToBuildsetCompletions(
-                                                self._buildsetComplete)
-        elif not self._waiters and self._bsc_subscription:
-            self._bsc_subscription.unsubscribe()
-            self._bsc_subscription = None
+    def _getBuildset(self, ssid, set_props):
+        # properties for this buildset are composed of anything from the
+        # triggering build, updated with our own properties, as in
+        # addBuildsetForSourceStamp
+        props = Properties()
+        if set_props:
+            props.updateFromProperties(set_props)
+        props.updateFromProperties(self.properties)
+        return dict(ssid=ssid, reason=self.reason,
+                    properties=props.asDict(),
+                    builderNames=self.builderNames, priority=self.priority)
+
+    def _waitForBuildset(self, bsid):
+        # note that this does not use the buildset subscriptions mechanism, as
+        # the duration of interest to the caller is bounded by the lifetime of
+        # this process.
+        d = defer.Deferred()
+        subscription = self.master.subscribeToBuildsetCompletion(bsid,
+                                                    self._buildsetComplete)
+        self._waiters[bsid] = (d, subscription)
+        return d
 
     def _buildsetComplete(self, bsid, result):
         if bsid not in self._waiters:
             return
 
-        # pop this bsid from the waiters list, and potentially unsubscribe
-        # from completion notifications
-        d = self._waiters.pop(bsid)
-        self._updateWaiters()
+        # pop this bsid from the waiters list, and unsubscribe from its
+        # completion notification
+        d, subscription = self._waiters.pop(bsid)
+        subscription.unsubscribe()
 
         # fire the callback to indicate that the triggered build is complete
         d.callback(result)
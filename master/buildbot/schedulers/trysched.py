@@ -15,9 +15,10 @@
 
 import os
 
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from twisted.python import log, runtime
 from twisted.protocols import basic
+from twisted.spread import pb
 
 from buildbot import pbutil
 from buildbot.util.maildir import MaildirService
@@ -29,6 +30,35 @@ from buildbot.status.builder import BuildSetStatus
 
 class TryBase(base.BaseScheduler):
 
+    compare_attrs = base.BaseScheduler.compare_attrs + ( 'maxPriority', )
+
+    def __init__(self, name, builderNames, properties, priority=0,
+                 maxPriority=None):
+        base.BaseScheduler.__init__(self, name, builderNames, properties,
+                                    priority=priority)
+        self.maxPriority = maxPriority
+        "highest priority a try user may ask for; None for C{self.priority}"
+
+    def clampPriority(self, priority):
+        """
+        Limit a priority requested by a try user to C{self.maxPriority}, or
+        to C{self.priority} if that is not set, so that try users cannot
+        jump ahead of other work.  A C{priority} of None stays None, meaning
+        the scheduler's priority.
+
+        @returns: priority to use for the try buildset
+        """
+        if priority is None:
+            return None
+        maxPriority = self.maxPriority
+        if maxPriority is None:
+            maxPriority = self.priority
+        if priority > maxPriority:
+            log.msg("%s: clamping requested priority %d to %d"
+                    % (self, priority, maxPriority))
+            return maxPriority
+        return priority
+
     def filterBuilderList(self, builderNames):
         """
         Make sure that C{builderNames} is a subset of the configured
@@ -79,7 +109,7 @@ class JobdirService(MaildirService):
             path = os.path.join(md, "cur", filename)
             f = open(path, "r")
 
-        self.parent.handleJobFile(filename, f)
+        return self.parent.handleJobFile(filename, f)
 
 
 class Try_Jobdir(TryBase):
@@ -87,8 +117,10 @@ class Try_Jobdir(TryBase):
     compare_attrs = TryBase.compare_attrs + ( 'jobdir', )
 
     def __init__(self, name, builderNames, jobdir,
-                 properties={}):
-        TryBase.__init__(self, name=name, builderNames=builderNames, properties=properties)
+                 properties={}, priority=0, maxPriority=None):
+        TryBase.__init__(self, name=name, builderNames=builderNames,
+                         properties=properties, priority=priority,
+                         maxPriority=maxPriority)
         self.jobdir = jobdir
         self.watcher = JobdirService()
         self.watcher.setServiceParent(self)
@@ -101,12 +133,16 @@ class Try_Jobdir(TryBase):
     def parseJob(self, f):
         # jobfiles are serialized build requests. Each is a list of
         # serialized netstrings, in the following order:
-        #  "2", the format version number ("1" does not have project/repo)
+        #  "3", the format version number ("1" does not have project/repo,
+        #       "2" does not have priority)
         #  buildsetID, arbitrary string, used to find the buildSet later
         #  branch name, "" for default-branch
         #  base revision, "" for HEAD
         #  patchlevel, usually "1"
         #  patch
+        #  repository
+        #  project
+        #  priority, "" for the scheduler's priority
         #  builderNames...
         p = netstrings.NetstringParser()
         try:
@@ -126,6 +162,7 @@ class Try_Jobdir(TryBase):
             patchlevel = int(patchlevel)
             repository=''
             project=''
+            priority=None
         elif ver == "2": # introduced the repository and project property
             buildsetID, branch, baserev, patchlevel, diff, repository, project = p.strings[:7]
             builderNames = p.strings[7:]
@@ -134,6 +171,23 @@ class Try_Jobdir(TryBase):
             if baserev == "":
                 baserev = None
             patchlevel = int(patchlevel)
+            priority=None
+        elif ver == "3": # introduced the priority
+            (buildsetID, branch, baserev, patchlevel, diff, repository, project,
+                    priority) = p.strings[:8]
+            builderNames = p.strings[8:]
+            if branch == "":
+                branch = None
+            if baserev == "":
+                baserev = None
+            patchlevel = int(patchlevel)
+            if priority == "":
+                priority = None
+            else:
+                try:
+                    priority = int(priority)
+                except ValueError:
+                    raise BadJobfile("invalid priority '%s'" % priority)
         else:
             raise BadJobfile("unknown version '%s'" % ver)
         return dict(
@@ -144,19 +198,28 @@ class Try_Jobdir(TryBase):
                 patch_level=patchlevel,
                 repository=repository,
                 project=project,
+                priority=priority,
                 jobid=buildsetID)
 
     def handleJobFile(self, filename, f):
-        try:
-            parsed_job = self.parseJob(f)
-            builderNames = parsed_job['builderNames']
-        except BadJobfile:
+        # read and parse the jobfile in the reactor's thread pool, since a
+        # large patch can take a while
+        def parse():
+            try:
+                return self.parseJob(f)
+            finally:
+                f.close()
+        d = threads.deferToThread(parse)
+        def bad_jobfile(why):
+            why.trap(BadJobfile)
             log.msg("%s reports a bad jobfile in %s" % (self, filename))
-            log.err()
-            return defer.succeed(None)
+            log.err(why)
+        d.addCallbacks(self._addTryJob, bad_jobfile)
+        return d
 
+    def _addTryJob(self, parsed_job):
         # Validate/fixup the builder names.
-        builderNames = self.filterBuilderList(builderNames)
+        builderNames = self.filterBuilderList(parsed_job['builderNames'])
         if not builderNames:
             log.msg("incoming Try job did not specify any allowed builder names")
             return defer.succeed(None)
@@ -172,7 +235,8 @@ class Try_Jobdir(TryBase):
         def create_buildset(ssid):
             return self.addBuildsetForSourceStamp(ssid=ssid,
                     reason="'try' job", external_idstring=parsed_job['jobid'],
-                    builderNames=builderNames)
+                    builderNames=builderNames,
+                    priority=self.clampPriority(parsed_job.get('priority')))
         d.addCallback(create_buildset)
         return d
 
@@ -181,11 +245,46 @@ class Try_Userpass_Perspective(pbutil.NewCredPerspective):
     def __init__(self, scheduler, username):
         self.scheduler = scheduler
         self.username = username
+        self.patch_chunks = []
+        self.patch_size = 0
+        # true if the chunks of the current patch went over maxPatchSize
+        self.patch_rejected = False
+
+    def _patchTooLarge(self):
+        return pb.Error("patch is larger than the maximum of %d bytes"
+                        % self.scheduler.maxPatchSize)
+
+    def perspective_addPatchChunk(self, data):
+        """Add C{data} to the patch for the next try request, which should
+        then give a patch body of None.  Clients send patches too large for a
+        single PB call this way.  Once the patch is larger than the
+        scheduler's C{maxPatchSize}, it is discarded, and this and any
+        further chunks and the try request itself fail."""
+        if self.patch_rejected:
+            raise self._patchTooLarge()
+        self.patch_size += len(data)
+        if self.patch_size > self.scheduler.maxPatchSize:
+            log.msg("user %s sent a patch larger than %d bytes; rejecting it"
+                    % (self.username, self.scheduler.maxPatchSize))
+            self.patch_chunks = []
+            self.patch_size = 0
+            self.patch_rejected = True
+            raise self._patchTooLarge()
+        self.patch_chunks.append(data)
 
     @defer.deferredGenerator
     def perspective_try(self, branch, revision, patch, repository, project,
-                        builderNames, properties={}, ):
+                        builderNames, properties={}, priority=None):
         db = self.scheduler.master.db
+        rejected = self.patch_rejected
+        if patch[1] is None and self.patch_chunks:
+            patch = (patch[0], "".join(self.patch_chunks))
+        self.patch_chunks = []
+        self.patch_size = 0
+        self.patch_rejected = False
+        if rejected or (patch[1] is not None
+                        and len(patch[1]) > self.scheduler.maxPatchSize):
+            raise self._patchTooLarge()
         log.msg("user %s requesting build on builders %s" % (self.username,
                                                              builderNames))
 
@@ -209,7 +308,8 @@ class Try_Userpass_Perspective(pbutil.NewCredPerspective):
         wfd = defer.waitForDeferred(
                 self.scheduler.addBuildsetForSourceStamp(ssid=ssid,
                         reason=reason, properties=requested_props,
-                        builderNames=builderNames))
+                        builderNames=builderNames,
+                        priority=self.scheduler.clampPriority(priority)))
         yield wfd
         bsid = wfd.getResult()
 
@@ -228,13 +328,18 @@ class Try_Userpass_Perspective(pbutil.NewCredPerspective):
 
 
 class Try_Userpass(TryBase):
-    compare_attrs = ( 'name', 'builderNames', 'port', 'userpass', 'properties' )
+    compare_attrs = ( 'name', 'builderNames', 'port', 'userpass', 'properties',
+                      'priority', 'maxPriority', 'maxPatchSize' )
 
     def __init__(self, name, builderNames, port, userpass,
-                 properties={}):
-        TryBase.__init__(self, name=name, builderNames=builderNames, properties=properties)
+                 properties={}, priority=0, maxPriority=None,
+                 maxPatchSize=10*1024*1024):
+        TryBase.__init__(self, name=name, builderNames=builderNames,
+                         properties=properties, priority=priority,
+                         maxPriority=maxPriority)
         self.port = port
         self.userpass = userpass
+        self.maxPatchSize = maxPatchSize
 
     def startService(self):
         TryBase.startService(self)
@@ -957,6 +957,9 @@ class TryOptions(OptionsWithOptionsFile):
 
         ["baserev", None, None,
          "Base revision to use instead of scanning a local tree."],
+        ["diff-from", None, None,
+         "Base revision to diff the local tree against, instead of finding it."
+         " Not supported for darcs or p4."],
 
         ["vc", None, None,
          "The VC system in use, one of: cvs,svn,bzr,darcs,p4"],
@@ -968,6 +971,9 @@ class TryOptions(OptionsWithOptionsFile):
          "Run the trial build on this Builder. Can be used multiple times."],
         ["properties", None, None,
          "A set of properties made available in the build environment, format:prop1=value1,prop2=value2..."],
+        ["priority", None, None,
+         "Priority of the trial builds, instead of the try scheduler's;"
+         " higher priorities are built first", int],
 
         ["try-topfile", None, None,
          "Name of a file at the top of the tree, used to find the top. Only needed for SVN and CVS."],
@@ -997,6 +1003,7 @@ class TryOptions(OptionsWithOptionsFile):
         [ 'try_dir', 'trydir' ],
         [ 'try_password', 'passwd' ],
         [ 'try_master', 'master' ],
+        [ 'try_priority', 'priority' ],
         #[ 'try_wait', 'wait' ], <-- handled in postOptions
         [ 'masterstatus', 'master' ],
     ]
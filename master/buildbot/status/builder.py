@@ -502,6 +502,11 @@ class LogFile:
     def addHeader(self, text):
         self.addEntry(HEADER, text)
 
+    def getPendingLength(self):
+        """Return the number of bytes which have been added to this log but
+        not yet written to disk."""
+        return self.runLength + self.tailLength
+
     def finish(self):
         if self.tailBuffer:
             msg = "\nFinal %i bytes follow below:\n" % self.tailLength
@@ -55,6 +55,10 @@ class IQueue(Interface):
     def popChunk(nbItems=None):
         """Pop many items at once. Defaults to self.maxItems()."""
 
+    def peekChunk(nbItems=None):
+        """Return the items that popChunk would pop, without removing them
+        from the queue."""
+
     def save():
         """Save the queue to storage if implemented."""
 
@@ -114,6 +118,16 @@ class MemoryQueue(object):
                 items.append(self._items.popleft())
         return items
 
+    def peekChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        items = []
+        for item in self._items:
+            if len(items) == nbItems:
+                break
+            items.append(item)
+        return items
+
     def save(self):
         pass
 
@@ -205,6 +219,18 @@ class DiskQueue(object):
             self.firstItemId = id + 1
         return ret
 
+    def peekChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = []
+        id = self.firstItemId
+        for i in range(min(nbItems, self._nbItems)):
+            id = self._findNext(id)
+            path = os.path.join(self.path, str(id))
+            ret.append(self.unpickleFn(ReadFile(path)))
+            id += 1
+        return ret
+
     def save(self):
         pass
 
@@ -325,6 +351,15 @@ class PersistentQueue(object):
             ret.extend(self.secondaryQueue.popChunk(nbItems))
         return ret
 
+    def peekChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self.primaryQueue.maxItems()
+        ret = self.primaryQueue.peekChunk(nbItems)
+        nbItems -= len(ret)
+        if nbItems and self.secondaryQueue.nbItems():
+            ret.extend(self.secondaryQueue.peekChunk(nbItems))
+        return ret
+
     def save(self):
         self.secondaryQueue.insertBackChunk(self.primaryQueue.popChunk())
 
@@ -38,10 +38,12 @@ from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.slaves import BuildSlavesResource
 from buildbot.status.web.status_json import JsonStatusResource
 from buildbot.status.web.about import AboutBuildbot
+from buildbot.status.web.locks import LocksResource
 from buildbot.status.web.authz import Authz
 from buildbot.status.web.auth import AuthFailResource
 from buildbot.status.web.root import RootPage
-from buildbot.status.web.change_hook import ChangeHookResource
+from buildbot.status.web.change_hook import ChangeHookResource, \
+        ChangeHookQueue
 
 # this class contains the WebStatus class.  Basic utilities are in base.py,
 # and specific pages are each in their own module.
@@ -89,6 +91,7 @@ class WebStatus(service.MultiService):
      /buildslaves/SLAVENAME : describe a single BuildSlave
      /one_line_per_build : summarize the last few builds, one line each
      /one_line_per_build/BUILDERNAME : same, but only for a single builder
+     /locks : list the locks in use, with their contention statistics
      /about : describe this buildmaster (Buildbot and support library versions)
      /change_hook[/DIALECT] : accepts changes from external sources, optionally
                               choosing the dialect that will be permitted
@@ -147,7 +150,8 @@ class WebStatus(service.MultiService):
                  order_console_by_time=False, changecommentlink=None,
                  revlink=None, projects=None, repositories=None,
                  authz=None, logRotateLength=None, maxRotatedFiles=None,
-                 change_hook_dialects = {}, provide_feeds=None):
+                 change_hook_dialects = {}, provide_feeds=None,
+                 change_hook_queue=None):
         """Run a web server that provides Buildbot status.
 
         @type  http_port: int or L{twisted.application.strports} string
@@ -256,6 +260,15 @@ class WebStatus(service.MultiService):
                                      to the dialect
                                      
                                      To enable the DEFAULT handler, use a key of DEFAULT
+
+        @type  change_hook_queue: None, True, or dict
+        @param change_hook_queue: If set, change_hook requests are answered
+                                  with '202 Accepted' once their changes are
+                                  queued, and the changes are added in the
+                                  background.  A dict gives keyword
+                                  arguments for L{ChangeHookQueue}
+                                  (maxsize, concurrency, queuedir,
+                                  retryDelay).
                                      
                                      
         
@@ -328,9 +341,16 @@ class WebStatus(service.MultiService):
         
         # do we want to allow change_hook
         self.change_hook_dialects = {}
+        self.change_hook_queue = None
         if change_hook_dialects:
             self.change_hook_dialects = change_hook_dialects
-            self.putChild("change_hook", ChangeHookResource(dialects = self.change_hook_dialects))
+            if change_hook_queue:
+                if change_hook_queue is True:
+                    change_hook_queue = {}
+                self.change_hook_queue = ChangeHookQueue(**change_hook_queue)
+                self.change_hook_queue.setServiceParent(self)
+            self.putChild("change_hook", ChangeHookResource(dialects = self.change_hook_dialects,
+                                                            queue = self.change_hook_queue))
 
         # Set default feeds
         if provide_feeds is None:
@@ -353,6 +373,7 @@ class WebStatus(service.MultiService):
         self.putChild("buildstatus", BuildStatusStatusResource())
         self.putChild("one_line_per_build",
                       OneLinePerBuild(numbuilds=numbuilds))
+        self.putChild("locks", LocksResource())
         self.putChild("about", AboutBuildbot())
         self.putChild("authfail", AuthFailResource())
 
@@ -18,24 +18,40 @@
 # otherwise, Andrew Melo <andrew.melo@gmail.com> wrote the rest
 # but "the rest" is pretty minimal
 
+import os
 import re
+import pickle
 from twisted.web import resource
 from twisted.python.reflect import namedModule
 from twisted.python import log
-from twisted.internet import defer
+from twisted.internet import defer, reactor
+from twisted.application import service
+from buildbot import util
+from buildbot.status.persistent_queue import DiskQueue, MemoryQueue, \
+        ReadFile, WriteFile
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 
 class ChangeHookResource(resource.Resource):
      # this is a cheap sort of template thingy
     contentType = "text/html; charset=utf-8"
     children    = {}
-    def __init__(self, dialects={}):
+    def __init__(self, dialects={}, queue=None):
         """
         The keys of 'dialects' select a modules to load under
         master/buildbot/status/web/hooks/
         The value is passed to the module's getChanges function, providing
         configuration options to the dialect.
+
+        If 'queue' is given, it is a ChangeHookQueue; requests are answered
+        with '202 Accepted' as soon as their changes are queued, and the
+        changes are added to the master later.
         """
         self.dialects = dialects
+        self.queue = queue
     
     def getChild(self, name, request):
         return self
@@ -68,6 +84,8 @@ class ChangeHookResource(resource.Resource):
         if not changes:
             log.msg("No changes found")
             return defer.succeed("no changes found")
+        if self.queue:
+            return defer.succeed(self.queueChanges(changes, request))
         d = self.submitChanges( changes, request )
         d.addCallback(lambda _ : "OK")
         return d
@@ -114,11 +132,264 @@ class ChangeHookResource(resource.Resource):
 
         return changes
                 
-    @defer.deferredGenerator
+    def queueChanges(self, changes, request):
+        result = self.queue.add(changes)
+        if result == ChangeHookQueue.REJECTED:
+            msg = "change hook queue is full"
+            request.setResponseCode(503, msg)
+            return msg
+        request.setResponseCode(202)
+        if result == ChangeHookQueue.COALESCED:
+            return "Accepted (duplicate)"
+        return "Accepted"
+
     def submitChanges(self, changes, request):
+        # all of the changes in a request are added together
         master = request.site.buildbot_service.master
-        for chdict in changes:
-            wfd = defer.waitForDeferred(master.addChange(**chdict))
-            yield wfd
-            change = wfd.getResult()
+        d = master.addChanges(changes)
+        def log_changes(changes):
+            for change in changes:
+                log.msg("injected change %s" % change)
+        d.addCallback(log_changes)
+        return d
+
+
+class ChangeHookQueue(service.Service):
+    """
+    A bounded queue of the changes from change hook requests, which are added
+    to the master in the background, at most C{concurrency} requests at a
+    time.  A request whose changes are identical to those of a request that
+    is still queued or being added (such as a redelivery of the same
+    payload) is coalesced with it.
+
+    The queue is kept in C{queuedir}, relative to the master's basedir, so
+    that queued changes survive a restart of the master.  A request being
+    added to the master is recorded in a C{running-} file in C{queuedir}
+    until its changes have been committed, so that a request interrupted by
+    a crash is queued again when the master restarts.  If C{queuedir} is
+    None, the queue is only kept in memory.  Changes that cannot be added
+    are put back at the front of the queue and retried after C{retryDelay}
+    seconds.
+    """
+
+    # results of add()
+    QUEUED = 'queued'
+    COALESCED = 'coalesced'
+    REJECTED = 'rejected'
+
+    # prefix of the files recording the requests being added to the master
+    RUNNING_PREFIX = 'running-'
+
+    _reactor = reactor # for tests
+
+    def __init__(self, maxsize=1000, concurrency=1,
+                 queuedir="change_hook_queue", retryDelay=60):
+        assert concurrency >= 1
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self.queuedir = queuedir
+        self.retryDelay = retryDelay
+        self.master = None
+        self.queue = MemoryQueue(maxItems=maxsize)
+        # the directory holding the running- files, if the queue is on disk
+        self._path = None
+
+        # number of queued or running items with each key, and when the
+        # first of them was queued
+        self._keys = {}
+        self._since = {}
+        self._running = 0
+        self._retry_timer = None
+        self._stopped_waiters = []
+
+        # statistics
+        self.accepted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+
+    def startService(self):
+        service.Service.startService(self)
+        # (the parent is a WebStatus)
+        self.master = self.parent.master
+        if self.queuedir:
+            path = os.path.join(self.master.basedir, self.queuedir)
+            self.queue = DiskQueue(path, maxItems=self.maxsize)
+            self._path = path
+            self._requeueRunning()
+            for item in self.queue.items():
+                self._remember(item)
+            if self.queue.nbItems():
+                log.msg("change hook queue: resuming %d queued requests"
+                        % self.queue.nbItems())
+        self._pump()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._retry_timer:
+            self._retry_timer.cancel()
+            self._retry_timer = None
+        self.queue.save()
+        # wait for the running requests to finish
+        if not self._running:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._stopped_waiters.append(d)
+        return d
+
+    def getKey(self, changes):
+        """Return a key identifying this list of change dictionaries, such
+        that identical lists have the same key."""
+        return sha1(repr([ sorted(ch.items()) for ch in changes ])).hexdigest()
+
+    def add(self, changes):
+        """Queue a list of change dictionaries, as returned by a change hook
+        dialect, and return one of QUEUED, COALESCED, or REJECTED."""
+        key = self.getKey(changes)
+        if key in self._keys:
+            self.coalesced += 1
+            return self.COALESCED
+        if self.queue.nbItems() >= self.maxsize:
+            self.rejected += 1
+            log.msg("change hook queue is full; rejecting %d changes"
+                    % len(changes))
+            return self.REJECTED
+        item = dict(key=key, changes=changes, queued=util.now(self._reactor))
+        self.queue.pushItem(item)
+        self._remember(item)
+        self.accepted += 1
+        self._pump()
+        return self.QUEUED
+
+    def getStatus(self):
+        """Return a dictionary describing the queue: its depth, how long the
+        oldest queued or running request has waited, counts of the requests handled, and the latency
+        (time from being queued to being added to the master) of the
+        requests processed so far."""
+        oldest_wait = None
+        if self._since:
+            oldest_wait = util.now(self._reactor) - min(self._since.values())
+        average_latency = None
+        if self.processed:
+            average_latency = self.total_latency / self.processed
+        return dict(depth=self.queue.nbItems(),
+                    running=self._running,
+                    maxsize=self.maxsize,
+                    concurrency=self.concurrency,
+                    accepted=self.accepted,
+                    coalesced=self.coalesced,
+                    rejected=self.rejected,
+                    processed=self.processed,
+                    failed=self.failed,
+                    oldest_wait=oldest_wait,
+                    average_latency=average_latency,
+                    max_latency=self.max_latency,
+                    last_latency=self.last_latency)
+
+    def _pump(self):
+        while (self.running and not self._retry_timer
+               and self._running < self.concurrency
+               and self.queue.nbItems()):
+            # record the request as running before taking it off the queue,
+            # so that it is never only in memory
+            item = self.queue.peekChunk(1)[0]
+            self._writeRunning(item)
+            self.queue.popChunk(1)
+            self._running += 1
+            d = defer.maybeDeferred(self.master.addChanges, item['changes'])
+            d.addCallbacks(self._added, self._failed,
+                           callbackArgs=(item,), errbackArgs=(item,))
+            d.addErrback(log.err, 'in change hook queue')
+
+    def _added(self, changes, item):
+        latency = util.now(self._reactor) - item['queued']
+        self.processed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+        for change in changes:
             log.msg("injected change %s" % change)
+        self._removeRunning(item)
+        self._forget(item)
+        self._finished()
+
+    def _failed(self, why, item):
+        log.err(why, 'while adding changes from change hook queue; retrying '
+                     'in %d seconds' % self.retryDelay)
+        self.failed += 1
+        # put it back, and pause processing for a while
+        self.queue.insertBackChunk([ item ])
+        self._removeRunning(item)
+        if self.running and not self._retry_timer:
+            self._retry_timer = self._reactor.callLater(self.retryDelay,
+                                                        self._retry)
+        self._finished()
+
+    def _retry(self):
+        self._retry_timer = None
+        self._pump()
+
+    def _runningPath(self, item):
+        return os.path.join(self._path, self.RUNNING_PREFIX + item['key'])
+
+    def _writeRunning(self, item):
+        if not self._path:
+            return
+        # write it under another name first, so that a crash cannot leave a
+        # partial file behind
+        path = self._runningPath(item)
+        WriteFile(path + '.tmp', pickle.dumps(item))
+        os.rename(path + '.tmp', path)
+
+    def _removeRunning(self, item):
+        if not self._path:
+            return
+        os.remove(self._runningPath(item))
+
+    def _requeueRunning(self):
+        # put the requests that were running when the master stopped back at
+        # the front of the queue, unless they are still queued (if the master
+        # stopped before it took them off the queue)
+        queued = dict([ (item['key'], None) for item in self.queue.items() ])
+        names = [ name for name in os.listdir(self._path)
+                  if name.startswith(self.RUNNING_PREFIX) ]
+        items = []
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            item = pickle.loads(ReadFile(os.path.join(self._path, name)))
+            if item['key'] not in queued:
+                items.append((item['queued'], item))
+        if items:
+            items.sort()
+            log.msg("change hook queue: requeueing %d interrupted requests"
+                    % len(items))
+            self.queue.insertBackChunk([ item for _, item in items ])
+        for name in names:
+            os.remove(os.path.join(self._path, name))
+
+    def _remember(self, item):
+        key = item['key']
+        self._keys[key] = self._keys.get(key, 0) + 1
+        self._since[key] = min(self._since.get(key, item['queued']),
+                               item['queued'])
+
+    def _forget(self, item):
+        key = item['key']
+        self._keys[key] -= 1
+        if not self._keys[key]:
+            del self._keys[key]
+            del self._since[key]
+
+    def _finished(self):
+        self._running -= 1
+        if self.running:
+            self._pump()
+        elif not self._running:
+            waiters, self._stopped_waiters = self._stopped_waiters, []
+            for d in waiters:
+                d.callback(None)
@@ -0,0 +1,35 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from buildbot.status.web.base import HtmlResource
+
+# /locks
+class LocksResource(HtmlResource):
+    title = "Locks"
+
+    def content(self, request, cxt):
+        botmaster = self.getStatus(request).botmaster
+        locks = cxt['locks'] = []
+        for lock_status in botmaster.getLockStatus():
+            info = lock_status.copy()
+            if info['waits']:
+                info['mean_wait_time'] = \
+                        float(info['total_wait_time']) / info['waits']
+            else:
+                info['mean_wait_time'] = 0
+            locks.append(info)
+
+        template = request.site.buildbot_service.templates.get_template("locks.html")
+        return template.render(**cxt)
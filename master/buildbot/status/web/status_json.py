@@ -579,6 +579,39 @@ class ChangesJsonResource(JsonResource):
         return JsonResource.asDict(self, request)
 
 
+class ChangeHookJsonResource(JsonResource):
+    help = """Describe the change hook's queue, if it has one.
+
+The depth of the queue, how long its oldest request has waited, the numbers of
+requests accepted, coalesced with a duplicate, rejected because the queue was
+full, processed and failed, and the average, maximum and last latency (in
+seconds) from queueing a request to adding its changes.
+"""
+    title = 'Change Hook'
+
+    def asDict(self, request):
+        queue = getattr(request.site.buildbot_service, 'change_hook_queue',
+                        None)
+        if not queue:
+            return {}
+        return queue.getStatus()
+
+
+class ChangeRoutingJsonResource(JsonResource):
+    help = """Describe how new changes are routed to schedulers.
+
+The numbers of changes routed, of schedulers considered for them through the
+change filter indexes and otherwise, and of change filter checks made and
+reused; and for each scheduler, the change attribute its filter is indexed by
+(if any), and the numbers of changes it was considered for and accepted.
+"""
+    title = 'Change Routing'
+
+    def asDict(self, request):
+        master = request.site.buildbot_service.master
+        return master.change_classifier.getStatus()
+
+
 class ChangeSourcesJsonResource(JsonResource):
     help = """Describe a change source.
 """
@@ -596,6 +629,26 @@ class ChangeSourcesJsonResource(JsonResource):
         return result
 
 
+class LocksJsonResource(JsonResource):
+    help = """List the locks that builds and steps have used, with their
+contention statistics.
+
+For each lock (one for each slave, for a SlaveLock), its name, description,
+maxCount and slave, the numbers of its current exclusive and counting owners
+and of builds and steps waiting for it, its current owners (each with a
+description of the build or step, its access mode and the number of times it
+holds the lock), and the number of waits that ended
+with the lock being granted, with the total and longest time spent in them,
+in seconds.  The statistics are kept in memory, and start again when the
+master is restarted or the lock is reconfigured.
+"""
+    title = 'Locks'
+
+    def asDict(self, request):
+        master = request.site.buildbot_service.master
+        return master.botmaster.getLockStatus()
+
+
 class ProjectJsonResource(JsonResource):
     help = """Project-wide settings.
 """
@@ -643,6 +696,27 @@ class SlaveJsonResource(JsonResource):
         return results
 
 
+class SchedulersJsonResource(JsonResource):
+    help = """List the configured schedulers.
+
+For each scheduler, its class and builders, and for those with a
+treeStableTimer, the number of timers that are running (one for each branch
+waiting for its tree to become stable).
+"""
+    title = 'Schedulers'
+
+    def asDict(self, request):
+        master = request.site.buildbot_service.master
+        result = {}
+        for sched in master.allSchedulers():
+            sched_dict = dict(class_name=sched.__class__.__name__,
+                              builderNames=sched.listBuilderNames())
+            if hasattr(sched, 'getPendingTimerCount'):
+                sched_dict['pending_timers'] = sched.getPendingTimerCount()
+            result[sched.name] = sched_dict
+        return result
+
+
 class SlavesJsonResource(JsonResource):
     help = """List the registered slaves.
 """
@@ -690,8 +764,12 @@ For help on any sub directory, use url /child/help
         JsonResource.__init__(self, status)
         self.level = 1
         self.putChild('builders', BuildersJsonResource(status))
+        self.putChild('change_hook', ChangeHookJsonResource(status))
+        self.putChild('change_routing', ChangeRoutingJsonResource(status))
         self.putChild('change_sources', ChangeSourcesJsonResource(status))
+        self.putChild('locks', LocksJsonResource(status))
         self.putChild('project', ProjectJsonResource(status))
+        self.putChild('schedulers', SchedulersJsonResource(status))
         self.putChild('slaves', SlavesJsonResource(status))
         # This needs to be called before the first HelpResource().body call.
         self.hackExamples()
@@ -39,7 +39,7 @@ class Source(LoggingBuildStep):
     branch = None # the default branch, should be set in __init__
 
     def __init__(self, workdir=None, mode='update', alwaysUseLatest=False,
-                 timeout=20*60, retry=None, **kwargs):
+                 timeout=20*60, retry=None, copyHardlinks=False, **kwargs):
         """
         @type  workdir: string
         @param workdir: local directory (relative to the Builder's root)
@@ -121,6 +121,13 @@ class Source(LoggingBuildStep):
                       failures that could be handled by simply retrying a
                       couple times.
 
+        @type  copyHardlinks: boolean
+        @param copyHardlinks: in 'copy' mode, hard-link files from the
+                              source directory into the workdir instead of
+                              copying them, where the slave's filesystem
+                              allows it. Only safe if the build never
+                              modifies source files in place.
+
         """
 
         LoggingBuildStep.__init__(self, **kwargs)
@@ -129,6 +136,7 @@ class Source(LoggingBuildStep):
                                  alwaysUseLatest=alwaysUseLatest,
                                  timeout=timeout,
                                  retry=retry,
+                                 copyHardlinks=copyHardlinks,
                                  )
 
         assert mode in ("update", "copy", "clobber", "export")
@@ -141,6 +149,8 @@ class Source(LoggingBuildStep):
                      'retry': retry,
                      'patch': None, # set during .start
                      }
+        if copyHardlinks:
+            self.args['copy_hardlinks'] = True
         # This will get added to args later, after properties are rendered
         self.workdir = workdir
 
@@ -186,31 +196,61 @@ class Source(LoggingBuildStep):
         source step took and the Change 'repository' property
         '''
 
+        s = self.build.getSourceStamp()
+        props = self.build.getProperties()
+        return self._computeRepositoryURL(repository, s, props.render)
+
+    def computePrefetchRepositoryURL(self, repository, sourcestamp):
+        '''
+        Like computeRepositoryURL, but usable before the build has started,
+        when there are no properties to render.  Returns None if the URL
+        depends on properties, or cannot be determined.
+        '''
+        class Unknown(Exception):
+            pass
+        def render(value):
+            if value is None or isinstance(value, WithProperties):
+                raise Unknown
+            return value
+
+        if not repository and not sourcestamp.repository:
+            return None
+        try:
+            return self._computeRepositoryURL(repository, sourcestamp, render)
+        except Unknown:
+            return None
+
+    def _computeRepositoryURL(self, repository, s, render):
         assert not repository or callable(repository) or isinstance(repository, dict) or \
             isinstance(repository, str) or isinstance(repository, unicode) or \
             isinstance(repository, WithProperties)
 
-        s = self.build.getSourceStamp()
-        props = self.build.getProperties()
-
         if not repository:
             assert s.repository
             return str(s.repository)
         else:
             if callable(repository):
-                return str(props.render(repository(s.repository)))
+                return str(render(repository(s.repository)))
             elif isinstance(repository, dict):
-                return str(props.render(repository.get(s.repository)))
+                return str(render(repository.get(s.repository)))
             elif isinstance(repository, WithProperties):
-                return str(props.render(repository))
+                return str(render(repository))
             else: # string or unicode
                 try:
                     repourl = str(repository % s.repository)
                 except TypeError:
                     # that's the backward compatibility case
-                    repourl = props.render(repository)
+                    repourl = render(repository)
                 return repourl
 
+    def getPrefetchArgs(self, sourcestamp):
+        """Return a tuple (command, args) describing how the slave can start
+        fetching the sources this step will need for SOURCESTAMP, or None if
+        it cannot.  This is called, before the build starts, on the step
+        instance given to the L{BuildFactory}, which is not attached to any
+        build.  See L{BuildFactory.getPrefetchArgs}."""
+        return None
+
     def start(self):
         if self.notReally:
             log.msg("faking %s checkout/update" % self.name)
@@ -254,6 +294,10 @@ class Source(LoggingBuildStep):
             got_revision = cmd.updates["got_revision"][-1]
             if got_revision is not None:
                 self.setProperty("got_revision", str(got_revision), "Source")
+        if cmd.updates.has_key("mirror"):
+            # statistics from the slave's shared repository mirror
+            for name, value in cmd.updates["mirror"][-1].items():
+                self.setProperty(name, value, "Source")
 
 
 
@@ -526,7 +570,7 @@ class SVN(Source):
     def __init__(self, svnurl=None, baseURL=None, defaultBranch=None,
                  directory=None, username=None, password=None,
                  extra_args=None, keep_on_purge=None, ignore_ignores=None,
-                 always_purge=None, depth=None, **kwargs):
+                 always_purge=None, depth=None, sparse_paths=None, **kwargs):
         """
         @type  svnurl: string
         @param svnurl: the URL which points to the Subversion server,
@@ -551,6 +595,12 @@ class SVN(Source):
 
         @type  password: string
         @param password: password to pass to svn's --password
+
+        @type  sparse_paths: list of strings
+        @param sparse_paths: check out only these paths (relative to the
+                             URL), using sparse directories; overrides
+                             C{depth}, and requires Subversion 1.5+ on
+                             the slave
         """
 
         if not 'workdir' in kwargs and directory is not None:
@@ -568,6 +618,7 @@ class SVN(Source):
         self.ignore_ignores = ignore_ignores
         self.always_purge = always_purge
         self.depth = depth
+        self.sparse_paths = sparse_paths
 
         Source.__init__(self, **kwargs)
         self.addFactoryArguments(svnurl=svnurl,
@@ -581,6 +632,7 @@ class SVN(Source):
                                  ignore_ignores=ignore_ignores,
                                  always_purge=always_purge,
                                  depth=depth,
+                                 sparse_paths=sparse_paths,
                                  )
 
         if svnurl and baseURL:
@@ -663,6 +715,8 @@ class SVN(Source):
         #Set up depth if specified
         if self.depth is not None:
             self.args['depth'] = self.depth
+        if self.sparse_paths:
+            self.args['sparse_paths'] = self.sparse_paths
 
         if self.username is not None:
             self.args['username'] = self.username
@@ -791,6 +845,8 @@ class Git(Source):
                  reference=None,
                  shallow=False,
                  progress=False,
+                 mirror=False,
+                 sparse_paths=None,
                  **kwargs):
         """
         @type  repourl: string
@@ -816,6 +872,16 @@ class Git(Source):
         @param progress: Pass the --progress option when fetching. This
                          can solve long fetches getting killed due to
                          lack of output, but requires Git 1.7.2+.
+
+        @type  mirror: boolean
+        @param mirror: Fetch through a mirror of the repository shared by
+                       all builders on the slave, and borrow objects from
+                       it rather than keeping a full copy in each workdir.
+                       Overrides C{reference} and C{shallow}.
+
+        @type  sparse_paths: list of strings
+        @param sparse_paths: check out only these paths, using a sparse
+                             checkout.  Requires Git 1.7.0+.
         """
         Source.__init__(self, **kwargs)
         self.repourl = repourl
@@ -826,6 +892,8 @@ class Git(Source):
                                  reference=reference,
                                  shallow=shallow,
                                  progress=progress,
+                                 mirror=mirror,
+                                 sparse_paths=sparse_paths,
                                  )
         self.args.update({'branch': branch,
                           'submodules': submodules,
@@ -833,7 +901,10 @@ class Git(Source):
                           'reference': reference,
                           'shallow': shallow,
                           'progress': progress,
+                          'mirror': mirror,
                           })
+        if sparse_paths:
+            self.args['sparse_paths'] = sparse_paths
 
     def computeSourceRevision(self, changes):
         if not changes:
@@ -871,6 +942,18 @@ class Git(Source):
         cmd = LoggedRemoteCommand("git", self.args)
         self.startCommand(cmd)
 
+    def getPrefetchArgs(self, sourcestamp):
+        # only a mirror can be updated ahead of the build
+        if not self.args.get('mirror'):
+            return None
+        repourl = self.computePrefetchRepositoryURL(self.repourl, sourcestamp)
+        if not repourl:
+            return None
+        return ("git", {'workdir': self.workdir or 'build',
+                        'repourl': repourl,
+                        'progress': self.args['progress'],
+                        'mirror': True})
+
 
 class Repo(Source):
     """Check out a source tree from a repo repository described by manifest."""
@@ -1067,7 +1150,8 @@ class Mercurial(Source):
     name = "hg"
 
     def __init__(self, repourl=None, baseURL=None, defaultBranch=None,
-                 branchType='dirname', clobberOnBranchChange=True, **kwargs):
+                 branchType='dirname', clobberOnBranchChange=True,
+                 mirror=False, **kwargs):
         """
         @type  repourl: string
         @param repourl: the URL which points at the Mercurial repository.
@@ -1100,6 +1184,11 @@ class Mercurial(Source):
                                       using inrepos branches, clobber the tree
                                       at each branch change. Otherwise, just
                                       update to the branch.
+
+        @param mirror: boolean, defaults to False. If set, pull into a mirror
+                       of the repository shared by all builders on the
+                       slave, and create the workdir with 'hg share' so
+                       that it uses the mirror's store.
         """
         self.repourl = repourl
         self.baseURL = baseURL
@@ -1112,7 +1201,9 @@ class Mercurial(Source):
                                  defaultBranch=defaultBranch,
                                  branchType=branchType,
                                  clobberOnBranchChange=clobberOnBranchChange,
+                                 mirror=mirror,
                                  )
+        self.args['mirror'] = mirror
         if repourl and baseURL:
             raise ValueError("you must provide exactly one of repourl and"
                              " baseURL")
@@ -1145,6 +1236,24 @@ class Mercurial(Source):
         cmd = LoggedRemoteCommand("hg", self.args)
         self.startCommand(cmd)
 
+    def getPrefetchArgs(self, sourcestamp):
+        # only a mirror can be updated ahead of the build
+        if not self.args.get('mirror'):
+            return None
+        if self.repourl:
+            repourl = self.computePrefetchRepositoryURL(self.repourl,
+                                                        sourcestamp)
+        else:
+            repourl = self.computePrefetchRepositoryURL(self.baseURL,
+                                                        sourcestamp)
+            if repourl:
+                repourl += sourcestamp.branch or self.branch or ''
+        if not repourl:
+            return None
+        return ("hg", {'workdir': self.workdir or 'build',
+                       'repourl': repourl,
+                       'mirror': True})
+
     def computeSourceRevision(self, changes):
         if not changes:
             return None
@@ -15,6 +15,10 @@
 
 
 import os.path, tarfile, tempfile
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 try:
     from cStringIO import StringIO
     assert StringIO
@@ -391,11 +395,34 @@ class DirectoryUpload(BuildStep):
 
 class _FileReader(pb.Referenceable):
     """
-    Helper class that acts as a file-object with read access
+    Helper class that acts as a file-object with read access.
+
+    For delta downloads, the slave first sends the signatures (MD5 digests)
+    of the blocks of its existing copy of the file with
+    L{remote_addSignatures}, and then reads with L{remote_readDelta}, which
+    refers to those blocks rather than sending data the slave already has.
+    Only aligned blocks are matched; that is, a block of the master's file
+    can be replaced with any block of the slave's file, but insertions that
+    shift the remainder of the file are not detected.
     """
 
+    # maximum number of block references to return from one readDelta call
+    MAX_DELTA_OPS = 1024
+    # maximum number of literal bytes to return from one readDelta call,
+    # keeping the reply well below PB's 640K string limit
+    MAX_DELTA_LITERAL = 512*1024
+
     def __init__(self, fp):
         self.fp = fp
+        # (replaced by remote_addSignatures; this default only matters if
+        # the slave sends no signatures at all)
+        self.deltaBlocksize = 32*1024
+        self.signatures = {}
+        # the rest of a literal block that did not fit in the last
+        # readDelta reply
+        self.deltaPending = ''
+        self.bytes_sent = 0
+        self.bytes_saved = 0
 
     def remote_read(self, maxlength):
         """
@@ -411,8 +438,70 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self.bytes_sent += len(data)
         return data
 
+    def remote_addSignatures(self, blocksize, first, signatures):
+        """
+        Called from remote slave to describe the blocks of its existing copy
+        of the file
+
+        @type  blocksize: C{integer}
+        @param blocksize: size of each block
+        @type  first: C{integer}
+        @param first: index of the first block described by L{signatures}
+        @type  signatures: C{list} of C{string}
+        @param signatures: the MD5 digest of each block
+        """
+        self.deltaBlocksize = blocksize
+        for i, sig in enumerate(signatures):
+            self.signatures.setdefault(sig, first + i)
+
+    def remote_readDelta(self, maxlength):
+        """
+        Called from remote slave to read the next part of the file as a
+        delta against the blocks given to L{remote_addSignatures}.
+
+        @type  maxlength: C{integer}
+        @param maxlength: Maximum number of literal data bytes to return
+                          (further limited to L{MAX_DELTA_LITERAL})
+
+        @return: a list of operations, each either a string of literal data
+                 or an integer index of a block of the slave's copy of the
+                 file. An empty list indicates the end of the file.
+        """
+        ops = []
+        if self.fp is None:
+            return ops
+
+        limit = min(maxlength, self.MAX_DELTA_LITERAL)
+        literal = 0
+        while literal < limit and len(ops) < self.MAX_DELTA_OPS:
+            if self.deltaPending:
+                block, self.deltaPending = self.deltaPending, ''
+                index = None
+            else:
+                block = self.fp.read(self.deltaBlocksize)
+                if not block:
+                    break
+                index = self.signatures.get(md5(block).digest())
+            if index is not None:
+                ops.append(index)
+                self.bytes_saved += len(block)
+                continue
+            # split literal blocks that would overshoot the limit, keeping
+            # the rest for the next call so that reads stay block-aligned
+            if literal + len(block) > limit:
+                self.deltaPending = block[limit - literal:]
+                block = block[:limit - literal]
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += block
+            else:
+                ops.append(block)
+            literal += len(block)
+        self.bytes_sent += literal
+        return ops
+
     def remote_close(self):
         """
         Called by remote slave to state that no more data will be transfered
@@ -442,12 +531,17 @@ class FileDownload(_TransferBuildStep):
                    the buildslave account, or 0755 to be world-executable.
                    The default (=None) is to leave it up to the umask of
                    the buildslave process.
+     ['delta']     if true, and the slave already has a copy of slavedest,
+                   only send the blocks of the file which differ from that
+                   copy
+     ['deltablocksize'] size of the blocks compared in delta mode
 
     """
     name = 'download'
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
+                 delta=False, deltablocksize=32*1024,
                  **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(mastersrc=mastersrc,
@@ -456,6 +550,8 @@ class FileDownload(_TransferBuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  mode=mode,
+                                 delta=delta,
+                                 deltablocksize=deltablocksize,
                                  )
 
         self.mastersrc = mastersrc
@@ -465,6 +561,9 @@ class FileDownload(_TransferBuildStep):
         self.blocksize = blocksize
         assert isinstance(mode, (int, type(None)))
         self.mode = mode
+        self.delta = delta
+        self.deltablocksize = deltablocksize
+        self.fileReader = None
 
     def start(self):
         properties = self.build.getProperties()
@@ -495,7 +594,7 @@ class FileDownload(_TransferBuildStep):
             # maybeDeferred, just re-raise the exception here.
             reactor.callLater(0, BuildStep.finished, self, FAILURE)
             return
-        fileReader = _FileReader(fp)
+        fileReader = self.fileReader = _FileReader(fp)
 
         # default arguments
         args = {
@@ -507,10 +606,28 @@ class FileDownload(_TransferBuildStep):
             'mode': self.mode,
             }
 
+        if self.delta:
+            if self.slaveVersionIsOlderThan("downloadFile", "2.13"):
+                log.msg("slave is too old for delta downloads; "
+                        "sending the whole file")
+            else:
+                args['delta'] = True
+                args['deltablocksize'] = self.deltablocksize
+
         self.cmd = StatusRemoteCommand('downloadFile', args)
         d = self.runCommand(self.cmd)
         d.addCallback(self.finished).addErrback(self.failed)
 
+    def finished(self, result):
+        if self.delta and self.fileReader and result != SKIPPED:
+            sent = self.fileReader.bytes_sent
+            saved = self.fileReader.bytes_saved
+            self.step_status.setStatistic('bytes_sent', sent)
+            self.step_status.setStatistic('bytes_saved', saved)
+            self.addCompleteLog('delta',
+                    "sent %d bytes, saved %d bytes\n" % (sent, saved))
+        return _TransferBuildStep.finished(self, result)
+
 class StringDownload(_TransferBuildStep):
     """
     Download the first 'maxsize' bytes of a string, from the buildmaster to the
@@ -15,7 +15,7 @@
 
 from buildbot.process.buildstep import LoggingBuildStep, SUCCESS, FAILURE, EXCEPTION
 from buildbot.process.properties import Properties
-from buildbot.schedulers.triggerable import Triggerable
+from buildbot.schedulers.triggerable import Triggerable, triggerSchedulers
 from twisted.python import log
 from twisted.internet import defer
 
@@ -141,10 +141,14 @@ class Trigger(LoggingBuildStep):
         else:
             d = ss.getSourceStampId(master)
         def start_builds(ssid):
-            dl = []
-            for scheduler in triggered_schedulers:
-                sch = all_schedulers[scheduler]
-                dl.append(sch.trigger(ssid, set_props=props_to_set))
+            # add the buildsets for all of the schedulers at once
+            return triggerSchedulers(master,
+                    [ all_schedulers[scheduler]
+                      for scheduler in triggered_schedulers ],
+                    ssid, set_props=props_to_set)
+        d.addCallback(start_builds)
+
+        def wait_for_builds(dl):
             self.step_status.setText(['triggered'] + triggered_schedulers)
 
             d = defer.DeferredList(dl, consumeErrors=1)
@@ -155,7 +159,7 @@ class Trigger(LoggingBuildStep):
                 d.addErrback(log.err,
                         '(ignored) while invoking Triggerable schedulers:')
                 return None
-        d.addCallback(start_builds)
+        d.addCallback(wait_for_builds)
 
         def cb(rclist):
             rc = SUCCESS # (this rc is not the same variable as that above)
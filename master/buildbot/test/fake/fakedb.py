@@ -20,6 +20,7 @@ the real connector components.
 """
 
 import base64
+import zlib
 from buildbot.util import json, epoch2datetime
 from twisted.python import failure
 from twisted.internet import defer, reactor
@@ -150,6 +151,8 @@ class Patch(Row):
         id = None,
         patchlevel = 0,
         patch_base64 = 'aGVsbG8sIHdvcmxk', # 'hello, world'
+        compressed = 0,
+        patch_sha1 = None,
         subdir = None,
     )
 
@@ -370,6 +373,12 @@ class FakeSchedulersComponent(FakeDBComponent):
         self.classifications.setdefault(schedulerid, {}).update(classifications)
         return defer.succeed(None)
 
+    def classifyChangesForSchedulers(self, classifications):
+        for schedulerid, sched_classifications in classifications.items():
+            self.classifications.setdefault(schedulerid, {}).update(
+                    sched_classifications)
+        return defer.succeed(None)
+
     def flushChangeClassifications(self, schedulerid, less_than=None):
         if less_than is not None:
             classifications = self.classifications.setdefault(schedulerid, {})
@@ -380,7 +389,15 @@ class FakeSchedulersComponent(FakeDBComponent):
             self.classifications[schedulerid] = {}
         return defer.succeed(None)
 
+    def getChangeClassificationsForBranches(self, schedulerid, branches):
+        return defer.succeed(dict([
+            (branch, self._getClassifications(schedulerid, branch))
+            for branch in branches ]))
+
     def getChangeClassifications(self, schedulerid, branch=-1):
+        return defer.succeed(self._getClassifications(schedulerid, branch))
+
+    def _getClassifications(self, schedulerid, branch):
         classifications = self.classifications.setdefault(schedulerid, {})
         if branch is not -1:
             # filter out the classifications for the requested branch
@@ -390,7 +407,7 @@ class FakeSchedulersComponent(FakeDBComponent):
             classifications = dict(
                     (k,v) for (k,v) in classifications.iteritems()
                     if k in change_branches and change_branches[k] == branch )
-        return defer.succeed(classifications)
+        return classifications
 
     # fake methods
 
@@ -422,9 +439,12 @@ class FakeSourceStampsComponent(FakeDBComponent):
     def insertTestData(self, rows):
         for row in rows:
             if isinstance(row, Patch):
+                body = base64.b64decode(row.patch_base64)
+                if row.compressed:
+                    body = zlib.decompress(body)
                 self.patches[row.id] = dict(
                     patch_level=row.patchlevel,
-                    patch_body=base64.b64decode(row.patch_base64),
+                    patch_body=body,
                     patch_subdir=row.subdir)
 
         for row in rows:
@@ -449,14 +469,20 @@ class FakeSourceStampsComponent(FakeDBComponent):
         changeids = set(changeids)
 
         if patch_body:
-            patchid = len(self.patches) + 100
-            while patchid in self.patches:
-                patchid += 1
-            self.patches[patchid] = dict(
+            patch = dict(
                 patch_level=patch_level,
                 patch_body=patch_body,
                 patch_subdir=patch_subdir,
             )
+            # share identical patches, as the real component does
+            for patchid, existing in self.patches.iteritems():
+                if existing == patch:
+                    break
+            else:
+                patchid = len(self.patches) + 100
+                while patchid in self.patches:
+                    patchid += 1
+                self.patches[patchid] = patch
         else:
             patchid = None
 
@@ -518,6 +544,40 @@ class FakeBuildsetsComponent(FakeDBComponent):
         self.buildsets[bsid] = kwargs
         return defer.succeed(bsid)
 
+    def addBuildsets(self, buildsets):
+        bsids = []
+        for buildset in buildsets:
+            kwargs = buildset.copy()
+            kwargs.setdefault('external_idstring', None)
+            bsid = kwargs['id'] = self._newBsid()
+            self.buildsets[bsid] = kwargs
+            bsids.append(bsid)
+        return defer.succeed(bsids)
+
+    def addBuildsetsForChanges(self, buildsets, flushSchedulerid=None):
+        ids = []
+        for buildset in buildsets:
+            kwargs = buildset.copy()
+            changeids = kwargs.pop('changeids')
+            change = self.db.changes.changes[max(changeids)]
+            ssid = []
+            self.db.sourcestamps.createSourceStamp(
+                    branch=change.branch, revision=change.revision,
+                    repository=change.repository, project=change.project,
+                    changeids=changeids).addCallback(ssid.append)
+            ssid = ssid[0]
+            kwargs.setdefault('external_idstring', None)
+            bsid = kwargs['id'] = self._newBsid()
+            kwargs['ssid'] = ssid
+            self.buildsets[bsid] = kwargs
+            ids.append((bsid, ssid))
+            if flushSchedulerid is not None:
+                classifications = self.db.schedulers.classifications.get(
+                                                        flushSchedulerid, {})
+                for changeid in changeids:
+                    classifications.pop(changeid, None)
+        return defer.succeed(ids)
+
     def subscribeToBuildset(self, schedulerid, buildsetid):
         self.buildset_subs.append((schedulerid, buildsetid))
         return defer.succeed(None)
@@ -582,8 +642,9 @@ class FakeBuildsetsComponent(FakeDBComponent):
         expected; the ssid parameter of the buildset is omitted.  Properties
         are converted with asList and sorted.  Sourcestamp patches are inlined
         (patch_body, patch_level, patch_subdir), and changeids are represented
-        as a set, but omitted if empty.  If bsid is '?', then assert there is
-        only one new buildset, and use that."""
+        as a set, but omitted if empty.  The buildset's priority is omitted
+        if it is zero.  If bsid is '?', then assert there is only one new
+        buildset, and use that."""
         if bsid == '?':
             self.assertBuildsets(1)
             bsid = self.buildsets.keys()[0]
@@ -596,6 +657,8 @@ class FakeBuildsetsComponent(FakeDBComponent):
 
         if 'id' in buildset:
             del buildset['id']
+        if not buildset.get('priority', 1):
+            del buildset['priority']
 
         if buildset['properties']:
             buildset['properties'] = sorted(buildset['properties'].items())
@@ -739,6 +802,21 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             rv.append(self._brdictFromRow(br))
         return defer.succeed(rv)
 
+    def getUnclaimedBuildRequests(self, buildername, limit=None,
+                                  agingInterval=None):
+        def key(br):
+            if agingInterval:
+                rank = br.priority * agingInterval - br.submitted_at
+            else:
+                rank = br.priority
+            return (-rank, br.submitted_at, br.id)
+        reqs = [ br for br in self.reqs.itervalues()
+                 if br.buildername == buildername and not br.claimed_at ]
+        reqs.sort(key=key)
+        if limit is not None:
+            reqs = reqs[:limit]
+        return defer.succeed([ self._brdictFromRow(br) for br in reqs ])
+
     def claimBuildRequests(self, brids):
         for brid in brids:
             if brid not in self.reqs:
@@ -20,8 +20,8 @@ from twisted.internet import defer
 class MockRequest(Mock):
     """
     A fake Twisted Web Request object, including some pointers to the
-    buildmaster and an addChange method on that master which will append its
-    arguments to self.addedChanges.
+    buildmaster and addChange and addChanges methods on that master which
+    will append their arguments to self.addedChanges.
     """
     def __init__(self, args={}):
         self.args = args
@@ -34,5 +34,9 @@ class MockRequest(Mock):
             self.addedChanges.append(kwargs)
             return defer.succeed(Mock())
         master.addChange = addChange
+        def addChanges(changes):
+            self.addedChanges.extend(changes)
+            return defer.succeed([ Mock() for ch in changes ])
+        master.addChanges = addChanges
 
         Mock.__init__(self)
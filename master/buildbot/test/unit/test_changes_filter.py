@@ -123,3 +123,47 @@ class ChangeFilter(unittest.TestCase):
         self.yes(Change(project='p', repository='r', branch='b', category='c', ff=True),
                 "all match and fn returns True -> False")
         self.check()
+
+    def test_getChangeKey(self):
+        self.setfilter(project='p', branch_re='^b')
+        self.assertEqual(
+            self.filt.getChangeKey(Change(project='p', branch='bx', x=1)),
+            self.filt.getChangeKey(Change(project='p', branch='bx', x=2)))
+        self.assertNotEqual(
+            self.filt.getChangeKey(Change(project='p', branch='bx')),
+            self.filt.getChangeKey(Change(project='p', branch='by')))
+
+    def test_getChangeKey_fn(self):
+        self.setfilter(project='p', branch_fn=lambda b : True)
+        self.assertEqual(self.filt.getChangeKey(Change(project='p')), None)
+        self.setfilter(filter_fn=lambda c : True)
+        self.assertEqual(self.filt.getChangeKey(Change(project='p')), None)
+
+    def test_getChangeKey_subclass(self):
+        class MyFilter(filter.ChangeFilter):
+            def filter_change(self, change):
+                return change.x == 1
+        self.filt = MyFilter(project='p')
+        self.assertEqual(self.filt.getChangeKey(Change(project='p', x=1)),
+                         None)
+
+    def test_getIndexableCheck(self):
+        self.setfilter(project='p', branch=['a', 'b'], category_re='c')
+        self.assertEqual(self.filt.getIndexableCheck(),
+                         ('project', frozenset(['p'])))
+
+    def test_getIndexableCheck_branch_None(self):
+        self.setfilter(branch=None)
+        self.assertEqual(self.filt.getIndexableCheck(),
+                         ('branch', frozenset([None])))
+
+    def test_getIndexableCheck_none(self):
+        self.setfilter(branch_re='b', project_fn=lambda p : True)
+        self.assertEqual(self.filt.getIndexableCheck(), None)
+
+    def test_getIndexableCheck_subclass(self):
+        class MyFilter(filter.ChangeFilter):
+            def filter_change(self, change):
+                return change.x == 1
+        self.filt = MyFilter(project='p')
+        self.assertEqual(self.filt.getIndexableCheck(), None)
@@ -15,86 +15,70 @@
 
 from twisted.trial import unittest
 from twisted.internet import defer
-from exceptions import Exception
 from buildbot.changes import gitpoller
 from buildbot.test.util import changesource, gpo
 
-class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
-    """Test GitPoller methods for parsing git output"""
+def git_log_output(*commits):
+    """Build the output of 'git log -z --name-only' with GitPoller's
+    LOG_FORMAT for the given (rev, timestamp, email, comments, files[,
+    parents]) tuples"""
+    output = []
+    for commit in commits:
+        rev, timestamp, email, comments, files = commit[:5]
+        parents = ' '.join(commit[5:6] and commit[5] or [])
+        output.append('\x01%s\n%s\n%s\n%s\n%s\n\0'
+                % (rev, parents, timestamp, email, comments))
+        if files:
+            output.append('\n' + ''.join([ f + '\0' for f in files ]))
+    return ''.join(output)
+
+class GitOutputParsing(unittest.TestCase):
+    """Test GitPoller's parsing of git log output"""
     def setUp(self):
         self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
-        self.setUpGetProcessOutput()
 
-    def tearDown(self):
-        self.tearDownGetProcessOutput()
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        dummyRevStr = '12345abcde'
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
-        self.addGetProcessOutputResult(self.gpoAnyPattern(), '')
-
-        d = defer.succeed(None)
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_empty)
-    
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-
-        # and the method shouldn't supress any exceptions
-        def call_exception(_):
-            # we should get an Exception with empty output from git
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                    lambda b, a, **k: defer.fail(Exception('fake')))
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_exception)
-    
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on empty output")
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-
-        # finally we should get what's expected from good output
-        def call_desired(_):
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                desiredGoodOutput)
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_desired)
-    
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        
-    def test_get_commit_name(self):
-        nameStr = 'Sammy Jankis'
-        return self._perform_git_output_test(self.poller._get_commit_name,
-                nameStr, nameStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        return self._perform_git_output_test(self.poller._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                stampStr, float(stampStr))
+    def test_parse_log(self):
+        output = git_log_output(
+            ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258010',
+             'sammy@example.com', 'empty commit', [],
+             ['4423cdbcbb89c14e50dd5f4152415afd686c5241']),
+            ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+             'sammy@example.com', 'this is a commit message\n\nthat is multiline',
+             ['file1', 'dir/file with spaces']))
+        self.assertEqual(self.poller._parse_log(output), [
+            dict(revision='64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+                 parents=['4423cdbcbb89c14e50dd5f4152415afd686c5241'],
+                 timestamp=1273258010.0, name=u'sammy@example.com',
+                 files=[], comments=u'empty commit'),
+            dict(revision='4423cdbcbb89c14e50dd5f4152415afd686c5241',
+                 parents=[], timestamp=1273258009.0, name=u'sammy@example.com',
+                 files=['file1', 'dir/file with spaces'],
+                 comments=u'this is a commit message\n\nthat is multiline'),
+        ])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(self.poller._parse_log(''), [])
+
+    def test_parse_log_no_timestamps(self):
+        self.poller.usetimestamps = False
+        output = git_log_output(('12345abcde', '1273258009', 'sammy@example.com',
+                                 'msg', ['file1']))
+        self.assertEqual(self.poller._parse_log(output)[0]['timestamp'], None)
+
+    def test_parse_log_bad_timestamp(self):
+        output = git_log_output(('12345abcde', 'notatime', 'sammy@example.com',
+                                 'msg', ['file1']))
+        self.assertRaises(ValueError, self.poller._parse_log, output)
+
+    def test_parse_log_empty_comments(self):
+        output = git_log_output(('12345abcde', '1273258009', 'sammy@example.com',
+                                 '', ['file1']))
+        self.assertRaises(EnvironmentError, self.poller._parse_log, output)
+
+    def test_parse_log_empty_name(self):
+        output = git_log_output(('12345abcde', '1273258009', '',
+                                 'msg', ['file1']))
+        self.assertRaises(EnvironmentError, self.poller._parse_log, output)
 
     # _get_changes is tested in TestGitPoller, below
 
@@ -124,30 +108,20 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         self.addGetProcessOutputResult(
                 self.gpoSubcommandPattern('git', 'fetch'),
                 "no interesting output")
+        # a single 'git log' gets everything, newest first
+        def log(bin, args, **kwargs):
+            self.assertEqual(args[-1], 'master..origin/master')
+            return git_log_output(
+                ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258009',
+                 'by:64a5dc2a', 'hello!', ['/etc/64a']),
+                ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+                 'by:4423cdbc', 'hello!', ['/etc/442']))
         self.addGetProcessOutputResult(
-                self.gpoSubcommandPattern('git', 'log'),
-                '\n'.join([
-                    '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                    '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
+                self.gpoSubcommandPattern('git', 'log'), log)
         self.addGetProcessOutputAndValueResult(
                 self.gpoSubcommandPattern('git', 'reset'),
                 ('done', '', 0))
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def name(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_name', name)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         d = self.poller.poll()
 
@@ -163,6 +137,156 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             self.assertEqual(self.changes_added[1]['when'], 1273258009.0)
             self.assertEqual(self.changes_added[1]['comments'], 'hello!')
             self.assertEqual(self.changes_added[1]['files'], [ '/etc/64a' ])
+            # the workdir was caught up
+            self.assertEqual(self._gpoav_patterns, [])
+        d.addCallback(check)
+
+        return d
+
+    def test_poll_no_changes(self):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'),
+                "no interesting output")
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'), '')
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(self.changes_added, [])
+        d.addCallback(check)
+        return d
+
+    def test_poll_branches(self):
+        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                branches=['master', 'release', 'new'])
+        self.poller.master = self.master
+
+        # one fetch for all of the branches
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'),
+                "no interesting output")
+        logs = {
+            'master..origin/master' : git_log_output(
+                ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+                 'by:4423cdbc', 'on master', ['a'])),
+            'release..origin/release' : git_log_output(
+                ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258009',
+                 'by:64a5dc2a', 'on release', ['b'])),
+        }
+        def log(bin, args, **kwargs):
+            if args[-1] not in logs:
+                # the local branch for 'new' does not exist yet
+                return defer.fail(IOError("unknown revision"))
+            return logs[args[-1]]
+        for i in range(3):
+            self.addGetProcessOutputResult(
+                    self.gpoSubcommandPattern('git', 'log'), log)
+        updates = []
+        def update(bin, args, **kwargs):
+            updates.append(args)
+            return ('done', '', 0)
+        for i in range(3):
+            self.addGetProcessOutputAndValueResult(self.gpoAnyPattern(), update)
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual([ (ch['branch'], ch['comments'])
+                               for ch in self.changes_added ],
+                    [ ('master', 'on master'), ('release', 'on release') ])
+            self.assertEqual(updates, [
+                ['reset', '--hard', 'origin/master'],
+                ['branch', '-f', 'release', 'origin/release'],
+                ['branch', '-f', 'new', 'origin/new'],
+            ])
         d.addCallback(check)
+        return d
+
+    def test_branch_patterns_need_bare(self):
+        self.assertRaises(ValueError, lambda :
+                gitpoller.GitPoller('git@example.com:foo/baz.git',
+                                    branches=['release/*']))
+
+class TestGitPollerMirror(gpo.GetProcessOutputMixin,
+                    changesource.ChangeSourceMixin,
+                    unittest.TestCase):
+
+    def setUp(self):
+        self.setUpGetProcessOutput()
+        d = self.setUpChangeSource()
+        def create_poller(_):
+            self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                    branches=['master', 'release/*'], bare=True)
+            self.poller.master = self.master
+        d.addCallback(create_poller)
+        return d
+
+    def tearDown(self):
+        self.tearDownGetProcessOutput()
+        return self.tearDownChangeSource()
+
+    def expectRefs(self, current, seen):
+        lines = [ '%s refs/remotes/origin/%s' % (sha, branch)
+                  for branch, sha in current ]
+        lines += [ '%s refs/buildbot/heads/%s' % (sha, branch)
+                   for branch, sha in seen ]
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'for-each-ref'),
+                '\n'.join(lines) + '\n')
+
+    def expectUpdateRefs(self, n):
+        self.updates = []
+        def update(bin, args, **kwargs):
+            self.updates.append(args)
+            return ('', '', 0)
+        for i in range(n):
+            self.addGetProcessOutputAndValueResult(
+                    self.gpoSubcommandPattern('git', 'update-ref'), update)
+
+    def test_describe(self):
+        self.assertSubstring("master, release/*", self.poller.describe())
+
+    def test_poll(self):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), '')
+        self.expectRefs(
+            current=[ ('HEAD', 'm2'), ('master', 'm2'), ('release/1.0', 'r2'),
+                      ('release/2.0', 'm1'), ('topic', 't1') ],
+            seen=[ ('master', 'm1'), ('release/1.0', 'r1'), ('gone', 'g1') ])
+        # m2 and r2 both merge x1, which should only be reported once, on
+        # master; release/2.0 is new, but everything on it was seen already
+        def log(bin, args, **kwargs):
+            self.assertEqual(args[5:], [ 'm1', 'm2', 'r2',
+                                         '^g1', '^m1', '^r1', '--' ])
+            return git_log_output(
+                ('r2', '1273258012', 'bob', 'release fix', ['r'], ['r1', 'x1']),
+                ('m2', '1273258011', 'sam', 'merge x', ['m'], ['m1', 'x1']),
+                ('x1', '1273258010', 'sam', 'feature', ['x'], ['m1']))
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'log'), log)
+        self.expectUpdateRefs(4)
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual([ (ch['revision'], ch['branch'])
+                               for ch in self.changes_added ],
+                    [ ('x1', 'master'), ('m2', 'master'),
+                      ('r2', 'release/1.0') ])
+            self.assertEqual(self.updates, [
+                ['update-ref', '-d', 'refs/buildbot/heads/gone'],
+                ['update-ref', 'refs/buildbot/heads/master', 'm2'],
+                ['update-ref', 'refs/buildbot/heads/release/1.0', 'r2'],
+                ['update-ref', 'refs/buildbot/heads/release/2.0', 'm1'],
+            ])
+        d.addCallback(check)
+        return d
 
+    def test_poll_no_changes(self):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), '')
+        self.expectRefs(current=[ ('master', 'm1') ], seen=[ ('master', 'm1') ])
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(self.changes_added, [])
+        d.addCallback(check)
         return d
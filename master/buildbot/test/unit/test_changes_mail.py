@@ -15,7 +15,8 @@
 
 import os
 from twisted.trial import unittest
-from buildbot.test.util import changesource, dirs
+from twisted.internet import defer
+from buildbot.test.util import changesource, dirs, compat
 from buildbot.changes import mail
 
 class TestMaildirSource(changesource.ChangeSourceMixin, dirs.DirsMixin,
@@ -73,3 +74,42 @@ class TestMaildirSource(changesource.ChangeSourceMixin, dirs.DirsMixin,
             self.assertEqual(self.changes_added[0]['fake_chdict'], 1)
         d.addCallback(check)
         return d
+
+    @compat.usesFlushLoggedErrors
+    def test_messagesReceived_batches(self):
+        self.populateMaildir()
+        newdir = os.path.join(self.maildir, "new")
+        for name in ('msg2', 'msg3', 'msg4'):
+            open(os.path.join(newdir, name), "w").write(
+                    "Subject: %s\n\nthis is a test" % name)
+        mds = mail.MaildirSource(self.maildir)
+        mds.batchSize = 2
+        self.attachChangeSource(mds)
+
+        batches = []
+        def addChanges(changes):
+            batches.append([ ch['subject'] for ch in changes ])
+            self.changes_added.extend(changes)
+            return defer.succeed([])
+        self.master.addChanges = addChanges
+
+        def parse(message, prefix):
+            if message['subject'] == 'msg3':
+                raise RuntimeError("unparseable")
+            if message['subject'] == 'msg4':
+                return None
+            return dict(subject=message['subject'])
+        mds.parse = parse
+
+        d = mds.messagesReceived(['msg2', 'msg3', 'msg4', 'newmsg'])
+        def check(_):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            # one addChanges call for each batch with changes in it
+            self.assertEqual(batches, [ ['msg2'], ['test'] ])
+            # the unparseable message is left behind
+            self.assertEqual(sorted(os.listdir(newdir)), ['msg3'])
+            self.assertEqual(mds.messagesProcessed, 3)
+            self.assertEqual(mds.changesAdded, 2)
+            self.assertSubstring("3 messages, 2 changes", mds.describe())
+        d.addCallback(check)
+        return d
@@ -14,7 +14,7 @@
 # Copyright Buildbot Team Members
 
 import os
-import xml.dom.minidom
+import xml.parsers.expat
 from twisted.internet import defer
 from twisted.trial import unittest
 from buildbot.test.util import changesource, gpo, compat
@@ -232,10 +232,17 @@ def make_changes_output(maxrevision):
     output = changes_output_template % ("".join(logs))
     return output
 
-def make_logentry_elements(maxrevision):
-    "return the corresponding logentry elements for the given revisions"
-    doc = xml.dom.minidom.parseString(make_changes_output(maxrevision))
-    return doc.getElementsByTagName("logentry")
+def make_logentries(maxrevision):
+    "return the corresponding parsed log entries for the given revisions"
+    parser = svnpoller.LogParser()
+    parser.feed(make_changes_output(maxrevision))
+    return parser.close()
+
+def make_range_output(minrevision, maxrevision):
+    # return what 'svn log --revision=MIN:HEAD' would have just after the
+    # given revision was committed
+    logs = sample_logentries[minrevision-1:maxrevision]
+    return changes_output_template % ("".join(logs))
 
 def split_file(path):
     pieces = path.split("/")
@@ -311,29 +318,51 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         s = self.attachSVNPoller('file:///foo')
         output = make_changes_output(4)
         entries = s.parse_logs(output)
-        # no need for elaborate assertions here; this is minidom's logic
-        self.assertEqual(len(entries), 4)
+        self.assertEqual([ e['revision'] for e in entries ], [4, 3, 2, 1])
+        self.assertEqual(entries[1], dict(revision=3, author=u'warner',
+                msg=u'commit_on_branch',
+                paths=[(u'M', u'/sample/branch/main.c')]))
+        self.assertEqual(len(entries[3]['paths']), 6)
+
+    def test_log_parsing_pieces(self):
+        # the parser can be fed any amount of output at a time
+        output = make_changes_output(6)
+        parser = svnpoller.LogParser()
+        for i in range(0, len(output), 7):
+            parser.feed(output[i:i+7])
+        self.assertEqual(parser.close(), make_logentries(6))
+
+    def test_log_parsing_missing_elements(self):
+        s = self.attachSVNPoller('file:///foo')
+        entries = s.parse_logs(changes_output_template %
+                '<logentry revision="7"><msg></msg></logentry>\n')
+        self.assertEqual(entries, [ dict(revision=7, author=u'<unknown>',
+                                         msg=u'', paths=None) ])
+
+    def test_log_parsing_error(self):
+        s = self.attachSVNPoller('file:///foo')
+        self.assertRaises(xml.parsers.expat.ExpatError,
+                          s.parse_logs, '<log><logentry')
 
     def test_get_new_logentries(self):
         s = self.attachSVNPoller('file:///foo')
-        entries = make_logentry_elements(4)
+        entries = make_logentries(4)
 
         s.last_change = 4
         new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
         self.assertEqual(len(new), 0)
 
         s.last_change = 3
         new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 1)
+        self.assertEqual([ e['revision'] for e in new ], [4])
 
+        # returned oldest first
         s.last_change = 1
         new = s.get_new_logentries(entries)
-        self.assertEqual(s.last_change, 4)
-        self.assertEqual(len(new), 3)
+        self.assertEqual([ e['revision'] for e in new ], [2, 3, 4])
 
-        # special case: if last_change is None, then no new changes are queued
+        # special case: if last_change is None, then no new changes are
+        # queued, but last_change is set
         s.last_change = None
         new = s.get_new_logentries(entries)
         self.assertEqual(s.last_change, 4)
@@ -345,7 +374,7 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         s = self.attachSVNPoller(base, split_file=split_file)
         s._prefix = "sample"
 
-        logentries = dict(zip(xrange(1, 7), reversed(make_logentry_elements(6))))
+        logentries = dict(zip(xrange(1, 7), reversed(make_logentries(6))))
         changes = s.create_changes(reversed([ logentries[3], logentries[2] ]))
         self.failUnlessEqual(len(changes), 2)
         # note that parsing occurs in reverse
@@ -378,31 +407,44 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
 
         d = defer.succeed(None)
 
+        self.log_args = []
+        def log_result(output):
+            def fn(bin, args, **kwargs):
+                self.log_args.append(args)
+                return output
+            return fn
+
         # fire it the first time; it should do nothing
         def setup_first(_):
             self.add_svn_command_result('info', sample_info_output) # for get_root
-            self.add_svn_command_result('log', make_changes_output(1))
+            self.add_svn_command_result('log',
+                    log_result(make_changes_output(1)))
         d.addCallback(setup_first)
         d.addCallback(lambda _ : s.poll())
         def check_first(_):
             # no changes generated on the first iteration
             self.assertEqual(self.changes_added, [])
             self.failUnlessEqual(s.last_change, 1)
+            self.assertTrue('--limit=1' in self.log_args[-1])
         d.addCallback(check_first)
 
         # now fire it again, nothing changing
         def setup_second(_):
-            self.add_svn_command_result('log', make_changes_output(1))
+            self.add_svn_command_result('log',
+                    log_result(make_range_output(1, 1)))
         d.addCallback(setup_second)
         d.addCallback(lambda _ : s.poll())
         def check_second(_):
             self.assertEqual(self.changes_added, [])
             self.failUnlessEqual(s.last_change, 1)
+            # only the revisions since the last change are asked for
+            self.assertTrue('--revision=1:HEAD' in self.log_args[-1])
         d.addCallback(check_second)
 
         # and again, with r2 this time
         def setup_third(_):
-            self.add_svn_command_result('log', make_changes_output(2))
+            self.add_svn_command_result('log',
+                    log_result(make_range_output(1, 2)))
         d.addCallback(setup_third)
         d.addCallback(lambda _ : s.poll())
         def check_third(_):
@@ -418,7 +460,8 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
         # and again with both r3 and r4 appearing together
         def setup_fourth(_):
             self.changes_added = []
-            self.add_svn_command_result('log', make_changes_output(4))
+            self.add_svn_command_result('log',
+                    log_result(make_range_output(2, 4)))
         d.addCallback(setup_fourth)
         d.addCallback(lambda _ : s.poll())
         def check_fourth(_):
@@ -434,10 +477,95 @@ class TestSVNPoller(gpo.GetProcessOutputMixin,
             self.failUnlessEqual(c['files'], ["version.c"])
             self.failUnlessEqual(c['comments'], "revised_to_2")
             self.failUnlessEqual(s.last_change, 4)
+            self.assertTrue('--revision=2:HEAD' in self.log_args[-1])
         d.addCallback(check_fourth)
 
         return d
 
+    def fake_batched_log(self, batches, last_rev):
+        # return a fake 'svn log' that honors --revision and --limit, and
+        # records the first revision asked for in batches
+        def log(bin, args, **kwargs):
+            rev = [ a for a in args if a.startswith('--revision=') ][0]
+            first = int(rev[len('--revision='):].split(':')[0])
+            limit = [ a for a in args if a.startswith('--limit=') ][0]
+            limit = int(limit[len('--limit='):])
+            batches.append(first)
+            return make_range_output(first, min(first + limit - 1, last_rev))
+        return log
+
+    def test_poll_batches(self):
+        # with histmax=2, catching up from r1 to r6 takes several batches,
+        # all in the same poll
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                histmax=2)
+        s._prefix = 'sample'
+        s.last_change = 1
+        cachepath = os.path.abspath('revcache')
+        s.cachepath = cachepath
+
+        batches = []
+        for i in range(6):
+            self.add_svn_command_result('log',
+                    self.fake_batched_log(batches, 6))
+
+        d = s.poll()
+        def check(_):
+            # (the last batch is not full, so polling stops there)
+            self.assertEqual(batches, [1, 3, 5])
+            self.assertEqual([ c['revision'] for c in self.changes_added ],
+                             ['2', '3', '4', '6'])
+            self.assertEqual(s.last_change, 6)
+            self.assertEqual(open(cachepath).read().strip(), '6')
+        d.addCallback(check)
+        return d
+
+    def test_poll_batches_histmax_1(self):
+        # each batch still holds one new revision
+        s = self.attachSVNPoller(sample_base, split_file=split_file,
+                histmax=1)
+        s._prefix = 'sample'
+        s.last_change = 1
+
+        batches = []
+        for i in range(6):
+            self.add_svn_command_result('log',
+                    self.fake_batched_log(batches, 4))
+
+        d = s.poll()
+        def check(_):
+            self.assertEqual(batches, [1, 2, 3, 4])
+            self.assertEqual([ c['revision'] for c in self.changes_added ],
+                             ['2', '3', '4'])
+            self.assertEqual(s.last_change, 4)
+        d.addCallback(check)
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def test_poll_failure_keeps_progress(self):
+        s = self.attachSVNPoller(sample_base, split_file=split_file)
+        s._prefix = 'sample'
+        s.last_change = 1
+        self.add_svn_command_result('log', make_range_output(1, 4))
+
+        # fail when adding r3
+        def addChanges(changes):
+            if changes[0]['revision'] == '3':
+                return defer.fail(RuntimeError("db went away"))
+            self.changes_added.extend(changes)
+            return defer.succeed(None)
+        self.master.addChanges = addChanges
+
+        d = s.poll()
+        def check(_):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            self.assertEqual([ c['revision'] for c in self.changes_added ],
+                             ['2'])
+            # so the next poll will start after r2
+            self.assertEqual(s.last_change, 2)
+        d.addCallback(check)
+        return d
+
     def test_cachepath_empty(self):
         cachepath = os.path.abspath('revcache')
         if os.path.exists(cachepath):
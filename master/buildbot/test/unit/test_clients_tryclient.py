@@ -0,0 +1,199 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.test import proto_helpers
+from buildbot.clients import tryclient
+
+class Extractors(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(tryclient, 'which', lambda exe : [ '/usr/bin/' + exe ])
+
+    def makeExtractor(self, cls, branch=None, diffFrom=None):
+        e = cls('/tree', branch, diffFrom)
+        # record the VC commands, firing them from the test
+        self.vc_calls = []
+        def dovc(cmd):
+            d = defer.Deferred()
+            self.vc_calls.append((cmd, d))
+            return d
+        e.dovc = dovc
+        return e
+
+    def test_hg_concurrent(self):
+        e = self.makeExtractor(tryclient.MercurialExtractor)
+        d = e.get()
+        # both queries are running at once
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ],
+            [ ['identify', '--id', '--debug'], ['diff'] ])
+        self.vc_calls[1][1].callback('the diff')
+        self.vc_calls[0][1].callback('abcdef123 tip\n')
+        def check(ss):
+            self.assertEqual(ss.revision, 'abcdef123')
+            self.assertEqual(ss.patch, (1, 'the diff'))
+        d.addCallback(check)
+        return d
+
+    def test_hg_concurrent_failure(self):
+        e = self.makeExtractor(tryclient.MercurialExtractor)
+        d = e.get()
+        self.vc_calls[1][1].errback(RuntimeError('oh noes'))
+        self.vc_calls[0][1].callback('abcdef123 tip\n')
+        return self.assertFailure(d, RuntimeError)
+
+    def test_svn_sequential(self):
+        e = self.makeExtractor(tryclient.SVNExtractor)
+        d = e.get()
+        # the diff needs the base revision
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ],
+            [ ['status', '-u'] ])
+        self.vc_calls[0][1].callback('Status against revision:     1234\n')
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ][1:],
+            [ ['diff', '-r1234'] ])
+        self.vc_calls[1][1].callback('the diff')
+        d.addCallback(lambda ss : self.assertEqual(ss.revision, '1234'))
+        return d
+
+    def test_git_branch_and_config_concurrent(self):
+        e = self.makeExtractor(tryclient.GitExtractor)
+        d = e.get()
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ],
+            [ ['branch', '--no-color', '-v', '--no-abbrev'],
+              ['config', '-l'] ])
+        self.vc_calls[1][1].callback('branch.master.remote=origin\n'
+                                     'branch.master.merge=refs/heads/master\n')
+        self.vc_calls[0][1].callback('* master ' + 'a' * 40 + ' msg\n')
+        self.assertEqual(self.vc_calls[2][0],
+                         ['rev-parse', 'origin/master'])
+        self.vc_calls[2][1].callback('b' * 40 + '\n')
+        self.assertEqual(self.vc_calls[3][0], ['diff', 'b' * 40])
+        self.vc_calls[3][1].callback('the diff')
+        d.addCallback(lambda ss : self.assertEqual(ss.revision, 'b' * 40))
+        return d
+
+    def test_diffFrom(self):
+        e = self.makeExtractor(tryclient.SVNExtractor, diffFrom='1200')
+        d = e.get()
+        # the base revision is not looked up
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ],
+            [ ['diff', '-r1200'] ])
+        self.vc_calls[0][1].callback('the diff')
+        d.addCallback(lambda ss : self.assertEqual(ss.revision, '1200'))
+        return d
+
+    def test_diffFrom_hg(self):
+        e = self.makeExtractor(tryclient.MercurialExtractor, diffFrom='abc')
+        e.get()
+        self.assertEqual([ cmd for cmd, _ in self.vc_calls ],
+            [ ['diff', '-r', 'abc'] ])
+
+    def test_diffFrom_unsupported(self):
+        e = self.makeExtractor(tryclient.DarcsExtractor, diffFrom='abc')
+        d = e.get()
+        self.assertEqual(self.vc_calls, [])
+        return self.assertFailure(d, RuntimeError)
+
+class Delivery(unittest.TestCase):
+
+    def makeTry(self):
+        t = tryclient.Try(dict(connect='pb', builders=['a']))
+        t.quiet = True
+        t.patchChunkSize = 4
+        return t
+
+    def test_createJobfile(self):
+        job = tryclient.createJobfile('bsid', 'br', 12, 1, 'diff', 'repo',
+                                      'proj', ['a', 'b'])
+        self.assertEqual(job,
+            '1:2,4:bsid,2:br,2:12,1:1,4:diff,4:repo,4:proj,1:a,1:b,')
+
+    def test_createJobfile_priority(self):
+        job = tryclient.createJobfile('bsid', 'br', 12, 1, 'diff', 'repo',
+                                      'proj', ['a', 'b'], priority=10)
+        self.assertEqual(job,
+            '1:3,4:bsid,2:br,2:12,1:1,4:diff,4:repo,4:proj,2:10,1:a,1:b,')
+
+    def do_deliver_pb(self, diff, priority=None, with_kwargs=False):
+        t = self.makeTry()
+        t.priority = priority
+        t.sourcestamp = mock.Mock()
+        t.sourcestamp.patch = (1, diff)
+        remote = mock.Mock()
+        remote.callRemote.return_value = defer.succeed('status')
+        d = t._deliverJob_pb(remote)
+        if with_kwargs:
+            d.addCallback(lambda _ : remote.callRemote.call_args_list)
+        else:
+            d.addCallback(lambda _ : [ call[0] for call in
+                                       remote.callRemote.call_args_list ])
+        return d
+
+    def test_deliverJob_pb_priority(self):
+        d = self.do_deliver_pb('abcd', priority=10, with_kwargs=True)
+        def check(calls):
+            self.assertEqual(calls[0][1], dict(priority=10))
+        d.addCallback(check)
+        return d
+
+    def test_deliverJob_pb_no_priority(self):
+        d = self.do_deliver_pb('abcd', with_kwargs=True)
+        def check(calls):
+            self.assertEqual(calls[0][1], {})
+        d.addCallback(check)
+        return d
+
+    def test_deliverJob_pb_small(self):
+        d = self.do_deliver_pb('abcd')
+        def check(calls):
+            self.assertEqual([ call[0] for call in calls ], [ 'try' ])
+            self.assertEqual(calls[0][3], (1, 'abcd'))
+        d.addCallback(check)
+        return d
+
+    def test_deliverJob_pb_chunked(self):
+        d = self.do_deliver_pb('abcdefghij')
+        def check(calls):
+            self.assertEqual(calls[:3], [ ('addPatchChunk', 'abcd'),
+                ('addPatchChunk', 'efgh'), ('addPatchChunk', 'ij') ])
+            self.assertEqual(calls[3][0], 'try')
+            self.assertEqual(calls[3][3], (1, None))
+        d.addCallback(check)
+        return d
+
+    def test_RemoteTryPP_chunks(self):
+        progress = []
+        pp = tryclient.RemoteTryPP('x' * 40000,
+                lambda sent, total : progress.append((sent, total)))
+        transport = proto_helpers.StringTransport()
+        transport.closeStdin = mock.Mock()
+        pp.makeConnection(transport)
+        while transport.producer:
+            transport.producer.resumeProducing()
+        self.assertEqual(transport.value(), 'x' * 40000)
+        self.assertTrue(transport.closeStdin.called)
+        self.assertTrue(len(progress) > 1)
+        self.assertEqual(progress[-1], (40000, 40000))
+
+    def test_reportProgress(self):
+        t = self.makeTry()
+        announced = []
+        t.announce = announced.append
+        for sent in range(0, 101, 5):
+            t.reportProgress(sent, 100)
+        self.assertEqual(len(announced), 11)
+        self.assertEqual(announced[-1], 'sent 100% of 100 bytes')
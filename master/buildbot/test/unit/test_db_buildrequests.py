@@ -262,6 +262,54 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def do_test_getUnclaimedBuildRequests(self, expected, **kwargs):
+        d = self.insertTestData([
+            # 50: oldest, default priority
+            fakedb.BuildRequest(id=50, buildsetid=self.BSID, buildername="bbb",
+                submitted_at=1000),
+            # 51: newer, higher priority
+            fakedb.BuildRequest(id=51, buildsetid=self.BSID, buildername="bbb",
+                submitted_at=4600, priority=1),
+            # 52: newest, highest priority
+            fakedb.BuildRequest(id=52, buildsetid=self.BSID, buildername="bbb",
+                submitted_at=9000, priority=2),
+            # 53: same as 50, but later id
+            fakedb.BuildRequest(id=53, buildsetid=self.BSID, buildername="bbb",
+                submitted_at=1000),
+            # 54: claimed
+            fakedb.BuildRequest(id=54, buildsetid=self.BSID, buildername="bbb",
+                submitted_at=1000, priority=5,
+                claimed_at=self.CLAIMED_AT_EPOCH,
+                claimed_by_name="other",
+                claimed_by_incarnation="other"),
+            # 55: other builder
+            fakedb.BuildRequest(id=55, buildsetid=self.BSID, buildername="ccc",
+                submitted_at=1000, priority=5),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getUnclaimedBuildRequests("bbb",
+                                                                **kwargs))
+        def check(brlist):
+            self.assertEqual([ br['brid'] for br in brlist ], expected)
+        d.addCallback(check)
+        return d
+
+    def test_getUnclaimedBuildRequests(self):
+        return self.do_test_getUnclaimedBuildRequests([ 52, 51, 50, 53 ])
+
+    def test_getUnclaimedBuildRequests_limit(self):
+        return self.do_test_getUnclaimedBuildRequests([ 52, 51 ], limit=2)
+
+    def test_getUnclaimedBuildRequests_aging(self):
+        # at 3600 seconds per point, 51 has aged past 52, and 50 and 53 have
+        # caught up with 51
+        return self.do_test_getUnclaimedBuildRequests([ 50, 53, 51, 52 ],
+                agingInterval=3600)
+
+    def test_getUnclaimedBuildRequests_slow_aging(self):
+        return self.do_test_getUnclaimedBuildRequests([ 52, 51, 50 ],
+                agingInterval=100000, limit=3)
+
     def do_test_claimBuildRequests(self, rows, now, brids, expected=None,
                                   expfailure=None, race_hook=None):
         clock = task.Clock()
@@ -16,7 +16,7 @@
 import datetime
 from twisted.trial import unittest
 from twisted.internet import defer, task
-from buildbot.db import buildsets
+from buildbot.db import buildsets, sourcestamps
 from buildbot.util import json, UTC
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
@@ -30,10 +30,12 @@ class TestBuildsetsConnectorComponent(
             table_names=[ 'patches', 'changes', 'sourcestamp_changes',
                 'buildsets', 'buildset_properties', 'schedulers',
                 'buildrequests', 'scheduler_upstream_buildsets',
-                'sourcestamps' ])
+                'sourcestamps', 'scheduler_changes' ])
 
         def finish_setup(_):
             self.db.buildsets = buildsets.BuildsetsConnectorComponent(self.db)
+            self.db.sourcestamps = \
+                    sourcestamps.SourceStampsConnectorComponent(self.db)
         d.addCallback(finish_setup)
 
         # set up a sourcestamp with id 234 for use below
@@ -81,6 +83,20 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_addBuildset_priority(self):
+        d = self.db.buildsets.addBuildset(ssid=234, reason='because',
+                properties={}, builderNames=['a', 'b'], priority=7)
+        def check(bsid):
+            def thd(conn):
+                r = conn.execute(self.db.model.buildrequests.select())
+                rows = [ (row.buildsetid, row.buildername, row.priority)
+                          for row in r.fetchall() ]
+                self.assertEqual(sorted(rows),
+                    [ ( bsid, 'a', 7), ( bsid, 'b', 7) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
     def test_addBuildset_bigger(self):
         props = dict(prop=(['list'], 'test'))
         d = defer.succeed(None)
@@ -115,6 +131,115 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_addBuildsets(self):
+        clock = task.Clock()
+        clock.advance(1234)
+        d = self.insertTestData([
+            fakedb.SourceStamp(id=235, branch='br', revision='1'),
+        ])
+        d.addCallback(lambda _ :
+            self.db.buildsets.addBuildsets([
+                dict(ssid=235, reason='r1', properties={},
+                     builderNames=['a']),
+                dict(ssid=235, reason='r2',
+                     properties=dict(p=(1, 'test')), builderNames=['a', 'b'],
+                     external_idstring='ext'),
+                ], _reactor=clock))
+        def check(bsids):
+            self.assertEqual(len(bsids), 2)
+            def thd(conn):
+                r = conn.execute(self.db.model.buildsets.select())
+                rows = [ (row.id, row.sourcestampid, row.reason,
+                          row.external_idstring, row.submitted_at)
+                         for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (bsids[0], 235, 'r1', None, 1234),
+                    (bsids[1], 235, 'r2', 'ext', 1234) ])
+
+                r = conn.execute(self.db.model.buildrequests.select())
+                rows = [ (row.buildsetid, row.buildername)
+                         for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (bsids[0], 'a'), (bsids[1], 'a'), (bsids[1], 'b') ])
+
+                r = conn.execute(self.db.model.buildset_properties.select())
+                rows = [ (row.buildsetid, row.property_name)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (bsids[1], 'p') ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_addBuildsetsForChanges(self):
+        clock = task.Clock()
+        clock.advance(1234)
+        d = self.insertTestData([
+            fakedb.Change(changeid=13, branch='master', revision='13'),
+            fakedb.Change(changeid=14, branch='master', revision='14',
+                          repository='repo14', project='proj14'),
+            fakedb.Change(changeid=15, branch='devel', revision='15'),
+            fakedb.Change(changeid=16, branch='other'),
+            fakedb.Scheduler(schedulerid=92),
+            fakedb.SchedulerChange(schedulerid=92, changeid=13, important=1),
+            fakedb.SchedulerChange(schedulerid=92, changeid=14, important=0),
+            fakedb.SchedulerChange(schedulerid=92, changeid=15, important=1),
+            fakedb.SchedulerChange(schedulerid=92, changeid=16, important=1),
+        ])
+        d.addCallback(lambda _ :
+            self.db.buildsets.addBuildsetsForChanges([
+                dict(changeids=[13, 14], reason='r1', properties={},
+                     builderNames=['a']),
+                dict(changeids=[15], reason='r2',
+                     properties=dict(p=(1, 'test')), builderNames=['a', 'b'],
+                     external_idstring='ext'),
+                ], flushSchedulerid=92, _reactor=clock))
+        def check(ids):
+            self.assertEqual(len(ids), 2)
+            def thd(conn):
+                r = conn.execute(self.db.model.buildsets.select())
+                rows = [ (row.id, row.sourcestampid, row.reason,
+                          row.external_idstring, row.submitted_at)
+                         for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (ids[0][0], ids[0][1], 'r1', None, 1234),
+                    (ids[1][0], ids[1][1], 'r2', 'ext', 1234) ])
+
+                # the sourcestamps take their attributes from the newest change
+                r = conn.execute(self.db.model.sourcestamps.select(
+                    whereclause=self.db.model.sourcestamps.c.id.in_(
+                        [ ssid for bsid, ssid in ids ])))
+                rows = [ (row.id, row.branch, row.revision, row.repository,
+                          row.project) for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (ids[0][1], 'master', '14', 'repo14', 'proj14'),
+                    (ids[1][1], 'devel', '15', 'repo', 'proj') ])
+
+                r = conn.execute(self.db.model.sourcestamp_changes.select())
+                rows = [ (row.sourcestampid, row.changeid)
+                         for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (ids[0][1], 13), (ids[0][1], 14), (ids[1][1], 15) ])
+
+                r = conn.execute(self.db.model.buildrequests.select())
+                rows = [ (row.buildsetid, row.buildername)
+                         for row in r.fetchall() ]
+                self.assertEqual(sorted(rows), [
+                    (ids[0][0], 'a'), (ids[1][0], 'a'), (ids[1][0], 'b') ])
+
+                r = conn.execute(self.db.model.buildset_properties.select())
+                rows = [ (row.buildsetid, row.property_name)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (ids[1][0], 'p') ])
+
+                # and only the built changes' classifications are flushed
+                r = conn.execute(self.db.model.scheduler_changes.select())
+                rows = [ (row.schedulerid, row.changeid)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (92, 16) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
     def test_subscribeToBuildset(self):
         tbl = self.db.model.scheduler_upstream_buildsets
         def add_data_thd(conn):
@@ -264,6 +264,50 @@ class TestChangesConnectorComponent(
         d.addCallback(check_change_properties)
         return d
 
+    def test_addChanges(self):
+        d = self.db.changes.addChanges([
+            dict(who=u'dustin', files=[u'a.txt', u'b.txt'],
+                 comments=u'first', links=[u'http://wired.com/g'],
+                 revision=u'1', when=266738400,
+                 properties={u'platform': u'linux'}),
+            dict(who=u'tom', files=[u'c.txt'], comments=u'second',
+                 revision=u'2', when=266738401),
+            ])
+        def check_changes(changes):
+            self.assertEqual([ c.number for c in changes ], [1, 2])
+            self.assertEqual([ c.revision for c in changes ], [u'1', u'2'])
+            def thd(conn):
+                r = conn.execute(sa.select(
+                        [self.db.model.changes.c.changeid,
+                         self.db.model.changes.c.author],
+                        order_by=[self.db.model.changes.c.changeid]))
+                self.assertEqual([ tuple(row) for row in r.fetchall() ],
+                        [ (1, u'dustin'), (2, u'tom') ])
+                tbl = self.db.model.change_files
+                r = conn.execute(sa.select([tbl.c.changeid, tbl.c.filename],
+                        order_by=[tbl.c.filename]))
+                self.assertEqual([ tuple(row) for row in r.fetchall() ],
+                        [ (1, u'a.txt'), (1, u'b.txt'), (2, u'c.txt') ])
+                tbl = self.db.model.change_links
+                r = conn.execute(sa.select([tbl.c.changeid, tbl.c.link]))
+                self.assertEqual([ tuple(row) for row in r.fetchall() ],
+                        [ (1, u'http://wired.com/g') ])
+                tbl = self.db.model.change_properties
+                r = conn.execute(sa.select([tbl.c.changeid,
+                                            tbl.c.property_name]))
+                self.assertEqual([ tuple(row) for row in r.fetchall() ],
+                        [ (1, u'platform') ])
+            return self.db.pool.do(thd)
+        d.addCallback(check_changes)
+        return d
+
+    def test_addChanges_empty(self):
+        d = self.db.changes.addChanges([])
+        def check(changes):
+            self.assertEqual(changes, [])
+        d.addCallback(check)
+        return d
+
     def test_pruneChanges(self):
         d = self.insertTestData([
             fakedb.Scheduler(schedulerid=29),
@@ -30,7 +30,8 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
         d = self.setUpRealDatabase(
             table_names=['changes', 'change_properties', 'change_links',
                     'change_files', 'patches', 'sourcestamps',
-                    'buildset_properties', 'buildsets' ])
+                    'sourcestamp_changes', 'buildset_properties',
+                    'buildsets' ])
         def make_dbc(_):
             self.dbc = connector.DBConnector(mock.Mock(), self.db_url,
                                         os.path.abspath('basedir'))
@@ -97,6 +98,21 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
         d.addCallback(do_test)
         return d
 
+    def test_getSourceStampNumberedNow_compressed_patch(self):
+        # large patches are stored compressed; the old-style SourceStamp
+        # gets the original text
+        patch_body = 'this is a long patch\n' * 200
+        d = self.dbc.sourcestamps.createSourceStamp(branch='b',
+                revision='1', repository='r', project='p',
+                patch_body=patch_body, patch_level=1)
+        def check(ssid):
+            row = list(self.dbc.runQueryNow("SELECT compressed FROM patches"))
+            self.assertEqual(row, [(1,)])
+            ss = self.dbc.getSourceStampNumberedNow(ssid)
+            self.assertEqual(ss.patch, (1, patch_body))
+        d.addCallback(check)
+        return d
+
     def test_doCleanup(self):
         # patch out all of the cleanup tasks; note that we can't patch dbc.doCleanup
         # directly, since it's already been incorporated into the TimerService
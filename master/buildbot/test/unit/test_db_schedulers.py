@@ -163,6 +163,30 @@ class TestSchedulersConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_classifyChangesForSchedulers(self):
+        d = self.insertTestData([
+            self.change3, self.change4, self.scheduler24,
+            fakedb.Scheduler(schedulerid=25, name='t2', state='',
+                             class_name='Nightly'),
+            fakedb.SchedulerChange(schedulerid=24, changeid=3, important=0),
+        ])
+        d.addCallback(lambda _ :
+                self.db.schedulers.classifyChangesForSchedulers({
+                    24 : { 3 : True, 4 : False },
+                    25 : { 4 : True } }))
+        def check(_):
+            def thd(conn):
+                sch_chgs_tbl = self.db.model.scheduler_changes
+                q = sch_chgs_tbl.select(order_by=[sch_chgs_tbl.c.schedulerid,
+                                                  sch_chgs_tbl.c.changeid])
+                r = conn.execute(q)
+                rows = [ (row.schedulerid, row.changeid, row.important)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (24, 3, 1), (24, 4, 0), (25, 4, 1) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
     def test_flushChangeClassifications(self):
         d = self.insertTestData([ self.change3, self.change4,
                                   self.change5, self.scheduler24 ])
@@ -220,6 +244,24 @@ class TestSchedulersConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getChangeClassificationsForBranches(self):
+        d = self.insertTestData([ self.change3, self.change4, self.change5,
+                                  self.change6, self.scheduler24,
+                                  fakedb.Change(changeid=7, branch=None) ])
+        d.addCallback(self.addClassifications, 24,
+                (3, 1), (4, 0), (5, 1), (6, 1), (7, 0))
+        d.addCallback(lambda _ :
+            self.db.schedulers.getChangeClassificationsForBranches(24,
+                                        [ 'master', 'sql', None, 'nosuch' ]))
+        def check(cls):
+            self.assertEqual(cls, {
+                'master' : { 3 : True, 4 : False, 5 : True },
+                'sql' : { 6 : True },
+                None : { 7 : False },
+                'nosuch' : {} })
+        d.addCallback(check)
+        return d
+
     def test_getSchedulerId_first_time(self):
         d = self.insertTestData([
             fakedb.Scheduler(name='distractor', class_name='Weekly',
@@ -124,6 +124,63 @@ class TestSourceStampsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def getPatchRows(self):
+        def thd(conn):
+            patches_tbl = self.db.model.patches
+            r = conn.execute(patches_tbl.select())
+            return [ (row.id, row.patchlevel, row.subdir, row.compressed)
+                     for row in r.fetchall() ]
+        return self.db.pool.do(thd)
+
+    def test_createSourceStamp_patch_shared(self):
+        ssids = []
+        def create(_, patch_body='my patch', patch_subdir='master/'):
+            d = self.db.sourcestamps.createSourceStamp('production', 'abdef',
+                'test://repo', 'stamper', patch_body=patch_body,
+                patch_level=3, patch_subdir=patch_subdir)
+            d.addCallback(ssids.append)
+            return d
+        d = defer.succeed(None)
+        d.addCallback(create)
+        d.addCallback(create)
+        # a different subdir or body requires a new patch
+        d.addCallback(create, patch_subdir=None)
+        d.addCallback(create, patch_subdir=None)
+        d.addCallback(create, patch_body='your patch')
+        d.addCallback(lambda _ : self.getPatchRows())
+        def check(rows):
+            self.assertEqual(len(rows), 3)
+            self.assertEqual(len(set(ssids)), 5)
+            return defer.gatherResults([ self.db.sourcestamps.getSourceStamp(ssid)
+                                         for ssid in ssids ])
+        d.addCallback(check)
+        def check_ssdicts(ssdicts):
+            self.assertEqual([ (ssdict['patch_body'], ssdict['patch_subdir'])
+                               for ssdict in ssdicts ],
+                [ ('my patch', 'master/'), ('my patch', 'master/'),
+                  ('my patch', None), ('my patch', None),
+                  ('your patch', 'master/') ])
+        d.addCallback(check_ssdicts)
+        return d
+
+    def test_createSourceStamp_patch_compressed(self):
+        patch_body = ''.join([ '+line %d\n' % i for i in range(1000) ])
+        d = self.db.sourcestamps.createSourceStamp('production', 'abdef',
+                'test://repo', 'stamper', patch_body=patch_body,
+                patch_level=1, patch_subdir=None)
+        def check_rows(ssid):
+            d = self.getPatchRows()
+            def check(rows):
+                self.assertEqual([ row[3] for row in rows ], [ 1 ])
+            d.addCallback(check)
+            d.addCallback(lambda _ : self.db.sourcestamps.getSourceStamp(ssid))
+            return d
+        d.addCallback(check_rows)
+        def check(ssdict):
+            self.assertEqual(ssdict['patch_body'], patch_body)
+        d.addCallback(check)
+        return d
+
     def test_getSourceStamp_simple(self):
         d = self.insertTestData([
             fakedb.SourceStamp(id=234, branch='br', revision='rv',
@@ -185,6 +242,19 @@ class TestSourceStampsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getSourceStamp_patch_compressed(self):
+        d = self.insertTestData([
+            fakedb.Patch(id=99, compressed=1, patchlevel=1,
+                patch_base64='eJzLSM3JyddRKM8vykkBAB1UBIk='), # 'hello, world'
+            fakedb.SourceStamp(id=234, patchid=99),
+        ])
+        d.addCallback(lambda _ :
+                self.db.sourcestamps.getSourceStamp(234))
+        def check(ssdict):
+            self.assertEqual(ssdict['patch_body'], 'hello, world')
+        d.addCallback(check)
+        return d
+
     def test_getSourceStamp_nosuch(self):
         d = self.db.sourcestamps.getSourceStamp(234)
         def check(ssdict):
@@ -0,0 +1,209 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from buildbot.locks import BaseLock, MasterLock, SlaveLock, RealSlaveLock
+from buildbot.process.botmaster import BotMaster
+
+class BaseLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        lockid = MasterLock('lock')
+        self.counting = lockid.access('counting')
+        self.exclusive = lockid.access('exclusive')
+
+    def makeLock(self, maxCount=1):
+        lock = BaseLock('lock', maxCount)
+        lock._reactor = self.clock
+        return lock
+
+    def wait(self, lock, owner, access):
+        woken = []
+        d = lock.waitUntilAvailable(owner, access)
+        d.addCallback(lambda l : woken.append(owner))
+        return d, woken
+
+    def test_counting(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.counting)
+        self.assertTrue(lock.isAvailable(self.counting))
+        self.assertFalse(lock.isAvailable(self.exclusive))
+        lock.claim('b', self.counting)
+        self.assertFalse(lock.isAvailable(self.counting))
+        lock.release('a', self.counting)
+        self.assertTrue(lock.isAvailable(self.counting))
+        self.assertTrue(lock.isOwner('b', self.counting))
+        self.assertFalse(lock.isOwner('a', self.counting))
+
+    def test_exclusive(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.exclusive)
+        self.assertFalse(lock.isAvailable(self.counting))
+        self.assertFalse(lock.isAvailable(self.exclusive))
+        lock.release('a', self.exclusive)
+        self.assertTrue(lock.isAvailable(self.exclusive))
+
+    def test_claim_twice(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.counting)
+        lock.claim('a', self.counting)
+        lock.release('a', self.counting)
+        self.assertTrue(lock.isOwner('a', self.counting))
+        lock.release('a', self.counting)
+        self.assertFalse(lock.isOwner('a', self.counting))
+
+    def test_waitUntilAvailable_available(self):
+        lock = self.makeLock()
+        d, woken = self.wait(lock, 'a', self.counting)
+        self.assertEqual(woken, [ 'a' ])
+        self.assertTrue(lock.isOwner('a', self.counting))
+
+    def test_waitUntilAvailable_fifo(self):
+        lock = self.makeLock()
+        lock.claim('a', self.counting)
+        d1, woken1 = self.wait(lock, 'b', self.counting)
+        d2, woken2 = self.wait(lock, 'c', self.counting)
+        lock.release('a', self.counting)
+        # b has been granted the lock, and is woken from the reactor
+        self.assertTrue(lock.isOwner('b', self.counting))
+        self.assertEqual(woken1, [])
+        self.clock.advance(0)
+        self.assertEqual((woken1, woken2), ([ 'b' ], []))
+        lock.release('b', self.counting)
+        self.clock.advance(0)
+        self.assertEqual(woken2, [ 'c' ])
+        self.assertTrue(lock.isOwner('c', self.counting))
+
+    def test_waiters_not_overtaken(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.counting)
+        self.wait(lock, 'b', self.exclusive)
+        # the lock has room for another counting owner, but b is first
+        self.assertFalse(lock.isAvailable(self.counting))
+
+    def test_release_wakes_several(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.exclusive)
+        waits = [ self.wait(lock, o, self.counting) for o in 'bcd' ]
+        lock.release('a', self.exclusive)
+        self.clock.advance(0)
+        # only as many as can hold the lock are woken
+        self.assertEqual([ woken for d, woken in waits ],
+                         [ [ 'b' ], [ 'c' ], [] ])
+        self.assertEqual(len(lock.waiting), 1)
+
+    def test_stopWaitingUntilAvailable(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.counting)
+        d1, woken1 = self.wait(lock, 'b', self.exclusive)
+        d2, woken2 = self.wait(lock, 'c', self.counting)
+        lock.stopWaitingUntilAvailable('b', self.exclusive, d1)
+        # with b gone, c can share the lock with a
+        self.clock.advance(0)
+        self.assertEqual((woken1, woken2), ([], [ 'c' ]))
+        self.assertFalse(lock.isAvailable(self.counting))
+        lock.release('a', self.counting)
+        lock.release('c', self.counting)
+        self.assertEqual(len(lock.waiting), 0)
+        self.assertTrue(lock.isAvailable(self.exclusive))
+
+    def test_stopWaitingUntilAvailable_granted(self):
+        lock = self.makeLock()
+        lock.claim('a', self.counting)
+        d1, woken1 = self.wait(lock, 'b', self.counting)
+        d2, woken2 = self.wait(lock, 'c', self.counting)
+        lock.release('a', self.counting)
+        # b was granted the lock, but gives up before it is woken, so the
+        # lock passes to c
+        lock.stopWaitingUntilAvailable('b', self.counting, d1)
+        self.clock.advance(0)
+        self.assertEqual((woken1, woken2), ([], [ 'c' ]))
+        self.assertFalse(lock.isOwner('b', self.counting))
+        self.assertTrue(lock.isOwner('c', self.counting))
+
+    def test_getStatus(self):
+        lock = self.makeLock(maxCount=2)
+        lock.claim('a', self.counting)
+        self.wait(lock, 'b', self.exclusive)
+        status = lock.getStatus()
+        self.assertEqual((status['name'], status['max_count']), ('lock', 2))
+        self.assertEqual((status['exclusive_owners'],
+                          status['counting_owners'], status['waiting']),
+                         (0, 1, 1))
+        self.assertEqual(status['waits'], 0)
+        self.assertEqual(status['owners'],
+                [ dict(owner='a', mode='counting', count=1) ])
+
+    def test_getStatus_owners(self):
+        lock = self.makeLock(maxCount=3)
+        build = mock.Mock()
+        build.describeLockOwner.return_value = 'bldr #3'
+        lock.claim(build, self.counting)
+        lock.claim('x', self.counting)
+        lock.claim('x', self.counting)
+        self.assertEqual(lock.getStatus()['owners'], [
+            dict(owner='bldr #3', mode='counting', count=1),
+            dict(owner='x', mode='counting', count=2),
+        ])
+
+    def test_wait_statistics(self):
+        lock = self.makeLock()
+        lock.claim('a', self.counting)
+        self.wait(lock, 'b', self.counting)
+        self.clock.advance(10)
+        self.wait(lock, 'c', self.counting)
+        lock.release('a', self.counting)
+        self.clock.advance(20)
+        lock.release('b', self.counting)
+        status = lock.getStatus()
+        # b waited 10 seconds, and c 20
+        self.assertEqual((status['waits'], status['total_wait_time'],
+                          status['max_wait_time']), (2, 30, 20))
+        self.assertEqual((status['counting_owners'], status['waiting']),
+                         (1, 0))
+
+    def test_wait_statistics_no_wait(self):
+        lock = self.makeLock()
+        self.wait(lock, 'a', self.counting)
+        self.assertEqual(lock.getStatus()['waits'], 0)
+
+class RealSlaveLockTests(unittest.TestCase):
+
+    def test_getLocks(self):
+        lock = RealSlaveLock(SlaveLock('lock', maxCountForSlave={'b' : 3}))
+        for slavename in 'ba':
+            slavebuilder = mock.Mock()
+            slavebuilder.slave.slavename = slavename
+            lock.getLock(slavebuilder)
+        self.assertEqual([ (slavename, l.maxCount)
+                           for slavename, l in lock.getLocks() ],
+                         [ ('a', 1), ('b', 3) ])
+
+class BotMasterLockStatusTests(unittest.TestCase):
+
+    def test_getLockStatus(self):
+        botmaster = BotMaster(mock.Mock())
+        slavelock = botmaster.getLockByID(SlaveLock('slavelock'))
+        slavebuilder = mock.Mock()
+        slavebuilder.slave.slavename = 'bot1'
+        slavelock.getLock(slavebuilder)
+        botmaster.getLockByID(MasterLock('masterlock', maxCount=2))
+        status = botmaster.getLockStatus()
+        self.assertEqual([ (l['name'], l['slavename'], l['max_count'])
+                           for l in status ],
+                         [ ('masterlock', None, 2), ('slavelock', 'bot1', 1) ])
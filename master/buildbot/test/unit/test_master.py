@@ -57,6 +57,30 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_changes_subscription(self):
+        newchanges = [ mock.Mock(), mock.Mock() ]
+        self.master.db = mock.Mock()
+        self.master.db.changes.addChanges.return_value = \
+            defer.succeed(newchanges)
+
+        delivered = []
+        self.master.subscribeToChanges(delivered.append)
+        batches = []
+        sub = self.master.subscribeToChangeBatches(batches.append)
+        self.assertIsInstance(sub, subscription.Subscription)
+
+        d = self.master.addChanges([ dict(this='chdict'), dict(that='chdict') ])
+        def check(changes):
+            self.master.db.changes.addChanges.assert_called_with(
+                    [ dict(this='chdict'), dict(that='chdict') ])
+            self.assertEqual(changes, newchanges)
+            # each change is delivered, in order
+            self.assertEqual(delivered, newchanges)
+            # and delivered together, as one batch
+            self.assertEqual(batches, [ newchanges ])
+        d.addCallback(check)
+        return d
+
     def test_buildset_subscription(self):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
@@ -77,6 +101,60 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addBuildsets_subscription(self):
+        self.master.db = mock.Mock()
+        self.master.db.buildsets.addBuildsets.return_value = \
+            defer.succeed([ 10, 11 ])
+
+        got = []
+        self.master.subscribeToBuildsets(lambda **kw : got.append(kw))
+
+        buildsets = [
+            dict(ssid=20, reason='r', properties={}, builderNames=['a']),
+            dict(ssid=20, reason='r', properties={}, builderNames=['b'],
+                 external_idstring='x') ]
+        d = self.master.addBuildsets(buildsets)
+        def check(bsids):
+            self.master.db.buildsets.addBuildsets.assert_called_with(
+                                                                buildsets)
+            self.assertEqual(bsids, [ 10, 11 ])
+            # each buildset is announced
+            self.assertEqual(got, [
+                dict(bsid=10, ssid=20, reason='r', properties={},
+                     builderNames=['a'], external_idstring=None),
+                dict(bsid=11, ssid=20, reason='r', properties={},
+                     builderNames=['b'], external_idstring='x') ])
+        d.addCallback(check)
+        return d
+
+    def test_addBuildsetsForChanges_subscription(self):
+        self.master.db = mock.Mock()
+        self.master.db.buildsets.addBuildsetsForChanges.return_value = \
+            defer.succeed([ (10, 20), (11, 21) ])
+
+        got = []
+        self.master.subscribeToBuildsets(lambda **kw : got.append(kw))
+
+        buildsets = [
+            dict(changeids=[1, 2], reason='r', properties={},
+                 builderNames=['a']),
+            dict(changeids=[3], reason='r', properties={},
+                 builderNames=['a'], external_idstring='x') ]
+        d = self.master.addBuildsetsForChanges(buildsets,
+                                               flushSchedulerid=7)
+        def check(bsids):
+            self.master.db.buildsets.addBuildsetsForChanges.assert_called_with(
+                    buildsets, flushSchedulerid=7)
+            self.assertEqual(bsids, [ 10, 11 ])
+            # each buildset is announced
+            self.assertEqual(got, [
+                dict(bsid=10, ssid=20, reason='r', properties={},
+                     builderNames=['a'], external_idstring=None),
+                dict(bsid=11, ssid=21, reason='r', properties={},
+                     builderNames=['a'], external_idstring='x') ])
+        d.addCallback(check)
+        return d
+
     def test_buildset_completion_subscription(self):
         self.master.db = mock.Mock()
 
@@ -88,10 +166,30 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
         # assert the notification sub was called correctly
         cb.assert_called_with(938593, 999)
 
+    def test_buildset_completion_subscription_by_bsid(self):
+        self.master.db = mock.Mock()
+
+        cb = mock.Mock()
+        other_cb = mock.Mock()
+        sub = self.master.subscribeToBuildsetCompletion(938593, cb)
+        self.assertIsInstance(sub, subscription.Subscription)
+        self.master.subscribeToBuildsetCompletion(938594, other_cb)
+
+        self.master.buildsetComplete(938593, 999)
+        cb.assert_called_with(938593, 999)
+        self.assertFalse(other_cb.called)
+
+        # once unsubscribed, nothing is delivered
+        sub.unsubscribe()
+        cb.reset_mock()
+        self.master.buildsetComplete(938593, 999)
+        self.assertFalse(cb.called)
+
 class Polling(dirs.DirsMixin, unittest.TestCase):
 
     def setUp(self):
         self.gotten_changes = []
+        self.gotten_change_batches = []
         self.gotten_buildset_additions = []
         self.gotten_buildset_completions = []
 
@@ -107,6 +205,8 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
             # overridesubscription callbacks
             self.master._change_subs = sub = mock.Mock()
             sub.deliver = self.deliverChange
+            self.master._change_batch_subs = sub = mock.Mock()
+            sub.deliver = self.gotten_change_batches.append
             self.master._new_buildset_subs = sub = mock.Mock()
             sub.deliver = self.deliverBuildsetAddition
             self.master._complete_buildset_subs = sub = mock.Mock()
@@ -168,6 +268,9 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
         def check(_):
             self.assertEqual([ ch.number for ch in self.gotten_changes],
                              [ 11, 12 ]) # note 10 was already seen
+            self.assertEqual([ [ ch.number for ch in batch ]
+                               for batch in self.gotten_change_batches ],
+                             [ [ 11, 12 ] ])
             self.assertEqual(self.gotten_buildset_additions, [])
             self.assertEqual(self.gotten_buildset_completions, [])
             self.db.state.assertState(53, last_processed_change=12)
@@ -185,6 +288,7 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
         d = self.master.pollDatabaseChanges()
         def check(_):
             self.assertEqual(self.gotten_changes, [])
+            self.assertEqual(self.gotten_change_batches, [])
             self.assertEqual(self.gotten_buildset_additions, [])
             self.assertEqual(self.gotten_buildset_completions, [])
             self.db.state.assertState(53, last_processed_change=10)
@@ -14,13 +14,13 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
 from buildbot.process.build import Build
 from buildbot.process.properties import Properties
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, RETRY, EXCEPTION
-from buildbot.locks import SlaveLock
-from buildbot.process.buildstep import LoggingBuildStep
+from buildbot.locks import SlaveLock, MasterLock
+from buildbot.process.buildstep import BuildStep, LoggingBuildStep
 
 from mock import Mock
 
@@ -64,6 +64,20 @@ class FakeMaster:
         return self.locks[lockid]
 
 class TestBuild(unittest.TestCase):
+    def testDescribeLockOwner(self):
+        b = Build([FakeRequest()])
+        builder = Mock()
+        builder.name = 'bldr'
+        b.setBuilder(builder)
+        self.assertEqual(b.describeLockOwner(), 'bldr')
+        b.build_status = Mock()
+        b.build_status.getNumber.return_value = 7
+        self.assertEqual(b.describeLockOwner(), 'bldr #7')
+
+        step = BuildStep(name='compile')
+        step.setBuild(b)
+        self.assertEqual(step.describeLockOwner(), 'bldr #7 step compile')
+
     def testRunSuccessfulBuild(self):
         r = FakeRequest()
 
@@ -222,6 +236,51 @@ class TestBuild(unittest.TestCase):
         self.assert_(b.currentStep is None)
         self.assert_(b._acquiringLock is not None)
 
+    def testBuildWaitingForSeveralLocks(self):
+        r = FakeRequest()
+
+        b = Build([r])
+        b.setBuilder(Mock())
+        b.builder.botmaster = FakeMaster()
+        slavebuilder = Mock()
+        status = Mock()
+        clock = task.Clock()
+
+        l1 = MasterLock('several-1')
+        l2 = MasterLock('several-2')
+        access1 = l1.access('counting')
+        access2 = l2.access('counting')
+        l1.access = lambda mode: access1
+        l2.access = lambda mode: access2
+        lock1 = b.builder.botmaster.getLockByID(l1).getLock(slavebuilder)
+        lock2 = b.builder.botmaster.getLockByID(l2).getLock(slavebuilder)
+        lock1._reactor = lock2._reactor = clock
+        b.setLocks([l1, l2])
+
+        step = Mock()
+        step.return_value = step
+        step.startStep.return_value = SUCCESS
+        b.setStepFactories([(step, {})])
+
+        other1, other2 = Mock(), Mock()
+        lock1.claim(other1, access1)
+        b.startBuild(status, None, slavebuilder)
+        self.assertIdentical(b._acquiringLock[0], lock1)
+
+        # lock1 is granted to the build, but lock2 has since been taken, so
+        # the build gives up lock1 while it waits for lock2
+        lock2.claim(other2, access2)
+        lock1.release(other1, access1)
+        clock.advance(0)
+        self.assertFalse(lock1.isOwner(b, access1))
+        self.assertIdentical(b._acquiringLock[0], lock2)
+
+        lock2.release(other2, access2)
+        clock.advance(0)
+        self.assertTrue(lock1.isOwner(b, access1))
+        self.assertTrue(lock2.isOwner(b, access2))
+        self.assert_( ('startStep', (b.remote,), {}) in step.method_calls)
+
     def testStopBuildWaitingForLocks(self):
         r = FakeRequest()
 
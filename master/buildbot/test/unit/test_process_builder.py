@@ -19,7 +19,10 @@ from twisted.trial import unittest
 from twisted.python import failure
 from twisted.internet import defer
 from buildbot.test.fake import fakedb
-from buildbot.process import builder, buildrequest
+from buildbot.process import builder, buildrequest, factory
+from buildbot.process.properties import WithProperties
+from buildbot.steps import shell, source
+from buildbot.sourcestamp import SourceStamp
 from buildbot.db import buildrequests
 
 class TestBuilderBuildCreation(unittest.TestCase):
@@ -44,6 +47,7 @@ class TestBuilderBuildCreation(unittest.TestCase):
         self.master.db = self.db = db = fakedb.FakeDBConnector(self)
         self.master.master_name = db.buildrequests.MASTER_NAME
         self.master.master_incarnation = db.buildrequests.MASTER_INCARNATION
+        self.master.priorityAgingInterval = None
         self.bldr.master = self.master
 
         # patch into the _startBuildsFor method
@@ -257,6 +261,63 @@ class TestBuilderBuildCreation(unittest.TestCase):
         return self.do_test_doMaybeStartBuild(rows=rows,
                 exp_claims=[], exp_builds=[], exp_fail=RuntimeError)
 
+    def test_doMaybeStartBuild_priority(self):
+        self.makeBuilder(mergeRequests=False)
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=135000, priority=5),
+        ]
+        return self.do_test_doMaybeStartBuild(rows=rows,
+                exp_claims=[11], exp_builds=[('test-slave1', [11])])
+
+    def test_doMaybeStartBuild_priority_aging(self):
+        # with an hour per priority point, 10 is two points ahead of 11 by
+        # the time 11 is submitted, so it beats 11's single point
+        self.makeBuilder(mergeRequests=False)
+        self.master.priorityAgingInterval = 3600
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=137200, priority=1),
+        ]
+        return self.do_test_doMaybeStartBuild(rows=rows,
+                exp_claims=[10], exp_builds=[('test-slave1', [10])])
+
+    def test_doMaybeStartBuild_window_refilled(self):
+        self.makeBuilder(mergeRequests=False, patch_random=True)
+        self.bldr.unclaimedRequestsWindow = 1
+        self.setSlaveBuilders({'test-slave1':1, 'test-slave2':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=135000),
+        ]
+        return self.do_test_doMaybeStartBuild(rows=rows,
+                exp_claims=[10, 11],
+                exp_builds=[('test-slave2', [10]), ('test-slave1', [11])])
+
+    def test_doMaybeStartBuild_window_merging(self):
+        # requests outside the window are left for the next build
+        self.makeBuilder(patch_random=True)
+        self.bldr.unclaimedRequestsWindow = 2
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=135000),
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="bldr",
+                submitted_at=140000),
+        ]
+        return self.do_test_doMaybeStartBuild(rows=rows,
+                exp_claims=[10, 11], exp_builds=[('test-slave1', [10, 11])])
+
     def test_doMaybeStartBuild_claim_race(self):
         self.makeBuilder(patch_random=True)
 
@@ -501,3 +562,64 @@ class TestBuilderBuildCreation(unittest.TestCase):
             self.assertEqual(res, [breq])
         d.addCallback(check)
         return d
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.makeBuilder([
+            shell.ShellCommand(command='make'),
+            source.Git(repourl='git://example.com/repo', mirror=True),
+            source.Git(repourl='git://example.com/other'),
+        ])
+
+        self.build = mock.Mock()
+        self.build.getSourceStamp.return_value = SourceStamp()
+
+        self.sb = mock.Mock()
+        self.sb.remote.callRemote.return_value = defer.succeed(True)
+
+    def makeBuilder(self, steps):
+        config = dict(name="bldr", slavename="slv", builddir="bdir",
+                     slavebuilddir="sbdir", factory=factory.BuildFactory(steps))
+        self.bldr = builder.Builder(config, mock.Mock())
+
+    def test_prefetch(self):
+        self.sb.getSlaveCommandVersion.return_value = "2.14"
+        self.bldr._startPrefetch(self.build, self.sb)
+        self.assertEqual(self.sb.remote.callRemote.call_args_list, [
+            (("prefetch", "git", dict(workdir='build',
+                                      repourl='git://example.com/repo',
+                                      progress=False, mirror=True)), {}),
+        ])
+
+    def test_prefetch_old_slave(self):
+        self.sb.getSlaveCommandVersion.return_value = "2.13"
+        self.bldr._startPrefetch(self.build, self.sb)
+        self.assertFalse(self.sb.remote.callRemote.called)
+
+    def test_prefetch_needs_properties(self):
+        self.sb.getSlaveCommandVersion.return_value = "2.14"
+        self.makeBuilder([
+            source.Git(repourl=WithProperties('git://%(host)s/repo'),
+                       mirror=True),
+        ])
+        self.bldr._startPrefetch(self.build, self.sb)
+        self.assertFalse(self.sb.remote.callRemote.called)
+
+    def test_prefetch_step_class(self):
+        # steps given as a class and arguments are not instantiated just to
+        # ask them
+        f = factory.BuildFactory()
+        f.addStep(source.Git, repourl='git://example.com/repo', mirror=True)
+        self.assertEqual(f.getPrefetchArgs(SourceStamp()), [])
+
+    def test_prefetch_error(self):
+        self.sb.getSlaveCommandVersion.return_value = "2.14"
+        step = source.Git(repourl='git://example.com/repo', mirror=True)
+        def getPrefetchArgs(ss):
+            raise RuntimeError("oops")
+        step.getPrefetchArgs = getPrefetchArgs
+        self.makeBuilder([ step ])
+        self.bldr._startPrefetch(self.build, self.sb)
+        self.assertFalse(self.sb.remote.callRemote.called)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
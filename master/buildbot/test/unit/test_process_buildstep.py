@@ -14,10 +14,15 @@
 # Copyright Buildbot Team Members
 
 import re
+import mock
 
 from twisted.trial import unittest
+from twisted.internet import task
 
-from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator
+from buildbot import util
+from buildbot.locks import BaseLock, MasterLock
+from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator, \
+        LoggedRemoteCommand, RemoteShellCommand, BuildStep
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, EXCEPTION
 
 class FakeLogFile:
@@ -87,3 +92,87 @@ class TestLoggingBuildStep(unittest.TestCase):
         lbs = LoggingBuildStep(log_eval_func=eval)
         status = lbs.evaluateCommand(cmd)
         self.assertEqual(status, WARNINGS, "evaluateCommand didn't call log_eval_func or overrode its results")
+
+class TestAcquireLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(util, 'now', lambda : self.clock.seconds())
+        self.lock = BaseLock('lock')
+        self.lock._reactor = self.clock
+        self.access = MasterLock('lock').access('counting')
+        self.step = BuildStep()
+        self.step.locks = [ (self.lock, self.access) ]
+        self.step.step_status = mock.Mock()
+
+    def test_no_wait(self):
+        d = self.step.acquireLocks()
+        def check(_):
+            self.assertTrue(self.lock.isOwner(self.step, self.access))
+            self.assertEqual(self.step.lockWaitTime, 0)
+            self.assertFalse(self.step.step_status.setStatistic.called)
+        d.addCallback(check)
+        return d
+
+    def test_lockWaited(self):
+        self.lock.claim('other', self.access)
+        d = self.step.acquireLocks()
+        self.step.step_status.setWaitingForLocks.assert_called_with(True)
+        self.clock.advance(30)
+        self.lock.release('other', self.access)
+        self.clock.advance(0)
+        def check(_):
+            self.assertTrue(self.lock.isOwner(self.step, self.access))
+            self.step.step_status.setWaitingForLocks.assert_called_with(False)
+            self.assertEqual(self.step.lockWaitTime, 30)
+            self.step.step_status.setStatistic.assert_called_with(
+                                                    'lock_wait_time', 30)
+        d.addCallback(check)
+        return d
+
+class FakeBufferingLogFile:
+    def __init__(self, pending):
+        self.pending = pending
+
+    def getPendingLength(self):
+        return self.pending
+
+class TestUpdateCredit(unittest.TestCase):
+
+    def makeCommand(self):
+        cmd = LoggedRemoteCommand('shell', {})
+        cmd.buildslave = mock.Mock()
+        cmd.active = True
+        cmd.updates = {}
+        return cmd
+
+    def test_remote_update_returns_credit(self):
+        cmd = self.makeCommand()
+        credit = cmd.remote_update([[{'stdout' : 'hi'}, 0]])
+        self.assertEqual(credit, cmd.updateCredit)
+        self.assertTrue(cmd.buildslave.messageReceivedFromSlave.called)
+
+    def test_credit_reduced_by_pending(self):
+        cmd = self.makeCommand()
+        cmd.updateCredit = 100000
+        cmd.logs['stdio'] = FakeBufferingLogFile(30000)
+        cmd.logs['other'] = FakeLogFile('no buffering here')
+        self.assertEqual(cmd.getUpdateCredit(), 70000)
+
+    def test_credit_minimum(self):
+        cmd = self.makeCommand()
+        cmd.logs['stdio'] = FakeBufferingLogFile(cmd.updateCredit * 2)
+        self.assertEqual(cmd.getUpdateCredit(), cmd.minUpdateCredit)
+
+class TestRemoteShellCommand(unittest.TestCase):
+
+    def test_buffer_args_default(self):
+        cmd = RemoteShellCommand('build', ['make'])
+        self.assertFalse('bufferSize' in cmd.args)
+        self.assertFalse('bufferTimeout' in cmd.args)
+
+    def test_buffer_args(self):
+        cmd = RemoteShellCommand('build', ['make'],
+                bufferSize=(1024, 65536), bufferTimeout=2)
+        self.assertEqual(cmd.args['bufferSize'], (1024, 65536))
+        self.assertEqual(cmd.args['bufferTimeout'], 2)
@@ -14,11 +14,11 @@
 # Copyright Buildbot Team Members
 
 import sys
-import mock
 import twisted
 from twisted.trial import unittest
 from twisted.internet import defer
 from buildbot.schedulers import base
+from buildbot.changes import filter
 from buildbot.process import properties
 from buildbot.test.util import scheduler
 from buildbot.test.fake import fakedb
@@ -43,10 +43,10 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         self.tearDownScheduler()
 
     def makeScheduler(self, name='testsched', builderNames=['a', 'b'],
-                            properties={}):
+                            properties={}, priority=0):
         sched = self.attachScheduler(
                 base.BaseScheduler(name=name, builderNames=builderNames,
-                                   properties=properties),
+                                   properties=properties, priority=priority),
                 self.SCHEDULERID)
 
         return sched
@@ -150,10 +150,10 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         def test(_):
             # check that it registered a callback
             callbacks = self.master.getSubscriptionCallbacks()
-            self.assertNotEqual(callbacks['changes'], None)
+            self.assertNotEqual(callbacks['change_batches'], None)
 
             # invoke the callback with the change, and check the result
-            callbacks['changes'](change)
+            callbacks['change_batches']([ change ])
             self.assertEqual(change_received[0], expected_result)
         d.addCallback(test)
         d.addCallback(lambda _ : sched.stopService())
@@ -192,21 +192,56 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
             "flushLoggedErrors does not work correctly on 9.0.0 and earlier with Python-2.7"
 
     def test_change_consumption_change_filter_True(self):
-        cf = mock.Mock()
-        cf.filter_change = lambda c : True
+        cf = filter.ChangeFilter(filter_fn=lambda c : True)
         return self.do_test_change_consumption(
                 dict(change_filter=cf),
                 self.makeFakeChange(),
                 True)
 
     def test_change_consumption_change_filter_False(self):
-        cf = mock.Mock()
-        cf.filter_change = lambda c : False
+        cf = filter.ChangeFilter(filter_fn=lambda c : False)
         return self.do_test_change_consumption(
                 dict(change_filter=cf),
                 self.makeFakeChange(),
                 None)
 
+    def test_change_consumption_batch(self):
+        sched = self.makeScheduler()
+        sched.startService()
+
+        got = []
+        def gotChanges(changes):
+            got.append(changes)
+            return defer.succeed(None)
+        sched.gotChanges = gotChanges
+
+        cf = filter.ChangeFilter(filter_fn=lambda c : c.number != 2)
+        changes = [ self.makeFakeChange(number=n) for n in (1, 2, 3) ]
+        d = sched.startConsumingChanges(change_filter=cf,
+                fileIsImportant=lambda c : c.number == 3)
+        def test(_):
+            callbacks = self.master.getSubscriptionCallbacks()
+            callbacks['change_batches'](changes)
+            # the batch is filtered and classified, then handled in one call
+            self.assertEqual(got,
+                    [ [ (changes[0], False), (changes[2], True) ] ])
+        d.addCallback(test)
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
+    def test_gotChanges_default(self):
+        sched = self.makeScheduler()
+        got = []
+        def gotChange(change, important):
+            got.append((change, important))
+            return defer.succeed(None)
+        sched.gotChange = gotChange
+        changes = [ (self.makeFakeChange(number=1), True),
+                    (self.makeFakeChange(number=2), False) ]
+        d = sched.gotChanges(changes)
+        d.addCallback(lambda _ : self.assertEqual(got, changes))
+        return d
+
     def test_addBuilsetForLatest_args(self):
         sched = self.makeScheduler(name='xyz', builderNames=['y', 'z'])
         d = sched.addBuildsetForLatest(reason='cuz', branch='default',
@@ -273,6 +308,37 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addBuildsetsForChanges(self):
+        sched = self.makeScheduler(name='n', builderNames=['b'])
+        self.db.insertTestData([
+            fakedb.Change(changeid=13, branch='trunk', revision='9283',
+                            repository='svn://...', project='world-domination'),
+            fakedb.Change(changeid=14, branch='trunk', revision='9284',
+                            repository='svn://...', project='world-domination'),
+            fakedb.Change(changeid=15, branch='devel', revision='9285',
+                            repository='svn://...', project='world-domination'),
+        ])
+        self.db.schedulers.fakeClassifications(self.SCHEDULERID,
+                                    { 13 : True, 14 : False, 15 : True })
+        d = sched.addBuildsetsForChanges(reason='power',
+                            changeids_list=[ [13, 14], [15] ],
+                            flushClassifications=True)
+        def check(bsids):
+            self.assertEqual(len(bsids), 2)
+            for bsid, branch, revision, changeids in [
+                    (bsids[0], 'trunk', '9284', set([13, 14])),
+                    (bsids[1], 'devel', '9285', set([15])) ]:
+                self.db.buildsets.assertBuildset(bsid,
+                        dict(reason='power', builderNames=['b'],
+                            external_idstring=None,
+                            properties=[('scheduler', ('n', 'Scheduler'))]),
+                        dict(branch=branch, repository='svn://...',
+                            changeids=changeids, project='world-domination',
+                            revision=revision))
+            self.db.schedulers.assertClassifications(self.SCHEDULERID, {})
+        d.addCallback(check)
+        return d
+
     def test_addBuildsetForChanges_properties(self):
         props = properties.Properties(xxx="yyy")
         sched = self.makeScheduler(name='n', builderNames=['c'])
@@ -357,6 +423,43 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_addBuildsetForSourceStamp_priority(self):
+        sched = self.makeScheduler(name='n', builderNames=['b'], priority=3)
+        d = self.db.insertTestData([
+            fakedb.SourceStamp(id=91, branch='fixins', revision='abc',
+                patchid=None, repository='r', project='p'),
+        ])
+        d.addCallback(lambda _ :
+                sched.addBuildsetForSourceStamp(reason='whynot', ssid=91))
+        def check(bsid):
+            self.db.buildsets.assertBuildset(bsid,
+                    dict(reason='whynot', builderNames=['b'],
+                        external_idstring=None, priority=3,
+                        properties=[('scheduler', ('n', 'Scheduler'))]),
+                    dict(branch='fixins', revision='abc', repository='r',
+                         project='p'))
+        d.addCallback(check)
+        return d
+
+    def test_addBuildsetForSourceStamp_priority_override(self):
+        sched = self.makeScheduler(name='n', builderNames=['b'], priority=3)
+        d = self.db.insertTestData([
+            fakedb.SourceStamp(id=91, branch='fixins', revision='abc',
+                patchid=None, repository='r', project='p'),
+        ])
+        d.addCallback(lambda _ :
+                sched.addBuildsetForSourceStamp(reason='whynot', ssid=91,
+                                                priority=8))
+        def check(bsid):
+            self.db.buildsets.assertBuildset(bsid,
+                    dict(reason='whynot', builderNames=['b'],
+                        external_idstring=None, priority=8,
+                        properties=[('scheduler', ('n', 'Scheduler'))]),
+                    dict(branch='fixins', revision='abc', repository='r',
+                         project='p'))
+        d.addCallback(check)
+        return d
+
     def test_addBuildsetForSourceStamp_properties(self):
         props = properties.Properties(xxx="yyy")
         sched = self.makeScheduler(name='n', builderNames=['b'])
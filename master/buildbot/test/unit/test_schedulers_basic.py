@@ -41,6 +41,19 @@ class CommonStuffMixin(object):
             return defer.succeed(None)
         sched.addBuildsetForChanges = addBuildsetForChanges
 
+        # the stable timers add buildsets (and flush classifications) in bulk
+        def addBuildsetsForChanges(reason='', changeids_list=[],
+                                   flushClassifications=False):
+            for changeids in changeids_list:
+                addBuildsetForChanges(reason=reason, changeids=changeids)
+                if flushClassifications:
+                    cls = self.db.schedulers.classifications.get(
+                                                    self.SCHEDULERID, {})
+                    for changeid in changeids:
+                        cls.pop(changeid, None)
+            return defer.succeed(None)
+        sched.addBuildsetsForChanges = addBuildsetsForChanges
+
         # see self.assertConsumingChanges
         self.consumingChanges = None
         def startConsumingChanges(**kwargs):
@@ -99,7 +112,8 @@ class BaseBasicScheduler(CommonStuffMixin,
         # check that the scheduler has started to consume changes, and the
         # classifications *have* been flushed, since they will not be used
         def check(_):
-            self.assertConsumingChanges(fileIsImportant=fII, change_filter=cf)
+            self.assertConsumingChanges(fileIsImportant=fII, change_filter=cf,
+                                        recordClassifications=False)
             self.db.schedulers.assertClassifications(self.SCHEDULERID, {})
         d.addCallback(check)
         d.addCallback(lambda _ : sched.stopService())
@@ -123,7 +137,8 @@ class BaseBasicScheduler(CommonStuffMixin,
         # classification should have been acted on, so the timer should be
         # running
         def check(_):
-            self.assertConsumingChanges(fileIsImportant=None, change_filter=cf)
+            self.assertConsumingChanges(fileIsImportant=None, change_filter=cf,
+                                        recordClassifications=True)
             self.db.schedulers.assertClassifications(self.SCHEDULERID, { 20 : True })
             self.assertTrue(sched.timer_started)
         d.addCallback(check)
@@ -154,6 +169,22 @@ class BaseBasicScheduler(CommonStuffMixin,
 
         d.addCallback(lambda _ : sched.stopService())
 
+    def test_gotChanges_no_treeStableTimer(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=None, branch='master')
+
+        sched.startService()
+
+        d = sched.gotChanges([
+                (self.makeFakeChange(branch='master', number=13), True),
+                (self.makeFakeChange(branch='master', number=14), False),
+                (self.makeFakeChange(branch='master', number=15), True) ])
+        def check(_):
+            self.assertEqual(self.events, [ 'B[13]@0', 'B[15]@0' ])
+        d.addCallback(check)
+
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
     def test_gotChange_treeStableTimer_unimportant(self):
         sched = self.makeScheduler(self.Subclass, treeStableTimer=10, branch='master')
 
@@ -248,6 +279,41 @@ class BaseBasicScheduler(CommonStuffMixin,
         wfd.getResult()
 
 
+    def test_stableTimersFired_unseen_changes(self):
+        # the classifier records a change's classification before delivering
+        # it; a timer that fires in between builds only the changes that the
+        # scheduler has seen
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10,
+                                   branch='master')
+        sched.startService()
+
+        d = sched.gotChange(self.makeFakeChange(branch='master', number=13),
+                            True)
+        def classify_unseen(_):
+            self.clock.advance(9)
+            self.db.schedulers.fakeClassifications(self.SCHEDULERID,
+                                                   { 13 : True, 14 : True })
+            self.clock.advance(1)
+            self.assertEqual(self.events, [ 'B[13]@10' ])
+            self.db.schedulers.assertClassifications(self.SCHEDULERID,
+                                                     { 14 : True })
+            # the fired timer is forgotten
+            self.assertEqual(sched._stable_timer_changeids, {})
+        d.addCallback(classify_unseen)
+        d.addCallback(lambda _ : sched.gotChanges(
+                [ (self.makeFakeChange(branch='master', number=14), True) ]))
+        def check(_):
+            # the change gets its own treeStableTimer
+            self.clock.advance(10)
+            self.assertEqual(self.events, [ 'B[13]@10', 'B[14]@20' ])
+            self.db.schedulers.assertClassifications(self.SCHEDULERID, {})
+            self.assertEqual(sched._stable_timer_changeids, {})
+        d.addCallback(check)
+
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
+
 class SingleBranchScheduler(CommonStuffMixin,
         scheduler.SchedulerMixin, unittest.TestCase):
 
@@ -336,3 +402,85 @@ class AnyBranchScheduler(CommonStuffMixin,
         d.addCallback(check)
 
         d.addCallback(lambda _ : sched.stopService())
+
+    def test_gotChanges_treeStableTimer_multiple_branches(self):
+        # a batch is classified at once, with one timer per branch it touches
+        sched = self.makeScheduler(basic.AnyBranchScheduler,
+                            treeStableTimer=10, branches=['master', 'devel', 'boring'],
+                            fileIsImportant=lambda ch : ch.number in (13, 15))
+        # consume changes for real, via the master's classifier
+        del sched.startConsumingChanges
+
+        def mkch(**kwargs):
+            ch = self.makeFakeChange(**kwargs)
+            self.db.changes.fakeAddChange(ch)
+            return ch
+
+        d = sched.startService(_returnDeferred=True)
+        def deliver(_):
+            callbacks = self.master.getSubscriptionCallbacks()
+            return callbacks['change_batches']([
+                mkch(branch='master', number=13),
+                mkch(branch='master', number=14),
+                mkch(branch='devel', number=15),
+                mkch(branch='boring', number=16) ])
+        d.addCallback(deliver)
+        def check_classified(_):
+            self.db.schedulers.assertClassifications(self.SCHEDULERID,
+                    { 13 : True, 14 : False, 15 : True, 16 : False })
+        d.addCallback(check_classified)
+        d.addCallback(lambda _ :
+                self.clock.pump([1]*10)) # time is now 10
+        def check(_):
+            self.assertEqual(self.events, [ 'B[13,14]@10', 'B[15]@10' ])
+        d.addCallback(check)
+
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
+    def test_stable_timers_fire_together(self):
+        # a mass rebase: many branches, whose timers all expire at once, are
+        # handled with one query and one call to add their buildsets
+        branches = [ 'br%02d' % i for i in range(50) ]
+        sched = self.makeScheduler(basic.AnyBranchScheduler,
+                            treeStableTimer=10, branches=branches)
+        del sched.startConsumingChanges
+
+        queries = []
+        real_get = self.db.schedulers.getChangeClassificationsForBranches
+        def getChangeClassificationsForBranches(schedulerid, branches):
+            queries.append(branches)
+            return real_get(schedulerid, branches)
+        self.db.schedulers.getChangeClassificationsForBranches = \
+                getChangeClassificationsForBranches
+        calls = []
+        real_add = sched.addBuildsetsForChanges
+        def addBuildsetsForChanges(**kwargs):
+            calls.append(kwargs['changeids_list'])
+            return real_add(**kwargs)
+        sched.addBuildsetsForChanges = addBuildsetsForChanges
+
+        changes = []
+        for i, branch in enumerate(branches):
+            ch = self.makeFakeChange(branch=branch, number=100+i)
+            self.db.changes.fakeAddChange(ch)
+            changes.append(ch)
+
+        d = sched.startService(_returnDeferred=True)
+        d.addCallback(lambda _ :
+            self.master.getSubscriptionCallbacks()['change_batches'](changes))
+        def check_pending(_):
+            self.assertEqual(sched.getPendingTimerCount(), 50)
+            # all of the timers share one reactor timer
+            self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        d.addCallback(check_pending)
+        d.addCallback(lambda _ : self.clock.advance(10))
+        def check(_):
+            self.assertEqual(sched.getPendingTimerCount(), 0)
+            self.assertEqual(queries, [ branches ])
+            self.assertEqual(calls, [ [ [100+i] for i in range(50) ] ])
+            self.assertEqual(len(self.events), 50)
+            self.db.schedulers.assertClassifications(self.SCHEDULERID, {})
+        d.addCallback(check)
+        d.addCallback(lambda _ : sched.stopService())
+        return d
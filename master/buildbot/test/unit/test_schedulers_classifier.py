@@ -0,0 +1,245 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.schedulers import classifier
+from buildbot.changes import filter
+from buildbot.test.fake import fakedb
+
+class Change(object):
+    project = ''
+    repository = ''
+    category = ''
+    def __init__(self, number, branch='master'):
+        self.number = number
+        self.branch = branch
+
+class ChangeClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.master = mock.Mock()
+        self.master.db = fakedb.FakeDBConnector(self)
+        self.change_batches_cb = None
+        def subscribeToChangeBatches(cb):
+            self.change_batches_cb = cb
+            sub = mock.Mock()
+            def unsubscribe():
+                self.change_batches_cb = None
+            sub.unsubscribe = unsubscribe
+            return sub
+        self.master.subscribeToChangeBatches = subscribeToChangeBatches
+        self.classifier = classifier.ChangeClassifier(self.master)
+        self.clock = self.classifier._reactor = task.Clock()
+
+        self.recorded = []
+        real_classify = self.master.db.schedulers.classifyChangesForSchedulers
+        def classifyChangesForSchedulers(classifications):
+            self.recorded.append(classifications)
+            return real_classify(classifications)
+        self.master.db.schedulers.classifyChangesForSchedulers = \
+                classifyChangesForSchedulers
+
+    def subscribe(self, **kwargs):
+        got = []
+        def cb(classified):
+            got.append([ (ch.number, imp) for ch, imp in classified ])
+            return defer.succeed(None)
+        self.classifier.subscribe(cb, **kwargs)
+        return got
+
+    def test_batches(self):
+        got = self.subscribe()
+        self.change_batches_cb([ Change(1) ])
+        self.change_batches_cb([ Change(2), Change(3) ])
+        self.assertEqual(got, [])
+        self.clock.advance(self.classifier.batchDelay)
+        # both batches are delivered together
+        self.assertEqual(got, [ [ (1, True), (2, True), (3, True) ] ])
+
+    def test_filter_and_classify(self):
+        got_master = self.subscribe(
+                change_filter=filter.ChangeFilter(branch='master'),
+                fileIsImportant=lambda ch : ch.number % 2 == 0)
+        got_devel = self.subscribe(
+                change_filter=filter.ChangeFilter(branch='devel'))
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2), Change(3, 'devel') ])
+        self.assertEqual(got_master, [ [ (1, False), (2, True) ] ])
+        self.assertEqual(got_devel, [ [ (3, True) ] ])
+
+    def test_filter_results_reused(self):
+        # (a regular expression, so that the filter is not indexed)
+        cf = filter.ChangeFilter(branch_re='master')
+        calls = []
+        real_filter_change = cf.filter_change
+        def filter_change(change):
+            calls.append(change.number)
+            return real_filter_change(change)
+        cf.filter_change = filter_change
+        # two schedulers sharing a filter
+        got1 = self.subscribe(change_filter=cf)
+        got2 = self.subscribe(change_filter=cf)
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2), Change(3, 'devel') ])
+        self.assertEqual(got1, [ [ (1, True), (2, True) ] ])
+        self.assertEqual(got2, got1)
+        # only one call for each distinct branch
+        self.assertEqual(calls, [ 1, 3 ])
+
+    def test_filter_subclass_not_cached(self):
+        class OddFilter(filter.ChangeFilter):
+            def filter_change(self, change):
+                return change.number % 2 == 1
+        got = self.subscribe(change_filter=OddFilter(branch_re='master'))
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2), Change(3) ])
+        self.assertEqual(got, [ [ (1, True), (3, True) ] ])
+
+    def test_filter_exception(self):
+        class BrokenFilter(filter.ChangeFilter):
+            def filter_change(self, change):
+                if change.number == 2:
+                    raise RuntimeError('oops')
+                return True
+        got_broken = self.subscribe(change_filter=BrokenFilter())
+        def bad_fileIsImportant(change):
+            raise RuntimeError('oops')
+        got_bad_imp = self.subscribe(fileIsImportant=bad_fileIsImportant)
+        got_ok = self.subscribe()
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2) ])
+        # only the consumer whose check failed misses the change
+        self.assertEqual(got_broken, [ [ (1, True) ] ])
+        self.assertEqual(got_bad_imp, [])
+        self.assertEqual(got_ok, [ [ (1, True), (2, True) ] ])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 3)
+
+    def test_indexed_routing(self):
+        got_master = self.subscribe(name='m',
+                change_filter=filter.ChangeFilter(branch='master'))
+        got_ab = self.subscribe(name='ab',
+                change_filter=filter.ChangeFilter(branch=['a', 'b']))
+        got_proj = self.subscribe(name='proj',
+                change_filter=filter.ChangeFilter(project='p',
+                                                  branch_re='^rel'))
+        got_re = self.subscribe(name='re',
+                change_filter=filter.ChangeFilter(branch_re='^(a|rel)'))
+        got_all = self.subscribe(name='all')
+        self.classifier.batchDelay = 0
+        changes = [ Change(1), Change(2, 'a'), Change(3, 'rel-1'),
+                    Change(4, 'rel-2') ]
+        changes[2].project = 'p'
+        self.change_batches_cb(changes)
+        self.assertEqual(got_master, [ [ (1, True) ] ])
+        self.assertEqual(got_ab, [ [ (2, True) ] ])
+        self.assertEqual(got_proj, [ [ (3, True) ] ])
+        self.assertEqual(got_re, [ [ (2, True), (3, True), (4, True) ] ])
+        self.assertEqual(got_all, [ [ (1, True), (2, True), (3, True),
+                                      (4, True) ] ])
+
+        status = self.classifier.getStatus()
+        self.assertEqual(status['changes_routed'], 4)
+        # changes 1, 2 and 3 found one indexed candidate each
+        self.assertEqual(status['indexed_candidates'], 3)
+        self.assertEqual(status['unindexed_candidates'], 8)
+        self.assertEqual([ (c['name'], c['indexed_by'], c['candidates'],
+                            c['matched']) for c in status['consumers'] ],
+            [ ('m', 'branch', 1, 1), ('ab', 'branch', 1, 1),
+              ('proj', 'project', 1, 1), ('re', None, 4, 3),
+              ('all', None, 4, 4) ])
+
+    def test_duck_typed_filter(self):
+        class OddFilter(object):
+            # not a ChangeFilter, but has filter_change
+            def filter_change(self, change):
+                return change.number % 2 == 1
+        got_odd = self.subscribe(change_filter=OddFilter())
+        got_master = self.subscribe(
+                change_filter=filter.ChangeFilter(branch='master'))
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2), Change(3) ])
+        self.assertEqual(got_odd, [ [ (1, True), (3, True) ] ])
+        self.assertEqual(got_master, [ [ (1, True), (2, True), (3, True) ] ])
+        self.assertEqual(
+                self.classifier.getStatus()['consumers'][0]['indexed_by'],
+                None)
+
+    def test_filter_subclass_not_indexed(self):
+        class ProjectOrMaster(filter.ChangeFilter):
+            def filter_change(self, change):
+                return change.project == 'p' or change.branch == 'master'
+        got = self.subscribe(change_filter=ProjectOrMaster(project='p'))
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2, 'devel') ])
+        self.assertEqual(got, [ [ (1, True) ] ])
+
+    def test_index_updated_on_unsubscribe(self):
+        self.subscribe(change_filter=filter.ChangeFilter(branch='master'))
+        sub = self.classifier.subscribe(lambda classified : None,
+                change_filter=filter.ChangeFilter(branch='master'))
+        self.classifier.batchDelay = 0
+        sub.unsubscribe()
+        self.change_batches_cb([ Change(1) ])
+        self.assertEqual(self.classifier.getStatus()['indexed_candidates'], 1)
+
+    def test_record_one_transaction(self):
+        self.subscribe(schedulerid=10)
+        self.subscribe(schedulerid=11,
+                change_filter=filter.ChangeFilter(branch='devel'))
+        self.subscribe() # doesn't record
+        self.classifier.batchDelay = 0
+        self.change_batches_cb([ Change(1), Change(2, 'devel') ])
+        self.assertEqual(self.recorded, [
+            { 10 : { 1 : True, 2 : True }, 11 : { 2 : True } } ])
+
+    def test_unsubscribe(self):
+        got = []
+        sub = self.classifier.subscribe(got.append)
+        self.change_batches_cb([ Change(1) ])
+        sub.unsubscribe()
+        self.assertEqual(self.change_batches_cb, None)
+        self.clock.advance(self.classifier.batchDelay)
+        self.assertEqual(got, [])
+
+    def test_unsubscribe_hands_on_buffer(self):
+        # a scheduler replaced at reconfig gets the changes that its
+        # predecessor had not yet been given
+        sub = self.classifier.subscribe(lambda classified : None)
+        self.change_batches_cb([ Change(1) ])
+        sub.unsubscribe()
+        got = self.subscribe()
+        self.clock.advance(self.classifier.batchDelay)
+        self.assertEqual(got, [ [ (1, True) ] ])
+
+    def test_unsubscribe_remaining_consumers(self):
+        got = self.subscribe()
+        sub = self.classifier.subscribe(lambda classified : None)
+        self.change_batches_cb([ Change(1) ])
+        sub.unsubscribe()
+        self.clock.advance(self.classifier.batchDelay)
+        self.assertEqual(got, [ [ (1, True) ] ])
+
+    def test_large_batch_yields(self):
+        got = self.subscribe()
+        self.classifier.batchDelay = 0
+        self.classifier.chunkSize = 2
+        d = self.change_batches_cb([ Change(n) for n in range(5) ])
+        self.assertEqual(got, [])
+        self.clock.advance(0)
+        self.clock.advance(0)
+        self.assertEqual(len(got[0]), 5)
+        return d
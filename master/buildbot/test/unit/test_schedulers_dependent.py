@@ -54,9 +54,11 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
         sched = self.makeScheduler()
         sched.startService()
 
+        # the scheduler subscribes to buildset additions, and only listens to
+        # all completions while loading its subscriptions
         callbacks = self.master.getSubscriptionCallbacks()
         self.assertNotEqual(callbacks['buildsets'], None)
-        self.assertNotEqual(callbacks['buildset_completion'], None)
+        self.assertEqual(callbacks['buildset_completion'], None)
 
         d = sched.stopService()
         def check(_):
@@ -78,7 +80,7 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
                                 project='proj', repository='repo'),
             fakedb.Buildset(id=44, sourcestampid=93),
             ])
-        callbacks['buildsets'](bsid=44,
+        callbacks['buildsets'](bsid=44, ssid=93,
                 properties=properties.Properties(scheduler=scheduler_name))
 
         # check whether scheduler is subscribed to that buildset
@@ -89,7 +91,7 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
 
         # pretend that the buildset is finished
         self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=result)
-        callbacks['buildset_completion'](44, result)
+        self.master.buildsetComplete(44, result)
 
         # and check whether a buildset was added in response
         if expect_buildset:
@@ -106,6 +108,10 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
         else:
             self.db.buildsets.assertBuildsets(1) # only the one we added above
 
+        # either way, nothing is left subscribed
+        self.db.buildsets.assertBuildsetSubscriptions()
+        self.assertEqual(len(self.master.bset_completion_index), 0)
+
     def test_related_buildset_SUCCESS(self):
         return self.do_test(self.UPSTREAM_NAME, True, SUCCESS, True)
 
@@ -117,3 +123,51 @@ class Dependent(scheduler.SchedulerMixin, unittest.TestCase):
 
     def test_unrelated_buildset(self):
         return self.do_test('unrelated', False, SUCCESS, False)
+
+    def test_unrelated_completion_ignored(self):
+        sched = self.makeScheduler()
+        sched.startService()
+        callbacks = self.master.getSubscriptionCallbacks()
+
+        self.db.insertTestData([
+            fakedb.SourceStamp(id=93, revision='555', branch='master'),
+            fakedb.Buildset(id=44, sourcestampid=93),
+            fakedb.Buildset(id=45, sourcestampid=93),
+            ])
+        callbacks['buildsets'](bsid=44, ssid=93,
+                properties=properties.Properties(scheduler=self.UPSTREAM_NAME))
+
+        # the completion of another buildset does not touch the database
+        def fail(*args):
+            self.fail("database consulted for an unrelated buildset")
+        self.db.buildsets.getSubscribedBuildsets = fail
+        self.db.buildsets.fakeBuildsetCompletion(bsid=45, result=SUCCESS)
+        self.master.buildsetComplete(45, SUCCESS)
+
+        self.db.buildsets.assertBuildsets(2)
+        self.db.buildsets.assertBuildsetSubscriptions((self.SCHEDULERID, 44))
+
+    def test_subscriptions_loaded_at_start(self):
+        sched = self.makeScheduler()
+        self.db.insertTestData([
+            fakedb.SourceStamp(id=93, revision='555', branch='master',
+                                project='proj', repository='repo'),
+            fakedb.Buildset(id=44, sourcestampid=93),
+            fakedb.Buildset(id=45, sourcestampid=93),
+            ])
+        self.db.buildsets.subscribeToBuildset(self.SCHEDULERID, 44)
+        self.db.buildsets.subscribeToBuildset(self.SCHEDULERID, 45)
+        # buildset 44 completed while the scheduler was not running
+        self.db.buildsets.fakeBuildsetCompletion(bsid=44, result=SUCCESS)
+
+        sched.startService()
+
+        # 44 was acted on at once, while 45 is awaited
+        self.db.buildsets.assertBuildsets(3)
+        self.db.buildsets.assertBuildsetSubscriptions((self.SCHEDULERID, 45))
+
+        self.db.buildsets.fakeBuildsetCompletion(bsid=45, result=WARNINGS)
+        self.master.buildsetComplete(45, WARNINGS)
+        self.db.buildsets.assertBuildsets(4)
+        self.db.buildsets.assertBuildsetSubscriptions()
+        return sched.stopService()
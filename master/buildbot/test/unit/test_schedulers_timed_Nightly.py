@@ -13,7 +13,10 @@
 #
 # Copyright Buildbot Team Members
 
+import os
 import time
+import random
+import calendar
 import mock
 from twisted.trial import unittest
 from twisted.internet import defer, task
@@ -22,6 +25,73 @@ from buildbot.schedulers import timed
 from buildbot.test.util import scheduler
 from buildbot.changes import filter
 
+US_EASTERN = 'EST5EDT,M3.2.0,M11.1.0'
+
+def brute_force_getNextBuildTime(sched, lastActuated, dayLimit):
+    # the original implementation of Nightly.getNextBuildTime, which steps
+    # through every minute until it finds a match, giving up (by returning
+    # None) after dayLimit days rather than two years
+    def addTime(timetuple, secs):
+        return time.localtime(time.mktime(timetuple)+secs)
+
+    def check(ourvalue, value):
+        if ourvalue == '*': return True
+        if isinstance(ourvalue, int): return value == ourvalue
+        return (value in ourvalue)
+
+    dateTime = time.localtime(lastActuated)
+    dateTime = addTime(dateTime, 60-dateTime[5])
+    stepLimit = dayLimit * 24 * 60
+    def isRunTime(timetuple):
+        if not check(sched.minute, timetuple[4]):
+            return False
+        if not check(sched.hour, timetuple[3]):
+            return False
+        if not check(sched.month, timetuple[1]):
+            return False
+        if sched.dayOfMonth != '*' and sched.dayOfWeek != '*':
+            if not (check(sched.dayOfMonth, timetuple[2]) or
+                    check(sched.dayOfWeek, timetuple[6])):
+                return False
+        else:
+            if not check(sched.dayOfMonth, timetuple[2]):
+                return False
+            if not check(sched.dayOfWeek, timetuple[6]):
+                return False
+        return True
+
+    while not isRunTime(dateTime):
+        dateTime = addTime(dateTime, 60)
+        stepLimit -= 1
+        if not stepLimit:
+            return None
+    return time.mktime(dateTime)
+
+def random_spec(rand):
+    def field(values, p_star):
+        r = rand.random()
+        if r < p_star:
+            return '*'
+        elif r < (1 + p_star) / 2:
+            return rand.choice(values)
+        else:
+            return rand.sample(values, rand.randint(1, 4))
+    return dict(minute=field(range(60), 0.1),
+                hour=field(range(24), 0.4),
+                dayOfMonth=field(range(1, 32), 0.8),
+                month=field(range(1, 13), 0.9),
+                dayOfWeek=field(range(7), 0.7))
+
+def find_utc_offset_changes(start, end):
+    # return the hours between start and end at which the UTC offset changes
+    def offset(when):
+        return calendar.timegm(time.localtime(when)) - when
+    changes = []
+    for when in range(start, end, 3600):
+        if offset(when) != offset(when + 3600):
+            changes.append(when + 3600)
+    return changes
+
 class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     SCHEDULERID = 132
@@ -245,6 +315,112 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             ((2011,  1,  5, 22, 19), (2011,  1,  7,  1,  0)), # Thurs
         )
 
+    def test_getNextBuildTime_leap_day(self):
+        # far enough away that stepping through every minute would give up
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                dayOfMonth=29, month=2, hour=6)
+        return self.do_getNextBuildTime_test(sched,
+            ((2012,  3,  1,  0,  0), (2016,  2, 29,  6,  0)),
+            ((2096,  3,  1,  0,  0), (2104,  2, 29,  6,  0)), # 2100 isn't
+        )
+
+    def test_getNextBuildTime_never(self):
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                dayOfMonth=30, month=2)
+        d = sched.getNextBuildTime(time.mktime((2011, 1, 1, 0, 0, 0, 0, 0, -1)))
+        d.addCallback(self.assertEqual, None)
+        return d
+
+    ## getNextBuildTime across DST changes
+
+    def setTimezone(self, tz):
+        if not hasattr(time, 'tzset'):
+            raise unittest.SkipTest("cannot change the timezone here")
+        old_tz = os.environ.get('TZ')
+        def restore():
+            if old_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old_tz
+            time.tzset()
+        self.addCleanup(restore)
+        os.environ['TZ'] = tz
+        time.tzset()
+
+    def getNextBuildTimeFrom(self, sched, when):
+        l = []
+        sched.getNextBuildTime(when).addCallback(l.append)
+        return l[0]
+
+    def test_getNextBuildTime_dst_skipped(self):
+        # 2:30 does not occur on 2011-03-13 in the US
+        self.setTimezone(US_EASTERN)
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                hour=2, minute=30)
+        self.assertEqual(self.getNextBuildTimeFrom(sched,
+                            time.mktime((2011, 3, 12, 12, 0, 0, 0, 0, -1))),
+                         time.mktime((2011, 3, 14, 2, 30, 0, 0, 0, -1)))
+
+    def test_getNextBuildTime_dst_repeated(self):
+        # 1:30 occurs twice on 2011-11-06 in the US, an hour apart
+        self.setTimezone(US_EASTERN)
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                hour=1, minute=[30, 50])
+        first = time.mktime((2011, 11, 6, 1, 30, 0, 0, 0, 1))
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first - 3600), first)
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first), first + 1200)
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first + 1200), first + 3600)
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first + 3600),
+                         first + 4800)
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first + 4800),
+                         time.mktime((2011, 11, 7, 1, 30, 0, 0, 0, -1)))
+
+    def test_getNextBuildTime_dst_repeated_first_after(self):
+        # from 1:40 EDT, 1:50 EDT comes before the second 1:30
+        self.setTimezone(US_EASTERN)
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                hour=1, minute=[30, 50])
+        first = time.mktime((2011, 11, 6, 1, 30, 0, 0, 0, 1))
+        self.assertEqual(self.getNextBuildTimeFrom(sched, first + 600),
+                         first + 1200)
+
+    ## randomized comparison with stepping through every minute
+
+    def check_matches_brute_force(self, tz, seed, count):
+        self.setTimezone(tz)
+        rand = random.Random(seed)
+        changes = find_utc_offset_changes(1293840000, 1325376000) # 2011
+        for i in range(count):
+            spec = random_spec(rand)
+            sched = timed.Nightly(name='test', builderNames=['test'],
+                                  branch=None, **spec)
+            # mostly around DST changes, sometimes anywhere
+            if changes and rand.random() < 0.7:
+                when = rand.choice(changes) + rand.randint(-86400, 86400)
+            else:
+                when = rand.randint(1262304000, 1420070400) # 2010-2014
+            when += rand.choice([0, 0.5])
+            expected = brute_force_getNextBuildTime(sched, when, 8)
+            if expected is None:
+                continue # too slow to find by stepping
+            got = self.getNextBuildTimeFrom(sched, when)
+            self.assertEqual(got, expected, "%r from %r (%s): %r != %r" %
+                    (spec, when, time.ctime(when), got and time.ctime(got),
+                     time.ctime(expected)))
+
+    def test_getNextBuildTime_matches_brute_force_utc(self):
+        self.check_matches_brute_force('UTC0', 1, 150)
+
+    def test_getNextBuildTime_matches_brute_force_us(self):
+        self.check_matches_brute_force(US_EASTERN, 2, 150)
+
+    def test_getNextBuildTime_matches_brute_force_eu(self):
+        self.check_matches_brute_force('CET-1CEST,M3.5.0,M10.5.0/3', 3, 150)
+
+    def test_getNextBuildTime_matches_brute_force_half_hour_dst(self):
+        # Lord Howe Island moves its clocks by half an hour
+        self.check_matches_brute_force('LHST-10:30LHDT-11,M10.1.0,M4.1.0', 4, 150)
+
     ## end-to-end tests: let's see the scheduler in action
 
     def test_iterations_simple(self):
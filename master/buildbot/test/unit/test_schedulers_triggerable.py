@@ -44,6 +44,10 @@ class Triggerable(scheduler.SchedulerMixin, unittest.TestCase):
     # The Deferred from trigger() is completely processed before this test
     # method returns.
 
+    def assertWaitingFor(self, *bsids):
+        self.assertEqual(sorted(self.master.bset_completion_index.subscriptions),
+                         sorted(bsids))
+
     def test_trigger(self):
         sched = self.makeScheduler()
         self.db.insertTestData([
@@ -52,8 +56,7 @@ class Triggerable(scheduler.SchedulerMixin, unittest.TestCase):
         ])
 
         # no subscription should be in place yet
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertEqual(callbacks['buildset_completion'], None)
+        self.assertWaitingFor()
 
         # trigger the scheduler, exercising properties while we're at it
         set_props = properties.Properties()
@@ -78,26 +81,23 @@ class Triggerable(scheduler.SchedulerMixin, unittest.TestCase):
                 dict(branch='br', project='p', repository='r',
                      revision='myrev'))
 
-        # check that the scheduler has subscribed to buildset changes, but
-        # not fired yet
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertNotEqual(callbacks['buildset_completion'], None)
+        # check that the scheduler has subscribed to the completion of its
+        # buildset, but not fired yet
+        self.assertWaitingFor(bsid)
         self.assertFalse(self.fired)
 
         # pretend a non-matching buildset is complete
-        callbacks['buildset_completion'](bsid+27, 3)
+        self.master.buildsetComplete(bsid+27, 3)
 
         # scheduler should not have reacted
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertNotEqual(callbacks['buildset_completion'], None)
+        self.assertWaitingFor(bsid)
         self.assertFalse(self.fired)
 
         # pretend the matching buildset is complete
-        callbacks['buildset_completion'](bsid, 13)
+        self.master.buildsetComplete(bsid, 13)
 
         # scheduler should have reacted
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertEqual(callbacks['buildset_completion'], None)
+        self.assertWaitingFor()
         self.assertTrue(self.fired)
 
     def test_trigger_overlapping(self):
@@ -110,8 +110,7 @@ class Triggerable(scheduler.SchedulerMixin, unittest.TestCase):
         ])
 
         # no subscription should be in place yet
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertEqual(callbacks['buildset_completion'], None)
+        self.assertWaitingFor()
 
         # trigger the scheduler the first time
         d = sched.trigger(91)
@@ -135,17 +134,67 @@ class Triggerable(scheduler.SchedulerMixin, unittest.TestCase):
                 dict(branch='br', project='p', repository='r',
                      revision='myrev2'))
 
-        # check that the scheduler has subscribed to buildset changes
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertNotEqual(callbacks['buildset_completion'], None)
+        # check that the scheduler has subscribed to both buildsets
+        self.assertWaitingFor(bsid1, bsid2)
 
         # let a few buildsets complete
-        callbacks['buildset_completion'](bsid2+27, 3)
-        callbacks['buildset_completion'](bsid2, 22)
-        callbacks['buildset_completion'](bsid2+7, 3)
-        callbacks['buildset_completion'](bsid1, 11)
+        self.master.buildsetComplete(bsid2+27, 3)
+        self.master.buildsetComplete(bsid2, 22)
+        self.master.buildsetComplete(bsid2+7, 3)
+        self.master.buildsetComplete(bsid1, 11)
 
         # both should have triggered with appropriate results, and the
-        # subscription should be cancelled
-        callbacks = self.master.getSubscriptionCallbacks()
-        self.assertEqual(callbacks['buildset_completion'], None)
+        # subscriptions should be cancelled
+        self.assertWaitingFor()
+
+    def test_triggerSchedulers(self):
+        sched1 = self.makeScheduler()
+        sched2 = triggerable.Triggerable(name='m', builderNames=['c', 'd'])
+        sched2.master = self.master
+        self.db.insertTestData([
+            fakedb.SourceStamp(id=91, revision='myrev', branch='br',
+                project='p', repository='r'),
+        ])
+
+        # count the transactions
+        calls = []
+        addBuildsets = self.db.buildsets.addBuildsets
+        def addBuildsetsCounted(buildsets):
+            calls.append(len(buildsets))
+            return addBuildsets(buildsets)
+        self.db.buildsets.addBuildsets = addBuildsetsCounted
+
+        results = []
+        d = triggerable.triggerSchedulers(self.master, [ sched1, sched2 ], 91)
+        def gotWaiters(waiters):
+            for w in waiters:
+                w.addCallback(results.append)
+        d.addCallback(gotWaiters)
+
+        # both buildsets were added at once
+        self.assertEqual(calls, [ 2 ])
+        bsids = self.db.buildsets.allBuildsetIds()
+        bsids.sort()
+        self.assertEqual(self.db.buildsets.buildsets[bsids[0]]['builderNames'],
+                         ['b'])
+        self.assertEqual(self.db.buildsets.buildsets[bsids[1]]['builderNames'],
+                         ['c', 'd'])
+        self.assertWaitingFor(*bsids)
+
+        self.master.buildsetComplete(bsids[1], 3)
+        self.master.buildsetComplete(bsids[0], 0)
+        self.assertEqual(results, [ 3, 0 ])
+        self.assertWaitingFor()
+
+    def test_stopService_fails_waiters(self):
+        sched = self.makeScheduler()
+        self.db.insertTestData([
+            fakedb.SourceStamp(id=91, revision='myrev', branch='br',
+                project='p', repository='r'),
+        ])
+        sched.startService()
+        d = sched.trigger(91)
+        d = self.assertFailure(d, RuntimeError)
+        d.addCallback(lambda _ : self.assertWaitingFor())
+        sched.stopService()
+        return d
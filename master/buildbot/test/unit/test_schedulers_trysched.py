@@ -22,6 +22,7 @@ import StringIO
 import twisted
 from twisted.trial import unittest
 from twisted.internet import defer
+from twisted.spread import pb
 
 from buildbot.schedulers import trysched
 from buildbot.test.util import scheduler, dirs
@@ -153,7 +154,8 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
             'patch_body': 'this is my diff, -- ++, etc.',
             'patch_level': 1,
             'project': '',
-            'repository': ''
+            'repository': '',
+            'priority': None,
         })
 
     def test_parseJob_v1_empty_branch_rev(self):
@@ -185,7 +187,8 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
             'patch_body': 'this is my diff, -- ++, etc.',
             'patch_level': 1,
             'project': 'proj',
-            'repository': 'repo'
+            'repository': 'repo',
+            'priority': None,
         })
 
     def test_parseJob_v2_empty_branch_rev(self):
@@ -211,12 +214,55 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
         parsedjob = sched.parseJob(StringIO.StringIO(jobstr))
         self.assertEqual(parsedjob['builderNames'], [])
 
+    def test_parseJob_v3(self):
+        sched = trysched.Try_Jobdir(name='tsched',
+                builderNames=['buildera','builderb'], jobdir='foo')
+        jobstr = self.makeNetstring(
+            '3', 'extid', 'trunk', '1234', '1', 'this is my diff, -- ++, etc.',
+            'repo', 'proj', '10',
+            'buildera', 'builderc'
+        )
+        parsedjob = sched.parseJob(StringIO.StringIO(jobstr))
+        self.assertEqual(parsedjob, {
+            'baserev': '1234',
+            'branch': 'trunk',
+            'builderNames': ['buildera', 'builderc'],
+            'jobid': 'extid',
+            'patch_body': 'this is my diff, -- ++, etc.',
+            'patch_level': 1,
+            'project': 'proj',
+            'repository': 'repo',
+            'priority': 10,
+        })
+
+    def test_parseJob_v3_empty_priority(self):
+        sched = trysched.Try_Jobdir(name='tsched',
+                builderNames=['buildera','builderb'], jobdir='foo')
+        jobstr = self.makeNetstring(
+            '3', 'extid', 'trunk', '1234', '1', 'this is my diff, -- ++, etc.',
+            'repo', 'proj', '',
+            'buildera', 'builderc'
+        )
+        parsedjob = sched.parseJob(StringIO.StringIO(jobstr))
+        self.assertEqual(parsedjob['priority'], None)
+
+    def test_parseJob_v3_invalid_priority(self):
+        sched = trysched.Try_Jobdir(name='tsched',
+                builderNames=['buildera','builderb'], jobdir='foo')
+        jobstr = self.makeNetstring(
+            '3', 'extid', 'trunk', '1234', '1', 'this is my diff, -- ++, etc.',
+            'repo', 'proj', 'high',
+            'buildera', 'builderc'
+        )
+        self.assertRaises(trysched.BadJobfile,
+            lambda : sched.parseJob(StringIO.StringIO(jobstr)))
+
     # handleJobFile
 
-    def call_handleJobFile(self, parseJob):
+    def call_handleJobFile(self, parseJob, **kwargs):
         sched = self.attachScheduler(
             trysched.Try_Jobdir(name='tsched', builderNames=['buildera','builderb'],
-                                jobdir='foo'),
+                                jobdir='foo', **kwargs),
             self.SCHEDULERID)
 
         fakefile = mock.Mock()
@@ -224,6 +270,7 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
             assert f is fakefile
             return parseJob(f)
         sched.parseJob = parseJob
+        self.fakefile = fakefile
         return sched.handleJobFile('fakefile', fakefile)
 
     def makeSampleParsedJob(self, **overrides):
@@ -237,6 +284,8 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
     def test_handleJobFile(self):
         d = self.call_handleJobFile(lambda f : self.makeSampleParsedJob())
         def check(_):
+            # the jobfile is closed once it has been parsed
+            self.assertTrue(self.fakefile.close.called)
             self.db.buildsets.assertBuildset('?',
                     dict(reason="'try' job", builderNames=['buildera', 'builderb'],
                         external_idstring='extid',
@@ -248,6 +297,38 @@ class Try_Jobdir(scheduler.SchedulerMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_handleJobFile_priority(self):
+        d = self.call_handleJobFile(
+                lambda f : self.makeSampleParsedJob(priority=10),
+                maxPriority=20)
+        def check(_):
+            self.db.buildsets.assertBuildset('?',
+                    dict(reason="'try' job", builderNames=['buildera', 'builderb'],
+                        external_idstring='extid', priority=10,
+                        properties=[('scheduler', ('tsched', 'Scheduler'))]),
+                    dict(branch='trunk', repository='repo',
+                        project='proj', revision='1234',
+                        patch_body='this is my diff, -- ++, etc.',
+                        patch_level=1, patch_subdir=''))
+        d.addCallback(check)
+        return d
+
+    def test_handleJobFile_priority_clamped(self):
+        d = self.call_handleJobFile(
+                lambda f : self.makeSampleParsedJob(priority=10),
+                priority=3)
+        def check(_):
+            self.db.buildsets.assertBuildset('?',
+                    dict(reason="'try' job", builderNames=['buildera', 'builderb'],
+                        external_idstring='extid', priority=3,
+                        properties=[('scheduler', ('tsched', 'Scheduler'))]),
+                    dict(branch='trunk', repository='repo',
+                        project='proj', revision='1234',
+                        patch_body='this is my diff, -- ++, etc.',
+                        patch_level=1, patch_subdir=''))
+        d.addCallback(check)
+        return d
+
     def test_handleJobFile_exception(self):
         def parseJob(f):
             raise trysched.BadJobfile
@@ -309,8 +390,12 @@ class Try_Userpass_Perspective(scheduler.SchedulerMixin, unittest.TestCase):
 
     def call_perspective_try(self, *args, **kwargs):
         sched = self.makeScheduler(name='tsched', builderNames=['a', 'b'],
-                port='xxx', userpass=[('a', 'b')], properties=dict(frm='schd'))
+                port='xxx', userpass=[('a', 'b')], properties=dict(frm='schd'),
+                maxPatchSize=kwargs.pop('maxPatchSize', 100),
+                maxPriority=kwargs.pop('maxPriority', None))
         persp = trysched.Try_Userpass_Perspective(sched, 'a')
+        for chunk in kwargs.pop('patch_chunks', []):
+            persp.perspective_addPatchChunk(chunk)
         return persp.perspective_try(*args, **kwargs)
 
     def test_perspective_try(self):
@@ -332,6 +417,91 @@ class Try_Userpass_Perspective(scheduler.SchedulerMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_perspective_try_patch_chunks(self):
+        d = self.call_perspective_try('default', 'abcdef', (1, None), 'repo',
+                'proj', ['a'], patch_chunks=['-- ', '++'])
+        def check(_):
+            self.db.buildsets.assertBuildset('?',
+                    dict(reason="'try' job from user a",
+                        builderNames=['a'],
+                        external_idstring=None,
+                        properties=[
+                            ('frm', ('schd', 'Scheduler')),
+                            ('scheduler', ('tsched', 'Scheduler')),
+                        ]),
+                    dict(branch='default', repository='repo',
+                        project='proj', revision='abcdef',
+                        patch_body='-- ++', patch_level=1, patch_subdir=''))
+        d.addCallback(check)
+        return d
+
+    def test_perspective_addPatchChunk_too_large(self):
+        sched = self.makeScheduler(name='tsched', builderNames=['a', 'b'],
+                port='xxx', userpass=[('a', 'b')], maxPatchSize=5)
+        persp = trysched.Try_Userpass_Perspective(sched, 'a')
+        persp.perspective_addPatchChunk('-- ')
+        self.assertRaises(pb.Error,
+                lambda : persp.perspective_addPatchChunk('+++'))
+        # the patch is discarded, and later chunks are rejected too
+        self.assertEqual(persp.patch_chunks, [])
+        self.assertRaises(pb.Error,
+                lambda : persp.perspective_addPatchChunk('+'))
+        d = persp.perspective_try('default', 'abcdef', (1, None), 'repo',
+                'proj', ['a'])
+        d = self.assertFailure(d, pb.Error)
+        def check(_):
+            self.db.buildsets.assertBuildsets(0)
+            # the next patch starts afresh
+            persp.perspective_addPatchChunk('-- ')
+            self.assertEqual(persp.patch_chunks, ['-- '])
+        d.addCallback(check)
+        return d
+
+    def test_perspective_try_patch_too_large(self):
+        d = self.call_perspective_try('default', 'abcdef', (1, '-- ++'), 'repo',
+                'proj', ['a'], maxPatchSize=4)
+        d = self.assertFailure(d, pb.Error)
+        d.addCallback(lambda _ : self.db.buildsets.assertBuildsets(0))
+        return d
+
+    def test_perspective_try_priority(self):
+        d = self.call_perspective_try('default', 'abcdef', (1, '-- ++'), 'repo',
+                'proj', ['a'], priority=5, maxPriority=5)
+        def check(_):
+            self.db.buildsets.assertBuildset('?',
+                    dict(reason="'try' job from user a",
+                        builderNames=['a'],
+                        external_idstring=None,
+                        priority=5,
+                        properties=[
+                            ('frm', ('schd', 'Scheduler')),
+                            ('scheduler', ('tsched', 'Scheduler')),
+                        ]),
+                    dict(branch='default', repository='repo',
+                        project='proj', revision='abcdef',
+                        patch_body='-- ++', patch_level=1, patch_subdir=''))
+        d.addCallback(check)
+        return d
+
+    def test_perspective_try_priority_clamped(self):
+        d = self.call_perspective_try('default', 'abcdef', (1, '-- ++'), 'repo',
+                'proj', ['a'], priority=5, maxPriority=2)
+        def check(_):
+            self.db.buildsets.assertBuildset('?',
+                    dict(reason="'try' job from user a",
+                        builderNames=['a'],
+                        external_idstring=None,
+                        priority=2,
+                        properties=[
+                            ('frm', ('schd', 'Scheduler')),
+                            ('scheduler', ('tsched', 'Scheduler')),
+                        ]),
+                    dict(branch='default', repository='repo',
+                        project='proj', revision='abcdef',
+                        patch_body='-- ++', patch_level=1, patch_subdir=''))
+        d.addCallback(check)
+        return d
+
     def test_perspective_try_bad_builders(self):
         d = self.call_perspective_try('default', 'abcdef', (1, '-- ++'), 'repo',
                 'proj', ['xxx'], properties={'pr':'op'})
@@ -79,6 +79,9 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
             self.assertEqual([1, 2, 3], q.primaryQueue.items())
             self.assertEqual([4, 5, 6, 7, 8], q.secondaryQueue.items())
 
+        self.assertEqual([1, 2], q.peekChunk(2))
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7, 8], q.peekChunk(20))
+        self.assertEqual(8, q.nbItems())
         self.assertEqual([1, 2], q.popChunk(2))
         self.assertEqual([3, 4, 5, 6, 7, 8], q.items())
         self.assertEqual(6, q.nbItems())
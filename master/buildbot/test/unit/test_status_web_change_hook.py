@@ -13,13 +13,16 @@
 #
 # Copyright Buildbot Team Members
 
+import os
+import shutil
 from buildbot.status.web import change_hook
+from buildbot.test.util import compat
 from buildbot.util import json
 from buildbot.test.fake.web import MockRequest
 from mock import Mock
 
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
 class TestChangeHookUnconfigured(unittest.TestCase):
     def setUp(self):
@@ -119,3 +122,137 @@ class TestChangeHookConfigured(unittest.TestCase):
             self.assertEquals(change['files'], ['file1', 'file2'])
         d.addCallback(check_changes)
         return d
+
+class TestChangeHookQueue(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+        self.added = []
+        self.results = []
+        self.master = Mock()
+        self.master.basedir = self.basedir
+        def addChanges(changes):
+            self.added.append(changes)
+            d = defer.Deferred()
+            self.results.append(d)
+            return d
+        self.master.addChanges = addChanges
+
+    def makeQueue(self, **kwargs):
+        q = change_hook.ChangeHookQueue(**kwargs)
+        q._reactor = self.clock = task.Clock()
+        q.parent = Mock()
+        q.parent.master = self.master
+        q.startService()
+        return q
+
+    def test_concurrency(self):
+        q = self.makeQueue(concurrency=2, queuedir=None)
+        for rev in '123':
+            self.assertEqual(q.add([ dict(revision=rev) ]), q.QUEUED)
+        # only two are running
+        self.assertEqual(self.added,
+                [ [ dict(revision='1') ], [ dict(revision='2') ] ])
+        self.assertEqual(q.getStatus()['depth'], 1)
+        self.clock.advance(5)
+        self.results[0].callback([])
+        self.assertEqual(len(self.added), 3)
+        status = q.getStatus()
+        self.assertEqual((status['depth'], status['running'],
+                          status['processed'], status['last_latency']),
+                         (0, 2, 1, 5))
+
+    def test_coalesce(self):
+        q = self.makeQueue(concurrency=1, queuedir=None)
+        self.assertEqual(q.add([ dict(revision='1') ]), q.QUEUED)
+        self.assertEqual(q.add([ dict(revision='2') ]), q.QUEUED)
+        # duplicates of both the running and the queued request
+        self.assertEqual(q.add([ dict(revision='1') ]), q.COALESCED)
+        self.assertEqual(q.add([ dict(revision='2') ]), q.COALESCED)
+        self.results[0].callback([])
+        self.results[1].callback([])
+        self.assertEqual(self.added,
+                [ [ dict(revision='1') ], [ dict(revision='2') ] ])
+        self.assertEqual(q.getStatus()['coalesced'], 2)
+        # once processed, the same changes are accepted again
+        self.assertEqual(q.add([ dict(revision='1') ]), q.QUEUED)
+
+    def test_bounded(self):
+        q = self.makeQueue(maxsize=1, queuedir=None)
+        self.assertEqual(q.add([ dict(revision='1') ]), q.QUEUED) # running
+        self.assertEqual(q.add([ dict(revision='2') ]), q.QUEUED)
+        self.assertEqual(q.add([ dict(revision='3') ]), q.REJECTED)
+        self.assertEqual(q.getStatus()['rejected'], 1)
+
+    @compat.usesFlushLoggedErrors
+    def test_retry(self):
+        q = self.makeQueue(retryDelay=10, queuedir=None)
+        q.add([ dict(revision='1') ])
+        q.add([ dict(revision='2') ])
+        self.results[0].errback(RuntimeError("db went away"))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(len(self.added), 1)
+        self.clock.advance(10)
+        # the failed request is retried first
+        self.assertEqual(self.added[1], [ dict(revision='1') ])
+        self.assertEqual(q.getStatus()['failed'], 1)
+
+    def test_durable(self):
+        q = self.makeQueue(queuedir='chq')
+        q.add([ dict(revision='1') ])
+        q.add([ dict(revision='2') ])
+        d = q.stopService()
+        self.assertFalse(d.called) # r1 is still running
+        self.results[0].callback([])
+        self.assertTrue(d.called)
+
+        # a new queue picks up where that one left off
+        q = self.makeQueue(queuedir='chq')
+        self.assertEqual(self.added[-1], [ dict(revision='2') ])
+        self.assertEqual(q.add([ dict(revision='2') ]), q.COALESCED)
+
+    def test_durable_running(self):
+        q = self.makeQueue(queuedir='chq')
+        q.add([ dict(revision='1') ])
+        q.add([ dict(revision='2') ])
+        # the master crashes while r1 is being added; r1 is requeued ahead
+        # of r2 when it restarts
+        q = self.makeQueue(queuedir='chq')
+        self.assertEqual(self.added[-1], [ dict(revision='1') ])
+        self.assertEqual(q.getStatus()['depth'], 1)
+        self.results[-1].callback([])
+        self.assertEqual(self.added[-1], [ dict(revision='2') ])
+        self.results[-1].callback([])
+        self.assertEqual(os.listdir(os.path.join(self.basedir, 'chq')), [])
+
+    @compat.usesFlushLoggedErrors
+    def test_durable_failed(self):
+        q = self.makeQueue(queuedir='chq', retryDelay=10)
+        q.add([ dict(revision='1') ])
+        self.results[0].errback(RuntimeError("db went away"))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        # the failed request is only queued once after a restart
+        q = self.makeQueue(queuedir='chq')
+        self.assertEqual(self.added[-1], [ dict(revision='1') ])
+        self.assertEqual(q.getStatus()['depth'], 0)
+
+    def test_render_accepted(self):
+        q = self.makeQueue(queuedir=None)
+        request = MockRequest()
+        request.uri = "/change_hook/"
+        request.args = { "revision" : [99] }
+        request.setResponseCode = Mock()
+        resource = change_hook.ChangeHookResource(dialects={'base' : True},
+                                                  queue=q)
+        d = resource.render_POST(request)
+        def check(ret):
+            self.assertEqual(ret, "Accepted")
+            request.setResponseCode.assert_called_with(202)
+            # the changes are added by the queue, not the request
+            self.assertEqual(request.addedChanges, [])
+            self.assertEqual([ ch['revision'] for ch in self.added[0] ], [99])
+        d.addCallback(check)
+        return d
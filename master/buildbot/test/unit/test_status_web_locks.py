@@ -0,0 +1,73 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from buildbot.locks import MasterLock, RealMasterLock
+from buildbot.status.web import base, locks, status_json
+from buildbot.util import json
+
+class Locks(unittest.TestCase):
+
+    def setUp(self):
+        lockid = MasterLock('biglock', maxCount=2)
+        self.lock = RealMasterLock(lockid)
+        build = mock.Mock()
+        build.describeLockOwner.return_value = 'bldr #3'
+        self.lock.claim(build, lockid.access('counting'))
+        self.lock.waits = 4
+        self.lock.totalWaitTime = 10
+        self.lock.maxWaitTime = 5
+
+        lock_status = self.lock.getStatus()
+        lock_status['slavename'] = None
+
+        self.request = mock.Mock()
+        self.request.args = {}
+        service = self.request.site.buildbot_service
+        service.templates = base.createJinjaEnv()
+        service.master.botmaster.getLockStatus.return_value = [ lock_status ]
+        service.getStatus.return_value.botmaster = service.master.botmaster
+
+    def makeContext(self):
+        # what the layout needs from HtmlResource.getContext
+        return dict(title='Locks', path_to_root='', stylesheet='default.css',
+                    version='0.0', time='now', tz='UTC', metatags=[],
+                    authz=mock.Mock(), welcomeurl='')
+
+    def test_LocksResource(self):
+        res = locks.LocksResource()
+        html = res.content(self.request, self.makeContext())
+        self.assertSubstring('<b>biglock</b>', html)
+        self.assertSubstring('bldr #3', html)
+        # the mean wait time
+        self.assertSubstring('2.5s', html)
+
+    def test_LocksResource_no_locks(self):
+        botmaster = self.request.site.buildbot_service.master.botmaster
+        botmaster.getLockStatus.return_value = []
+        res = locks.LocksResource()
+        html = res.content(self.request, self.makeContext())
+        self.assertSubstring('No locks have been used', html)
+
+    def test_LocksJsonResource(self):
+        res = status_json.LocksJsonResource(mock.Mock())
+        data = json.loads(res.content(self.request))
+        self.assertEqual(len(data), 1)
+        self.assertEqual((data[0]['name'], data[0]['max_count'],
+                          data[0]['counting_owners'], data[0]['waits']),
+                         ('biglock', 2, 1, 4))
+        self.assertEqual(data[0]['owners'],
+                [ dict(owner='bldr #3', mode='counting', count=1) ])
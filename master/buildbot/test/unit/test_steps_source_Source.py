@@ -16,6 +16,7 @@
 from twisted.trial import unittest
 
 from buildbot.steps.source import Source
+from buildbot.process.properties import WithProperties
 
 class SourceStamp(object):
     repository = "test"
@@ -75,3 +76,47 @@ class RepoURL(unittest.TestCase):
         self.assertEquals(s.computeRepositoryURL(func), "testbar")
 
 
+
+class CopyHardlinks(unittest.TestCase):
+
+    def test_default(self):
+        s = Source(mode='copy')
+        self.assertFalse('copy_hardlinks' in s.args)
+
+    def test_enabled(self):
+        s = Source(mode='copy', copyHardlinks=True)
+        self.assertEqual(s.args['copy_hardlinks'], True)
+
+class MirrorProperties(unittest.TestCase):
+
+    def test_commandComplete(self):
+        s = Source()
+        props = {}
+        s.setProperty = lambda name, value, source : props.__setitem__(name, value)
+        class Cmd:
+            updates = { 'mirror' : [ { 'mirror_hit' : True,
+                                       'mirror_hits' : 3,
+                                       'mirror_misses' : 1,
+                                       'mirror_update_time' : 0.25 } ] }
+        s.commandComplete(Cmd())
+        self.assertEqual(props, { 'mirror_hit' : True, 'mirror_hits' : 3,
+                                  'mirror_misses' : 1,
+                                  'mirror_update_time' : 0.25 })
+
+class PrefetchRepoURL(unittest.TestCase):
+
+    def test_string(self):
+        s = Source()
+        self.assertEqual(s.computePrefetchRepositoryURL("http://server/%s",
+                                                        SourceStamp()),
+                         "http://server/test")
+
+    def test_dict_missing(self):
+        s = Source()
+        self.assertEqual(s.computePrefetchRepositoryURL(dict(other="x"),
+                                                        SourceStamp()), None)
+
+    def test_withproperties(self):
+        s = Source()
+        self.assertEqual(s.computePrefetchRepositoryURL(
+                WithProperties("http://%(foo)s/"), SourceStamp()), None)
@@ -14,6 +14,11 @@
 # Copyright Buildbot Team Members
 
 import tempfile, os
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+from cStringIO import StringIO
 from twisted.trial import unittest
 
 from mock import Mock
@@ -21,7 +26,7 @@ from mock import Mock
 from buildbot.process.properties import Properties
 from buildbot.util import json
 from buildbot.steps.transfer import StringDownload, JSONStringDownload, JSONPropertiesDownload, \
-    FileUpload
+    FileUpload, FileDownload, _FileReader
 
 class TestFileUpload(unittest.TestCase):
     def setUp(self):
@@ -144,3 +149,86 @@ class TestJSONPropertiesDownload(unittest.TestCase):
                 break
         else:
             self.assert_(False, "No downloadFile command found")
+
+class TestFileDownload(unittest.TestCase):
+    def makeStep(self, slaveversion, **kwargs):
+        s = FileDownload(mastersrc=__file__, slavedest="dest", **kwargs)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = slaveversion
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        return s
+
+    def getArgs(self, s):
+        for c in s.remote.method_calls:
+            name, command, args = c
+            if command[3] == 'downloadFile':
+                return command[-1]
+        self.fail("No downloadFile command found")
+
+    def testDelta(self):
+        s = self.makeStep("2.13", delta=True, deltablocksize=1024)
+        s.start()
+        kwargs = self.getArgs(s)
+        self.assertEqual((kwargs['delta'], kwargs['deltablocksize']),
+                         (True, 1024))
+        kwargs['reader'].remote_close()
+
+    def testDeltaOldSlave(self):
+        s = self.makeStep("2.12", delta=True)
+        s.start()
+        kwargs = self.getArgs(s)
+        self.assertFalse('delta' in kwargs)
+        kwargs['reader'].remote_close()
+
+class TestFileReaderDelta(unittest.TestCase):
+    def sigs(self, data, bs):
+        return [ md5(data[i:i+bs]).digest() for i in range(0, len(data), bs) ]
+
+    def testReadDelta(self):
+        reader = _FileReader(StringIO('aaaaXXXXccccddddee'))
+        reader.remote_addSignatures(4, 0, self.sigs('aaaabbbb', 4))
+        reader.remote_addSignatures(4, 2, self.sigs('ccccdddd', 4))
+        ops = reader.remote_readDelta(100)
+        self.assertEqual(ops, [0, 'XXXX', 2, 3, 'ee'])
+        self.assertEqual(reader.remote_readDelta(100), [])
+        self.assertEqual((reader.bytes_sent, reader.bytes_saved), (6, 12))
+
+    def testReadDeltaNoSignatures(self):
+        reader = _FileReader(StringIO('hello'))
+        self.assertEqual(reader.remote_readDelta(100), ['hello'])
+        self.assertEqual(reader.remote_readDelta(100), [])
+
+    def testReadDeltaLimits(self):
+        reader = _FileReader(StringIO('XXXXYYYYZZZZ'))
+        reader.remote_addSignatures(4, 0, [])
+        # literal blocks are split rather than overshooting maxlength
+        self.assertEqual(reader.remote_readDelta(5), ['XXXXY'])
+        self.assertEqual(reader.remote_readDelta(5), ['YYYZZ'])
+        self.assertEqual(reader.remote_readDelta(5), ['ZZ'])
+        self.assertEqual(reader.remote_readDelta(5), [])
+        self.assertEqual(reader.bytes_sent, 12)
+
+    def testReadDeltaSplitKeepsAlignment(self):
+        reader = _FileReader(StringIO('XXXXaaaa'))
+        reader.remote_addSignatures(4, 0, self.sigs('aaaa', 4))
+        self.assertEqual(reader.remote_readDelta(3), ['XXX'])
+        # the rest of the literal block comes first, then the match
+        self.assertEqual(reader.remote_readDelta(3), ['X', 0])
+        self.assertEqual(reader.remote_readDelta(3), [])
+
+    def testReadDeltaMaxLiteral(self):
+        reader = _FileReader(StringIO('X' * 40))
+        reader.MAX_DELTA_LITERAL = 10
+        reader.remote_addSignatures(16, 0, [])
+        self.assertEqual(reader.remote_readDelta(100), ['X' * 10])
+
+    def testReadDeltaMaxOps(self):
+        reader = _FileReader(StringIO('aaaa' * 5))
+        reader.MAX_DELTA_OPS = 3
+        reader.remote_addSignatures(4, 0, self.sigs('aaaa', 4))
+        self.assertEqual(reader.remote_readDelta(100), [0, 0, 0])
+        self.assertEqual(reader.remote_readDelta(100), [0, 0])
@@ -63,3 +63,43 @@ class TestMaildirService(dirs.DirsMixin, unittest.TestCase):
             self.assertEqual(messagesReceived, [ 'newmsg' ])
         d.addCallback(check_nonempty)
         return d
+
+    def test_messagesReceived(self):
+        self.svc = maildir.MaildirService(self.maildir)
+
+        # add a fake messagesReceived method
+        batches = []
+        def messagesReceived(filenames):
+            batches.append(filenames)
+            return defer.succeed(None)
+        self.svc.messagesReceived = messagesReceived
+        d = defer.maybeDeferred(self.svc.startService)
+        def add_msgs(_):
+            for name in ('2-msg', '1-msg', '3-msg'):
+                open(os.path.join(self.newdir, name), "w")
+        d.addCallback(add_msgs)
+        d.addCallback(lambda _ : self.svc.poll())
+        # a second poll finds nothing new
+        d.addCallback(lambda _ : self.svc.poll())
+        def check(_):
+            self.assertEqual(batches, [ [ '1-msg', '2-msg', '3-msg' ] ])
+        d.addCallback(check)
+        return d
+
+    def test_inotify(self):
+        self.svc = maildir.MaildirService(self.maildir)
+        d = defer.Deferred()
+        def messagesReceived(filenames):
+            d.callback(filenames)
+            return defer.succeed(None)
+        self.svc.messagesReceived = messagesReceived
+        self.svc.startService()
+        if not self.svc.inotify:
+            raise unittest.SkipTest("inotify is not available")
+        tmpfile = os.path.join(self.tmpdir, "newmsg")
+        open(tmpfile, "w")
+        os.rename(tmpfile, os.path.join(self.newdir, "newmsg"))
+        # no explicit poll: inotify should notice the new message
+        d.addCallback(self.assertEqual, [ 'newmsg' ])
+        return d
+    test_inotify.timeout = 10
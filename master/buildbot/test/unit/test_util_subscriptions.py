@@ -62,3 +62,49 @@ class subscriptions(unittest.TestCase):
         # log.err will cause Trial to complain about this error anyway, unless
         # we clean it up
         self.assertEqual(1, len(self.flushLoggedErrors(RuntimeError)))
+
+class indexedSubscriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.subpt = subscription.IndexedSubscriptionPoint('test_sub')
+
+    def test_str(self):
+        self.assertIn('test_sub', str(self.subpt))
+
+    def test_subscribe_unsubscribe(self):
+        state = []
+        def cb(*args, **kwargs):
+            state.append((args, kwargs))
+
+        # subscribe to two keys
+        sub1 = self.subpt.subscribe(1, cb)
+        sub2 = self.subpt.subscribe(2, cb)
+        self.assertTrue(isinstance(sub1, subscription.Subscription))
+        self.assertEqual(len(self.subpt), 2)
+
+        # deliver only reaches the subscribers for the key
+        self.subpt.deliver(1, 'x', a=3)
+        self.subpt.deliver(3, 'y')
+        self.assertEqual(state, [(('x',), dict(a=3))])
+        state.pop()
+
+        # unsubscribe, removing the key once it has no subscribers
+        sub1.unsubscribe()
+        self.assertEqual(len(self.subpt), 1)
+        self.subpt.deliver(1, 'x')
+        self.assertEqual(state, [])
+
+        sub2.unsubscribe()
+        self.assertEqual(len(self.subpt), 0)
+
+    @compat.usesFlushLoggedErrors
+    def test_exception(self):
+        def cb(*args, **kwargs):
+            raise RuntimeError('mah bucket!')
+
+        self.subpt.subscribe('k', cb)
+        try:
+            self.subpt.deliver('k')
+        except RuntimeError:
+            self.fail("should not have seen exception here!")
+        self.assertEqual(1, len(self.flushLoggedErrors(RuntimeError)))
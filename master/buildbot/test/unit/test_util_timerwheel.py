@@ -0,0 +1,138 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from twisted.internet import task
+from buildbot.util import timerwheel
+
+class TimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.fired = []
+        self.wheel = timerwheel.TimerWheel(self.callback, _reactor=self.clock)
+
+    def callback(self, names):
+        self.fired.append((self.clock.seconds(), names))
+
+    def test_fire(self):
+        self.wheel.reset('a', 10)
+        self.assertTrue(self.wheel.isPending('a'))
+        self.assertEqual(len(self.wheel), 1)
+        self.clock.advance(9)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [ (10, [ 'a' ]) ])
+        self.assertFalse(self.wheel.isPending('a'))
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_reset_postpones(self):
+        self.wheel.reset('a', 10)
+        self.clock.advance(5)
+        self.wheel.reset('a', 10)
+        self.clock.advance(5)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(5)
+        self.assertEqual(self.fired, [ (15, [ 'a' ]) ])
+
+    def test_reset_sooner(self):
+        self.wheel.reset('a', 10)
+        self.wheel.reset('a', 3)
+        self.clock.advance(3)
+        self.assertEqual(self.fired, [ (3, [ 'a' ]) ])
+        self.clock.advance(10)
+        self.assertEqual(len(self.fired), 1)
+
+    def test_one_reactor_timer(self):
+        for i in range(100):
+            self.wheel.reset(i, 10 + i % 7)
+        self.assertEqual(len(self.wheel), 100)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+    def test_expired_together_in_deadline_order(self):
+        self.wheel.reset('a', 10)
+        self.wheel.reset('b', 5)
+        self.wheel.reset('c', 7)
+        # the reactor is late, so all three have expired
+        self.clock.advance(20)
+        self.assertEqual(self.fired, [ (20, [ 'b', 'c', 'a' ]) ])
+
+    def test_resolution(self):
+        wheel = timerwheel.TimerWheel(self.callback, resolution=10,
+                                      _reactor=self.clock)
+        wheel.reset('a', 11)
+        self.clock.advance(2)
+        wheel.reset('b', 12)
+        # both fire at the next multiple of the resolution
+        self.clock.advance(17)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [ (20, [ 'a', 'b' ]) ])
+
+    def test_resolution_integer_time(self):
+        # with an integer clock and resolution, deadlines are still rounded
+        # up, not down
+        self.clock.rightNow = 0
+        wheel = timerwheel.TimerWheel(self.callback, resolution=10,
+                                      _reactor=self.clock)
+        wheel.reset('a', 11)
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [ (20, [ 'a' ]) ])
+
+    def test_cancel(self):
+        self.wheel.reset('a', 10)
+        self.wheel.reset('b', 20)
+        self.wheel.cancel('a')
+        self.wheel.cancel('nosuch')
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [ (20, [ 'b' ]) ])
+
+    def test_cancelAll(self):
+        self.wheel.reset('a', 10)
+        self.wheel.reset('b', 20)
+        self.wheel.cancelAll()
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(30)
+        self.assertEqual(self.fired, [])
+
+    def test_reset_from_callback(self):
+        def callback(names):
+            self.fired.append((self.clock.seconds(), names))
+            if len(self.fired) == 1:
+                self.wheel.reset('a', 10)
+        self.wheel.callback = callback
+        self.wheel.reset('a', 10)
+        self.clock.advance(10)
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [ (10, [ 'a' ]), (20, [ 'a' ]) ])
+
+    def test_callback_exception(self):
+        def callback(names):
+            raise RuntimeError("oh noes")
+        self.wheel.callback = callback
+        self.wheel.reset('a', 10)
+        self.wheel.reset('b', 20)
+        self.clock.advance(10)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        # the wheel keeps going
+        self.wheel.callback = self.callback
+        self.clock.advance(10)
+        self.assertEqual(self.fired, [ (20, [ 'b' ]) ])
@@ -23,6 +23,8 @@ class ChangeSourceMixin(object):
      - starting and stopping a ChangeSource service
      - a fake C{self.master.addChange}, which adds its args
        to the list C{self.chagnes_added}
+     - a fake C{self.master.addChanges}, which adds each of the changes
+       given to it to the same list
     """
 
     changesource = None
@@ -35,8 +37,12 @@ class ChangeSourceMixin(object):
             self.changes_added.append(kwargs)
             change = mock.Mock()
             return defer.succeed(change)
+        def addChanges(changes):
+            self.changes_added.extend(changes)
+            return defer.succeed([ mock.Mock() for ch in changes ])
         self.master = mock.Mock()
         self.master.addChange = addChange
+        self.master.addChanges = addChanges
         return defer.succeed(None)
 
     def tearDownChangeSource(self):
@@ -16,6 +16,8 @@
 import os
 import mock
 from buildbot.test.fake import fakedb
+from buildbot.schedulers import classifier
+from buildbot.util import subscription
 
 class FakeMaster(object):
 
@@ -23,12 +25,28 @@ class FakeMaster(object):
         self.basedir = basedir
         self.db = db
         self.changes_subscr_cb = None
+        self.change_batches_subscr_cb = None
         self.bset_subscr_cb = None
         self.bset_completion_subscr_cb = None
+        self.bset_completion_index = subscription.IndexedSubscriptionPoint(
+                                                        'buildset_completion')
+
+        # use a real classifier, but process changes immediately
+        self.change_classifier = classifier.ChangeClassifier(self)
+        self.change_classifier.batchDelay = 0
 
     def addBuildset(self, **kwargs):
         return self.db.buildsets.addBuildset(**kwargs)
 
+    def addBuildsets(self, buildsets):
+        return self.db.buildsets.addBuildsets(buildsets)
+
+    def addBuildsetsForChanges(self, buildsets, flushSchedulerid=None):
+        d = self.db.buildsets.addBuildsetsForChanges(buildsets,
+                                        flushSchedulerid=flushSchedulerid)
+        d.addCallback(lambda ids : [ bsid for bsid, ssid in ids ])
+        return d
+
     # subscriptions
     # note that only one subscription of each type is supported
 
@@ -44,6 +62,14 @@ class FakeMaster(object):
         self.changes_subscr_cb = callback
         return self._makeSubscription('changes_subscr_cb')
 
+    def subscribeToChangeBatches(self, callback):
+        assert not self.change_batches_subscr_cb
+        self.change_batches_subscr_cb = callback
+        return self._makeSubscription('change_batches_subscr_cb')
+
+    def subscribeToClassifiedChanges(self, callback, **kwargs):
+        return self.change_classifier.subscribe(callback, **kwargs)
+
     def subscribeToBuildsets(self, callback):
         assert not self.bset_subscr_cb
         self.bset_subscr_cb = callback
@@ -54,14 +80,24 @@ class FakeMaster(object):
         self.bset_completion_subscr_cb = callback
         return self._makeSubscription('bset_completion_subscr_cb')
 
+    def subscribeToBuildsetCompletion(self, bsid, callback):
+        return self.bset_completion_index.subscribe(bsid, callback)
+
+    def buildsetComplete(self, bsid, result):
+        if self.bset_completion_subscr_cb:
+            self.bset_completion_subscr_cb(bsid, result)
+        self.bset_completion_index.deliver(bsid, bsid, result)
+
     # useful assertions
 
     def getSubscriptionCallbacks(self):
         """get the subscription callbacks set on the master, in a dictionary
-        with keys @{buildsets}, @{buildset_completion}, and C{changes}."""
+        with keys @{buildsets}, @{buildset_completion}, C{changes}, and
+        C{change_batches}."""
         return dict(buildsets=self.bset_subscr_cb,
                     buildset_completion=self.bset_completion_subscr_cb,
-                    changes=self.changes_subscr_cb)
+                    changes=self.changes_subscr_cb,
+                    change_batches=self.change_batches_subscr_cb)
 
 
 class SchedulerMixin(object):
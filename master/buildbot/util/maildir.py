@@ -15,19 +15,26 @@
 
 
 # This is a class which watches a maildir for new messages. It uses the
-# linux dirwatcher API (if available) to look for new files. The
-# .messageReceived method is invoked with the filename of the new message,
-# relative to the top of the maildir (so it will look like "new/blahblah").
+# linux inotify or dirwatcher API (if available) to look for new files. The
+# .messagesReceived method is invoked with the filenames of the new messages,
+# relative to the top of the maildir (so they will look like "new/blahblah").
 
 import os
-from twisted.python import log
+from twisted.python import log, filepath
 from twisted.application import service, internet
 from twisted.internet import reactor, defer
+inotify = None
+try:
+    from twisted.internet import inotify
+except:
+    pass
 dnotify = None
 try:
     import dnotify
 except:
-    log.msg("unable to import dnotify, so Maildir will use polling instead")
+    if not inotify:
+        log.msg("unable to import inotify or dnotify, so Maildir will use "
+                "polling instead")
 
 class NoSuchMaildir(Exception):
     pass
@@ -35,16 +42,17 @@ class NoSuchMaildir(Exception):
 class MaildirService(service.MultiService):
     """I watch a maildir for new messages. I should be placed as the service
     child of some MultiService instance. When running, I use the linux
-    dirwatcher API (if available) or poll for new files in the 'new'
-    subdirectory of my maildir path. When I discover a new message, I invoke
-    my .messageReceived() method with the short filename of the new message,
-    so the full name of the new file can be obtained with
-    os.path.join(maildir, 'new', filename). messageReceived() should be
-    overridden by a subclass to do something useful. I will not move or
-    delete the file on my own: the subclass's messageReceived() should
-    probably do that.
+    inotify or dirwatcher API (if available) or poll for new files in the
+    'new' subdirectory of my maildir path. When I discover new messages, I
+    invoke my .messagesReceived() method with the short filenames of the new
+    messages, oldest first, so the full name of each new file can be
+    obtained with os.path.join(maildir, 'new', filename). By default,
+    messagesReceived() invokes .messageReceived() for each message in turn;
+    a subclass should override one of them to do something useful. I will
+    not move or delete the files on my own: the subclass should probably do
+    that.
     """
-    pollinterval = 10  # only used if we don't have DNotify
+    pollinterval = 10  # only used if we don't have INotify or DNotify
 
     def __init__(self, basedir=None):
         """Create the Maildir watcher. BASEDIR is the maildir directory (the
@@ -54,8 +62,10 @@ class MaildirService(service.MultiService):
         self.basedir = basedir
         "base of the maildir"
         self.newdir = None
-        self.files = []
+        self.files = set()
+        self.inotify = None
         self.dnotify = None
+        self._poll_timer = None
 
     def setBasedir(self, basedir):
         # some users of MaildirService (scheduler.Try_Jobdir, in particular)
@@ -69,8 +79,21 @@ class MaildirService(service.MultiService):
         self.newdir = os.path.join(self.basedir, "new")
         if not os.path.isdir(self.basedir) or not os.path.isdir(self.newdir):
             raise NoSuchMaildir("invalid maildir '%s'" % self.basedir)
+        if inotify:
+            try:
+                self.inotify = inotify.INotify()
+                self.inotify.startReading()
+                # messages are moved into new/ once they are complete
+                self.inotify.watch(filepath.FilePath(self.newdir),
+                                   mask=inotify.IN_MOVED_TO|inotify.IN_CREATE,
+                                   callbacks=[self.inotify_callback])
+            except Exception, e:
+                log.msg("INotify failed (%s), falling back" % (e,))
+                if self.inotify:
+                    self.inotify.loseConnection()
+                self.inotify = None
         try:
-            if dnotify:
+            if dnotify and not self.inotify:
                 # we must hold an fd open on the directory, so we can get
                 # notified when it changes.
                 self.dnotify = dnotify.DNotify(self.newdir,
@@ -81,7 +104,7 @@ class MaildirService(service.MultiService):
             # dnotify. OverflowError will occur on some 64-bit machines
             # because of a python bug
             log.msg("DNotify failed, falling back to polling")
-        if not self.dnotify:
+        if not self.inotify and not self.dnotify:
             t = internet.TimerService(self.pollinterval, self.poll)
             t.setServiceParent(self)
         self.poll()
@@ -98,28 +121,52 @@ class MaildirService(service.MultiService):
         # why, and I'd have to hack qmail to investigate further, so it's
         # easier to just wait a second before yanking the message out of new/
 
-        reactor.callLater(0.1, self.poll)
+        self._pollSoon()
+
+    def inotify_callback(self, ignored, path, mask):
+        self._pollSoon()
 
+    def _pollSoon(self):
+        # a burst of deliveries is handled by a single poll
+        if not self._poll_timer:
+            self._poll_timer = reactor.callLater(0.1, self._pollNow)
+
+    def _pollNow(self):
+        self._poll_timer = None
+        d = self.poll()
+        d.addErrback(log.err, "while polling maildir '%s'" % self.basedir)
 
     def stopService(self):
+        if self._poll_timer:
+            self._poll_timer.cancel()
+            self._poll_timer = None
+        if self.inotify:
+            self.inotify.loseConnection()
+            self.inotify = None
         if self.dnotify:
             self.dnotify.remove()
             self.dnotify = None
         return service.MultiService.stopService(self)
 
-    @defer.deferredGenerator
     def poll(self):
         assert self.basedir
-        # see what's new
-        for f in self.files:
-            if not os.path.isfile(os.path.join(self.newdir, f)):
-                self.files.remove(f)
-        newfiles = []
-        for f in os.listdir(self.newdir):
-            if not f in self.files:
-                newfiles.append(f)
-        self.files.extend(newfiles)
-        for n in newfiles:
+        # see what's new, forgetting about files that have gone away
+        current = os.listdir(self.newdir)
+        self.files.intersection_update(current)
+        newfiles = [ f for f in current if f not in self.files ]
+        # maildir filenames begin with the delivery time
+        newfiles.sort()
+        self.files.update(newfiles)
+        if not newfiles:
+            return defer.succeed(None)
+        return self.messagesReceived(newfiles)
+
+    @defer.deferredGenerator
+    def messagesReceived(self, filenames):
+        """Process a list of received messages, oldest first.  The filenames
+        are relative to self.newdir.  Returns a Deferred.  By default, this
+        calls messageReceived for each message in turn."""
+        for n in filenames:
             try:
                 wfd = defer.waitForDeferred(self.messageReceived(n))
                 yield wfd
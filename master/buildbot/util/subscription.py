@@ -56,6 +56,48 @@ class SubscriptionPoint(object):
     def _unsubscribe(self, subscription):
         self.subscriptions.remove(subscription)
 
+class IndexedSubscriptionPoint(object):
+    """
+    Something that can be subscribed to for particular keys, so that each
+    delivery only reaches the subscribers for its key.
+    """
+    def __init__(self, name):
+        self.name = name
+        # key -> set of subscriptions
+        self.subscriptions = {}
+
+    def __str__(self):
+        return "<IndexedSubscriptionPoint '%s'>" % self.name
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def subscribe(self, key, callback):
+        """Add C{callback} to the subscriptions for C{key}; returns a
+        L{Subscription} instance."""
+        sub = Subscription(self, callback)
+        sub.key = key
+        self.subscriptions.setdefault(key, set()).add(sub)
+        return sub
+
+    def deliver(self, key, *args, **kwargs):
+        """
+        Deliver the given args and keyword args to all of the current
+        subscribers for C{key}.
+        """
+        for sub in list(self.subscriptions.get(key, ())):
+            try:
+                sub.callback(*args, **kwargs)
+            except:
+                log.err(failure.Failure(),
+                        'while invoking callback %s to %s' % (sub.callback, self))
+
+    def _unsubscribe(self, subscription):
+        subs = self.subscriptions[subscription.key]
+        subs.remove(subscription)
+        if not subs:
+            del self.subscriptions[subscription.key]
+
 class Subscription(object):
     """
     Represents a subscription to a L{SubscriptionPoint}; use
@@ -0,0 +1,137 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+A wheel of named timers, sharing a single reactor timer.
+"""
+
+import heapq
+import math
+from twisted.internet import reactor
+from twisted.python import log
+
+class TimerWheel(object):
+    """
+    I keep any number of named timers, which are started or restarted with
+    L{reset}.  Deadlines are rounded up to a multiple of C{resolution}
+    seconds, and kept in one slot for each such multiple, so that however
+    many timers are pending, only one reactor timer is live: the one for the
+    earliest slot.  When it fires, C{callback} is called once, with the names
+    of all of the timers that have expired, in the order of their deadlines.
+
+    Whatever C{callback} returns (such as a Deferred) is ignored, so it
+    should handle its own errors.
+    """
+
+    def __init__(self, callback, resolution=1, _reactor=reactor):
+        self.callback = callback
+        self.resolution = resolution
+        self._reactor = _reactor
+
+        # name -> (deadline, sequence number), for ordering expired timers
+        self._deadlines = {}
+        # slot -> set of names
+        self._slots = {}
+        # heap of slots that may have timers in them
+        self._heap = []
+        self._seq = 0
+
+        # the reactor timer, and the slot it is set for
+        self._timer = None
+        self._timer_slot = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def isPending(self, name):
+        """Return true if the named timer is pending."""
+        return name in self._deadlines
+
+    def getPending(self):
+        """Return the names of the pending timers."""
+        return self._deadlines.keys()
+
+    def reset(self, name, delay):
+        """Start the named timer, to expire C{delay} seconds from now,
+        replacing any pending timer with the same name."""
+        self._remove(name)
+        deadline = self._reactor.seconds() + delay
+        # avoid integer division when both are ints
+        slot = int(math.ceil(deadline / float(self.resolution)))
+        self._seq += 1
+        self._deadlines[name] = (deadline, self._seq, slot)
+        if slot not in self._slots:
+            self._slots[slot] = set()
+            heapq.heappush(self._heap, slot)
+        self._slots[slot].add(name)
+        self._schedule()
+
+    def cancel(self, name):
+        """Cancel the named timer, if it is pending."""
+        self._remove(name)
+        self._schedule()
+
+    def cancelAll(self):
+        """Cancel all pending timers."""
+        self._deadlines = {}
+        self._slots = {}
+        self._heap = []
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self._timer_slot = None
+
+    def _remove(self, name):
+        if name not in self._deadlines:
+            return
+        slot = self._deadlines.pop(name)[2]
+        names = self._slots[slot]
+        names.discard(name)
+        if not names:
+            # (the slot is left in the heap, and skipped when it comes up)
+            del self._slots[slot]
+
+    def _schedule(self):
+        # make sure the reactor timer is set for the earliest occupied slot
+        while self._heap and self._heap[0] not in self._slots:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            slot = None
+        else:
+            slot = self._heap[0]
+        if slot == self._timer_slot:
+            return
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._timer_slot = slot
+        if slot is not None:
+            delay = max(0, slot * self.resolution - self._reactor.seconds())
+            self._timer = self._reactor.callLater(delay, self._fire)
+
+    def _fire(self):
+        self._timer = self._timer_slot = None
+        now = self._reactor.seconds()
+        expired = []
+        while self._heap and self._heap[0] * self.resolution <= now:
+            slot = heapq.heappop(self._heap)
+            for name in self._slots.pop(slot, ()):
+                expired.append((self._deadlines.pop(name)[:2], name))
+        self._schedule()
+        if expired:
+            expired.sort()
+            try:
+                self.callback([ name for _, name in expired ])
+            except:
+                log.err(None, 'while handling expired timers')
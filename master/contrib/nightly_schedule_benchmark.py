@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for the Nightly scheduler's calculation of its next build time.
+
+For each of a few schedules, from hourly to once a year, this times
+Nightly.getNextBuildTime against the minute-by-minute search that it used to
+do (as kept in the unit tests), starting from a number of random times.
+
+Run it from the master directory, e.g.:
+
+  python contrib/nightly_schedule_benchmark.py --starts 20
+"""
+
+import sys
+import time
+import random
+from twisted.python import usage
+
+from buildbot.schedulers import timed
+from buildbot.test.unit import test_schedulers_timed_Nightly as fixtures
+
+SPECS = [
+    ('hourly', dict()),
+    ('nightly', dict(hour=3, minute=0)),
+    ('weekly', dict(dayOfWeek=5, hour=22, minute=30)),
+    ('monthly', dict(dayOfMonth=1, hour=0, minute=15)),
+    ('yearly', dict(month=12, dayOfMonth=25, hour=6, minute=0)),
+    ]
+
+class Options(usage.Options):
+    optParameters = [
+        ("starts", "n", 20, "number of random starting times", int),
+        ("seed", "s", 0, "random seed", int),
+        ]
+
+def solve(sched, when):
+    l = []
+    sched.getNextBuildTime(when).addCallback(l.append)
+    return l[0]
+
+def step(sched, when):
+    # (with the same two-year limit as before)
+    return fixtures.brute_force_getNextBuildTime(sched, when, 2*366)
+
+def bench(fn, sched, starts):
+    start = time.time()
+    for when in starts:
+        fn(sched, when)
+    return (time.time() - start) / len(starts)
+
+def main():
+    opts = Options()
+    opts.parseOptions(sys.argv[1:])
+    rand = random.Random(opts['seed'])
+    starts = [ rand.randint(1262304000, 1420070400) # 2010-2014
+               for i in range(opts['starts']) ]
+    print "mean time per calculation, from %d starting times" % len(starts)
+    print "%-8s %12s %12s %9s" % ("spec", "stepping", "solver", "speedup")
+    for name, spec in SPECS:
+        sched = timed.Nightly(name=name, builderNames=['b'], branch=None,
+                              **spec)
+        for when in starts:
+            assert solve(sched, when) == step(sched, when), (name, when)
+        stepping = bench(step, sched, starts)
+        solver = bench(solve, sched, starts)
+        print "%-8s %11.6fs %11.6fs %8.0fx" % (name, stepping, solver,
+                                              stepping / solver)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+Microbenchmark for SVNPoller's parsing of 'svn log --xml --verbose' output.
+
+This builds a log from the recorded 'svn log' entries used by the SVNPoller
+unit tests, repeated to the requested number of revisions and with each
+entry's paths repeated to the requested size, then times the DOM-based
+parsing that SVNPoller used to do against its streaming LogParser.
+
+Run it from the master directory, e.g.:
+
+  python contrib/svnpoller_parse_benchmark.py --revisions 500 --paths 1000
+"""
+
+import sys
+import time
+import xml.dom.minidom
+from twisted.python import usage
+
+from buildbot.changes import svnpoller
+from buildbot.test.unit import test_changes_svnpoller as fixtures
+
+class Options(usage.Options):
+    optParameters = [
+        ("revisions", "r", 100, "number of log entries", int),
+        ("paths", "p", 100, "number of paths in each log entry", int),
+        ("repeat", "n", 5, "number of times to parse the log", int),
+        ]
+
+def make_log(revisions, paths):
+    # take the shape of each entry from the recorded output, giving it a new
+    # revision number and repeating its paths
+    entries = []
+    samples = fixtures.sample_logentries
+    for rev in xrange(revisions, 0, -1):
+        entry = samples[rev % len(samples)]
+        head, rest = entry.split('<paths>\n', 1)
+        pathxml, tail = rest.split('</paths>\n', 1)
+        head = head.replace('revision="%s"' % (rev % len(samples) + 1),
+                            'revision="%d"' % rev)
+        pathxml = pathxml * (paths / max(pathxml.count('<path'), 1) or 1)
+        entries.append(head + '<paths>\n' + pathxml + '</paths>\n' + tail)
+    return fixtures.changes_output_template % "".join(entries)
+
+def parse_dom(output):
+    # what SVNPoller.parse_logs and create_changes used to do
+    doc = xml.dom.minidom.parseString(output)
+    count = 0
+    for el in doc.getElementsByTagName("logentry"):
+        int(el.getAttribute("revision"))
+        for p in el.getElementsByTagName("path"):
+            p.getAttribute("action")
+            "".join([t.data for t in p.childNodes])
+            count += 1
+    return count
+
+def parse_stream(output):
+    parser = svnpoller.LogParser()
+    parser.feed(output)
+    count = 0
+    for entry in parser.close():
+        count += len(entry['paths'] or [])
+    return count
+
+def bench(name, fn, output, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        count = fn(output)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-8s %8.3fs  (%d paths)" % (name, best, count)
+    return best
+
+def main():
+    opts = Options()
+    opts.parseOptions(sys.argv[1:])
+    output = make_log(opts['revisions'], opts['paths'])
+    print "parsing %d bytes of 'svn log' output, best of %d" % (
+            len(output), opts['repeat'])
+    dom = bench("minidom", parse_dom, output, opts['repeat'])
+    stream = bench("stream", parse_stream, output, opts['repeat'])
+    if stream:
+        print "speedup: %.1fx" % (dom / stream)
+
+if __name__ == '__main__':
+    main()
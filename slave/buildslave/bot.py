@@ -17,6 +17,9 @@ import os.path
 import socket
 import sys
 import signal
+import tempfile
+import cPickle
+from collections import deque
 
 from twisted.spread import pb
 from twisted.python import log
@@ -27,11 +30,101 @@ from twisted.cred import credentials
 import buildslave
 from buildslave.util import now
 from buildslave.pbutil import ReconnectingPBClientFactory
-from buildslave.commands import registry, base
+from buildslave.commands import registry, base, mirror
 
 class UnknownCommand(pb.Error):
     pass
 
+def updateSize(update):
+    """Return the approximate number of payload bytes in a status update,
+    for the purposes of flow control.  Only log data is counted; other keys
+    are small enough to be ignored."""
+    size = 0
+    for k in ('stdout', 'stderr', 'header'):
+        if k in update:
+            size += len(update[k])
+    if 'log' in update:
+        size += len(update['log'][1])
+    return size
+
+class UpdateQueue:
+    """A FIFO of status updates waiting for flow-control credit.  Up to
+    C{memoryLimit} bytes of updates are kept in memory; once that limit is
+    reached, further updates are pickled into a spill file in C{spilldir}
+    until the queue has drained completely.  Ordering is preserved across
+    the two."""
+
+    def __init__(self, spilldir, memoryLimit):
+        self.spilldir = spilldir
+        self.memoryLimit = memoryLimit
+        self.memory = deque()
+        self.memoryBytes = 0
+        self.spillfile = None
+        self.spillReadPos = 0
+        self.spillSizes = deque()
+
+    def __len__(self):
+        return len(self.memory) + len(self.spillSizes)
+
+    def peekSize(self):
+        """Return the size of the oldest update; the queue must not be
+        empty."""
+        if self.memory:
+            return self.memory[0][1]
+        return self.spillSizes[0]
+
+    def put(self, update, size):
+        if self.spillfile is None and \
+                (not self.memory or self.memoryBytes + size <= self.memoryLimit):
+            self.memory.append((update, size))
+            self.memoryBytes += size
+            return
+        if self.spillfile is None:
+            log.msg("UpdateQueue: spilling status updates to disk")
+            self.spillfile = tempfile.TemporaryFile(prefix="updates",
+                                                    dir=self.spilldir)
+            self.spillReadPos = 0
+        self.spillfile.seek(0, 2)
+        cPickle.dump(update, self.spillfile, cPickle.HIGHEST_PROTOCOL)
+        self.spillSizes.append(size)
+
+    def get(self):
+        """Return the oldest (update, size) tuple; the queue must not be
+        empty."""
+        if self.memory:
+            update, size = self.memory.popleft()
+            self.memoryBytes -= size
+            return update, size
+        self.spillfile.seek(self.spillReadPos)
+        update = cPickle.load(self.spillfile)
+        self.spillReadPos = self.spillfile.tell()
+        size = self.spillSizes.popleft()
+        if not self.spillSizes:
+            self.spillfile.close()
+            self.spillfile = None
+        return update, size
+
+    def clear(self):
+        self.memory.clear()
+        self.memoryBytes = 0
+        if self.spillfile:
+            self.spillfile.close()
+            self.spillfile = None
+        self.spillSizes.clear()
+
+class PrefetchBuilder:
+    """A stand-in for a SlaveBuilder, given to the commands run by
+    SlaveBuilder.remote_prefetch.  Those commands run outside of any step, so
+    their status updates are discarded rather than sent to the master."""
+
+    def __init__(self, builder):
+        self.basedir = builder.basedir
+        self.usePTY = builder.usePTY
+        self.unicode_encoding = builder.unicode_encoding
+
+    def sendUpdate(self, data):
+        pass
+
 class SlaveBuilder(pb.Referenceable, service.Service):
 
     """This is the local representation of a single Builder: it handles a
@@ -41,6 +134,13 @@ class SlaveBuilder(pb.Referenceable, service.Service):
 
     stopCommandOnShutdown = True
 
+    # flow control for status updates: no more than updateCredit bytes of
+    # log data are sent to the master without being acknowledged.  The master
+    # may adjust this value in its acknowledgements.  Updates beyond that are
+    # queued locally, and spilled to disk beyond maxBufferedBytes.
+    updateCredit = 1024*1024
+    maxBufferedBytes = 16*1024*1024
+
     # remote is a ref to the Builder object on the master side, and is set
     # when they attach. We use it to detect when the connection to the master
     # is severed.
@@ -57,6 +157,9 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.unackedBytes = 0
+        self.updateQueue = None
+        self.pendingComplete = None
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -75,6 +178,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self.basedir = os.path.join(self.bot.basedir, self.builddir)
         if not os.path.isdir(self.basedir):
             os.makedirs(self.basedir)
+        self.updateQueue = UpdateQueue(self.basedir, self.maxBufferedBytes)
 
     def stopService(self):
         service.Service.stopService(self)
@@ -104,6 +208,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.resetUpdates()
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -114,6 +219,37 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         doesn't do much, but masters call it so it's still here."""
         pass
 
+    def remote_prefetch(self, command, args):
+        """
+        This is invoked by the master when it has picked this builder for a
+        build, to update the repository mirror that the build's source step
+        (COMMAND, with ARGS) will use while the build is still starting.
+        See L{buildslave.commands.mirror}.  Returns a Deferred that fires
+        with True if the mirror was updated, or False if the command does not
+        use a mirror or the update failed.
+        """
+        self.activity()
+        try:
+            factory = registry.getFactory(command)
+        except KeyError:
+            raise UnknownCommand, "unrecognized SlaveCommand '%s'" % command
+        cmd = factory(PrefetchBuilder(self), "prefetch", args)
+        if not getattr(cmd, 'mirrordir', None):
+            return False
+        log.msg(" prefetch:%s into %s" % (command, cmd.mirrordir))
+        cmd.running = True
+        d = cmd.doUpdateMirror(None, prefetch=True)
+        def done(res):
+            cmd.running = False
+            return True
+        def failed(f):
+            cmd.running = False
+            log.msg("prefetch into %s failed: %s" % (cmd.mirrordir,
+                                                    f.getErrorMessage()))
+            return False
+        d.addCallbacks(done, failed)
+        return d
+
     def remote_startCommand(self, stepref, stepId, command, args):
         """
         This gets invoked by L{buildbot.process.step.RemoteCommand.start}, as
@@ -136,6 +272,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command,stepId))
+        self.resetUpdates()
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
         d = self.command.doStart()
@@ -170,31 +307,73 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def sendUpdate(self, data):
         """This sends the status update to the master-side
         L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        number in the process. Updates are subject to flow control: if too
+        many bytes are awaiting acknowledgement from the master, the update
+        is queued locally and sent when acknowledgements arrive."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
+        if not self.remoteStep:
+            return
+        size = updateSize(data)
+        if len(self.updateQueue) or not self._haveCredit(size):
+            self.updateQueue.put(data, size)
+            return
+        self._sendUpdate(data, size)
+
+    def _haveCredit(self, size):
+        # always allow one update in flight, no matter how large, so that
+        # progress is possible even with a tiny credit
+        return (not self.unackedBytes or
+                self.unackedBytes + size <= self.updateCredit)
+
+    def _sendUpdate(self, data, size):
         # the update[1]=0 comes from the leftover 'updateNum', which the
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new slaves and old masters.
-        if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
-            d.addCallback(self.ackUpdate)
-            d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
-
-    def ackUpdate(self, acknum):
+        update = [data, 0]
+        updates = [update]
+        self.unackedBytes += size
+        d = self.remoteStep.callRemote("update", updates)
+        d.addCallback(self.ackUpdate, size)
+        d.addErrback(self._updateFailed, size)
+
+    def _sendQueuedUpdates(self):
+        q = self.updateQueue
+        while self.remoteStep and len(q) and self._haveCredit(q.peekSize()):
+            data, size = q.get()
+            self._sendUpdate(data, size)
+        if not len(self.updateQueue) and self.pendingComplete:
+            failure = self.pendingComplete[0]
+            self.pendingComplete = None
+            self._sendComplete(failure)
+
+    def resetUpdates(self):
+        self.unackedBytes = 0
+        self.pendingComplete = None
+        if self.updateQueue:
+            self.updateQueue.clear()
+
+    def ackUpdate(self, acknum, size=0):
         self.activity() # update the "last activity" timer
+        # masters which support flow control acknowledge each update with
+        # the credit they are willing to extend to us; older masters return
+        # the (always zero) update number
+        if isinstance(acknum, int) and acknum > 0:
+            self.updateCredit = acknum
+        self.unackedBytes = max(0, self.unackedBytes - size)
+        self._sendQueuedUpdates()
 
     def ackComplete(self, dummy):
         self.activity() # update the "last activity" timer
 
+    def _updateFailed(self, why, size):
+        self.unackedBytes = max(0, self.unackedBytes - size)
+        self._ackFailed(why, "SlaveBuilder.sendUpdate")
+
     def _ackFailed(self, why, where):
         log.msg("SlaveBuilder._ackFailed:", where)
         log.err(why) # we don't really care
@@ -217,11 +396,18 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
-            self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
-            d = self.remoteStep.callRemote("complete", failure)
-            d.addCallback(self.ackComplete)
-            d.addErrback(self._ackFailed, "sendComplete")
-            self.remoteStep = None
+            if len(self.updateQueue):
+                # the completion must follow any queued updates
+                self.pendingComplete = (failure,)
+                return
+            self._sendComplete(failure)
+
+    def _sendComplete(self, failure):
+        self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
+        d = self.remoteStep.callRemote("complete", failure)
+        d.addCallback(self.ackComplete)
+        d.addErrback(self._ackFailed, "sendComplete")
+        self.remoteStep = None
 
 
     def remote_shutdown(self):
@@ -280,7 +466,7 @@ class Bot(pb.Referenceable, service.MultiService):
 
         for d in os.listdir(self.basedir):
             if os.path.isdir(os.path.join(self.basedir, d)):
-                if d not in wanted_dirs:
+                if d not in wanted_dirs and d != mirror.MIRROR_DIR:
                     log.msg("I have a leftover directory '%s' that is not "
                             "being used by the buildmaster: you can delete "
                             "it now" % d)
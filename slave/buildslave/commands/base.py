@@ -17,7 +17,7 @@
 import os
 from base64 import b64encode
 import sys
-import shutil
+import time
 
 from zope.interface import implements
 from twisted.internet import reactor, defer
@@ -26,12 +26,12 @@ from twisted.python import log, failure, runtime
 from buildslave.interfaces import ISlaveCommand
 from buildslave import runprocess
 from buildslave.exceptions import AbandonChain
-from buildslave.commands import utils
+from buildslave.commands import utils, mirror
 
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.12"
+command_version = "2.15"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -60,6 +60,9 @@ command_version = "2.12"
 #  >= 2.10: CVS can handle 'extra_options' and 'export_options'
 #  >= 2.11: Arch, Bazaar, and Monotone removed
 #  >= 2.12: SlaveShellCommand no longer accepts 'keep_stdin_open'
+#  >= 2.13: downloadFile accepts 'delta' and 'deltablocksize'
+#  >= 2.14: git and hg accept 'mirror'; SlaveBuilder.remote_prefetch
+#  >= 2.15: git and svn accept 'sparse_paths'
 
 class Command:
     implements(ISlaveCommand)
@@ -228,9 +231,15 @@ class SourceBaseCommand(Command):
                         reattempted, up to REPEATS times, after a delay of
                         DELAY seconds. This is intended to deal with slaves
                         that experience transient network failures.
+
+        - ['mirror']:   If true, and the VC supports it, build the sources
+                        from a mirror of the repository shared by all
+                        builders on this slave.  See
+                        L{buildslave.commands.mirror}.
     """
 
     sourcedata = ""
+    mirrordir = None # set by subclasses which support mirrors
 
     def setup(self, args):
         # if we need to parse the output, use this environment. Otherwise
@@ -288,6 +297,8 @@ class SourceBaseCommand(Command):
             os.rename(old_sd_path, self.sourcedatafile)
 
         d = defer.succeed(None)
+        if self.mirrordir:
+            d.addCallback(self.doUpdateMirror)
         self.maybeClobber(d)
         if not (self.sourcedirIsUpdateable() and self.sourcedataMatches()):
             # the directory cannot be updated, so we have to clobber it.
@@ -304,6 +315,35 @@ class SourceBaseCommand(Command):
         d.addCallbacks(self._sendRC, self._checkAbandoned)
         return d
 
+    def getMirrorPath(self, vc, repourl):
+        # mirrors are shared by all builders, so they live beside the
+        # builder directories
+        return mirror.getMirrorPath(
+                os.path.dirname(os.path.abspath(self.builder.basedir)),
+                vc, repourl)
+
+    def doUpdateMirror(self, res, prefetch=False):
+        d = mirror.updateMirror(self.mirrordir,
+                                self.doMirrorCreate, self.doMirrorUpdate,
+                                requester=self.builder.basedir,
+                                prefetch=prefetch)
+        def updated((rc, stats)):
+            self.sendStatus({'mirror': stats})
+            return rc
+        d.addCallback(updated)
+        d.addCallback(self._abandonOnFailure)
+        return d
+
+    def doMirrorCreate(self, tmpdir):
+        """Create a new mirror in C{tmpdir}; subclasses which set
+        C{self.mirrordir} must override this."""
+        raise NotImplementedError
+
+    def doMirrorUpdate(self):
+        """Update the existing mirror in C{self.mirrordir}; subclasses
+        which set C{self.mirrordir} must override this."""
+        raise NotImplementedError
+
     def maybeClobber(self, d):
         # do we need to clobber anything?
         if self.mode in ("copy", "clobber", "export"):
@@ -456,25 +496,19 @@ class SourceBaseCommand(Command):
         return res
 
     def doClobber(self, dummy, dirname, chmodDone=False):
-        # TODO: remove the old tree in the background
-##         workdir = os.path.join(self.builder.basedir, self.workdir)
-##         deaddir = self.workdir + ".deleting"
-##         if os.path.isdir(workdir):
-##             try:
-##                 os.rename(workdir, deaddir)
-##                 # might fail if deaddir already exists: previous deletion
-##                 # hasn't finished yet
-##                 # start the deletion in the background
-##                 # TODO: there was a solaris/NetApp/NFS problem where a
-##                 # process that was still running out of the directory we're
-##                 # trying to delete could prevent the rm-rf from working. I
-##                 # think it stalled the rm, but maybe it just died with
-##                 # permission issues. Try to detect this.
-##                 os.commands("rm -rf %s &" % deaddir)
-##             except:
-##                 # fall back to sequential delete-then-checkout
-##                 pass
         d = os.path.join(self.builder.basedir, dirname)
+        if not chmodDone:
+            # move the old tree out of the way and delete it in the
+            # background, so that the checkout can start right away
+            start = time.time()
+            deaddir = utils.renameForRemoval(d)
+            if deaddir:
+                self.sendStatus({'header': "moved %s aside in %.2fs; "
+                        "removing it in the background\n"
+                        % (dirname, time.time() - start)})
+                utils.removeInBackground(deaddir)
+                return defer.succeed(0)
+            # otherwise fall back to sequential delete-then-checkout
         if runtime.platformType != "posix":
             # if we're running on w32, use rmtree instead. It will block,
             # but hopefully it won't take too long.
@@ -526,26 +560,30 @@ class SourceBaseCommand(Command):
         # now copy tree to workdir
         fromdir = os.path.join(self.builder.basedir, self.srcdir)
         todir = os.path.join(self.builder.basedir, self.workdir)
-        if runtime.platformType != "posix":
-            self.sendStatus({'header': "Since we're on a non-POSIX platform, "
-            "we're not going to try to execute cp in a subprocess, but instead "
-            "use shutil.copytree(), which will block until it is complete.  "
-            "fromdir: %s, todir: %s\n" % (fromdir, todir)})
-            shutil.copytree(fromdir, todir)
-            return defer.succeed(0)
 
         if not os.path.exists(os.path.dirname(todir)):
             os.makedirs(os.path.dirname(todir))
         if os.path.exists(todir):
             # I don't think this happens, but just in case..
-            log.msg("cp target '%s' already exists -- cp will not do what you think!" % todir)
+            log.msg("copy target '%s' already exists -- copy will fail!" % todir)
 
-        command = ['cp', '-R', '-P', '-p', fromdir, todir]
-        c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
-                         sendRC=False, timeout=self.timeout, maxTime=self.maxTime,
-                         usePTY=False)
+        start = time.time()
+        c = utils.TreeCopy(fromdir, todir,
+                hardlinks=self.args.get('copy_hardlinks', False),
+                timeout=self.timeout, maxTime=self.maxTime)
         self.command = c
         d = c.start()
+        def copied((files, bytes)):
+            self.sendStatus({'header': "copied %d files (%d bytes) from %s "
+                    "to %s in %.2fs\n" % (files, bytes, self.srcdir,
+                                          self.workdir, time.time() - start)})
+            return 0
+        def failed(f):
+            log.err(f, "while copying %s to %s" % (fromdir, todir))
+            self.sendStatus({'header': "copy from %s to %s failed: %s\n"
+                    % (self.srcdir, self.workdir, f.getErrorMessage())})
+            return 1
+        d.addCallbacks(copied, failed)
         d.addCallback(self._abandonOnFailure)
         return d
 
@@ -15,7 +15,7 @@
 
 import os
 import sys
-import shutil
+import time
 
 from twisted.internet import defer
 from twisted.python import runtime, log
@@ -61,6 +61,9 @@ class RemoveDirectory(base.Command):
 
         - ['maxTime']:  seconds before we kill off the command
 
+    The directory is renamed out of the way and deleted in the background,
+    so the command finishes as soon as the rename has.  If the rename fails,
+    the directory is deleted in place.
 
     RemoveDirectory creates the following status messages:
         - {'rc': rc} : when the process has terminated
@@ -77,9 +80,16 @@ class RemoveDirectory(base.Command):
         self.timeout = args.get('timeout', 120)
         self.maxTime = args.get('maxTime', None)
 
-        # TODO: remove the old tree in the background
         self.dir = os.path.join(self.builder.basedir, dirname)
-        if runtime.platformType != "posix":
+        start = time.time()
+        deaddir = utils.renameForRemoval(self.dir)
+        if deaddir:
+            self.sendStatus({'header': "moved %s aside in %.2fs; "
+                    "removing it in the background\n"
+                    % (dirname, time.time() - start)})
+            utils.removeInBackground(deaddir)
+            d = defer.succeed(0)
+        elif runtime.platformType != "posix":
             # if we're running on w32, use rmtree instead. It will block,
             # but hopefully it won't take too long.
             utils.rmdirRecursive(self.dir)
@@ -148,12 +158,15 @@ class CopyDirectory(base.Command):
 
         - ['maxTime']:  seconds before we kill off the command
 
+        - ['hardlinks']: if true, hard-link files instead of copying them
+                         where possible
 
     CopyDirectory creates the following status messages:
         - {'rc': rc} : when the process has terminated
     """
 
     header = "rmdir"
+    command = None
 
     def start(self):
         args = self.args
@@ -168,32 +181,39 @@ class CopyDirectory(base.Command):
         self.timeout = args.get('timeout', 120)
         self.maxTime = args.get('maxTime', None)
 
-        if runtime.platformType != "posix":
-            self.sendStatus({'header': "Since we're on a non-POSIX platform, "
-            "we're not going to try to execute cp in a subprocess, but instead "
-            "use shutil.copytree(), which will block until it is complete.  "
-            "fromdir: %s, todir: %s\n" % (fromdir, todir)})
-            shutil.copytree(fromdir, todir)
-            d = defer.succeed(0)
-        else:
-            if not os.path.exists(os.path.dirname(todir)):
-                os.makedirs(os.path.dirname(todir))
-            if os.path.exists(todir):
-                # I don't think this happens, but just in case..
-                log.msg("cp target '%s' already exists -- cp will not do what you think!" % todir)
-
-            command = ['cp', '-R', '-P', '-p', fromdir, todir]
-            c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
-                             sendRC=False, timeout=self.timeout, maxTime=self.maxTime,
-                             usePTY=False)
-            self.command = c
-            d = c.start()
-            d.addCallback(self._abandonOnFailure)
+        if not os.path.exists(os.path.dirname(todir)):
+            os.makedirs(os.path.dirname(todir))
+        if os.path.exists(todir):
+            # I don't think this happens, but just in case..
+            log.msg("copy target '%s' already exists -- copy will fail!" % todir)
+
+        start = time.time()
+        c = utils.TreeCopy(fromdir, todir,
+                hardlinks=args.get('hardlinks', False),
+                timeout=self.timeout, maxTime=self.maxTime)
+        self.command = c
+        d = c.start()
+        def copied((files, bytes)):
+            self.sendStatus({'header': "copied %d files (%d bytes) in %.2fs\n"
+                    % (files, bytes, time.time() - start)})
+            return 0
+        def failed(f):
+            log.err(f, "while copying %s to %s" % (fromdir, todir))
+            self.sendStatus({'header': "copy failed: %s\n"
+                    % f.getErrorMessage()})
+            return 1
+        d.addCallbacks(copied, failed)
+        d.addCallback(self._abandonOnFailure)
 
         # always set the RC, regardless of platform
         d.addCallbacks(self._sendRC, self._checkAbandoned)
         return d
 
+    def interrupt(self):
+        self.interrupted = True
+        if self.command:
+            self.command.kill("command interrupted")
+
 class StatFile(base.Command):
     """This is a command which stats a file on the slave. The args dict contains the following keys:
 
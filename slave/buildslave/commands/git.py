@@ -38,6 +38,12 @@ class Git(SourceBaseCommand):
     ['progress'] (optional):       have git output progress markers,
                                    avoiding timeouts for long fetches;
                                    requires Git 1.7.2 or later.
+    ['mirror'] (optional):         fetch from a mirror shared by all
+                                   builders on this slave, which is used
+                                   as the reference repository.
+    ['sparse_paths'] (optional):   only check out these paths, using
+                                   sparse checkout; requires Git 1.7.0
+                                   or later.
     """
 
     header = "git operation"
@@ -53,6 +59,15 @@ class Git(SourceBaseCommand):
         self.ignore_ignores = args.get('ignore_ignores', True)
         self.reference = args.get('reference', None)
         self.gerrit_branch = args.get('gerrit_branch', None)
+        self.sparse_paths = args.get('sparse_paths')
+        if args.get('mirror'):
+            self.mirrordir = self.getMirrorPath('git', self.repourl)
+            self.reference = self.mirrordir
+
+    def _fetchurl(self):
+        # the mirror has just been updated, so fetch from it rather than
+        # going back to the network
+        return self.mirrordir or self.repourl
 
     def _fullSrcdir(self):
         return os.path.join(self.builder.basedir, self.srcdir)
@@ -65,9 +80,10 @@ class Git(SourceBaseCommand):
     def sourcedirIsUpdateable(self):
         return os.path.isdir(os.path.join(self._fullSrcdir(), ".git"))
 
-    def _dovccmd(self, command, cb=None, **kwargs):
+    def _dovccmd(self, command, cb=None, workdir=None, **kwargs):
         git = self.getCommand("git")
-        c = runprocess.RunProcess(self.builder, [git] + command, self._fullSrcdir(),
+        c = runprocess.RunProcess(self.builder, [git] + command,
+                         workdir or self._fullSrcdir(),
                          sendRC=False, timeout=self.timeout,
                          maxTime=self.maxTime, usePTY=False, **kwargs)
         self.command = c
@@ -128,11 +144,39 @@ class Git(SourceBaseCommand):
             if "Couldn't find remote ref" in self.command.stderr:
                 raise AbandonChain(-1)
 
+    def _sparseCheckoutFile(self):
+        return os.path.join(self._fullSrcdir(), '.git', 'info',
+                            'sparse-checkout')
+
+    def _setSparseCheckout(self, res):
+        # git applies the patterns on the next 'reset --hard', so changing
+        # them only adds or removes the affected files
+        sparsefile = self._sparseCheckoutFile()
+        if self.sparse_paths:
+            patterns = [ '/' + p.strip('/') for p in self.sparse_paths ]
+        elif os.path.exists(sparsefile):
+            # this was a sparse checkout; bring everything back
+            patterns = [ '/*' ]
+        else:
+            return res
+        if not os.path.isdir(os.path.dirname(sparsefile)):
+            os.makedirs(os.path.dirname(sparsefile))
+        f = open(sparsefile, 'w')
+        f.write(''.join([ p + '\n' for p in patterns ]))
+        f.close()
+        return self._dovccmd(['config', 'core.sparseCheckout', 'true'],
+                             lambda _ : res)
+
     # Update first runs "git clean", removing local changes,
     # if the branch to be checked out has changed.  This, combined
     # with the later "git reset" equates clobbering the repo,
     # but it's much more efficient.
     def doVCUpdate(self):
+        d = defer.maybeDeferred(self._setSparseCheckout, None)
+        d.addCallback(lambda _ : self._doVCUpdate())
+        return d
+
+    def _doVCUpdate(self):
         try:
             # Check to see if our branch has changed
             diffbranch = self.sourcedata != self.readSourcedata()
@@ -148,7 +192,7 @@ class Git(SourceBaseCommand):
     def _doFetch(self, dummy, branch):
         # The plus will make sure the repo is moved to the branch's
         # head even if it is not a simple "fast-forward"
-        command = ['fetch', '-t', self.repourl, '+%s' % branch]
+        command = ['fetch', '-t', self._fetchurl(), '+%s' % branch]
         # If the 'progress' option is set, tell git fetch to output
         # progress information to the log. This can solve issues with
         # long fetches killed due to lack of output, but only works
@@ -190,7 +234,9 @@ class Git(SourceBaseCommand):
 
         # If they didn't ask for a specific revision, we can get away with a
         # shallow clone.
-        if not self.args.get('revision') and self.args.get('shallow'):
+        # (a mirror already has the full history, so there's no point)
+        if (not self.args.get('revision') and self.args.get('shallow')
+                and not self.mirrordir):
             cmd = [git, 'clone', '--depth', '1']
             # If we have a reference repository, pass it to the clone command
             if self.reference:
@@ -207,6 +253,22 @@ class Git(SourceBaseCommand):
             os.makedirs(self._fullSrcdir())
             return self._dovccmd(['init'], self._didInit)
 
+    def doMirrorCreate(self, tmpdir):
+        command = ['clone', '--mirror', self.repourl, tmpdir]
+        d = self._dovccmd(command, workdir=self.builder.basedir)
+        # workdirs borrow objects from the mirror through alternates, which
+        # git knows nothing about, so it must never prune them
+        d.addCallback(self._abandonOnFailure)
+        d.addCallback(lambda _ : self._dovccmd(
+            ['config', 'gc.pruneExpire', 'never'], workdir=tmpdir))
+        return d
+
+    def doMirrorUpdate(self):
+        command = ['fetch']
+        if self.args.get('progress'):
+            command.append('--progress')
+        return self._dovccmd(command, workdir=self.mirrordir)
+
     def parseGotRevision(self):
         command = ['rev-parse', 'HEAD']
         def _parse(res):
@@ -28,6 +28,8 @@ class Mercurial(SourceBaseCommand):
 
     ['repourl'] (required): the Mercurial repository string
     ['clobberOnBranchChange']: Document me. See ticket #462.
+    ['mirror']: share the store of a mirror used by all builders on this
+                slave, instead of keeping a separate clone.
     """
 
     header = "mercurial operation"
@@ -41,12 +43,26 @@ class Mercurial(SourceBaseCommand):
         self.stdout = ""
         self.stderr = ""
         self.clobbercount = 0 # n times we've clobbered
+        if args.get('mirror'):
+            self.mirrordir = self.getMirrorPath('hg', self.repourl)
 
     def sourcedirIsUpdateable(self):
-        return os.path.isdir(os.path.join(self.builder.basedir,
-                                          self.srcdir, ".hg"))
+        hgdir = os.path.join(self.builder.basedir, self.srcdir, ".hg")
+        if self.mirrordir:
+            # the workdir must share the mirror's store; a standalone clone
+            # would never see what is pulled into the mirror
+            try:
+                sharedpath = open(os.path.join(hgdir, "sharedpath")).read()
+            except IOError:
+                return False
+            return (os.path.realpath(sharedpath.strip()) ==
+                    os.path.realpath(os.path.join(self.mirrordir, ".hg")))
+        return os.path.isdir(hgdir)
 
     def doVCUpdate(self):
+        if self.mirrordir:
+            # the shared store was updated along with the mirror
+            return self._update(0)
         hg = self.getCommand('hg')
         d = os.path.join(self.builder.basedir, self.srcdir)
         command = [hg, 'pull', '--verbose', self.repourl]
@@ -70,6 +86,8 @@ class Mercurial(SourceBaseCommand):
         return res
 
     def doVCFull(self):
+        if self.mirrordir:
+            return self._share()
         hg = self.getCommand('hg')
         command = [hg, 'clone', '--verbose', '--noupdate']
 
@@ -87,6 +105,48 @@ class Mercurial(SourceBaseCommand):
         cmd1.addCallback(self._update)
         return cmd1
 
+    def _share(self):
+        hg = self.getCommand('hg')
+        command = [hg, '--config', 'extensions.share=', 'share', '--noupdate',
+                   self.mirrordir, self.srcdir]
+        c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
+                         sendRC=False, timeout=self.timeout,
+                         maxTime=self.maxTime, usePTY=False)
+        self.command = c
+        d = c.start()
+        d.addCallback(self._abandonOnFailure)
+        def setDefaultPath(res):
+            # 'hg share' points the default path at the mirror; point it back
+            # at the real repository, which is what _update checks against
+            hgrc = open(os.path.join(self.builder.basedir, self.srcdir,
+                                     ".hg", "hgrc"), "w")
+            hgrc.write("[paths]\ndefault = %s\n" % self.repourl)
+            hgrc.close()
+            return 0
+        d.addCallback(setDefaultPath)
+        d.addCallback(self._update)
+        return d
+
+    def doMirrorCreate(self, tmpdir):
+        hg = self.getCommand('hg')
+        command = [hg, 'clone', '--verbose', '--noupdate', self.repourl, tmpdir]
+        c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
+                         sendRC=False, timeout=self.timeout,
+                         maxTime=self.maxTime, usePTY=False)
+        self.command = c
+        return c.start()
+
+    def doMirrorUpdate(self):
+        hg = self.getCommand('hg')
+        command = [hg, 'pull', '--verbose', self.repourl]
+        c = runprocess.RunProcess(self.builder, command, self.mirrordir,
+                         sendRC=False, timeout=self.timeout,
+                         maxTime=self.maxTime, keepStdout=True, usePTY=False)
+        self.command = c
+        d = c.start()
+        d.addCallback(self._handleEmptyUpdate)
+        return d
+
     def _clobber(self, dummy, dirname):
         self.clobbercount += 1
 
@@ -0,0 +1,151 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Shared, per-slave mirrors of VC repositories.
+
+Source commands that are given the 'mirror' argument keep one mirror of each
+repository under the slave's basedir, keyed by repourl, and build their
+workdirs from it rather than from the network.  The mirror is updated once
+per checkout, under a lock so that builders sharing it do not update it
+concurrently.  All builders run in the same slave process, so an in-memory
+lock is sufficient.
+"""
+
+import os
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from twisted.internet import defer
+
+from buildslave.commands import utils
+
+# name of the directory, in the slave basedir, holding the mirrors
+MIRROR_DIR = "mirrors"
+
+# seconds for which a prefetch stands in for its requester's next update; a
+# build that never reaches its source step must not leave a marker that
+# satisfies a build much later
+PREFETCH_LIFETIME = 5*60
+
+class Mirror:
+    """State for one mirrored repository: its lock, when it was last
+    updated, and how often it has been used."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = defer.DeferredLock()
+        self.lastUpdateStarted = None
+        # requester -> time at which a prefetch was requested for it
+        self.prefetched = {}
+        self.hits = 0
+        self.misses = 0
+
+_mirrors = {}
+
+def getMirrorPath(slavebasedir, vc, repourl):
+    """Return the directory holding the mirror of C{repourl}."""
+    key = md5(repourl).hexdigest()
+    return os.path.join(slavebasedir, MIRROR_DIR, "%s-%s" % (vc, key))
+
+def getMirror(path):
+    if path not in _mirrors:
+        _mirrors[path] = Mirror(path)
+    return _mirrors[path]
+
+def updateMirror(path, create, update, requester=None, prefetch=False):
+    """Bring the mirror at C{path} up to date, calling C{create(tmpdir)} to
+    create it (in C{tmpdir}, which will be renamed into place on success)
+    or C{update()} to refresh an existing one.  Both must return Deferreds
+    firing with an rc.
+
+    If another builder successfully updated the mirror, starting after this
+    call was made, its update is as good as ours, so ours is skipped.
+
+    If C{prefetch} is true, this is an update made on behalf of the next
+    build of C{requester} (a builder's basedir), before that build starts.
+    When C{requester} later updates the mirror, within PREFETCH_LIFETIME
+    seconds, it counts as having been requested at the time of the
+    prefetch, so the prefetch is not repeated.
+
+    Returns a Deferred firing with (rc, stats), where stats is a dictionary
+    suitable for returning to the master as step properties."""
+    mirror = getMirror(path)
+    requested = time.time()
+    stats = {}
+
+    def locked(_):
+        start = time.time()
+        since = requested
+        if not prefetch and requester in mirror.prefetched:
+            prefetched = mirror.prefetched.pop(requester)
+            if requested - prefetched <= PREFETCH_LIFETIME:
+                since = min(since, prefetched)
+                stats['mirror_prefetched'] = True
+        if os.path.isdir(path):
+            mirror.hits += 1
+            stats['mirror_hit'] = True
+            if (mirror.lastUpdateStarted is not None
+                    and mirror.lastUpdateStarted >= since):
+                stats['mirror_update_time'] = 0
+                return 0
+            d = update()
+        else:
+            mirror.misses += 1
+            stats['mirror_hit'] = False
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            tmpdir = path + ".tmp"
+            if os.path.exists(tmpdir):
+                # left over from a failed or interrupted creation
+                utils.rmdirRecursive(tmpdir)
+            d = create(tmpdir)
+            def created(rc):
+                if rc == 0:
+                    os.rename(tmpdir, path)
+                return rc
+            d.addCallback(created)
+        def updated(rc):
+            stats['mirror_update_time'] = round(time.time() - start, 2)
+            if rc == 0:
+                mirror.lastUpdateStarted = start
+            return rc
+        d.addCallback(updated)
+        return d
+
+    d = mirror.lock.acquire()
+    d.addCallback(locked)
+    # (this must happen before the lock is released, since releasing it
+    # starts the next waiter immediately)
+    def notePrefetch(rc):
+        if prefetch and rc == 0:
+            mirror.prefetched[requester] = requested
+        return rc
+    d.addCallback(notePrefetch)
+    def release(res):
+        mirror.lock.release()
+        return res
+    d.addBoth(release)
+    def addStats(rc):
+        stats['mirror_hits'] = mirror.hits
+        stats['mirror_misses'] = mirror.misses
+        return (rc, stats)
+    d.addCallback(addStats)
+    return d
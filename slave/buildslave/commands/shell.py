@@ -46,6 +46,11 @@ class SlaveShellCommand(base.Command):
                         watched just like 'tail -f', and all changes will be
                         written to 'log' status updates.
         - ['logEnviron']: False to not log the environment variables on the slave
+        - ['bufferSize']: bytes of output to collect before sending it to the
+                          master: a number, or a (min, max) tuple to adapt
+                          between based on the output rate
+        - ['bufferTimeout']: longest time, in seconds, to hold output before
+                             sending it to the master; same form as bufferSize
 
     ShellCommand creates the following status messages:
         - {'stdout': data} : when stdout data is available
@@ -75,6 +80,8 @@ class SlaveShellCommand(base.Command):
                          logfiles=args.get('logfiles', {}),
                          usePTY=args.get('usePTY', "slave-config"),
                          logEnviron=args.get('logEnviron', True),
+                         bufferSize=args.get('bufferSize'),
+                         bufferTimeout=args.get('bufferTimeout'),
                          )
         c._reactor = self._reactor
         self.command = c
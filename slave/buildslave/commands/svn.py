@@ -35,6 +35,10 @@ class SVN(SourceBaseCommand):
     ['ignore_ignores']:    Ignore ignores when purging changes
     ['always_purge']:      Always purge local changes after each build
     ['depth']:             Pass depth argument to subversion 1.5+
+    ['sparse_paths']:      Only check out these paths (relative to svnurl)
+                           and their parent directories, using sparse
+                           directories (subversion 1.5+).  Overrides
+                           'depth'; ignored in export mode.
     """
 
     header = "svn operation"
@@ -42,7 +46,11 @@ class SVN(SourceBaseCommand):
     def setup(self, args):
         SourceBaseCommand.setup(self, args)
         self.svnurl = args['svnurl']
+        self.sparse_paths = [ p.strip('/') for p in args.get('sparse_paths') or [] ]
         self.sourcedata = "%s\n" % self.svnurl
+        if self.sparse_paths:
+            # a different set of paths needs a fresh checkout
+            self.sourcedata += "sparse: %s\n" % " ".join(self.sparse_paths)
         self.keep_on_purge = args.get('keep_on_purge', [])
         self.keep_on_purge.append(".buildbot-sourcedata")
         self.ignore_ignores = args.get('ignore_ignores', True)
@@ -58,7 +66,7 @@ class SVN(SourceBaseCommand):
         if args.get('extra_args', None) is not None:
             self.svn_args.extend(args['extra_args'])
 
-        if args.has_key('depth'):
+        if args.has_key('depth') and not self.sparse_paths:
             self.svn_args.extend(["--depth",args['depth']])
 
     def _dovccmd(self, command, args, rootdir=None, cb=None, **kwargs):
@@ -96,11 +104,38 @@ class SVN(SourceBaseCommand):
         if self.mode == 'export':
             if revision == 'HEAD': return self.doSVNExport()
             else: command = 'export'
+        elif self.sparse_paths:
+            # check out just the top directory, then fill in the paths we
+            # want; the depths are sticky, so later updates stay sparse
+            return self._dovccmd('checkout', ['--depth', 'empty'] + args,
+                                 rootdir=self.builder.basedir,
+                                 cb=self._sparseCheckout)
         else:
             # mode=='clobber', or copy/update on a broken workspace
             command = 'checkout'
         return self._dovccmd(command, args, rootdir=self.builder.basedir)
 
+    def _sparseCheckout(self, res):
+        revision = str(self.args['revision'] or 'HEAD')
+        # intermediate directories are checked out empty, parents first
+        parents = set()
+        for path in self.sparse_paths:
+            parts = path.split('/')
+            for i in range(1, len(parts)):
+                parents.add('/'.join(parts[:i]))
+        parents = [ p for p in parents if p not in self.sparse_paths ]
+        parents.sort(key=lambda p : (p.count('/'), p))
+
+        def fillPaths(res):
+            return self._dovccmd('update', ['--set-depth', 'infinity',
+                                            '--revision', revision]
+                                            + self.sparse_paths)
+        if parents:
+            return self._dovccmd('update', ['--set-depth', 'empty',
+                                            '--revision', revision] + parents,
+                                 cb=fillPaths)
+        return fillPaths(None)
+
     def doSVNExport(self):
         ''' Since svnversion cannot be used on a svn export, we find the HEAD
             revision from the repository and pass it to the --revision arg'''
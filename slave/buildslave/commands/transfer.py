@@ -13,10 +13,14 @@
 #
 # Copyright Buildbot Team Members
 
-import os, tarfile, tempfile
+import os, shutil, tarfile, tempfile
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
-from twisted.python import log
-from twisted.internet import defer
+from twisted.python import log, failure
+from twisted.internet import defer, threads
 
 from buildslave.commands.base import Command
 
@@ -237,9 +241,16 @@ class SlaveFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['delta']:     if true, and slavedest already exists, only fetch
+                         the parts of the file that differ from it; the old
+                         file is kept if the download fails or is truncated
+        - ['deltablocksize']: size of the blocks compared in delta mode
     """
     debug = False
 
+    # number of block signatures to send in each call to the master
+    SIGNATURE_BATCH = 4096
+
     def setup(self, args):
         self.workdir = args['workdir']
         self.filename = args['slavedest']
@@ -247,8 +258,12 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.bytes_remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.delta = args.get('delta', False)
+        self.deltablocksize = args.get('deltablocksize', 32*1024)
         self.stderr = None
         self.rc = 0
+        self.oldfp = None
+        self.tmpname = None
 
     def start(self):
         if self.debug:
@@ -263,6 +278,31 @@ class SlaveFileDownloadCommand(TransferCommand):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        # (an empty file has no blocks to compare against, so is replaced
+        # with a plain download)
+        if self.delta and os.path.isfile(self.path) \
+                and os.path.getsize(self.path) > 0:
+            d = self._startDelta()
+        else:
+            d = defer.succeed(None)
+            self._openFile()
+
+        def loop(_):
+            d = defer.Deferred()
+            self._reactor.callLater(0, self._loop, d)
+            return d
+        d.addCallback(loop)
+        def _close(res):
+            # close the file, but pass through any errors from _loop
+            d1 = self.reader.callRemote('close')
+            d1.addErrback(log.err, 'while trying to close reader')
+            d1.addCallback(lambda ignored: res)
+            return d1
+        d.addBoth(_close)
+        d.addBoth(self.finished)
+        return d
+
+    def _openFile(self):
         try:
             self.fp = open(self.path, 'wb')
             if self.debug:
@@ -284,18 +324,46 @@ class SlaveFileDownloadCommand(TransferCommand):
             if self.debug:
                 log.msg("Cannot open file '%s' for download" % self.path)
 
-        d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
-        def _close(res):
-            # close the file, but pass through any errors from _loop
-            d1 = self.reader.callRemote('close')
-            d1.addErrback(log.err, 'while trying to close reader')
-            d1.addCallback(lambda ignored: res)
-            return d1
-        d.addBoth(_close)
-        d.addBoth(self.finished)
+    def _startDelta(self):
+        # the new file is assembled in a temporary file next to the old one,
+        # and renamed over it when complete
+        try:
+            self.oldfp = open(self.path, 'rb')
+            fd, self.tmpname = tempfile.mkstemp(
+                    dir=os.path.dirname(self.path))
+            self.fp = os.fdopen(fd, 'wb')
+        except (IOError, OSError):
+            if self.oldfp:
+                self.oldfp.close()
+                self.oldfp = None
+            self.delta = False
+            self._openFile()
+            return defer.succeed(None)
+
+        d = threads.deferToThread(self._computeSignatures)
+        def send(sigs):
+            dl = []
+            for i in range(0, len(sigs), self.SIGNATURE_BATCH):
+                dl.append(self.reader.callRemote('addSignatures',
+                        self.deltablocksize, i,
+                        sigs[i:i+self.SIGNATURE_BATCH]))
+            return defer.gatherResults(dl)
+        d.addCallback(send)
         return d
 
+    def _computeSignatures(self):
+        sigs = []
+        f = open(self.path, 'rb')
+        try:
+            while True:
+                block = f.read(self.deltablocksize)
+                if not block:
+                    break
+                sigs.append(md5(block).digest())
+        finally:
+            f.close()
+        return sigs
+
     def _loop(self, fire_when_done):
         d = defer.maybeDeferred(self._readBlock)
         def _done(finished):
@@ -322,10 +390,18 @@ class SlaveFileDownloadCommand(TransferCommand):
 
         if length <= 0:
             if self.stderr is None:
-                self.stderr = "Maximum filesize reached, truncating file '%s'" \
-                                % self.path
+                if self.oldfp:
+                    self.stderr = "Maximum filesize reached, keeping old " \
+                                  "file '%s'" % self.path
+                else:
+                    self.stderr = "Maximum filesize reached, truncating " \
+                                  "file '%s'" % self.path
                 self.rc = 1
             return True
+        elif self.oldfp:
+            d = self.reader.callRemote('readDelta', length)
+            d.addCallback(self._writeDelta)
+            return d
         else:
             d = self.reader.callRemote('read', length)
             d.addCallback(self._writeData)
@@ -344,8 +420,40 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.fp.write(data)
         return False
 
+    def _writeDelta(self, ops):
+        if not ops:
+            return True
+        for op in ops:
+            if isinstance(op, str):
+                data = op
+            else:
+                self.oldfp.seek(op * self.deltablocksize)
+                data = self.oldfp.read(self.deltablocksize)
+            if self.bytes_remaining is not None:
+                data = data[:self.bytes_remaining]
+                self.bytes_remaining -= len(data)
+            self.fp.write(data)
+        return False
+
     def finished(self, res):
         if self.fp is not None:
             self.fp.close()
+        if self.oldfp is not None:
+            self.oldfp.close()
+            if (self.interrupted or isinstance(res, failure.Failure)
+                    or self.rc != 0):
+                # leave the old file in place
+                os.unlink(self.tmpname)
+            else:
+                # mkstemp creates the file with mode 0600; keep the old
+                # file's permissions unless we were given new ones
+                if self.mode is None:
+                    shutil.copymode(self.path, self.tmpname)
+                # on windows, os.rename does not automatically unlink
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                os.rename(self.tmpname, self.path)
+                if self.mode is not None:
+                    os.chmod(self.path, self.mode)
 
         return TransferCommand.finished(self, res)
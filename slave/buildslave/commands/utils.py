@@ -14,8 +14,13 @@
 # Copyright Buildbot Team Members
 
 import os
+import sys
+import shutil
+import stat
+import threading
 
-from twisted.python import log
+from twisted.internet import defer, reactor
+from twisted.python import log, failure
 from twisted.python.procutils import which
 from twisted.python import runtime
 
@@ -94,5 +99,263 @@ if runtime.platformType  == 'win32':
         os.rmdir(dir)
 else:
     # use rmtree on POSIX
-    import shutil
     rmdirRecursive = shutil.rmtree
+
+# suffix given to directories which have been moved aside by
+# renameForRemoval and are waiting to be deleted
+REMOVAL_SUFFIX = ".buildbot-deleting"
+
+# deferreds for the background removals that are still in progress
+_pendingRemovals = []
+
+def renameForRemoval(dir):
+    """Move C{dir} aside to an unused sibling name so that the original
+    path can be re-used immediately.  Returns the new name, or None if
+    C{dir} does not exist or could not be renamed (for example because a
+    process on Windows is still holding a file open in it)."""
+    if not os.path.lexists(dir):
+        return None
+    dir = dir.rstrip(os.sep)
+    i = 0
+    while True:
+        deaddir = "%s%s.%d" % (dir, REMOVAL_SUFFIX, i)
+        if not os.path.lexists(deaddir):
+            break
+        i += 1
+    try:
+        os.rename(dir, deaddir)
+    except OSError, e:
+        log.msg("could not rename %s for removal (%s); removing in place"
+                % (dir, e))
+        return None
+    return deaddir
+
+def _forceRemove(dir):
+    # like rmdirRecursive, but fix up the permissions of anything that
+    # gets in the way, as 'chmod -Rf u+rwx' does for the 'rm -rf' path
+    if runtime.platformType == 'win32':
+        rmdirRecursive(dir)
+        return
+
+    def onerror(func, path, excinfo):
+        if not os.path.lexists(path):
+            return
+        for p in (os.path.dirname(path), path):
+            try:
+                if not os.path.islink(p):
+                    os.chmod(p, os.stat(p).st_mode | stat.S_IRWXU)
+            except OSError:
+                pass
+        if func is os.listdir:
+            shutil.rmtree(path, onerror=onerror)
+        else:
+            func(path)
+    shutil.rmtree(dir, onerror=onerror)
+
+def _staleRemovals(dir):
+    # directories left behind by removals that were interrupted (e.g., by a
+    # slave restart) before they finished
+    parent, base = os.path.split(dir)
+    prefix = base.split(REMOVAL_SUFFIX)[0] + REMOVAL_SUFFIX
+    pending = [ getattr(d, 'dir', None) for d in _pendingRemovals ]
+    try:
+        names = os.listdir(parent or os.curdir)
+    except OSError:
+        return []
+    return [ os.path.join(parent, n) for n in names
+             if n.startswith(prefix) and os.path.join(parent, n) != dir
+                and os.path.join(parent, n) not in pending ]
+
+def deferToDaemonThread(f, *args, **kwargs):
+    """Like twisted.internet.threads.deferToThread, but run C{f} in a new
+    daemon thread rather than in the reactor's threadpool.  This is for long
+    filesystem operations, which would otherwise tie up the threads that
+    other users of the pool are waiting for, and which must not hold up the
+    slave's shutdown while the reactor joins its threads."""
+    d = defer.Deferred()
+    def run():
+        try:
+            result = f(*args, **kwargs)
+        except:
+            reactor.callFromThread(d.errback, failure.Failure())
+        else:
+            reactor.callFromThread(d.callback, result)
+    t = threading.Thread(target=run)
+    t.setDaemon(True)
+    t.start()
+    return d
+
+def removeInBackground(dir):
+    """Remove C{dir} (usually the result of L{renameForRemoval}) in a
+    daemon thread, along with any earlier removals of the same directory
+    that were never completed.  The returned Deferred fires when the tree is
+    gone; a failure to remove it is logged, not raised.  A removal that is
+    cut short by the slave stopping is finished by the next one."""
+    def remove():
+        for d in [ dir ] + _staleRemovals(dir):
+            _forceRemove(d)
+    d = deferToDaemonThread(remove)
+    d.dir = dir
+    _pendingRemovals.append(d)
+    def done(res):
+        _pendingRemovals.remove(d)
+        return res
+    d.addBoth(done)
+    d.addErrback(log.err, "while removing %s in the background" % dir)
+    return d
+
+def waitForBackgroundRemovals():
+    """Return a Deferred that fires when all background removals started
+    so far are complete."""
+    return defer.DeferredList(list(_pendingRemovals))
+
+class CopyInterrupted(Exception):
+    """A copy by L{copyTree} was cancelled."""
+
+def _copyOwner(src, dst):
+    # like 'cp -p', keep the owner and group where we are allowed to, which
+    # is usually only when running as root
+    if not hasattr(os, 'lchown'):
+        return
+    st = os.lstat(src)
+    try:
+        os.lchown(dst, st.st_uid, st.st_gid)
+    except OSError:
+        pass
+
+def copyTree(fromdir, todir, hardlinks=False, workers=4, cancelled=None):
+    """Copy the tree at C{fromdir} to C{todir}, which must not already
+    exist, preserving symlinks, permissions and (where allowed) ownership
+    like C{cp -R -P -p}.  The directory structure is created first, then the
+    files are copied by a pool of C{workers} threads, which keeps several
+    requests outstanding to the filesystem at once.  If C{hardlinks} is
+    true, files are hard-linked rather than copied wherever the filesystem
+    allows it.  If C{cancelled} (a threading.Event) is set, the copy stops
+    as soon as the files in progress are done, and raises L{CopyInterrupted}.
+
+    This blocks; see L{TreeCopy} to run it from the reactor.  Returns a
+    tuple (files, bytes) of the number of files and bytes copied (hard links
+    count as files, but not bytes)."""
+    import Queue
+
+    if cancelled is None:
+        cancelled = threading.Event()
+
+    files = Queue.Queue()
+    dirs = []
+    def walkError(e):
+        raise e
+    for dirpath, dirnames, filenames in os.walk(fromdir, onerror=walkError):
+        if cancelled.isSet():
+            raise CopyInterrupted("copy of %s cancelled" % fromdir)
+        destpath = todir + dirpath[len(fromdir):]
+        os.mkdir(destpath)
+        dirs.append((dirpath, destpath))
+        # os.walk does not descend into symlinks to directories, but it does
+        # list them in dirnames
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(destpath, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                _copyOwner(src, dst)
+            elif name in filenames:
+                files.put((src, dst))
+
+    totals = [ 0, 0 ]
+    errors = []
+    state = { 'link' : hardlinks and hasattr(os, 'link') }
+    lock = threading.Lock()
+    def worker():
+        while not errors and not cancelled.isSet():
+            try:
+                src, dst = files.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                size = 0
+                linked = False
+                if state['link']:
+                    try:
+                        os.link(src, dst)
+                        linked = True
+                    except OSError:
+                        # e.g., todir is on another filesystem; stop trying
+                        state['link'] = False
+                if not linked:
+                    shutil.copy2(src, dst)
+                    _copyOwner(src, dst)
+                    size = os.path.getsize(dst)
+                lock.acquire()
+                try:
+                    totals[0] += 1
+                    totals[1] += size
+                finally:
+                    lock.release()
+            except:
+                errors.append(sys.exc_info())
+
+    pool = [ threading.Thread(target=worker)
+             for i in range(max(1, min(workers, files.qsize()))) ]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    if cancelled.isSet():
+        raise CopyInterrupted("copy of %s cancelled" % fromdir)
+
+    # copy directory metadata last, since creating their contents would
+    # update their mtimes
+    for src, dst in reversed(dirs):
+        shutil.copystat(src, dst)
+        _copyOwner(src, dst)
+
+    return tuple(totals)
+
+class TreeCopy:
+    """
+    I run L{copyTree} in a daemon thread on behalf of a command, standing in
+    for the C{cp -R -P -p} process that used to do the copy: like a
+    RunProcess, I can be stopped with L{kill}, and I stop the copy if it
+    takes longer than C{timeout} or C{maxTime} seconds.  (The copy produces
+    no output, so C{timeout}, the time it may stay silent, limits its total
+    time just as it did for C{cp}.)
+    """
+
+    _reactor = reactor # for tests
+
+    def __init__(self, fromdir, todir, hardlinks=False, timeout=None,
+                 maxTime=None):
+        self.fromdir = fromdir
+        self.todir = todir
+        self.hardlinks = hardlinks
+        limits = [ t for t in (timeout, maxTime) if t is not None ]
+        self.limit = None
+        if limits:
+            self.limit = min(limits)
+        self.cancelled = threading.Event()
+        self.timer = None
+
+    def start(self):
+        """Start the copy.  Returns a Deferred that fires with
+        (files, bytes), as for L{copyTree}, or fails with
+        L{CopyInterrupted} if the copy was stopped."""
+        d = deferToDaemonThread(copyTree, self.fromdir, self.todir,
+                hardlinks=self.hardlinks, cancelled=self.cancelled)
+        if self.limit is not None:
+            self.timer = self._reactor.callLater(self.limit, self.kill,
+                    "copy took longer than %d seconds" % self.limit)
+        def done(res):
+            if self.timer and self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+            return res
+        d.addBoth(done)
+        return d
+
+    def kill(self, msg):
+        log.msg("stopping copy of %s to %s: %s"
+                % (self.fromdir, self.todir, msg))
+        self.cancelled.set()
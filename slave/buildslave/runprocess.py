@@ -36,6 +36,12 @@ from buildslave.exceptions import AbandonChain
 if runtime.platformType == 'posix':
     from twisted.internet.process import Process
 
+try:
+    from twisted.internet import inotify
+    from twisted.python import filepath
+except ImportError:
+    inotify = None
+
 def shell_quote(cmd_list):
     # attempt to quote cmd_list such that a shell will properly re-interpret
     # it.  The pipes module is only available on UNIX, and Windows "shell"
@@ -58,13 +64,133 @@ def shell_quote(cmd_list):
             return pipes.quote(e)
         return " ".join([ quote(e) for e in cmd_list ])
 
+class LogFileWatchManager:
+    """
+    I deliver change notifications for the files watched by all
+    L{LogFileWatcher}s on this slave, using a single inotify descriptor with
+    one watch per directory.  Where inotify is not available (non-Linux
+    platforms, or older versions of Twisted), I decline to watch anything and
+    the watchers fall back to polling.
+
+    Events are coalesced: however many arrive for a directory before the
+    reactor next runs, each watcher whose file they concern is polled once.
+    """
+
+    WATCH_MASK = 0
+
+    def __init__(self, _reactor=reactor):
+        self._reactor = _reactor
+        self.notifier = None
+        self.disabled = inotify is None
+        # maps directory path to the list of watchers for files within it
+        self.watchers = {}
+        # maps directory path to the set of names in it that have changed
+        # since the last delivery of its events
+        self.pending = {}
+
+    def _getNotifier(self):
+        if self.notifier is None:
+            self.notifier = inotify.INotify(self._reactor)
+            self.notifier.startReading()
+        return self.notifier
+
+    def add(self, watcher):
+        """Start notifying C{watcher} of changes to its logfile, by calling
+        its C{poll} method.  Returns False if this is not possible."""
+        if self.disabled:
+            return False
+        dirname = filepath.FilePath(watcher.logfile).parent()
+        if dirname.path not in self.watchers:
+            try:
+                self._getNotifier().watch(dirname,
+                        mask=self.WATCH_MASK, callbacks=[self._notify])
+            except Exception, e:
+                if self.notifier is None:
+                    log.msg("inotify is not available (%s); polling "
+                            "logfiles instead" % (e,))
+                    self.disabled = True
+                else:
+                    log.msg("cannot watch %s (%s); polling it instead"
+                            % (dirname.path, e))
+                    if not self.watchers:
+                        self._closeNotifier()
+                return False
+            self.watchers[dirname.path] = []
+        self.watchers[dirname.path].append(watcher)
+        return True
+
+    def remove(self, watcher):
+        dirname = filepath.FilePath(watcher.logfile).parent()
+        watchers = self.watchers.get(dirname.path)
+        if not watchers or watcher not in watchers:
+            return
+        watchers.remove(watcher)
+        if not watchers:
+            del self.watchers[dirname.path]
+            self.notifier.ignore(dirname)
+        if not self.watchers:
+            self._closeNotifier()
+
+    def _closeNotifier(self):
+        # don't hold a descriptor open while no commands are watching files
+        self.notifier.stopReading()
+        self.notifier.connectionLost(None)
+        self.notifier = None
+
+    def _notify(self, ignored, path, mask):
+        if mask & inotify.IN_DELETE_SELF:
+            # the directory itself is gone, and inotify has dropped the
+            # watch, so go back to polling
+            for w in self.watchers.pop(path.path, []):
+                w.watchLost()
+            self.pending.pop(path.path, None)
+            if not self.watchers:
+                self._closeNotifier()
+            return
+        dirname = path.dirname()
+        if dirname not in self.watchers:
+            return
+        if dirname not in self.pending:
+            self.pending[dirname] = set()
+            self._reactor.callLater(0, self._deliver, dirname)
+        self.pending[dirname].add(path.basename())
+
+    def _deliver(self, dirname):
+        names = self.pending.pop(dirname, ())
+        for w in self.watchers.get(dirname, [])[:]:
+            if w.basename in names:
+                w.poll()
+
+if inotify is not None:
+    LogFileWatchManager.WATCH_MASK = (inotify.IN_MODIFY | inotify.IN_CREATE |
+            inotify.IN_MOVED_TO | inotify.IN_DELETE | inotify.IN_CLOSE_WRITE |
+            inotify.IN_DELETE_SELF)
+
+# the manager shared by all LogFileWatchers, created on first use
+_watchManager = None
+
+def getLogFileWatchManager():
+    global _watchManager
+    if _watchManager is None:
+        _watchManager = LogFileWatchManager()
+    return _watchManager
+
 class LogFileWatcher:
+    # how often to poll the logfile for changes when inotify is not in use,
+    # and when it is (as a backstop against lost events)
     POLL_INTERVAL = 2
+    BACKSTOP_POLL_INTERVAL = 30
+    READ_SIZE = 256*1024
 
-    def __init__(self, command, name, logfile, follow=False):
+    def __init__(self, command, name, logfile, follow=False,
+                 watchManager=None):
         self.command = command
         self.name = name
-        self.logfile = logfile
+        self.logfile = os.path.abspath(logfile)
+        self.basename = os.path.basename(self.logfile)
+        if watchManager is None:
+            watchManager = getLogFileWatchManager()
+        self.watchManager = watchManager
 
         log.msg("LogFileWatcher created to watch %s" % logfile)
         # we are created before the ShellCommand starts. If the logfile we're
@@ -72,22 +198,37 @@ class LogFileWatcher:
         # ctime/mtime so we can tell when it starts to change.
         self.old_logfile_stats = self.statFile()
         self.started = False
+        self.watching = False
 
         # follow the file, only sending back lines
         # added since we started watching
         self.follow = follow
 
-        # every 2 seconds we check on the file again
+        # poll the file periodically, too
         self.poller = task.LoopingCall(self.poll)
 
     def start(self):
-        self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
+        self.watching = self.watchManager.add(self)
+        if self.watching:
+            interval = self.BACKSTOP_POLL_INTERVAL
+        else:
+            interval = self.POLL_INTERVAL
+        self.poller.start(interval).addErrback(self._cleanupPoll)
 
     def _cleanupPoll(self, err):
         log.err(err, msg="Polling error")
         self.poller = None
 
+    def watchLost(self):
+        self.watching = False
+        if self.poller is not None and self.poller.running:
+            self.poller.stop()
+            self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
+
     def stop(self):
+        if self.watching:
+            self.watchManager.remove(self)
+            self.watching = False
         self.poll()
         if self.poller is not None:
             self.poller.stop()
@@ -120,7 +261,7 @@ class LogFileWatcher:
             self.started = True
         self.f.seek(self.f.tell(), 0)
         while True:
-            data = self.f.read(10000)
+            data = self.f.read(self.READ_SIZE)
             if not data:
                 return
             self.command.addLogfile(self.name, data)
@@ -212,10 +353,16 @@ class RunProcess:
     KILL = "KILL"
     CHUNK_LIMIT = 128*1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
+    # Don't send any data until at least bufferSize bytes have been collected
+    # or bufferTimeout elapsed.  Both adapt to the output rate: they start at
+    # their minimums, so sparse output is sent promptly, and double (up to
+    # BUFFER_SIZE and BUFFER_TIMEOUT) each time a buffer fills before its
+    # timer expires, so that chatty commands send fewer, larger messages.
+    # They shrink again when the output becomes sparse.
     BUFFER_SIZE = 64*1024
     BUFFER_TIMEOUT = 5
+    MIN_BUFFER_SIZE = 4*1024
+    MIN_BUFFER_TIMEOUT = 0.25
 
     # For sending elapsed time:
     startTime = None
@@ -235,7 +382,7 @@ class RunProcess:
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 useProcGroup=True):
+                 useProcGroup=True, bufferSize=None, bufferTimeout=None):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -249,6 +396,15 @@ class RunProcess:
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param bufferSize: the number of bytes of output to collect before
+            sending it to the master; either a fixed number, or a (min, max)
+            tuple to adapt between.  Defaults to (MIN_BUFFER_SIZE,
+            BUFFER_SIZE).
+
+        @param bufferTimeout: the longest time to hold output before sending
+            it to the master, in the same form as bufferSize.  Defaults to
+            (MIN_BUFFER_TIMEOUT, BUFFER_TIMEOUT).
         """
 
         self.builder = builder
@@ -321,6 +477,12 @@ class RunProcess:
         self.buffered = deque()
         self.buflen = 0
         self.buftimer = None
+        self.minBufferSize, self.maxBufferSize = self._bufferRange(
+                bufferSize, self.MIN_BUFFER_SIZE, self.BUFFER_SIZE)
+        self.minBufferTimeout, self.maxBufferTimeout = self._bufferRange(
+                bufferTimeout, self.MIN_BUFFER_TIMEOUT, self.BUFFER_TIMEOUT)
+        self.bufferSize = self.minBufferSize
+        self.bufferTimeout = self.minBufferTimeout
 
         if usePTY == "slave-config":
             self.usePTY = self.builder.usePTY
@@ -363,6 +525,14 @@ class RunProcess:
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.fake_command)
 
+    def _bufferRange(self, value, default_min, default_max):
+        if value is None:
+            return default_min, default_max
+        if isinstance(value, (tuple, list)):
+            lo, hi = value
+            return min(lo, hi), max(lo, hi)
+        return value, value
+
     def sendStatus(self, status):
         self.builder.sendUpdate(status)
 
@@ -557,8 +727,21 @@ class RunProcess:
 
     def _bufferTimeout(self):
         self.buftimer = None
+        # the timer expired before the buffer filled; if it did not even get
+        # close, the output is sparse, so send future output sooner
+        if self.buflen < self.bufferSize / 4:
+            self._shrinkBuffers()
         self._sendBuffers()
 
+    def _growBuffers(self):
+        self.bufferSize = min(self.bufferSize * 2, self.maxBufferSize)
+        self.bufferTimeout = min(self.bufferTimeout * 2, self.maxBufferTimeout)
+
+    def _shrinkBuffers(self):
+        self.bufferSize = max(self.bufferSize / 2, self.minBufferSize)
+        self.bufferTimeout = max(self.bufferTimeout / 2.0,
+                                 self.minBufferTimeout)
+
     def _sendBuffers(self):
         """
         Send all the content in our buffers.
@@ -614,18 +797,19 @@ class RunProcess:
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
-        If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
-        the buffers will be sent.
+        Start a timer to send the buffers if bufferTimeout elapses.
+        If adding data causes the buffer size to grow beyond bufferSize, then
+        the buffers will be sent, and the buffer limits will grow.
         """
         n = len(data)
 
         self.buflen += n
         self.buffered.append((logname, data))
-        if self.buflen > self.BUFFER_SIZE:
+        if self.buflen > self.bufferSize:
+            self._growBuffers()
             self._sendBuffers()
         elif not self.buftimer:
-            self.buftimer = self._reactor.callLater(self.BUFFER_TIMEOUT, self._bufferTimeout)
+            self.buftimer = self._reactor.callLater(self.bufferTimeout, self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
@@ -26,6 +26,7 @@ from buildslave.test.fake.remote import FakeRemote
 from buildslave.test.fake.runprocess import Expect
 import buildslave
 from buildslave import bot
+from buildslave.commands import mirror
 
 class TestBot(unittest.TestCase):
 
@@ -230,6 +231,34 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
     def test_startBuild(self):
         return self.sb.callRemote("startBuild")
 
+    def test_prefetch_noMirror(self):
+        d = self.sb.callRemote("prefetch", "git",
+                dict(workdir='build', repourl='git://example.com/repo'))
+        d.addCallback(self.assertEqual, False)
+        return d
+
+    def test_prefetch(self):
+        self.patch(mirror, '_mirrors', {})
+        self.patch_getCommand('git', 'path/to/git')
+        repourl = 'git://example.com/repo'
+        mirrordir = mirror.getMirrorPath(self.basedir, 'git', repourl)
+        os.makedirs(mirrordir)
+        self.patch_runprocess(
+            Expect([ 'path/to/git', 'fetch' ], mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+            + { 'stdout' : 'fetched\n' }
+            + 0,
+        )
+
+        d = self.sb.callRemote("prefetch", "git",
+                dict(workdir='build', repourl=repourl, mirror=True))
+        def check(res):
+            self.assertEqual(res, True)
+            self.assertEqual(mirror.getMirror(mirrordir).prefetched.keys(),
+                             [ os.path.join(self.basedir, 'sb') ])
+        d.addCallback(check)
+        return d
+
     def test_startCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -327,3 +356,149 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
             self.assertTrue(isinstance(st.actions[0][1], failure.Failure))
         d.addCallback(check)
         return d
+
+class SlowStep(object):
+    "A fake master-side BuildStep that acknowledges updates only on request."
+    def __init__(self, credit=0):
+        self.credit = credit
+        self.updates = []
+        self.acks = []
+        self.completed = False
+
+    def remote_update(self, updates):
+        self.updates.extend([ u[0] for u in updates ])
+        d = defer.Deferred()
+        self.acks.append(d)
+        return d
+
+    def remote_complete(self, f):
+        self.completed = True
+
+    def ack(self):
+        self.acks.pop(0).callback(self.credit)
+
+class TestFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("basedir")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+        self.bot = bot.Bot(self.basedir, False)
+        self.bot.startService()
+        builders = self.bot.remote_setBuilderList([('sb', 'sb')])
+        self.sb = builders['sb']
+        self.sb.updateCredit = 10
+        self.step = SlowStep()
+        self.sb.remoteStep = FakeRemote(self.step)
+
+    def tearDown(self):
+        d = defer.succeed(None)
+        if self.bot and self.bot.running:
+            d.addCallback(lambda _ : self.bot.stopService())
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        return d
+
+    def test_updateSize(self):
+        self.assertEqual(bot.updateSize({'stdout' : 'abc', 'stderr' : 'de',
+                                         'header' : 'f'}), 6)
+        self.assertEqual(bot.updateSize({'log' : ('x', 'abcd')}), 4)
+        self.assertEqual(bot.updateSize({'rc' : 0}), 0)
+
+    def test_withinCredit(self):
+        self.sb.sendUpdate({'stdout' : 'abcd'})
+        self.sb.sendUpdate({'stdout' : 'efgh'})
+        self.assertEqual(len(self.step.updates), 2)
+        self.assertEqual(self.sb.unackedBytes, 8)
+
+    def test_queuedUntilAck(self):
+        self.sb.sendUpdate({'stdout' : 'abcdefgh'})
+        self.sb.sendUpdate({'stdout' : 'ijklmnop'})
+        self.sb.sendUpdate({'rc' : 0})
+        self.assertEqual(self.step.updates, [{'stdout' : 'abcdefgh'}])
+        self.step.ack()
+        self.assertEqual(self.step.updates, [{'stdout' : 'abcdefgh'},
+                {'stdout' : 'ijklmnop'}, {'rc' : 0}])
+        self.assertEqual(self.sb.unackedBytes, 8)
+
+    def test_oversizedUpdateStillSent(self):
+        self.sb.sendUpdate({'stdout' : 'x' * 100})
+        self.assertEqual(len(self.step.updates), 1)
+
+    def test_creditFromMaster(self):
+        self.step.credit = 1000
+        self.sb.sendUpdate({'stdout' : 'abcdefgh'})
+        self.step.ack()
+        self.assertEqual(self.sb.updateCredit, 1000)
+
+    def test_legacyMasterAck(self):
+        # older masters acknowledge with the update number, 0
+        self.sb.sendUpdate({'stdout' : 'abcdefgh'})
+        self.step.ack()
+        self.assertEqual(self.sb.updateCredit, 10)
+        self.assertEqual(self.sb.unackedBytes, 0)
+
+    def test_completeWaitsForQueue(self):
+        self.sb.sendUpdate({'stdout' : 'abcdefgh'})
+        self.sb.sendUpdate({'stdout' : 'ijklmnop'})
+        self.sb.commandComplete(None)
+        self.assertFalse(self.step.completed)
+        self.step.ack()
+        self.assertTrue(self.step.completed)
+        self.assertEqual(self.sb.remoteStep, None)
+
+    def test_lostRemoteStep(self):
+        self.sb.sendUpdate({'stdout' : 'abcdefgh'})
+        self.sb.sendUpdate({'stdout' : 'ijklmnop'})
+        self.sb.stopCommandOnShutdown = False
+        self.sb.lostRemoteStep(None)
+        self.assertEqual(len(self.sb.updateQueue), 0)
+        self.assertEqual(self.sb.unackedBytes, 0)
+
+class TestUpdateQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("basedir")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def test_memoryOnly(self):
+        q = bot.UpdateQueue(self.basedir, 100)
+        q.put({'stdout' : 'a'}, 1)
+        q.put({'stdout' : 'b'}, 1)
+        self.assertEqual(len(q), 2)
+        self.assertEqual(q.spillfile, None)
+        self.assertEqual(q.get(), ({'stdout' : 'a'}, 1))
+        self.assertEqual(q.get(), ({'stdout' : 'b'}, 1))
+        self.assertEqual(len(q), 0)
+
+    def test_spill(self):
+        q = bot.UpdateQueue(self.basedir, 10)
+        for i in range(5):
+            q.put({'stdout' : str(i) * 6}, 6)
+        self.assertNotEqual(q.spillfile, None)
+        self.assertEqual(len(q), 5)
+        self.assertEqual(q.peekSize(), 6)
+        got = [ q.get()[0]['stdout'] for i in range(3) ]
+        # new updates go behind the spilled ones
+        q.put({'stdout' : 'x'}, 1)
+        got.extend([ q.get()[0]['stdout'] for i in range(3) ])
+        self.assertEqual(got, ['000000', '111111', '222222', '333333',
+                               '444444', 'x'])
+        self.assertEqual(q.spillfile, None)
+        self.assertEqual(len(q), 0)
+
+    def test_clear(self):
+        q = bot.UpdateQueue(self.basedir, 1)
+        q.put({'stdout' : 'abc'}, 3)
+        q.put({'stdout' : 'def'}, 3)
+        q.clear()
+        self.assertEqual(len(q), 0)
+        self.assertEqual(q.spillfile, None)
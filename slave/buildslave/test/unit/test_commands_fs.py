@@ -18,7 +18,7 @@ import os
 from twisted.trial import unittest
 
 from buildslave.test.util.command import CommandTestMixin
-from buildslave.commands import fs
+from buildslave.commands import fs, utils
 
 class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
 
@@ -32,6 +32,7 @@ class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
         self.make_command(fs.RemoveDirectory, dict(
             dir='workdir',
         ), True)
+        open(os.path.join(self.basedir, 'workdir', 'file'), "w")
         d = self.run_command()
 
         def check(_):
@@ -40,6 +41,23 @@ class TestRemoveDirectory(CommandTestMixin, unittest.TestCase):
                     self.get_updates(),
                     self.builder.show())
         d.addCallback(check)
+        d.addCallback(lambda _ : utils.waitForBackgroundRemovals())
+        def check_removed(_):
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check_removed)
+        return d
+
+    def test_nonexistent(self):
+        self.make_command(fs.RemoveDirectory, dict(
+            dir='no-such-dir',
+        ), True)
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': 0},
+                    self.get_updates(),
+                    self.builder.show())
+        d.addCallback(check)
         return d
 
 class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
@@ -65,6 +83,41 @@ class TestCopyDirectory(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_contents_hardlinks(self):
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='workdir',
+            todir='copy',
+            hardlinks=True,
+        ), True)
+        os.mkdir(os.path.join(self.basedir_workdir, 'sub'))
+        open(os.path.join(self.basedir_workdir, 'sub', 'f'), "w").write("abc")
+        d = self.run_command()
+
+        def check(_):
+            copied = os.path.join(self.basedir, 'copy', 'sub', 'f')
+            self.assertEqual(open(copied).read(), "abc")
+            if hasattr(os, 'link'):
+                self.assertEqual(os.stat(copied).st_nlink, 2)
+            self.assertIn({'rc': 0}, self.get_updates(), self.builder.show())
+            headers = [ u['header'] for u in self.get_updates()
+                        if 'header' in u ]
+            self.assertTrue(headers[0].startswith("copied 1 files"), headers)
+        d.addCallback(check)
+        return d
+
+    def test_missing_fromdir(self):
+        self.make_command(fs.CopyDirectory, dict(
+            fromdir='no-such-dir',
+            todir='copy',
+        ), True)
+        d = self.run_command()
+
+        def check(_):
+            self.assertIn({'rc': 1}, self.get_updates(), self.builder.show())
+            self.flushLoggedErrors()
+        d.addCallback(check)
+        return d
+
 class TestMakeDirectory(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
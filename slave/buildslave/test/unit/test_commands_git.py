@@ -13,11 +13,13 @@
 #
 # Copyright Buildbot Team Members
 
+import os
+
 from twisted.trial import unittest
 
 from buildslave.test.fake.runprocess import Expect
 from buildslave.test.util.sourcecommand import SourceCommandTestMixin
-from buildslave.commands import git
+from buildslave.commands import git, mirror
 
 class TestGit(SourceCommandTestMixin, unittest.TestCase):
 
@@ -135,6 +137,142 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
         d.addCallback(self.check_sourcedata, "git://github.com/djmitche/buildbot.git master\n")
         return d
 
+    def _sparseUpdateExpects(self, sparse):
+        expects = [
+            Expect([ 'clobber', 'workdir' ],
+                self.basedir)
+                + 0,
+        ]
+        if sparse:
+            expects.append(
+                Expect([ 'path/to/git', 'config', 'core.sparseCheckout', 'true' ],
+                    self.basedir_source,
+                    sendRC=False, timeout=120, usePTY=False)
+                    + 0)
+        expects.extend([
+            Expect([ 'path/to/git', 'fetch', '-t',
+                     'git://github.com/djmitche/buildbot.git', '+master' ],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False, keepStderr=True)
+                + { 'stderr' : '' }
+                + 0,
+            Expect(['path/to/git', 'reset', '--hard', 'FETCH_HEAD'],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect(['path/to/git', 'branch', '-M', 'master'],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'rev-parse', 'HEAD' ],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True)
+                + { 'stdout' : '4026d33b0532b11f36b0875f63699adfa8ee8662\n' }
+                + 0,
+            Expect([ 'copy', 'source', 'workdir'],
+                self.basedir)
+                + 0,
+        ])
+        return expects
+
+    def _makeSparseCommand(self, **kwargs):
+        self.patch_getCommand('git', 'path/to/git')
+        self.clean_environ()
+        args = dict(
+            workdir='workdir',
+            mode='copy',
+            revision=None,
+            repourl='git://github.com/djmitche/buildbot.git',
+        )
+        args.update(kwargs)
+        self.make_command(git.Git, args,
+            initial_sourcedata = "git://github.com/djmitche/buildbot.git master\n",
+        )
+        self.patch(self.cmd, "sourcedirIsUpdateable", lambda : True)
+        return os.path.join(self.basedir_source, '.git', 'info',
+                            'sparse-checkout')
+
+    def test_sparse_paths(self):
+        sparsefile = self._makeSparseCommand(sparse_paths=['src/lib/', 'doc'])
+        self.patch_runprocess(*self._sparseUpdateExpects(True))
+
+        d = self.run_command()
+        def check(_):
+            self.assertEqual(open(sparsefile).read(), "/src/lib\n/doc\n")
+        d.addCallback(check)
+        return d
+
+    def test_sparse_paths_removed(self):
+        sparsefile = self._makeSparseCommand()
+        os.makedirs(os.path.dirname(sparsefile))
+        open(sparsefile, "w").write("/doc\n")
+        self.patch_runprocess(*self._sparseUpdateExpects(True))
+
+        d = self.run_command()
+        def check(_):
+            self.assertEqual(open(sparsefile).read(), "/*\n")
+        d.addCallback(check)
+        return d
+
+    def test_mirror_update(self):
+        self.patch(mirror, '_mirrors', {})
+        self.patch_getCommand('git', 'path/to/git')
+        self.clean_environ()
+        self.make_command(git.Git, dict(
+            workdir='workdir',
+            mode='update',
+            revision=None,
+            repourl='git://github.com/djmitche/buildbot.git',
+            mirror=True,
+          ),
+            initial_sourcedata = "git://github.com/djmitche/buildbot.git master\n",
+        )
+        mirrordir = self.cmd.mirrordir
+        self.assertEqual(os.path.dirname(mirrordir),
+                os.path.join(os.path.dirname(self.basedir), 'mirrors'))
+        os.makedirs(mirrordir)
+        self.addCleanup(os.removedirs, mirrordir)
+
+        def sourcedirIsUpdateable():
+            return True
+        self.patch(self.cmd, "sourcedirIsUpdateable", sourcedirIsUpdateable)
+
+        expects = [
+            Expect([ 'path/to/git', 'fetch' ],
+                mirrordir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'fetch', '-t', mirrordir, '+master' ],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStderr=True)
+                + { 'stderr' : '' }
+                + 0,
+            Expect(['path/to/git', 'reset', '--hard', 'FETCH_HEAD'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect(['path/to/git', 'branch', '-M', 'master'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect([ 'path/to/git', 'rev-parse', 'HEAD' ],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True)
+                + { 'stdout' : '4026d33b0532b11f36b0875f63699adfa8ee8662\n' }
+                + 0,
+        ]
+        self.patch_runprocess(*expects)
+
+        d = self.run_command()
+        def check(_):
+            stats = [ u['mirror'] for u in self.get_updates() if 'mirror' in u ]
+            self.assertEqual(len(stats), 1)
+            self.assertEqual(stats[0]['mirror_hit'], True)
+            self.assertEqual(stats[0]['mirror_hits'], 1)
+            self.assertEqual(stats[0]['mirror_misses'], 0)
+        d.addCallback(check)
+        return d
+
     def test_nonexistant_ref(self):
         self.patch_getCommand('git', 'path/to/git')
         self.clean_environ()
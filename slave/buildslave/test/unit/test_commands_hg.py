@@ -13,11 +13,13 @@
 #
 # Copyright Buildbot Team Members
 
+import os
+
 from twisted.trial import unittest
 
 from buildslave.test.fake.runprocess import Expect
 from buildslave.test.util.sourcecommand import SourceCommandTestMixin
-from buildslave.commands import hg
+from buildslave.commands import hg, mirror
 
 class TestMercurial(SourceCommandTestMixin, unittest.TestCase):
 
@@ -83,3 +85,87 @@ class TestMercurial(SourceCommandTestMixin, unittest.TestCase):
         d.addCallback(self.check_sourcedata, "http://bitbucket.org/nicolas17/pyboinc\n")
         return d
 
+
+    def test_mirror_share(self):
+        self.patch(mirror, '_mirrors', {})
+        self.patch_getCommand('hg', 'path/to/hg')
+        self.clean_environ()
+        self.make_command(hg.Mercurial, dict(
+            workdir='workdir',
+            mode='update',
+            revision=None,
+            repourl='http://bitbucket.org/nicolas17/pyboinc',
+            mirror=True,
+        ), True)
+        mirrordir = self.cmd.mirrordir
+        os.makedirs(mirrordir)
+        self.addCleanup(os.removedirs, mirrordir)
+        # an old, unshared clone, which must be replaced
+        os.makedirs(os.path.join(self.basedir_workdir, '.hg'))
+
+        exp_environ = dict(PWD='.', LC_MESSAGES='C')
+        expects = [
+            Expect(['path/to/hg', 'pull', '--verbose',
+                    'http://bitbucket.org/nicolas17/pyboinc'],
+                mirrordir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True)
+                + { 'stdout' : 'no changes found\n' }
+                + 1,
+            Expect([ 'clobber', 'workdir' ],
+                self.basedir)
+                + 0,
+            Expect(['path/to/hg', '--config', 'extensions.share=', 'share',
+                    '--noupdate', mirrordir, 'workdir'],
+                self.basedir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect(['path/to/hg', 'identify', '--num', '--branch'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True,
+                keepStderr=True)
+                + { 'stdout' : '-1 default\n' }
+                + 0,
+            Expect(['path/to/hg', 'paths', 'default'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True,
+                keepStderr=True)
+                + { 'stdout' : 'http://bitbucket.org/nicolas17/pyboinc\n' }
+                + 0,
+            Expect(['path/to/hg', 'update', '--clean', '--repository',
+                    'workdir', '--rev', 'default'],
+                self.basedir,
+                sendRC=False, timeout=120, usePTY=False)
+                + 0,
+            Expect(['path/to/hg', 'identify', '--id', '--debug'],
+                self.basedir_workdir,
+                sendRC=False, timeout=120, usePTY=False, environ=exp_environ,
+                keepStdout=True)
+                + { 'stdout' : 'b7ddc0b638fa11cdac7c0345c40c6f76d8a7166d' }
+                + 0,
+        ]
+        self.patch_runprocess(*expects)
+
+        d = self.run_command()
+        def check(_):
+            hgrc = open(os.path.join(self.basedir_workdir, '.hg', 'hgrc')).read()
+            self.assertIn('default = http://bitbucket.org/nicolas17/pyboinc',
+                          hgrc)
+            self.assertIn({'rc': 0}, self.get_updates())
+        d.addCallback(check)
+        return d
+
+    def test_mirror_sourcedirIsUpdateable(self):
+        self.make_command(hg.Mercurial, dict(
+            workdir='workdir',
+            mode='update',
+            revision=None,
+            repourl='http://bitbucket.org/nicolas17/pyboinc',
+            mirror=True,
+        ), True)
+        self.cmd.srcdir = 'workdir'
+        hgdir = os.path.join(self.basedir_workdir, '.hg')
+        os.makedirs(hgdir)
+        self.assertFalse(self.cmd.sourcedirIsUpdateable())
+        open(os.path.join(hgdir, 'sharedpath'), 'w').write(
+                os.path.join(self.cmd.mirrordir, '.hg'))
+        self.assertTrue(self.cmd.sourcedirIsUpdateable())
@@ -0,0 +1,161 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import shutil
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from buildslave.commands import mirror
+
+class UpdateMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(mirror, '_mirrors', {})
+        self.basedir = os.path.abspath('mirror-test')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.path = mirror.getMirrorPath(self.basedir, 'git', 'git://foo/bar')
+        self.calls = []
+        # a clock that always moves forward
+        self.now = 0
+        def time():
+            self.now += 1
+            return self.now
+        self.patch(mirror.time, 'time', time)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def create(self, tmpdir, rc=0):
+        self.calls.append('create')
+        os.makedirs(tmpdir)
+        return defer.succeed(rc)
+
+    def update(self, rc=0):
+        self.calls.append('update')
+        return defer.succeed(rc)
+
+    def test_getMirrorPath(self):
+        self.assertEqual(os.path.dirname(self.path),
+                         os.path.join(self.basedir, 'mirrors'))
+        self.assertTrue(os.path.basename(self.path).startswith('git-'))
+        self.assertNotEqual(self.path,
+                mirror.getMirrorPath(self.basedir, 'git', 'git://foo/baz'))
+
+    def test_miss_then_hit(self):
+        d = mirror.updateMirror(self.path, self.create, self.update)
+        def check_miss((rc, stats)):
+            self.assertEqual(rc, 0)
+            self.assertTrue(os.path.isdir(self.path))
+            self.assertEqual(stats['mirror_hit'], False)
+            self.assertEqual((stats['mirror_hits'], stats['mirror_misses']),
+                             (0, 1))
+            return mirror.updateMirror(self.path, self.create, self.update)
+        d.addCallback(check_miss)
+        def check_hit((rc, stats)):
+            self.assertEqual(stats['mirror_hit'], True)
+            self.assertEqual((stats['mirror_hits'], stats['mirror_misses']),
+                             (1, 1))
+            self.assertEqual(self.calls, [ 'create', 'update' ])
+        d.addCallback(check_hit)
+        return d
+
+    def test_create_fails(self):
+        d = mirror.updateMirror(self.path,
+                lambda tmpdir : self.create(tmpdir, rc=1), self.update)
+        def check((rc, stats)):
+            self.assertEqual(rc, 1)
+            self.assertFalse(os.path.exists(self.path))
+            # the next attempt cleans up after this one
+            return mirror.updateMirror(self.path, self.create, self.update)
+        d.addCallback(check)
+        d.addCallback(lambda (rc, stats) : self.assertEqual(rc, 0))
+        return d
+
+    def test_concurrent_updates_coalesce(self):
+        os.makedirs(self.path)
+        first = defer.Deferred()
+        def slowUpdate():
+            self.calls.append('update')
+            return first
+        d1 = mirror.updateMirror(self.path, self.create, slowUpdate)
+        # these arrive while the first update holds the lock; the first
+        # update started before they were requested, so they must update
+        # again, but only one of them needs to
+        self.patch(mirror.time, 'time', lambda : 1e12)
+        d2 = mirror.updateMirror(self.path, self.create, self.update)
+        d3 = mirror.updateMirror(self.path, self.create, self.update)
+        first.callback(0)
+        d = defer.gatherResults([d1, d2, d3])
+        def check(results):
+            self.assertEqual(self.calls, [ 'update', 'update' ])
+            self.assertEqual([ stats['mirror_hit'] for rc, stats in results ],
+                             [ True, True, True ])
+        d.addCallback(check)
+        return d
+
+    def test_prefetch(self):
+        os.makedirs(self.path)
+        d = mirror.updateMirror(self.path, self.create, self.update,
+                                requester='sb', prefetch=True)
+        # a later update by the same builder is satisfied by the prefetch
+        d.addCallback(lambda _ : mirror.updateMirror(self.path, self.create,
+                                    self.update, requester='sb'))
+        def check((rc, stats)):
+            self.assertEqual(stats['mirror_prefetched'], True)
+            self.assertEqual(stats['mirror_update_time'], 0)
+            self.assertEqual(self.calls, [ 'update' ])
+            # ..but only once
+            return mirror.updateMirror(self.path, self.create, self.update,
+                                       requester='sb')
+        d.addCallback(check)
+        def check_again((rc, stats)):
+            self.assertFalse('mirror_prefetched' in stats)
+            self.assertEqual(self.calls, [ 'update', 'update' ])
+        d.addCallback(check_again)
+        return d
+
+    def test_prefetch_expired(self):
+        os.makedirs(self.path)
+        d = mirror.updateMirror(self.path, self.create, self.update,
+                                requester='sb', prefetch=True)
+        # the build that the prefetch was for never updated the mirror, and
+        # the next build comes along much later
+        def later(_):
+            self.now += mirror.PREFETCH_LIFETIME + 1
+            return mirror.updateMirror(self.path, self.create, self.update,
+                                       requester='sb')
+        d.addCallback(later)
+        def check((rc, stats)):
+            self.assertFalse('mirror_prefetched' in stats)
+            self.assertEqual(self.calls, [ 'update', 'update' ])
+            self.assertEqual(mirror.getMirror(self.path).prefetched, {})
+        d.addCallback(check)
+        return d
+
+    def test_prefetch_failed(self):
+        os.makedirs(self.path)
+        d = mirror.updateMirror(self.path, self.create,
+                lambda : self.update(rc=1), requester='sb', prefetch=True)
+        d.addCallback(lambda _ : mirror.updateMirror(self.path, self.create,
+                                    self.update, requester='sb'))
+        def check((rc, stats)):
+            self.assertFalse('mirror_prefetched' in stats)
+            self.assertEqual(self.calls, [ 'update', 'update' ])
+        d.addCallback(check)
+        return d
@@ -67,6 +67,61 @@ class TestSVN(SourceCommandTestMixin, unittest.TestCase):
         d.addCallback(self.check_sourcedata, "http://svn.local/app/trunk\n")
         return d
 
+    def test_sparse_paths(self):
+        self.patch_getCommand('svn', 'path/to/svn')
+        self.patch_getCommand('svnversion', 'path/to/svnversion')
+        self.clean_environ()
+        self.make_command(svn.SVN, dict(
+            workdir='workdir',
+            mode='copy',
+            revision=None,
+            svnurl='http://svn.local/app/trunk',
+            depth='files',
+            sparse_paths=['src/lib/', 'doc'],
+        ))
+
+        exp_environ = dict(PWD='.', LC_MESSAGES='C')
+        expects = [
+            Expect([ 'clobber', 'workdir' ],
+                self.basedir)
+                + 0,
+            Expect([ 'clobber', 'source' ],
+                self.basedir)
+                + 0,
+            Expect([ 'path/to/svn', 'checkout', '--non-interactive', '--no-auth-cache',
+                     '--depth', 'empty',
+                     '--revision', 'HEAD', 'http://svn.local/app/trunk@HEAD', 'source' ],
+                self.basedir,
+                sendRC=False, timeout=120, usePTY=False, environ=exp_environ)
+                + 0,
+            Expect([ 'path/to/svn', 'update', '--non-interactive', '--no-auth-cache',
+                     '--set-depth', 'empty', '--revision', 'HEAD', 'src' ],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False, environ=exp_environ)
+                + 0,
+            Expect([ 'path/to/svn', 'update', '--non-interactive', '--no-auth-cache',
+                     '--set-depth', 'infinity', '--revision', 'HEAD',
+                     'src/lib', 'doc' ],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False, environ=exp_environ)
+                + 0,
+            Expect([ 'path/to/svnversion', '.' ],
+                self.basedir_source,
+                sendRC=False, timeout=120, usePTY=False, keepStdout=True,
+                environ=exp_environ, sendStderr=False, sendStdout=False)
+                + { 'stdout' : '9753\n' }
+                + 0,
+            Expect([ 'copy', 'source', 'workdir'],
+                self.basedir)
+                + 0,
+        ]
+        self.patch_runprocess(*expects)
+
+        d = self.run_command()
+        d.addCallback(self.check_sourcedata,
+                "http://svn.local/app/trunk\nsparse: src/lib doc\n")
+        return d
+
 
 class TestGetUnversionedFiles(unittest.TestCase):
     def test_getUnversionedFiles_does_not_list_externals(self):
@@ -18,6 +18,10 @@ import sys
 import shutil
 import tarfile
 import StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 from twisted.trial import unittest
 from twisted.internet import defer, reactor
@@ -45,6 +49,7 @@ class FakeMasterMethods(object):
         self.written = False
         self.read = False
         self.data = ''
+        self.signatures = {}
 
     def remote_write(self, data):
         if self.count_writes:
@@ -79,6 +84,24 @@ class FakeMasterMethods(object):
         else:
             return slice
 
+    def remote_addSignatures(self, blocksize, first, signatures):
+        self.add_update('addSignatures %d %d' % (first, len(signatures)))
+        self.delta_blocksize = blocksize
+        for i, sig in enumerate(signatures):
+            self.signatures.setdefault(sig, first + i)
+
+    def remote_readDelta(self, length):
+        self.add_update('readDelta')
+        ops = []
+        bs = self.delta_blocksize
+        while self.data and len(ops) < 2:
+            block, self.data = self.data[:bs], self.data[bs:]
+            if md5(block).digest() in self.signatures:
+                ops.append(self.signatures[md5(block).digest()])
+            else:
+                ops.append(block)
+        return ops
+
     def remote_unpack(self):
         self.add_update('unpack')
 
@@ -432,3 +455,160 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+
+    def test_delta(self):
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write('aaaabbbbccccdddd')
+        self.fakemaster.data = test_data = 'aaaaXXXXccccddddee'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0777,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    'addSignatures 0 4', 'readDelta', 'readDelta',
+                    'readDelta', 'readDelta', 'close', {'rc': 0}
+                ])
+            self.assertEqual(open(datafile, 'rb').read(), test_data)
+            # no temporary files are left behind
+            self.assertEqual(os.listdir(self.basedir), ['data'])
+            if runtime.platformType != 'win32':
+                self.assertEqual(os.stat(datafile).st_mode & 0777, 0777)
+        d.addCallback(check)
+        return d
+
+    def test_delta_batches(self):
+        self.patch(transfer.SlaveFileDownloadCommand, 'SIGNATURE_BATCH', 3)
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write('aaaabbbbccccdddd')
+        self.fakemaster.data = test_data = 'ddddccccbbbbaaaa'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates()[:2], [
+                    'addSignatures 0 3', 'addSignatures 3 1' ])
+            self.assertEqual(open(datafile, 'rb').read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_delta_keeps_mode(self):
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write('aaaabbbb')
+        os.chmod(datafile, 0755)
+        self.fakemaster.data = test_data = 'aaaaXXXX'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(open(datafile, 'rb').read(), test_data)
+            if runtime.platformType != 'win32':
+                self.assertEqual(os.stat(datafile).st_mode & 0777, 0755)
+        d.addCallback(check)
+        return d
+
+    def test_delta_empty_file(self):
+        # an existing empty file has no signatures, so is replaced with a
+        # plain download
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').close()
+        self.fakemaster.data = test_data = 'hello'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    'read(s)', 'close', {'rc': 0}
+                ])
+            self.assertEqual(open(datafile, 'rb').read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_delta_maxsize(self):
+        # a truncated download leaves the old file in place
+        datafile = os.path.join(self.basedir, 'data')
+        open(datafile, 'wb').write('aaaabbbb')
+        self.fakemaster.data = 'aaaaXXXXcccc'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=6,
+            blocksize=32,
+            mode=None,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates()[-1]['rc'], 1)
+            self.assertEqual(open(datafile, 'rb').read(), 'aaaabbbb')
+            self.assertEqual(os.listdir(self.basedir), ['data'])
+        d.addCallback(check)
+        return d
+
+    def test_delta_nofile(self):
+        # without an existing file, delta mode is a plain download
+        self.fakemaster.data = test_data = 'hello'
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            delta=True,
+            deltablocksize=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    'read(s)', 'close', {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile, 'rb').read(), test_data)
+        d.addCallback(check)
+        return d
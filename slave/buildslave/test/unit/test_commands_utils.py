@@ -15,8 +15,10 @@
 
 import os, sys
 import shutil
+import threading
 
 from twisted.trial import unittest
+from twisted.internet import task
 from twisted.python import runtime
 import twisted.python.procutils
 
@@ -131,3 +133,151 @@ class RmdirRecursive(unittest.TestCase):
             os.rmdir("noperms")
 
         self.assertFalse(os.path.exists(self.target))
+
+class BackgroundRemoval(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('bgremove')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.target = os.path.join(self.basedir, 'wd')
+        os.makedirs(os.path.join(self.target, 'd'))
+        open(os.path.join(self.target, 'd', 'a'), "w")
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def test_renameForRemoval(self):
+        deaddir = utils.renameForRemoval(self.target)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertTrue(os.path.exists(os.path.join(deaddir, 'd', 'a')))
+        # a second rename picks a different name
+        os.mkdir(self.target)
+        self.assertNotEqual(utils.renameForRemoval(self.target), deaddir)
+
+    def test_renameForRemoval_nonexistent(self):
+        self.assertEqual(
+            utils.renameForRemoval(os.path.join(self.basedir, 'nope')), None)
+
+    def test_removeInBackground(self):
+        deaddir = utils.renameForRemoval(self.target)
+        d = utils.removeInBackground(deaddir)
+        def check(_):
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check)
+        return d
+
+    def test_removeInBackground_stale(self):
+        # left over from an earlier removal that never finished
+        stale = self.target + utils.REMOVAL_SUFFIX + ".7"
+        os.mkdir(stale)
+        deaddir = utils.renameForRemoval(self.target)
+        d = utils.removeInBackground(deaddir)
+        d.addCallback(lambda _ : utils.waitForBackgroundRemovals())
+        def check(_):
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check)
+        return d
+
+    def test_removeInBackground_noperms(self):
+        if runtime.platformType  == 'win32':
+            raise unittest.SkipTest("no chmod 000 on this platform")
+        os.chmod(os.path.join(self.target, 'd'), 0)
+        deaddir = utils.renameForRemoval(self.target)
+        d = utils.removeInBackground(deaddir)
+        def check(_):
+            self.assertEqual(os.listdir(self.basedir), [])
+        d.addCallback(check)
+        return d
+
+class CopyTree(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('copytree')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.src = os.path.join(self.basedir, 'src')
+        self.dst = os.path.join(self.basedir, 'dst')
+        os.makedirs(os.path.join(self.src, 'd', 'e'))
+        for name in [ 'a', 'b', os.path.join('d', 'c'),
+                      os.path.join('d', 'e', 'f') ]:
+            open(os.path.join(self.src, name), "w").write(name)
+        os.chmod(os.path.join(self.src, 'a'), 0755)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def test_copy(self):
+        files, bytes = utils.copyTree(self.src, self.dst, workers=3)
+        self.assertEqual((files, bytes), (4, 1 + 1 + 3 + 5))
+        self.assertEqual(open(os.path.join(self.dst, 'd', 'e', 'f')).read(),
+                         os.path.join('d', 'e', 'f'))
+        self.assertEqual(os.stat(os.path.join(self.dst, 'a')).st_mode,
+                         os.stat(os.path.join(self.src, 'a')).st_mode)
+        self.assertEqual(os.stat(os.path.join(self.dst, 'b')).st_nlink, 1)
+
+    def test_copy_symlinks(self):
+        if runtime.platformType  == 'win32':
+            raise unittest.SkipTest("no symlinks on this platform")
+        os.symlink('d', os.path.join(self.src, 'dlink'))
+        os.symlink('a', os.path.join(self.src, 'alink'))
+        utils.copyTree(self.src, self.dst)
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'dlink')), 'd')
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'alink')), 'a')
+
+    def test_copy_hardlinks(self):
+        if not hasattr(os, 'link'):
+            raise unittest.SkipTest("no hard links on this platform")
+        files, bytes = utils.copyTree(self.src, self.dst, hardlinks=True)
+        self.assertEqual((files, bytes), (4, 0))
+        self.assertEqual(os.stat(os.path.join(self.dst, 'b')).st_nlink, 2)
+
+    def test_copy_existing(self):
+        os.mkdir(self.dst)
+        self.assertRaises(OSError, lambda :
+                utils.copyTree(self.src, self.dst))
+
+    def test_copy_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertRaises(utils.CopyInterrupted, lambda :
+                utils.copyTree(self.src, self.dst, cancelled=cancelled))
+
+    def test_copy_ownership(self):
+        if not hasattr(os, 'geteuid') or os.geteuid() != 0:
+            raise unittest.SkipTest("only root can change file ownership")
+        os.chown(os.path.join(self.src, 'b'), 1, 1)
+        utils.copyTree(self.src, self.dst)
+        st = os.stat(os.path.join(self.dst, 'b'))
+        self.assertEqual((st.st_uid, st.st_gid), (1, 1))
+
+class TreeCopy(unittest.TestCase):
+
+    def setUp(self):
+        # a copy that runs until it is cancelled
+        def copyTree(fromdir, todir, hardlinks=False, cancelled=None):
+            cancelled.wait()
+            raise utils.CopyInterrupted()
+        self.patch(utils, 'copyTree', copyTree)
+
+    def makeTreeCopy(self, **kwargs):
+        c = utils.TreeCopy('src', 'dst', **kwargs)
+        c._reactor = self.clock = task.Clock()
+        return c
+
+    def test_kill(self):
+        c = self.makeTreeCopy()
+        d = c.start()
+        c.kill("command interrupted")
+        return self.assertFailure(d, utils.CopyInterrupted)
+
+    def test_timeout(self):
+        c = self.makeTreeCopy(timeout=120, maxTime=60)
+        d = c.start()
+        self.clock.advance(59)
+        self.assertFalse(c.cancelled.isSet())
+        self.clock.advance(1)
+        self.assertTrue(c.cancelled.isSet())
+        return self.assertFailure(d, utils.CopyInterrupted)
@@ -21,7 +21,7 @@ import signal
 
 from twisted.trial import unittest
 from twisted.internet import task, defer, reactor
-from twisted.python import runtime, util, log
+from twisted.python import runtime, util, log, filepath
 
 from buildslave.test.util.misc import nl, BasedirMixin
 from buildslave.test.util import compat
@@ -512,6 +512,79 @@ class TestLogging(BasedirMixin, unittest.TestCase):
         s._addToBuffers('stdout', data)
         self.failUnlessEqual(len(b.updates), 1)
 
+class TestAdaptiveBuffering(BasedirMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpBasedir()
+
+    def tearDown(self):
+        self.tearDownBasedir()
+
+    def makeRP(self, **kwargs):
+        self.b = FakeSlaveBuilder(False, self.basedir)
+        rp = runprocess.RunProcess(self.b, stdoutCommand('hello'),
+                                   self.basedir, **kwargs)
+        self.clock = rp._reactor = task.Clock()
+        return rp
+
+    def test_defaults(self):
+        rp = self.makeRP()
+        self.assertEqual(rp.bufferSize, rp.MIN_BUFFER_SIZE)
+        self.assertEqual(rp.bufferTimeout, rp.MIN_BUFFER_TIMEOUT)
+        self.assertEqual((rp.maxBufferSize, rp.maxBufferTimeout),
+                         (rp.BUFFER_SIZE, rp.BUFFER_TIMEOUT))
+
+    def test_sparseOutputSentQuickly(self):
+        rp = self.makeRP()
+        rp._addToBuffers('stdout', 'hello\n')
+        self.assertEqual(self.b.updates, [])
+        self.clock.advance(rp.MIN_BUFFER_TIMEOUT)
+        self.assertEqual(self.b.updates, [{'stdout' : 'hello\n'}])
+
+    def test_growsUnderLoad(self):
+        rp = self.makeRP(bufferSize=(10, 80), bufferTimeout=(1, 8))
+        rp._addToBuffers('stdout', 'x' * 11)
+        self.assertEqual(len(self.b.updates), 1)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (20, 2))
+        # 15 bytes is no longer enough to trigger a send
+        rp._addToBuffers('stdout', 'x' * 15)
+        self.assertEqual(len(self.b.updates), 1)
+        for i in range(5):
+            rp._addToBuffers('stdout', 'x' * 100)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (80, 8))
+        # the timer from the first 15 bytes is still running
+        self.clock.advance(1)
+        self.assertEqual(len(self.b.updates), 6)
+
+    def test_shrinksWhenSparse(self):
+        rp = self.makeRP(bufferSize=(10, 80), bufferTimeout=(1, 8))
+        rp.bufferSize, rp.bufferTimeout = 80, 8
+        rp._addToBuffers('stdout', 'x')
+        self.clock.advance(8)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (40, 4))
+        rp._addToBuffers('stdout', 'x')
+        self.clock.advance(4)
+        rp._addToBuffers('stdout', 'x')
+        self.clock.advance(2)
+        rp._addToBuffers('stdout', 'x')
+        self.clock.advance(1)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (10, 1))
+        self.assertEqual(len(self.b.updates), 4)
+
+    def test_moderateOutputHoldsSteady(self):
+        rp = self.makeRP(bufferSize=(40, 80), bufferTimeout=(1, 8))
+        rp._addToBuffers('stdout', 'x' * 20)
+        self.clock.advance(1)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (40, 1))
+
+    def test_fixed(self):
+        rp = self.makeRP(bufferSize=100, bufferTimeout=3)
+        rp._addToBuffers('stdout', 'x' * 101)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (100, 3))
+        rp._addToBuffers('stdout', 'x')
+        self.clock.advance(3)
+        self.assertEqual((rp.bufferSize, rp.bufferTimeout), (100, 3))
+        self.assertEqual(len(self.b.updates), 2)
+
 class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
     def setUp(self):
         self.setUpBasedir()
@@ -538,3 +611,117 @@ class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
         st = lf.statFile()
         self.assertEqual(st and st[2], 2, "statfile.log exists and size is correct")
         os.remove('statfile.log')
+
+    def test_poll_largeRead(self):
+        rp = self.makeRP()
+        chunks = []
+        rp.addLogfile = lambda name, data : chunks.append(data)
+        lf = runprocess.LogFileWatcher(rp, 'test', 'bigfile.log', False)
+        lf.READ_SIZE = 1000
+        open('bigfile.log', 'w').write('x' * 2500)
+        lf.poll()
+        self.assertEqual(map(len, chunks), [1000, 1000, 500])
+        lf.f.close()
+        os.remove('bigfile.log')
+
+class FakeWatcher:
+    def __init__(self, logfile):
+        self.logfile = os.path.abspath(logfile)
+        self.basename = os.path.basename(self.logfile)
+        self.polled = defer.Deferred()
+        self.polls = 0
+        self.lost = False
+
+    def poll(self):
+        self.polls += 1
+        if not self.polled.called:
+            self.polled.callback(None)
+
+    def watchLost(self):
+        self.lost = True
+
+class TestLogFileWatchManager(BasedirMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpBasedir()
+        os.makedirs(self.basedir)
+        self.mgr = runprocess.LogFileWatchManager()
+
+    def tearDown(self):
+        self.tearDownBasedir()
+
+    def test_notifiedOnWrite(self):
+        fn = os.path.join(self.basedir, 'test.log')
+        w = FakeWatcher(fn)
+        other = FakeWatcher(os.path.join(self.basedir, 'other.log'))
+        self.assertTrue(self.mgr.add(w))
+        self.assertTrue(self.mgr.add(other))
+        # both watchers share one watch
+        self.assertEqual(self.mgr.watchers.keys(), [os.path.abspath(self.basedir)])
+        open(fn, 'w').write('hello')
+        def check(_):
+            self.assertFalse(other.polled.called)
+            self.mgr.remove(w)
+            self.mgr.remove(other)
+            self.assertEqual(self.mgr.watchers, {})
+            self.assertEqual(self.mgr.notifier, None)
+        w.polled.addCallback(check)
+        return w.polled
+
+    def test_missingDirectory(self):
+        w = FakeWatcher(os.path.join(self.basedir, 'nosuchdir', 'test.log'))
+        self.assertFalse(self.mgr.add(w))
+        self.assertEqual(self.mgr.watchers, {})
+        self.assertEqual(self.mgr.notifier, None)
+
+    def test_directoryDeleted(self):
+        w = FakeWatcher(os.path.join(self.basedir, 'test.log'))
+        self.assertTrue(self.mgr.add(w))
+        os.rmdir(self.basedir)
+        d = defer.Deferred()
+        def check():
+            if not w.lost:
+                reactor.callLater(0.01, check)
+                return
+            self.assertEqual(self.mgr.notifier, None)
+            d.callback(None)
+        check()
+        return d
+
+    def test_eventsCoalesced(self):
+        clock = task.Clock()
+        mgr = runprocess.LogFileWatchManager(_reactor=clock)
+        w = FakeWatcher(os.path.join(self.basedir, 'test.log'))
+        other = FakeWatcher(os.path.join(self.basedir, 'other.log'))
+        mgr.watchers[os.path.dirname(w.logfile)] = [ w, other ]
+        path = filepath.FilePath(w.logfile)
+        for i in range(10):
+            mgr._notify(None, path, runprocess.inotify.IN_MODIFY)
+        self.assertEqual(w.polls, 0)
+        clock.advance(0)
+        self.assertEqual((w.polls, other.polls), (1, 0))
+        mgr._notify(None, path, runprocess.inotify.IN_MODIFY)
+        clock.advance(0)
+        self.assertEqual(w.polls, 2)
+
+    if runprocess.inotify is None or not sys.platform.startswith('linux'):
+        skip = "inotify is not available"
+
+class TestLogFileWatcherFallback(BasedirMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpBasedir()
+
+    def tearDown(self):
+        self.tearDownBasedir()
+
+    def test_pollsWithoutInotify(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        rp = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        mgr = runprocess.LogFileWatchManager()
+        mgr.disabled = True
+        lf = runprocess.LogFileWatcher(rp, 'test', 'test.log', False,
+                                       watchManager=mgr)
+        lf.poller.clock = task.Clock()
+        lf.start()
+        self.assertFalse(lf.watching)
+        self.assertEqual(lf.poller.interval, lf.POLL_INTERVAL)
+        lf.stop()